@@ -0,0 +1,368 @@
+"""
+Career, season and surface statistics of every player (aces, double faults
+and break points saved per match, minutes played and win percentage),
+computed in process from match_result.
+
+Grouping match_result row by row in SQL for every request gets slow over
+the full match history, so the matches are loaded once into NumPy column
+arrays instead: one array per column, with player IDs dictionary-encoded
+as small ints, surfaces as codes into SURFACES and each serve statistic
+alongside a mask of the matches it was recorded for (it is NULL for
+matches that weren't played out). The statistics of all players are then
+a handful of vectorized np.bincount passes per grouping, which are kept
+until more matches arrive, so a lookup is a binary search.
+
+New matches are read incrementally, by match_id, at most every
+refresh_interval seconds (or on the next lookup after expire()); only the
+matches with a higher match_id than the last one loaded are fetched and
+appended. Changes to matches already loaded (and to tournament surfaces)
+are picked up by the full reload after max_age seconds, or on the next
+lookup after invalidate().
+
+Per-match rates are over the matches the statistic was recorded for (for
+minutes, those that lasted more than 0 minutes), and are None for a player
+with none. The schema has no serve point counts, so the double fault rate
+is per match rather than per service point.
+"""
+import threading
+import time
+
+import numpy as np
+
+import db_pool
+import statements
+import storage
+
+SURFACES = ('Clay', 'Grass', 'Hard')
+_SURFACE_CODES = {surface: code for code, surface in enumerate(SURFACES)}
+# What the statistics can be grouped by, besides the player
+GROUPINGS = ('career', 'season', 'surface')
+# The serve statistics recorded for each side of a match
+STATS = ('aces', 'bp_saved', 'dfs')
+# Columns of the rows returned by player_stats and leaders, after the
+# player ID and the season or surface (None for career statistics)
+METRICS = ('matches', 'wins', 'losses', 'win_pct', 'minutes',
+           'minutes_per_match', 'aces', 'aces_per_match', 'bp_saved',
+           'bp_saved_per_match', 'dfs', 'dfs_per_match')
+# Metrics that leaders can rank players by
+RANKED_METRICS = ('matches', 'wins', 'win_pct', 'minutes',
+                  'minutes_per_match', 'aces', 'aces_per_match', 'bp_saved',
+                  'bp_saved_per_match', 'dfs', 'dfs_per_match')
+# Rows fetched from the server at a time while loading
+FETCH_SIZE = 10000
+
+statements.register('analytics_matches', """
+    SELECT M.match_id, M.tournament_date, T.surface, M.minutes,
+        M.winner_id, M.winner_aces, M.winner_bp_saved, M.winner_dfs,
+        M.loser_id, M.loser_aces, M.loser_bp_saved, M.loser_dfs
+    FROM match_result AS M
+        JOIN tournament AS T ON T.tournament_id = M.tournament_id
+    WHERE M.match_id > %s
+    ORDER BY M.match_id""",
+                    reads=('match_result', 'tournament'))
+
+
+class StatsTable:
+    """
+    The statistics of every (player, group) pair with at least one match,
+    as one array per metric, sorted by player code and then group.
+    """
+
+    def __init__(self, grouping, players, labels, metrics):
+        self.grouping = grouping
+        # Player code and season or surface of each row
+        self.players = players
+        self.labels = labels
+        self.metrics = metrics
+
+    def __len__(self):
+        return len(self.players)
+
+    def rows(self, positions, player_ids):
+        """
+        Returns the rows at the given positions, with the player IDs for
+        the codes.
+        """
+        columns = [self.metrics[metric][positions].tolist()
+                   for metric in METRICS]
+        labels = (self.labels[positions].tolist() if self.labels is not None
+                  else [None] * len(positions))
+        return [(player_ids[code], label, *values)
+                for code, label, *values in zip(
+                    self.players[positions].tolist(), labels, *columns)]
+
+
+class ServeStats:
+    """
+    match_result as NumPy columns, with the statistics computed from them.
+    """
+
+    def __init__(self, max_age=3600, refresh_interval=5):
+        self.max_age = max_age
+        self.refresh_interval = refresh_interval
+        self._loaded_at = None
+        self._checked_at = None
+        # Held while loading and while reading the columns
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self._columns = {
+            'match_id': np.empty(0, np.int64),
+            'season': np.empty(0, np.int16),
+            'surface': np.empty(0, np.int8),
+            'minutes': np.empty(0, np.int32),
+            'winner': np.empty(0, np.int32),
+            'loser': np.empty(0, np.int32),
+        }
+        # Per side and statistic, the values (0 where not recorded) and
+        # whether they were recorded
+        for side in ('winner', 'loser'):
+            for stat in STATS:
+                self._columns[f'{side}_{stat}'] = np.empty(0, np.int32)
+                self._columns[f'{side}_{stat}_recorded'] = np.empty(0, bool)
+        # Player ID <-> player code
+        self._codes = {}
+        self._player_ids = []
+        self._tables = {}
+        self.last_match_id = 0
+
+    def __len__(self):
+        return len(self._columns['match_id'])
+
+    def _encode(self, player_ids):
+        codes = self._codes
+        for player_id in player_ids:
+            if player_id not in codes:
+                codes[player_id] = len(self._player_ids)
+                self._player_ids.append(player_id)
+        return np.array([codes[player_id] for player_id in player_ids],
+                        np.int32)
+
+    def append(self, rows):
+        """
+        Adds matches (rows of the analytics_matches statement, in match_id
+        order) to the columns. Returns the number added.
+        """
+        rows = list(rows)
+        if not rows:
+            return 0
+        (match_ids, dates, surfaces, minutes, winners, winner_aces,
+         winner_bp_saved, winner_dfs, losers, loser_aces, loser_bp_saved,
+         loser_dfs) = zip(*rows)
+        new = {
+            'match_id': np.array(match_ids, np.int64),
+            # Dates come back as text from SQLite
+            'season': np.array([int(str(date)[:4]) for date in dates],
+                               np.int16),
+            'surface': np.array([_SURFACE_CODES[surface]
+                                 for surface in surfaces], np.int8),
+            'minutes': np.array(minutes, np.int32),
+            'winner': self._encode([str(w) for w in winners]),
+            'loser': self._encode([str(l) for l in losers]),
+        }
+        for name, values in (('winner_aces', winner_aces),
+                             ('winner_bp_saved', winner_bp_saved),
+                             ('winner_dfs', winner_dfs),
+                             ('loser_aces', loser_aces),
+                             ('loser_bp_saved', loser_bp_saved),
+                             ('loser_dfs', loser_dfs)):
+            # None becomes NaN in a float array
+            values = np.array(values, np.float64)
+            recorded = ~np.isnan(values)
+            new[name] = np.where(recorded, values, 0).astype(np.int32)
+            new[f'{name}_recorded'] = recorded
+        with self._lock:
+            for name, values in new.items():
+                self._columns[name] = np.concatenate((self._columns[name],
+                                                      values))
+            self.last_match_id = int(new['match_id'][-1])
+            self._tables = {}
+        return len(rows)
+
+    def load(self, rows):
+        """
+        Replaces the columns with the given matches (rows of the
+        analytics_matches statement).
+        """
+        with self._lock:
+            self._clear()
+            self.append(rows)
+            self._loaded_at = self._checked_at = time.monotonic()
+
+    def refresh(self, role=db_pool.CLIENT):
+        """
+        Appends the matches added since the last load or refresh, reloading
+        everything instead if the columns are older than max_age. Returns
+        the number of matches read.
+        """
+        with self._lock:
+            now = time.monotonic()
+            reload = (self._loaded_at is None
+                      or now - self._loaded_at > self.max_age)
+            if reload:
+                self._clear()
+            added = 0
+            with storage.connection(role) as conn:
+                rows = storage.iterate(conn, 'analytics_matches',
+                                       (self.last_match_id, ), FETCH_SIZE)
+                while True:
+                    batch = [row for _, row in zip(range(FETCH_SIZE), rows)]
+                    if not batch:
+                        break
+                    added += self.append(batch)
+            if reload:
+                self._loaded_at = now
+            self._checked_at = now
+            return added
+
+    def _ensure_current(self, role):
+        with self._lock:
+            if (self._checked_at is None or self._loaded_at is None
+                    or time.monotonic() - self._checked_at
+                    > self.refresh_interval):
+                self.refresh(role)
+
+    def expire(self):
+        """
+        Makes the next lookup check for new matches, e.g. after adding one.
+        """
+        with self._lock:
+            self._checked_at = None
+
+    def invalidate(self):
+        """
+        Drops the columns so that they are reloaded on next use, e.g. after
+        matches were changed or deleted.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def table(self, grouping):
+        """
+        Returns the StatsTable of every player for a grouping (see
+        GROUPINGS), computing it if the matches changed since it was last
+        asked for.
+        """
+        with self._lock:
+            if grouping not in self._tables:
+                self._tables[grouping] = self.aggregate(grouping)
+            return self._tables[grouping]
+
+    def aggregate(self, grouping):
+        """
+        Computes the statistics of every player for a grouping (use table()
+        for the cached copy) and returns them as a StatsTable. Each match
+        counts once for its winner and once for its loser, so the columns
+        are laid out twice (winner side, then loser side) and summed per
+        group key with np.bincount.
+        """
+        columns = self._columns
+        player = np.concatenate((columns['winner'], columns['loser']))
+        key = player.astype(np.int64)
+        labels = None
+        if grouping == 'career':
+            width = 1
+        elif grouping == 'season':
+            seasons = columns['season']
+            first = int(seasons.min()) if len(seasons) else 0
+            width = int(seasons.max()) - first + 1 if len(seasons) else 1
+            key = key * width + np.tile(seasons, 2).astype(np.int64) - first
+            labels = np.arange(first, first + width)
+        elif grouping == 'surface':
+            width = len(SURFACES)
+            key = key * width + np.tile(columns['surface'], 2).astype(np.int64)
+            labels = np.array(SURFACES, object)
+        else:
+            raise ValueError(f'Unknown grouping {grouping}')
+        size = len(self._player_ids) * width
+
+        def total(weights=None, mask=None):
+            k = key if mask is None else key[mask]
+            w = weights if weights is None or mask is None else weights[mask]
+            return np.bincount(k, w, minlength=size)
+
+        matches = total()
+        groups = np.flatnonzero(matches)
+        n = len(columns['match_id'])
+        won = np.concatenate((np.ones(n), np.zeros(n)))
+        metrics = {
+            'matches': matches[groups].astype(np.int64),
+            'wins': total(won)[groups].astype(np.int64),
+            'minutes': total(np.tile(columns['minutes'], 2).astype(
+                np.float64))[groups].astype(np.int64),
+        }
+        metrics['losses'] = metrics['matches'] - metrics['wins']
+        metrics['win_pct'] = np.round(
+            100.0 * metrics['wins'] / metrics['matches'], 1)
+        # Matches that weren't played (walkovers) last 0 minutes
+        played = np.tile(columns['minutes'], 2) > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            per_match = np.round(
+                metrics['minutes'] / total(mask=played)[groups], 1)
+        metrics['minutes_per_match'] = np.where(np.isnan(per_match), None,
+                                                per_match)
+        for stat in STATS:
+            values = np.concatenate((columns[f'winner_{stat}'],
+                                     columns[f'loser_{stat}'])).astype(
+                                         np.float64)
+            recorded = np.concatenate((columns[f'winner_{stat}_recorded'],
+                                       columns[f'loser_{stat}_recorded']))
+            sums = total(values, recorded)[groups]
+            counted = total(mask=recorded)[groups]
+            metrics[stat] = sums.astype(np.int64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                rate = np.round(sums / counted, 2)
+            # None (rather than NaN) for players with no recorded matches
+            metrics[f'{stat}_per_match'] = np.where(counted > 0, rate, None)
+        return StatsTable(grouping, groups // width,
+                          None if labels is None else labels[groups % width],
+                          metrics)
+
+    def player_stats(self, player_ids, grouping='career',
+                     role=db_pool.CLIENT):
+        """
+        Returns the statistics of the given players for a grouping, as
+        (player_id, season or surface, *METRICS) rows ordered by player and
+        group. Players without matches have no rows.
+        """
+        with self._lock:
+            self._ensure_current(role)
+            table = self.table(grouping)
+            codes = [self._codes[str(player_id)] for player_id in player_ids
+                     if str(player_id) in self._codes]
+            positions = []
+            for code in codes:
+                start, end = np.searchsorted(table.players, (code, code + 1))
+                positions.extend(range(start, end))
+            return table.rows(np.array(positions, np.int64),
+                              self._player_ids)
+
+    def leaders(self, metric, grouping='career', label=None, min_matches=1,
+                limit=10, role=db_pool.CLIENT):
+        """
+        Returns the limit players with the highest value of a metric (see
+        RANKED_METRICS) in a grouping, for one season or surface (label)
+        unless the grouping is career, among the players with at least
+        min_matches matches. Rows are as for player_stats.
+        """
+        if metric not in RANKED_METRICS:
+            raise ValueError(f'Unknown metric {metric}')
+        with self._lock:
+            self._ensure_current(role)
+            table = self.table(grouping)
+            eligible = table.metrics['matches'] >= min_matches
+            if table.labels is not None:
+                eligible &= table.labels == label
+            values = table.metrics[metric]
+            if values.dtype == object:
+                eligible &= np.not_equal(values, None)
+            positions = np.flatnonzero(eligible)
+            # Highest first, ties broken by more matches
+            order = np.lexsort((-table.metrics['matches'][positions],
+                                -values[positions].astype(np.float64)))
+            return table.rows(positions[order[:limit]], self._player_ids)
+
+
+# The statistics shared by the whole application.
+engine = ServeStats()
@@ -13,7 +13,19 @@ import mysql.connector
 # To get error codes from the connector, useful for user-friendly
 # error-handling
 import mysql.connector.errorcode as errorcode
-import datetime
+
+# Pools of reusable connections for the appadmin and appclient roles
+import db_pool
+# MySQL or the embedded SQLite copy, as configured
+import storage
+# Named, server-side prepared statements (usage report on quit)
+import statements
+# Cache of fan query results (statistics on quit)
+import result_cache
+# Latency, rows and slow queries of every statement (report on quit)
+import metrics
+# The prompt-free operations behind each menu option (shared with cli.py)
+import operations
 
 # Debugging flag to print errors when debugging that shouldn't be visible
 # to an actual client. ***Set to False when done testing.***
@@ -23,103 +35,50 @@ DEBUG = True
 # ----------------------------------------------------------------------
 # SQL Utility Functions
 # ----------------------------------------------------------------------
-def get_conn_for_admin():
+def check_connection(role):
     """"
-    Returns a connected MySQL connector instance for an admin, if connection
-    is successful. If unsuccessful, exits.
+    Checks that a pooled connection can be opened for the given database
+    role (db_pool.ADMIN or db_pool.CLIENT). If unsuccessful, exits.
     """
     try:
-        conn = mysql.connector.connect(
-          host='localhost',
-          user='appadmin',
-          # Find port in MAMP or MySQL Workbench GUI or with
-          # SHOW VARIABLES WHERE variable_name LIKE 'port';
-          port='3306',  # this may change!
-          password='adminpw',
-          database='wtadb'
-        )
+        with storage.connection(role):
+            pass
         print('Successfully connected.')
-        return conn
     except mysql.connector.Error as err:
         # Remember that this is specific to _database_ users, not
         # application users. So is probably irrelevant to a client in your
         # simulated program. Their user information would be in a users table
         # specific to your database; hence the DEBUG use.
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR and DEBUG:
-            sys.stderr('Incorrect username or password when connecting to DB.')
+            print('Incorrect username or password when connecting to DB.',
+                  file=sys.stderr)
         elif err.errno == errorcode.ER_BAD_DB_ERROR and DEBUG:
-            sys.stderr('Database does not exist.')
+            print('Database does not exist.', file=sys.stderr)
         elif DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
         else:
             # A fine catchall client-facing message.
-            sys.stderr('An error occurred, please contact the administrator.')
+            print('An error occurred, please contact the administrator.',
+                  file=sys.stderr)
         sys.exit(1)
 
-def get_conn_for_user():
-    """"
-    Returns a connected MySQL connector instance for a user, if connection
-    is successful. If unsuccessful, exits.
-    """
-    try:
-        conn = mysql.connector.connect(
-          host='localhost',
-          user='appclient',
-          # Find port in MAMP or MySQL Workbench GUI or with
-          # SHOW VARIABLES WHERE variable_name LIKE 'port';
-          port='3306',  # this may change!
-          password='clientpw',
-          database='wtadb'
-        )
-        print('Successfully connected.')
-        return conn
-    except mysql.connector.Error as err:
-        # Remember that this is specific to _database_ users, not
-        # application users. So is probably irrelevant to a client in your
-        # simulated program. Their user information would be in a users table
-        # specific to your database; hence the DEBUG use.
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR and DEBUG:
-            sys.stderr('Incorrect username or password when connecting to DB.')
-        elif err.errno == errorcode.ER_BAD_DB_ERROR and DEBUG:
-            sys.stderr('Database does not exist.')
-        elif DEBUG:
-            sys.stderr(err)
-        else:
-            # A fine catchall client-facing message.
-            sys.stderr('An error occurred, please contact the administrator.')
-        sys.exit(1)
-
-def exists(table, attribute, value):
+def exists(table, attribute, value, role=db_pool.ADMIN):
     """
     Checks to see if a specific value exists in a given table with a given
-    attribute.
+    attribute, using a connection from the given role's pool. Player IDs,
+    tournament IDs and countries are answered from the local key index.
     """
-    cursor = conn.cursor()
-    sql = 'SELECT * FROM %s WHERE %s = \'%s\';' % (table, attribute, value)
     try:
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-        if rows:
-            return True
-        return False
+        return operations.exists(table, attribute, value, role)
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when checking if user exists. ')
+            print('An error occurred when checking if user exists. ',
+                  file=sys.stderr)
             return
 
-def valid_date(date):
-    """
-    Checks to see if an input is in a valid date format.
-    """
-    try:
-        datetime.datetime.strptime(date, '%Y-%m-%d')
-        return True
-    except ValueError:
-        return False
-
 # ----------------------------------------------------------------------
 # Functions for Command-Line Options/Query Execution
 # ----------------------------------------------------------------------
@@ -131,32 +90,17 @@ def show_tournament_winners():
     """
 
     tournament = input('What tournament would you like to view? ')
-    sql = """SELECT tournament_year,
-                    first_name,
-                    last_name
-                FROM (
-                        SELECT tournament_name,
-                            tournament_year,
-                            winner_id
-                        FROM tournament
-                            NATURAL JOIN tournament_history
-                        WHERE tournament_name = '%s'
-                    ) AS T
-                    JOIN player ON winner_id = player_id
-                ORDER BY tournament_year;""" % (tournament, )
 
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        # row = cursor.fetchone()
-        rows = cursor.fetchall()
+        rows = operations.tournament_winners(tournament)
 
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when searching for tournament winners. ')
+            print('An error occurred when searching for tournament winners. ',
+                  file=sys.stderr)
             return
     if not rows:
         print('No results found.')
@@ -177,98 +121,65 @@ def show_players_top_20():
         ans = input('Invalid input. Please try again or press (q) to quit: ')
         if ans == 'q':
             quit_ui()
-    is_inside = True
-    if ans and ans.lower() == 'inside':
-        sql = """SELECT `rank`,
-                        first_name,
-                        last_name,
-                        TIMESTAMPDIFF(YEAR, dob, current_date()) AS age
-                    FROM ranking NATURAL JOIN player
-                    ORDER BY `rank`;"""
-    elif ans.lower() == 'outside':
-        is_inside = False
-        sql = """SELECT first_name,
-                        last_name,
-                        TIMESTAMPDIFF(YEAR, dob, current_date()) AS age
-                    FROM player
-                    WHERE player_id NOT IN (
-                            SELECT player_id
-                            FROM ranking
-                        )
-                    ORDER BY age;"""
+    is_inside = ans.lower() == 'inside'
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        # row = cursor.fetchone()
-        rows = cursor.fetchall()
-
-    except mysql.connector.Error as err:
-        if DEBUG:
-            sys.stderr(err)
-            sys.exit(1)
-        else:
-            sys.stderr('An error occurred when searching for players.')
-            return
-    if not rows:
-        print('No results found.')
-    else:
         if is_inside:
-            print('Players in the Top 20 (ordered by rank):')
+            rows = operations.players_inside_top_20()
+            found = bool(rows)
+            if found:
+                print('Players in the Top 20 (ordered by rank):')
             for row in rows:
                 (rank, first_name, last_name, age) = row
                 print('  ', f'Rank #{rank}: {first_name} {last_name}, Age: {age}')
         else:
-            print('Players outside the Top 20 (youngest first):')
-            for row in rows:
+            # Everyone else can be most of the player table, so stream it a
+            # page at a time instead of loading it all before printing
+            found = False
+            for row in operations.players_outside_top_20():
+                if not found:
+                    print('Players outside the Top 20 (youngest first):')
+                    found = True
                 (first_name, last_name, age) = row
                 print('  ', f'{first_name} {last_name}, Age: {age}')
 
+    except mysql.connector.Error as err:
+        if DEBUG:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+        else:
+            print('An error occurred when searching for players.',
+                  file=sys.stderr)
+            return
+    if not found:
+        print('No results found.')
+
 def show_surface_count():
     """
     Prompts the user to enter a player name to view the count breakdown of
     matches played on different surfaces.
     """
-    player_name = input('Enter a first and last name of player: ')
-    player_name = player_name.split()
-    first_name, last_name = player_name[0], player_name[1]
-    sql = """SELECT surface,
-                COUNT(*) AS num_matches
-            FROM (
-                    SELECT tournament_id
-                    FROM match_result
-                        JOIN (
-                            SELECT player_id
-                            FROM player
-                            WHERE first_name = '%s'
-                                AND last_name = '%s'
-                        ) AS P ON (
-                            winner_id = player_id
-                            OR loser_id = player_id
-                        )
-                ) AS M
-                NATURAL JOIN tournament
-            GROUP BY surface;
-    """ % (first_name, last_name, )
+    player_name = input('Enter the name of a player: ').strip()
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        # row = cursor.fetchone()
-        rows = cursor.fetchall()
+        rows = operations.surface_count(player_name)
 
+    except operations.InvalidInput as err:
+        print(err)
+        return
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when searching for this player.')
+            print('An error occurred when searching for this player.',
+                  file=sys.stderr)
             return
     if not rows:
-        print(f'No results found for {first_name.title()} {last_name.title()}.')
+        print(f'No results found for {player_name.title()}.')
     else:
-        print(f'Number of matches played by {first_name.title()} {last_name.title()} on each surface:')
+        print(f'Number of matches played by {player_name.title()} on each surface:')
         for row in rows:
-            (surface, count) = row
-            print('  ', f'Surface: {surface}, Matches Played: {count}')
+            (surface, count, wins, losses) = row
+            print('  ', f'Surface: {surface}, Matches Played: {count} ({wins}-{losses})')
 
 def show_player_country():
     """
@@ -276,31 +187,31 @@ def show_player_country():
     shows the list of players from the specified country.
     """
     country = input('What country would you like to see players from? Please enter its 3 digit character code: ')
-    while not exists('player', 'country', country):
+    while not exists('player', 'country', country, db_pool.CLIENT):
         country = input('Invalid country code. Please try again or press (q) to quit: ')
         if country == 'q':
             quit_ui()
-    sql = 'SELECT first_name, last_name, hand, height FROM player WHERE country = \'%s\';' % (country)
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        # row = cursor.fetchone()
-        rows = cursor.fetchall()
+        # Streamed a page at a time (ordered by name), since large countries
+        # have thousands of players
+        found = False
+        for row in operations.players_by_country(country):
+            if not found:
+                print(f'List of players from {country.upper()}:')
+                found = True
+            (first_name, last_name, hand, height) = row
+            print('  ', f'Player Name: {first_name} {last_name}, Dominant Hand: {hand}, Height: {height}')
 
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when searching for this player.')
+            print('An error occurred when searching for this player.',
+                  file=sys.stderr)
             return
-    if not rows:
+    if not found:
         print(f'No results found for {country.upper()}.')
-    else:
-        print(f'List of players from {country.upper()}:')
-        for row in rows:
-            (first_name, last_name, hand, height) = row
-            print('  ', f'Player Name: {first_name} {last_name}, Dominant Hand: {hand}, Height: {height}')
 
 
 def input_match_results():
@@ -320,7 +231,7 @@ def input_match_results():
         if id == 'q':
             quit_ui()
     date = input('Input tournament start date (YYYY-MM-DD): ')
-    while not valid_date(date):
+    while not operations.valid_date(date):
         date = input('Invalid date format. Please try again or press (q) to quit: ')
         if date == 'q':
             quit_ui()
@@ -377,30 +288,26 @@ def input_match_results():
             if loser_dfs == 'q':
                 quit_ui()
     else:
-        winner_aces = 'NULL'
-        winner_bp_saved = 'NULL'
-        winner_dfs = 'NULL'
-        loser_aces = 'NULL'
-        loser_bp_saved = 'NULL'
-        loser_dfs = 'NULL'
+        winner_aces = None
+        winner_bp_saved = None
+        winner_dfs = None
+        loser_aces = None
+        loser_bp_saved = None
+        loser_dfs = None
     try:
-        sql = """CALL input_match_results('%d', '%s', '%s', '%s', '%s', '%s',
-                                        %s, %s, %s, '%s', %s, %s, %s)
-            """ % (is_final, id, date, score, mins, winner_id, winner_aces,
-                    winner_bp_saved, winner_dfs, loser_id, loser_aces, loser_bp_saved, loser_dfs, )
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
-        # row = cursor.fetchone()
-        # rows = cursor.fetchall()
+        match_id = operations.input_match_result(
+            is_final, id, date, score, mins, winner_id, loser_id,
+            winner_aces, winner_bp_saved, winner_dfs,
+            loser_aces, loser_bp_saved, loser_dfs)
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when inputting the match data.')
+            print('An error occurred when inputting the match data.',
+                  file=sys.stderr)
             return
-    print('Match results input successfully entered into database. ')
+    print(f'Match results input successfully entered into database (match ID {match_id}). ')
 
 def update_player_information():
     """
@@ -424,52 +331,51 @@ def update_player_information():
     ans = input('Enter an option: ').lower()
     if ans == 'f':
         name = input('Enter new name: ')
-        sql = 'UPDATE player SET first_name = \'%s\' WHERE player_id = \'%s\';' % (name, id)
+        attribute, value = 'first_name', name
     elif ans == 'l':
         name = input('Enter new name: ')
-        sql = 'UPDATE player SET last_name = \'%s\' WHERE player_id = \'%s\';' % (name, id)
+        attribute, value = 'last_name', name
     elif ans == 'h':
         hand = input('Enter new hand: ')
         while hand.lower() != 'r' and hand.lower() != 'l':
             hand = input('Invalid input. Please try again or press (q) to quit: ')
             if hand == 'q':
                 quit_ui()
-        sql = 'UPDATE player SET hand = \'%s\' WHERE player_id = \'%s\';' % (hand.upper(), id)
+        attribute, value = 'hand', hand.upper()
     elif ans == 'd':
         dob = input('Enter new dob: ')
-        while not valid_date(dob):
+        while not operations.valid_date(dob):
             dob = input('Invalid input. Please try again or press (q) to quit: ')
             if dob == 'q':
                 quit_ui()
-        sql = 'UPDATE player SET dob = \'%s\' WHERE player_id = \'%s\';' % (dob, id)
+        attribute, value = 'dob', dob
     elif ans == 'c':
         country = input('Enter new country: ')
         while len(country) != 3 or country.isdecimal():
             country = input('Invalid input. Please try again or press (q) to quit: ')
             if country == 'q':
                 quit_ui()
-        sql = 'UPDATE player SET country = \'%s\' WHERE player_id = \'%s\';' % (country.upper(), id)
+        attribute, value = 'country', country.upper()
     elif ans == 'g':
         height = input('Enter new height: ')
         while not height.isdecimal():
             height = input('Invalid input. Please try again or press (q) to quit: ')
             if height == 'q':
                 quit_ui()
-        sql = 'UPDATE player SET height = \'%s\' WHERE player_id = \'%s\';' % (height, id)
+        attribute, value = 'height', height
     else:
         print('Unknown option.')
         return
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
+        operations.update_player(id, attribute, value)
         print('Changed player information successfully.')
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when inputting the player data.')
+            print('An error occurred when inputting the player data.',
+                  file=sys.stderr)
             return
 
 def update_rankings():
@@ -497,21 +403,16 @@ def update_rankings():
         t = input('Invalid number. Please try again or press (q) to quit: ')
         if t == 'q':
             quit_ui()
-    sql = """UPDATE ranking SET player_id = \'%s\',
-                                player_points = %s,
-                                tournaments_played = %s
-                            WHERE `rank` = %s;""" % (id, pts, t, rank)
     try:
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        conn.commit()
+        operations.update_ranking(rank, id, pts, t)
         print('Updated player ranking successfully.')
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred when inputting the ranking data.')
+            print('An error occurred when inputting the ranking data.',
+                  file=sys.stderr)
             return
 
 # ----------------------------------------------------------------------
@@ -530,21 +431,15 @@ def login_as_admin():
     """
     username = input('Enter admin username: ')
     password = input('Enter admin password: ')
-    cursor = conn.cursor()
-    sql = 'SELECT authenticate(\'%s\', \'%s\');' % (username, password, )
     try:
-        cursor.execute(sql)
-        res = cursor.fetchone()
-        if res[0]:
-            return True
-        else:
-            return False
+        return operations.authenticate(username, password)
     except mysql.connector.Error as err:
         if DEBUG:
-            sys.stderr(err)
+            print(err, file=sys.stderr)
             sys.exit(1)
         else:
-            sys.stderr('An error occurred while authenticating admin.')
+            print('An error occurred while authenticating admin.',
+                  file=sys.stderr)
             return
 
 def login_as_user():
@@ -556,36 +451,28 @@ def login_as_user():
     username = input('Enter username: ')
     password = input('Enter password: ')
     if exists('user_info', 'username', username):
-        cursor = conn.cursor()
-        sql = 'SELECT authenticate(\'%s\', \'%s\')' % (username, password, )
         try:
-            cursor.execute(sql)
-            res = cursor.fetchone()
-            if res[0]:
-                return True
-            else:
-                return False
+            return operations.authenticate(username, password)
         except mysql.connector.Error as err:
             if DEBUG:
-                sys.stderr(err)
+                print(err, file=sys.stderr)
                 sys.exit(1)
             else:
-                sys.stderr('An error occurred while authenticating user.')
+                print('An error occurred while authenticating user.',
+                      file=sys.stderr)
                 return
     else:
-        cursor = conn.cursor()
-        sql = 'CALL sp_add_user(\'%s\', \'%s\')' % (username, password, )
         try:
-            cursor.execute(sql)
-            conn.commit()
+            operations.add_user(username, password)
             print('Added new user to database.')
             return True
         except mysql.connector.Error as err:
             if DEBUG:
-                sys.stderr(err)
+                print(err, file=sys.stderr)
                 sys.exit(1)
             else:
-                sys.stderr('An error occurred while authenticating user.')
+                print('An error occurred while authenticating user.',
+                      file=sys.stderr)
                 return
 
 # ----------------------------------------------------------------------
@@ -647,6 +534,17 @@ def quit_ui():
     Quits the program, printing a good bye message to the user.
     """
     print('Good bye!')
+    if DEBUG:
+        # Confirms that repeated queries reused their prepared statements
+        # and cached results
+        print(statements.report())
+        print('Result cache:', result_cache.cache.stats())
+        # Where the database time went, by statement and role
+        print(metrics.metrics.report())
+        # Where the fan queries went, when reading from replicas
+        if db_pool.replica_status() is not None:
+            print('Replicas:', db_pool.replica_status())
+    storage.close_all()
     exit()
 
 
@@ -661,14 +559,13 @@ def login_options():
     ans = input('Enter either (a) or (u) for logging in: ').lower()
     if ans == 'a':
         if login_as_admin():
-            conn = get_conn_for_admin()
             show_admin_options()
         else:
             print('Invalid admin login. Please try again.')
             quit_ui()
     elif ans == 'u':
         if login_as_user():
-            conn = get_conn_for_user()
+            check_connection(db_pool.CLIENT)
             show_user_options()
         else:
             print('Invalid user login. Please try again.')
@@ -687,8 +584,10 @@ def main():
 
 
 if __name__ == '__main__':
-    # This conn is a global object that other functions can access.
-    # You'll need to use cursor = conn.cursor() each time you are
-    # about to execute a query with cursor.execute(<sqlquery>)
-    conn = get_conn_for_admin()
+    # The functions in operations borrow connections from the configured
+    # storage backend (the db_pool pools, or SQLite) each time they run a
+    # named statement. Logging in needs the admin role, so make sure it is
+    # reachable up front.
+    check_connection(db_pool.ADMIN)
     main()
+    storage.close_all()
@@ -0,0 +1,156 @@
+"""
+Multi-writer stress benchmark for the input_match_results procedure.
+
+Starts N writer threads, each with its own connection, that insert matches
+through input_match_results as fast as they can, for each writer count
+given. Every match ID returned by the procedure is collected, so the run
+fails loudly if two writers were ever handed the same ID or an insert
+failed with a duplicate key. Prints insert throughput per writer count.
+
+The inserted matches also bump ranking.tournaments_played through the
+insert trigger, so run this against a scratch copy of wtadb, e.g.:
+
+    $ WTADB_DATABASE=wtadb_bench python bench_concurrent_inserts.py \\
+        --writers 1 2 4 8 16 --inserts 200 --cleanup
+
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+
+import mysql.connector
+import mysql.connector.errorcode as errorcode
+
+import db_pool
+import statements
+
+statements.register('bench_player_ids', 'SELECT player_id FROM player')
+statements.register('bench_tournament_ids',
+                    'SELECT tournament_id FROM tournament')
+statements.register('bench_delete_matches', """
+    DELETE FROM match_result WHERE match_id BETWEEN %s AND %s""")
+
+
+def load_keys():
+    """
+    Returns the player and tournament IDs that generated matches use.
+    """
+    with db_pool.connection(db_pool.ADMIN) as conn:
+        players = [row[0] for row in
+                   statements.execute(conn, 'bench_player_ids').fetchall()]
+        tournaments = [row[0] for row in statements.execute(
+            conn, 'bench_tournament_ids').fetchall()]
+    return players, tournaments
+
+
+def random_match(rng, players, tournaments):
+    """
+    Returns the input_match_results parameters for a random, non-final
+    match between two distinct players.
+    """
+    winner_id, loser_id = rng.sample(players, 2)
+    return (0, rng.choice(tournaments), '2023-01-16', '6-4 6-4',
+            rng.randint(50, 200), winner_id, rng.randint(0, 15),
+            rng.randint(0, 10), rng.randint(0, 10), loser_id,
+            rng.randint(0, 15), rng.randint(0, 10), rng.randint(0, 10))
+
+
+def writer(inserts, players, tournaments, seed, barrier, ids, errors):
+    """
+    Inserts matches one transaction at a time, recording the returned IDs
+    and any errors.
+    """
+    rng = random.Random(seed)
+    params = [random_match(rng, players, tournaments) for _ in range(inserts)]
+    with db_pool.connection(db_pool.ADMIN) as conn:
+        barrier.wait()
+        for match in params:
+            try:
+                statements.execute(conn, 'input_match_results', match)
+                (match_id, ) = statements.execute(
+                    conn, 'new_match_id').fetchone()
+                conn.commit()
+                ids.append(match_id)
+            except mysql.connector.Error as err:
+                conn.rollback()
+                errors.append(err)
+
+
+def run(writers, inserts, players, tournaments):
+    """
+    Runs one round with the given number of concurrent writers and returns
+    its results.
+    """
+    barrier = threading.Barrier(writers + 1)
+    ids, errors = [], []
+    threads = [
+        threading.Thread(target=writer,
+                         args=(inserts, players, tournaments, seed, barrier,
+                               ids, errors))
+        for seed in range(writers)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    duplicate_keys = sum(1 for err in errors
+                         if err.errno == errorcode.ER_DUP_ENTRY)
+    return {
+        'writers': writers,
+        'inserts': len(ids),
+        'seconds': round(elapsed, 3),
+        'inserts_per_second': round(len(ids) / elapsed, 1),
+        'collisions': len(ids) - len(set(ids)) + duplicate_keys,
+        'errors': len(errors),
+        'first_id': min(ids, default=None),
+        'last_id': max(ids, default=None),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Concurrent input_match_results stress benchmark.')
+    parser.add_argument('--writers', type=int, nargs='+',
+                        default=[1, 2, 4, 8, 16],
+                        help='writer counts to benchmark')
+    parser.add_argument('--inserts', type=int, default=200,
+                        help='matches inserted by each writer')
+    parser.add_argument('--cleanup', action='store_true',
+                        help='delete the inserted matches afterward')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args(argv)
+
+    config = db_pool.load_config()
+    config['pool_size'] = str(max(args.writers))
+    db_pool.configure(config)
+
+    players, tournaments = load_keys()
+    results = []
+    print(f'{"Writers":>8} {"Inserts":>8} {"Seconds":>8} {"Inserts/s":>10} '
+          f'{"Collisions":>11} {"Errors":>7}')
+    for writers in args.writers:
+        result = run(writers, args.inserts, players, tournaments)
+        results.append(result)
+        print(f'{result["writers"]:>8} {result["inserts"]:>8} '
+              f'{result["seconds"]:>8} {result["inserts_per_second"]:>10} '
+              f'{result["collisions"]:>11} {result["errors"]:>7}')
+        if args.cleanup and result['first_id'] is not None:
+            with db_pool.connection(db_pool.ADMIN) as conn:
+                statements.execute(conn, 'bench_delete_matches',
+                                   (result['first_id'], result['last_id']))
+                conn.commit()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    db_pool.close_all()
+    return 1 if any(result['collisions'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
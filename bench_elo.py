@@ -0,0 +1,144 @@
+"""
+Benchmark of a full Elo replay (see elo.py): the time to rate every match
+in chronological order, overall and on each surface.
+
+For each size, synthetic matches between --players players (on random
+surfaces) are encoded as elo.Ratings.encode would encode them, then
+replayed, and the replay is timed. The run also replays the same matches
+in chunks, as update() does when new matches arrive, and fails if the
+ratings differ from those of the single replay. With --database, the
+matches in the configured database are loaded, encoded and replayed too
+(nothing is written):
+
+    $ python bench_elo.py --sizes 1000000 5000000
+    $ WTADB_DATABASE=wtadb_large python bench_elo.py --database
+
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from array import array
+
+import mysql.connector
+
+import db_pool
+import elo
+import storage
+
+# Chunks the matches are split into for the incremental replay
+CHUNKS = 10
+
+
+def generate_matches(size, players, seed=0):
+    """
+    Returns size random matches as (winners, losers, kinds) arrays of
+    player codes and surface indexes into elo.KINDS.
+    """
+    rng = random.Random(seed)
+    winners, losers, kinds = array('i'), array('i'), array('b')
+    for _ in range(size):
+        winner, loser = rng.sample(range(players), 2)
+        winners.append(winner)
+        losers.append(loser)
+        kinds.append(rng.randint(1, len(elo.SURFACES)))
+    return winners, losers, kinds
+
+
+def new_ratings(players):
+    ratings = elo.Ratings()
+    for player in range(players):
+        ratings.code(str(player))
+    return ratings
+
+
+def replay(size, players):
+    """
+    Replays size synthetic matches, in one go and in CHUNKS chunks. Returns
+    the result and whether both replays gave the same ratings.
+    """
+    winners, losers, kinds = generate_matches(size, players)
+    ratings = new_ratings(players)
+    start = time.perf_counter()
+    ratings.replay(winners, losers, kinds)
+    elapsed = time.perf_counter() - start
+    chunked = new_ratings(players)
+    step = -(-size // CHUNKS)
+    for i in range(0, size, step):
+        chunked.replay(winners[i:i + step], losers[i:i + step],
+                       kinds[i:i + step])
+    return ({'source': 'synthetic', 'matches': size, 'players': players,
+             'seconds': round(elapsed, 3),
+             'matches_per_second': round(size / elapsed, 1)},
+            chunked.elo == ratings.elo and chunked.matches == ratings.matches)
+
+
+def replay_database():
+    """
+    Loads, encodes and replays the matches in the configured database,
+    timing each step.
+    """
+    with storage.connection(db_pool.CLIENT) as conn:
+        start = time.perf_counter()
+        matches = storage.fetchall(conn, 'rating_matches', (0, ))
+    loaded = time.perf_counter()
+    ratings = elo.Ratings()
+    encoded = ratings.encode(matches)
+    encoded_at = time.perf_counter()
+    ratings.replay(*encoded)
+    end = time.perf_counter()
+    return {'source': 'database', 'matches': len(matches),
+            'players': len(ratings),
+            'load_seconds': round(loaded - start, 3),
+            'encode_seconds': round(encoded_at - loaded, 3),
+            'seconds': round(end - encoded_at, 3),
+            'matches_per_second': round(len(matches)
+                                        / max(end - encoded_at, 1e-9), 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time a full replay of the Elo ratings.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000000, 5000000],
+                        help='numbers of synthetic matches to replay')
+    parser.add_argument('--players', type=int, default=3000,
+                        help='players in the synthetic matches')
+    parser.add_argument('--database', action='store_true',
+                        help="also replay the configured database's "
+                             'matches')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args(argv)
+
+    results = []
+    consistent = True
+    print(f'{"Source":>9} {"Matches":>10} {"Seconds":>9} {"Matches/s":>10}')
+    runs = [lambda size=size: replay(size, args.players)
+            for size in args.sizes]
+    if args.database:
+        runs.append(lambda: (replay_database(), True))
+    try:
+        for run in runs:
+            result, same = run()
+            results.append(result)
+            print(f'{result["source"]:>9} {result["matches"]:>10} '
+                  f'{result["seconds"]:>9} '
+                  f'{result["matches_per_second"]:>10}')
+            if not same:
+                consistent = False
+                print(f'  chunked replay differs at {result["matches"]} '
+                      f'matches!', file=sys.stderr)
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Benchmark of loading player profiles (bio, current rankings, matches by
+surface, titles and recent matches, see operations.player_profiles) in
+two ways:
+
+  per-query:  the way a player page was built before, five lookups per
+              player, each a round trip that repeats the player lookup.
+  procedure:  one call of the player_profiles procedure for the whole
+              batch, returning five result sets.
+
+For each batch size, the players with the most matches are profiled both
+ways on one connection, bypassing the result cache, and the run fails if
+the two give different profiles. Round trips are the statements sent to
+the server for one batch:
+
+    $ python bench_profiles.py --sizes 1 32 128
+    $ WTADB_DATABASE=wtadb_large python bench_profiles.py --json out.json
+
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import mysql.connector
+
+import db_pool
+import operations
+import statements
+import storage
+
+APPROACHES = ('per-query', 'procedure')
+DEFAULT_SIZES = (1, 32, statements.PROFILE_PLAYERS)
+DEFAULT_REPEAT = 20
+
+statements.register('bench_profile_players', """
+    SELECT player_id
+    FROM (
+            SELECT winner_id AS player_id FROM match_result
+            UNION ALL
+            SELECT loser_id FROM match_result
+        ) AS M
+    GROUP BY player_id
+    ORDER BY COUNT(*) DESC, player_id
+    LIMIT %s""",
+                    reads=('match_result', ))
+
+# The per-player lookups, each led by the player ID like the procedure's
+# result sets.
+PER_PLAYER_STATEMENTS = (
+    statements.register('bench_profile_bio', """
+        SELECT player_id, first_name, last_name, hand, dob, country, height
+        FROM player
+        WHERE player_id = %s""",
+                        reads=('player', )),
+    statements.register('bench_profile_rankings', """
+        SELECT player_id, `rank`, player_points, tournaments_played
+        FROM ranking
+        WHERE player_id = %s
+        ORDER BY `rank`""",
+                        reads=('ranking', )),
+    statements.register('bench_profile_surfaces', """
+        SELECT player_id, surface, matches, wins, losses
+        FROM player_surface_stats
+        WHERE player_id = %s
+            AND matches > 0
+        ORDER BY surface""",
+                        reads=('player_surface_stats', )),
+    statements.register('bench_profile_titles', """
+        SELECT H.winner_id, H.tournament_year, H.tournament_id,
+            T.tournament_name
+        FROM tournament_history AS H
+            JOIN tournament AS T ON T.tournament_id = H.tournament_id
+        WHERE H.winner_id = %s
+        ORDER BY H.tournament_year DESC, H.tournament_id""",
+                        reads=('tournament_history', 'tournament')),
+    statements.register('bench_profile_recent', """
+        SELECT R.player_id, M.match_id, M.tournament_date,
+            T.tournament_name, R.result, R.opponent_id, O.first_name,
+            O.last_name, M.score
+        FROM (
+                SELECT winner_id AS player_id, match_id, 'W' AS result,
+                    loser_id AS opponent_id
+                FROM match_result
+                WHERE winner_id = %s
+                UNION ALL
+                SELECT loser_id, match_id, 'L', winner_id
+                FROM match_result
+                WHERE loser_id = %s
+            ) AS R
+            JOIN match_result AS M ON M.match_id = R.match_id
+            JOIN tournament AS T ON T.tournament_id = M.tournament_id
+            JOIN player AS O ON O.player_id = R.opponent_id
+        ORDER BY M.tournament_date DESC, M.match_id DESC
+        LIMIT %s""",
+                        reads=('match_result', 'tournament', 'player')),
+)
+
+
+def per_query(conn, player_ids, recent):
+    """
+    Returns the profiles of the players from five lookups per player.
+    """
+    sets = [[] for _ in PER_PLAYER_STATEMENTS]
+    for player_id in player_ids:
+        for rows, statement in zip(sets, PER_PLAYER_STATEMENTS):
+            params = (player_id, )
+            if statement.name == 'bench_profile_recent':
+                params = (player_id, player_id, recent)
+            rows.extend(storage.fetchall(conn, statement.name, params))
+    return operations.profile_rows(player_ids, sets)
+
+
+def procedure(conn, player_ids, recent):
+    """
+    Returns the profiles of the players from one call of the
+    player_profiles procedure.
+    """
+    return operations.profile_rows(player_ids, storage.fetchsets(
+        conn, 'player_profiles', (json.dumps(sorted(player_ids)), recent)))
+
+
+def time_runs(run, repeat):
+    """
+    Calls run() once to warm up and then repeat times, and returns what it
+    returned and the timing statistics in milliseconds.
+    """
+    result = run()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return result, {'median_ms': round(statistics.median(times), 3),
+                    'p95_ms': round(times[int(0.95 * (len(times) - 1))], 3),
+                    'mean_ms': round(statistics.fmean(times), 3)}
+
+
+def compare(conn, player_ids, recent, repeat):
+    """
+    Profiles the players both ways. Returns the result of each approach and
+    whether both gave the same profiles.
+    """
+    results = []
+    profiles = []
+    for approach, load in zip(APPROACHES, (per_query, procedure)):
+        rows, timing = time_runs(lambda: load(conn, player_ids, recent),
+                                 repeat)
+        profiles.append(rows)
+        round_trips = (len(PER_PLAYER_STATEMENTS) * len(player_ids)
+                       if approach == 'per-query' else 1)
+        results.append({'approach': approach, 'players': len(player_ids),
+                        'round_trips': round_trips, **timing})
+    return results, profiles[0] == profiles[1]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time loading player profiles per query and in one '
+                    'procedure call.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=list(DEFAULT_SIZES),
+                        help='players per batch (at most '
+                             f'{statements.PROFILE_PLAYERS})')
+    parser.add_argument('--recent', type=int,
+                        default=operations.RECENT_MATCHES,
+                        help='recent matches per player')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='timed runs of each batch')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args(argv)
+    if max(args.sizes) > statements.PROFILE_PLAYERS:
+        parser.error(f'batches are at most {statements.PROFILE_PLAYERS} '
+                     f'players')
+
+    results = []
+    consistent = True
+    print(f'{"Players":>7} {"Approach":>10} {"Round trips":>11} '
+          f'{"Median ms":>10} {"p95 ms":>9}')
+    try:
+        with storage.connection(db_pool.CLIENT) as conn:
+            players = [player_id for (player_id, ) in storage.fetchall(
+                conn, 'bench_profile_players', (max(args.sizes), ))]
+            for size in args.sizes:
+                found, same = compare(conn, players[:size], args.recent,
+                                      args.repeat)
+                for result in found:
+                    results.append(result)
+                    print(f'{result["players"]:>7} {result["approach"]:>10} '
+                          f'{result["round_trips"]:>11} '
+                          f'{result["median_ms"]:>10} '
+                          f'{result["p95_ms"]:>9}')
+                if not same:
+                    consistent = False
+                    print(f'  profiles of {size} players differ!',
+                          file=sys.stderr)
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,414 @@
+"""
+Benchmark of every read query and stored function the application runs,
+plus the queries in queries.sql.
+
+Each benchmark is run once to warm up and then --repeat times, timing the
+execution and the fetch of every row. Parameters are picked from the data
+(the tournament with the longest history, the player with the most
+matches, the country with the most players, the latest final), so the
+numbers reflect the expensive cases; the head-to-head lookups use the
+players with the most matches as a full draw. The paged listings are timed
+both for their first page and for a page from the middle of the listing,
+and name_search lookups and analytics statistics are timed in process on
+an index of every player and on the columns of every match, as is parsing
+a sample of the scores (see score_parser.py).
+The plan of each query is captured with EXPLAIN FORMAT=JSON (EXPLAIN QUERY
+PLAN on SQLite).
+
+Results are printed and, with --json, written out along with the size of
+every table. Given an earlier --json file as --baseline, any benchmark
+whose median time grew by more than --threshold is reported as a
+regression and the run fails, e.g.:
+
+    $ python datagen.py --players 10000 --matches 5000000 --out data/large
+    $ (load data/large into a scratch database)
+    $ WTADB_DATABASE=wtadb_large python bench_queries.py --json before.json
+    $ (change something)
+    $ WTADB_DATABASE=wtadb_large python bench_queries.py --json after.json \\
+        --baseline before.json
+
+Write paths are covered by bench_concurrent_inserts.py and
+bench_tournaments_played.py, the Elo replay by bench_elo.py, and loading
+player profiles in one procedure call by bench_profiles.py.
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import time
+
+import mysql.connector
+
+import analytics
+import db_pool
+# Imported for the statements they register
+import elo
+import key_index
+import name_search
+import paging
+import score_parser
+import statements
+import storage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERIES_FILE = os.path.join(HERE, 'queries.sql')
+DEFAULT_REPEAT = 20
+DEFAULT_THRESHOLD = 1.25
+
+statements.register('bench_sample_tournament', """
+    SELECT tournament_name
+    FROM tournament
+        NATURAL JOIN tournament_history
+    GROUP BY tournament_name
+    ORDER BY COUNT(*) DESC, tournament_name
+    LIMIT 1""")
+statements.register('bench_sample_player', """
+    SELECT player_id, first_name, last_name
+    FROM player
+        NATURAL JOIN player_surface_stats
+    GROUP BY player_id, first_name, last_name
+    ORDER BY SUM(matches) DESC, player_id
+    LIMIT 1""")
+statements.register('bench_sample_country', """
+    SELECT country, COUNT(*)
+    FROM player
+    GROUP BY country
+    ORDER BY COUNT(*) DESC, country
+    LIMIT 1""")
+statements.register('bench_sample_final', """
+    SELECT W.first_name, W.last_name, F.first_name, F.last_name
+    FROM tournament_history AS H
+        JOIN player AS W ON H.winner_id = W.player_id
+        JOIN player AS F ON H.finalist_id = F.player_id
+    ORDER BY H.match_id DESC
+    LIMIT 1""")
+# The players with the most matches, as the entrants of a full draw
+statements.register('bench_sample_draw', f"""
+    SELECT player_id
+    FROM player_surface_stats
+    GROUP BY player_id
+    ORDER BY SUM(matches) DESC, player_id
+    LIMIT {statements.HEAD_TO_HEAD_PLAYERS}""")
+# The match_id before the last 100, as an incremental analytics refresh
+statements.register('bench_sample_refresh', """
+    SELECT match_id
+    FROM match_result
+    ORDER BY match_id DESC
+    LIMIT 1 OFFSET 100""")
+statements.register('bench_count_outside_top_20', """
+    SELECT COUNT(*)
+    FROM player
+    WHERE player_id NOT IN (
+            SELECT player_id
+            FROM ranking
+            WHERE `rank` <= 20
+        )""")
+# Keys of the rows in the middle of the paged listings
+statements.register('bench_middle_outside_top_20', """
+    SELECT dob, player_id
+    FROM player
+    WHERE player_id NOT IN (
+            SELECT player_id
+            FROM ranking
+            WHERE `rank` <= 20
+        )
+    ORDER BY dob DESC, player_id
+    LIMIT 1 OFFSET %s""")
+statements.register('bench_middle_country', """
+    SELECT last_name, first_name, player_id
+    FROM player
+    WHERE country = %s
+    ORDER BY last_name, first_name, player_id
+    LIMIT 1 OFFSET %s""")
+# Scores to time the parser on
+statements.register('bench_sample_scores', """
+    SELECT score
+    FROM match_result
+    ORDER BY match_id DESC
+    LIMIT 10000""")
+COUNT_STATEMENTS = {
+    table: statements.register(f'bench_count_{table}',
+                               f'SELECT COUNT(*) FROM {table}').name
+    for table in (*storage.TABLES, 'player_surface_stats', 'head_to_head',
+                  'ranking_history', 'player_rating', 'match_score',
+                  'match_set', 'user_info')
+}
+
+
+def samples(conn):
+    """
+    Returns the parameter values the benchmarks run with.
+    """
+    def one(name, params=()):
+        return storage.fetchone(conn, name, params)
+
+    (tournament, ) = one('bench_sample_tournament') or ('Australian Open', )
+    player = one('bench_sample_player') or ('200033', 'Serena', 'Williams')
+    country, players = one('bench_sample_country') or ('USA', 1)
+    final = one('bench_sample_final') or ('Sofia', 'Kenin',
+                                          'Garbine', 'Muguruza')
+    (outside, ) = one('bench_count_outside_top_20')
+    outside_key = one('bench_middle_outside_top_20', (outside // 2, ))
+    country_key = one('bench_middle_country', (country, players // 2))
+    draw = sorted(player_id for (player_id, ) in
+                  storage.fetchall(conn, 'bench_sample_draw'))
+    (refresh_after, ) = one('bench_sample_refresh') or (0, )
+    return {'tournament': tournament, 'player': tuple(player),
+            'country': country, 'final': tuple(final),
+            'outside_key': tuple(outside_key or ('2000-01-01', '')),
+            'country_key': tuple(country_key or ('', '', '')),
+            'draw': draw, 'refresh_after': refresh_after}
+
+
+def benchmarks(s, page_size):
+    """
+    Returns the (label, statement name, params) of every benchmark.
+    """
+    # The draw padded as operations.draw_head_to_head does, and its
+    # first-round pairs
+    draw = tuple(s['draw']) + (None, ) * (statements.HEAD_TO_HEAD_PLAYERS
+                                          - len(s['draw']))
+    pairs = tuple(s['draw'][:2 * statements.HEAD_TO_HEAD_PAIRS])
+    pairs = pairs[:len(pairs) // 2 * 2]
+    today = datetime.date.today().isoformat()
+    return [
+        ('tournament_winners', 'tournament_winners', (s['tournament'], )),
+        ('players_inside_top_20', 'players_inside_top_20', ()),
+        ('players_outside_top_20', 'players_outside_top_20', ()),
+        ('players_outside_top_20_page (first)',
+         'players_outside_top_20_page_first', (page_size, )),
+        ('players_outside_top_20_page (middle)',
+         'players_outside_top_20_page_after',
+         (*paging.keyset_params(s['outside_key']), page_size)),
+        ('player_surface_count', 'player_surface_count', s['player'][:1]),
+        ('players_by_country', 'players_by_country', (s['country'], )),
+        ('players_by_country_page (first)', 'players_by_country_page_first',
+         (s['country'], page_size)),
+        ('players_by_country_page (middle)', 'players_by_country_page_after',
+         (s['country'], *paging.keyset_params(s['country_key']),
+          page_size)),
+        ('find_matchup_history', 'matchup_history', s['final']),
+        ('find_highest_ranked_player', 'highest_ranked_player',
+         (s['country'], )),
+        ('head_to_head_draw', 'head_to_head_draw', 2 * draw),
+        ('head_to_head_pairs', 'head_to_head_pairs',
+         pairs + (None, ) * (2 * statements.HEAD_TO_HEAD_PAIRS - len(pairs))),
+        ('authenticate', 'authenticate', ('admin', 'adminpw')),
+        ('exists_player_id', 'exists_player_id', ('200033', )),
+        ('exists_country', 'exists_country', (s['country'], )),
+        ('exists_tournament_id', 'exists_tournament_id', ('580', )),
+        ('index_player_ids', 'index_player_ids', ()),
+        ('index_tournament_ids', 'index_tournament_ids', ()),
+        ('index_countries', 'index_countries', ()),
+        ('name_index_players', 'name_index_players', ()),
+        ('player_rank_on', 'player_rank_on', (today, s['player'][0])),
+        ('top_ranked_on (top 100)', 'top_ranked_on', (today, 100)),
+        ('analytics_matches (100 new)', 'analytics_matches',
+         (s['refresh_after'], )),
+        ('rating_matches (100 new)', 'rating_matches',
+         (s['refresh_after'], )),
+        ('player_rating', 'player_rating', s['player'][:1]),
+        ('top_rated', elo.TOP_RATED_STATEMENTS[None].name, (10, 20)),
+        ('top_rated_clay', elo.TOP_RATED_STATEMENTS['Clay'].name, (10, 20)),
+        ('player_score_stats', 'player_score_stats', s['player'][:1] * 2),
+        ('set_score_counts', 'set_score_counts', ()),
+    ]
+
+
+def name_searches(s):
+    """
+    Returns the (label, query, prefix, fuzzy) of every name search
+    benchmark: the sample player's full name, the start of their last name
+    and their name with a typo in it.
+    """
+    _, first_name, last_name = s['player']
+    typo = last_name[:1] + last_name[2:3] + last_name[1:2] + last_name[3:]
+    return [
+        ('name search (full name)', f'{first_name} {last_name}', True, True),
+        ('name search (prefix)', last_name[:3], True, False),
+        ('name search (typo)', f'{first_name} {typo}', True, True),
+    ]
+
+
+def serve_stats_runs(s, serve_stats):
+    """
+    Returns the (label, run) of every analytics benchmark: computing the
+    statistics of every player for each grouping, and looking up the
+    sample player's.
+    """
+    player_id = s['player'][0]
+    runs = [(f'serve stats ({grouping}, all players)',
+             lambda grouping=grouping: serve_stats.aggregate(grouping))
+            for grouping in analytics.GROUPINGS]
+    runs.append(('serve stats (player by season)',
+                 lambda: serve_stats.player_stats([player_id], 'season')))
+    runs.append(('serve stats (career leaders)',
+                 lambda: serve_stats.leaders('aces_per_match', 'career')))
+    return runs
+
+
+def read_queries(path=QUERIES_FILE):
+    """
+    Returns the SQL of each query in queries.sql.
+    """
+    with open(path) as f:
+        sql = '\n'.join(line for line in f
+                        if not line.lstrip().startswith('--'))
+    return [query.strip() for query in sql.split(';') if query.strip()]
+
+
+def explain(conn, sql):
+    """
+    Returns the query plan of one of the queries in queries.sql (in the
+    backend's own SQL), or None if it is not a SELECT.
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    return storage.get_backend().explain(conn, sql)
+
+
+def time_runs(run, repeat):
+    """
+    Calls run() once to warm up and then repeat times, and returns the
+    number of rows it returned and the timing statistics in milliseconds.
+    """
+    rows = len(run())
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return rows, {'min_ms': round(times[0], 3),
+                  'median_ms': round(statistics.median(times), 3),
+                  'p95_ms': round(times[int(0.95 * (len(times) - 1))], 3),
+                  'mean_ms': round(statistics.fmean(times), 3),
+                  'max_ms': round(times[-1], 3)}
+
+
+def run_benchmarks(conn, repeat, page_size):
+    """
+    Runs every benchmark on the connection and returns their results.
+    """
+    results = []
+    s = samples(conn)
+    for label, name, params in benchmarks(s, page_size):
+        rows, timing = time_runs(
+            lambda: storage.fetchall(conn, name, params), repeat)
+        results.append({'benchmark': label, 'statement': name,
+                        'params': params, 'rows': rows, **timing,
+                        'plan': storage.explain(conn, name, params)})
+    for i, sql in enumerate(read_queries(), 1):
+        if storage.get_backend().name == storage.SQLITE:
+            sql = storage.translate(sql)
+
+            def run(sql=sql):
+                return conn.raw.execute(sql).fetchall()
+        else:
+            def run(sql=sql):
+                cursor = conn.cursor()
+                cursor.execute(sql)
+                rows = cursor.fetchall()
+                cursor.close()
+                return rows
+        rows, timing = time_runs(run, repeat)
+        results.append({'benchmark': f'queries.sql #{i}', 'statement': None,
+                        'params': [], 'rows': rows, **timing,
+                        'plan': explain(conn, sql)})
+    index = name_search.NameIndex()
+    index.load(storage.fetchall(conn, 'name_index_players'))
+    for label, query, prefix, fuzzy in name_searches(s):
+        rows, timing = time_runs(
+            lambda: index.search(query, prefix=prefix, fuzzy=fuzzy), repeat)
+        results.append({'benchmark': label, 'statement': None,
+                        'params': [query], 'rows': rows, **timing,
+                        'plan': None})
+    # Never refreshed from the database while being timed
+    serve_stats = analytics.ServeStats(max_age=float('inf'),
+                                       refresh_interval=float('inf'))
+    serve_stats.load(storage.iterate(conn, 'analytics_matches', (0, )))
+    for label, run in serve_stats_runs(s, serve_stats):
+        rows, timing = time_runs(run, repeat)
+        results.append({'benchmark': label, 'statement': None,
+                        'params': [], 'rows': rows, **timing, 'plan': None})
+    scores = [score for (score, ) in storage.fetchall(conn,
+                                                     'bench_sample_scores')]
+    # Uncached, as for scores the parser hasn't seen yet
+    rows, timing = time_runs(
+        lambda: [score_parser.parse.__wrapped__(score) for score in scores],
+        repeat)
+    results.append({'benchmark': f'score_parser.parse ({len(scores)} scores)',
+                    'statement': None, 'params': [], 'rows': rows, **timing,
+                    'plan': None})
+    return results
+
+
+def regressions(results, baseline, threshold):
+    """
+    Returns (benchmark, baseline median, median) for every benchmark whose
+    median grew by more than threshold times its baseline.
+    """
+    before = {result['benchmark']: result['median_ms']
+              for result in baseline['results']}
+    found = []
+    for result in results:
+        old = before.get(result['benchmark'])
+        if old and result['median_ms'] > old * threshold:
+            found.append((result['benchmark'], old, result['median_ms']))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Time every query and stored function of the '
+                    'application.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='timed runs of each benchmark')
+    parser.add_argument('--page-size', type=int,
+                        default=paging.DEFAULT_PAGE_SIZE,
+                        help='page size of the paged listings')
+    parser.add_argument('--json', help='write the results here')
+    parser.add_argument('--baseline',
+                        help='an earlier --json file to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown of the median that counts as a '
+                             'regression (default: 1.25)')
+    args = parser.parse_args(argv)
+
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            dataset = {table: storage.fetchone(conn, name)[0]
+                       for table, name in COUNT_STATEMENTS.items()}
+            results = run_benchmarks(conn, args.repeat, args.page_size)
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+
+    print(f'{"Benchmark":<40} {"Rows":>7} {"Median ms":>10} {"p95 ms":>9}')
+    for result in results:
+        print(f'{result["benchmark"]:<40} {result["rows"]:>7} '
+              f'{result["median_ms"]:>10} {result["p95_ms"]:>9}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'backend': storage.get_backend().name,
+                       'created': datetime.datetime.now().isoformat(),
+                       'repeat': args.repeat, 'dataset': dataset,
+                       'results': results}, f, indent=2, default=str)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for benchmark, old, new in found:
+            print(f'REGRESSION  {benchmark}: {old} ms -> {new} ms',
+                  file=sys.stderr)
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""
+Benchmark of the two ways ranking.tournaments_played is maintained when
+matches are bulk inserted:
+
+  row:  the default; trg_match_result_insert calls update_tournaments_played
+        for both players of every inserted row.
+  set:  the session sets @defer_tournaments_played = 1 and calls
+        apply_tournaments_played once per committed batch.
+
+For each size, synthetic matches between existing players are inserted
+once in each mode, timed, and then deleted again, with tournaments_played
+restored in between. Both modes must leave tournaments_played in the same
+state; the run fails if they don't.
+
+Run it against a scratch copy of wtadb, e.g.:
+
+    $ WTADB_DATABASE=wtadb_bench python bench_tournaments_played.py \\
+        --sizes 10000 100000 1000000
+
+"""
+import argparse
+import datetime
+import json
+import random
+import sys
+import time
+
+import db_pool
+# Imported for the ingest_match, index_player_ids and index_tournament_ids
+# statements they register
+import ingest
+import key_index
+import statements
+
+statements.register('bench_ranked_played',
+                    'SELECT player_id, tournaments_played FROM ranking')
+statements.register('bench_restore_played', """
+    UPDATE ranking SET tournaments_played = %s WHERE player_id = %s""")
+statements.register('bench_delete_match_range', """
+    DELETE FROM match_result WHERE match_id BETWEEN %s AND %s""")
+
+MODES = ('row', 'set')
+FIRST_WEEK = datetime.date(2000, 1, 3)
+
+
+def generate_matches(size, players, tournaments, seed=0):
+    """
+    Yields size random matches as tuples of ingest.MATCH_COLUMNS values,
+    spread over enough weekly tournament dates that each player and
+    tournament pair has a realistic number of matches.
+    """
+    rng = random.Random(seed)
+    weeks = max(1, size // 500)
+    for _ in range(size):
+        winner_id, loser_id = rng.sample(players, 2)
+        date = FIRST_WEEK + datetime.timedelta(weeks=rng.randrange(weeks))
+        yield (rng.choice(tournaments), date, '6-4 6-4', rng.randint(50, 200),
+               winner_id, rng.randint(0, 15), rng.randint(0, 10),
+               rng.randint(0, 10), loser_id, rng.randint(0, 15),
+               rng.randint(0, 10), rng.randint(0, 10))
+
+
+def snapshot(conn):
+    """
+    Returns the current tournaments_played of every ranked player.
+    """
+    cursor = statements.execute(conn, 'bench_ranked_played')
+    return dict(cursor.fetchall())
+
+
+def insert(conn, mode, size, batch_size, players, tournaments):
+    """
+    Inserts size synthetic matches in the given mode, one transaction per
+    batch, and returns the elapsed seconds and the inserted ID range.
+    """
+    if mode == 'set':
+        statements.execute(conn, 'defer_tournaments_played', (1, ))
+    first_id = last_id = None
+    matches = generate_matches(size, players, tournaments)
+    start = time.perf_counter()
+    try:
+        while True:
+            batch = [match for _, match in zip(range(batch_size), matches)]
+            if not batch:
+                break
+            cursor = statements.executemany(conn, 'ingest_match', batch)
+            batch_first = cursor.lastrowid
+            batch_last = batch_first + len(batch) - 1
+            if mode == 'set':
+                statements.execute(conn, 'apply_tournaments_played',
+                                   (batch_first, batch_last))
+            conn.commit()
+            if first_id is None:
+                first_id = batch_first
+            last_id = batch_last
+    finally:
+        if mode == 'set':
+            statements.execute(conn, 'defer_tournaments_played', (0, ))
+    return time.perf_counter() - start, first_id, last_id
+
+
+def restore(conn, played, first_id, last_id, batch_size):
+    """
+    Deletes the inserted matches and puts tournaments_played back.
+    """
+    for start in range(first_id, last_id + 1, batch_size):
+        statements.execute(conn, 'bench_delete_match_range',
+                           (start, min(start + batch_size - 1, last_id)))
+        conn.commit()
+    statements.executemany(conn, 'bench_restore_played',
+                           [(count, player_id)
+                            for player_id, count in played.items()])
+    conn.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare row-trigger and set-based maintenance of '
+                    'ranking.tournaments_played.')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='numbers of matches to insert')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='matches per INSERT and transaction')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args(argv)
+
+    results = []
+    consistent = True
+    with db_pool.connection(db_pool.ADMIN) as conn:
+        players = [row[0] for row in statements.execute(
+            conn, 'index_player_ids').fetchall()]
+        tournaments = [row[0] for row in statements.execute(
+            conn, 'index_tournament_ids').fetchall()]
+        before = snapshot(conn)
+
+        print(f'{"Matches":>10} {"Mode":>5} {"Seconds":>9} {"Matches/s":>10}')
+        for size in args.sizes:
+            after = {}
+            for mode in MODES:
+                elapsed, first_id, last_id = insert(
+                    conn, mode, size, args.batch_size, players, tournaments)
+                after[mode] = snapshot(conn)
+                restore(conn, before, first_id, last_id, args.batch_size)
+                result = {'matches': size, 'mode': mode,
+                          'seconds': round(elapsed, 3),
+                          'matches_per_second': round(size / elapsed, 1)}
+                results.append(result)
+                print(f'{size:>10} {mode:>5} {result["seconds"]:>9} '
+                      f'{result["matches_per_second"]:>10}')
+            if after['row'] != after['set']:
+                consistent = False
+                print(f'  tournaments_played differs between modes at '
+                      f'{size} matches!', file=sys.stderr)
+    db_pool.close_all()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0 if consistent else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,446 @@
+"""
+Builds (or rebuilds) the MySQL database in one command, instead of sourcing
+setup.sql, load-data.sql, setup-passwords.sql, setup-routines.sql and
+grant-permissions.sql by hand in the mysql client:
+
+    $ python bootstrap.py --create
+    $ python bootstrap.py --database wtadb_large --data-dir data/large --jobs 8
+
+It runs in timed phases:
+
+  schema:        setup.sql, holding back its CREATE INDEX statements.
+  load:          the LOAD DATA statements of load-data.sql, with foreign key
+                 and unique checks off. Tables are loaded level by level in
+                 foreign key order, the tables of a level in parallel on
+                 --jobs connections. No triggers exist yet, so none fire.
+  foreign keys:  every foreign key of the loaded tables, checked with one
+                 anti-join each (in parallel); orphaned rows fail the build.
+  indexes:       the held back indexes, added with one ALTER TABLE per table
+                 (a single sorted build of all of its indexes), tables in
+                 parallel.
+  routines:      setup-passwords.sql and setup-routines.sql, which create the
+                 triggers now that the data is in (without the rebuild
+                 calls at its end, which the derived phase makes).
+  grants:        grant-permissions.sql, with --grants.
+  derived:       the summary tables, each rebuilt in one set-based pass, in
+                 parallel: player_surface_stats and head_to_head (their
+                 rebuild procedures), match_score and match_set
+                 (score_parser.py) and player_rating (elo.py).
+
+The scripts are split into statements by split_script, which follows
+DELIMITER lines as the mysql client does, so the routine files run
+unchanged. ranking.tournaments_played is loaded as given in ranking.csv,
+as with load-data.sql.
+
+The connections are made as the admin user of wtadb.ini, or as --user;
+creating routines, and users with --grants, may need an account with more
+privileges (e.g. root). The server must allow LOAD DATA LOCAL INFILE
+(local_infile=ON).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+import db_pool
+import elo
+import score_parser
+import storage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.join(HERE, 'setup.sql')
+LOAD_FILE = os.path.join(HERE, 'load-data.sql')
+ROUTINE_FILES = (os.path.join(HERE, 'setup-passwords.sql'),
+                 os.path.join(HERE, 'setup-routines.sql'))
+GRANTS_FILE = os.path.join(HERE, 'grant-permissions.sql')
+DEFAULT_JOBS = 4
+
+# Session settings of the loading connections, and what they are restored
+# to before the connection goes back to the pool
+LOAD_SESSION = ('SET foreign_key_checks = 0', 'SET unique_checks = 0')
+RESTORE_SESSION = ('SET foreign_key_checks = 1', 'SET unique_checks = 1')
+
+_DELIMITER = re.compile(r'\s*DELIMITER\s+(\S+)', re.IGNORECASE)
+_CREATE_INDEX = re.compile(r'CREATE\s+INDEX\s+(\w+)\s+ON\s+(\w+)\s*(\(.*\))$',
+                           re.IGNORECASE | re.DOTALL)
+_CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(\w+)', re.IGNORECASE)
+_FOREIGN_KEY = re.compile(
+    r'FOREIGN\s+KEY\s*\((\w+)\)\s*REFERENCES\s+(\w+)\s*\((\w+)\)',
+    re.IGNORECASE)
+_REBUILD_CALL = re.compile(r'CALL\s+rebuild_\w+\s*\(\s*\)$', re.IGNORECASE)
+_LOAD_DATA = re.compile(r"LOAD\s+DATA\s+LOCAL\s+INFILE\s+'([^']+)'\s+"
+                        r'INTO\s+TABLE\s+(\w+)', re.IGNORECASE)
+
+
+# ----------------------------------------------------------------------
+# Scripts
+# ----------------------------------------------------------------------
+def split_script(text):
+    """
+    Yields the statements of a SQL script as the mysql client would send
+    them: split on the current delimiter (changed by DELIMITER lines),
+    except inside quotes and comments, with the comments removed.
+    """
+    delimiter = ';'
+    buffer = []
+    started = False
+    quote = None
+    i, n = 0, len(text)
+    while i < n:
+        char = text[i]
+        if quote:
+            buffer.append(char)
+            if char == '\\' and quote != '`' and i + 1 < n:
+                buffer.append(text[i + 1])
+                i += 1
+            elif char == quote:
+                quote = None
+            i += 1
+            continue
+        if not started and (i == 0 or text[i - 1] == '\n'):
+            end = text.find('\n', i)
+            end = n if end == -1 else end
+            found = _DELIMITER.match(text, i, end)
+            if found:
+                delimiter = found[1]
+                i = end + 1
+                continue
+        if text.startswith(delimiter, i):
+            if started:
+                yield ''.join(buffer).strip()
+            buffer, started = [], False
+            i += len(delimiter)
+            continue
+        if char == '#' or (text.startswith('--', i)
+                           and (i + 2 == n or text[i + 2].isspace())):
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+            continue
+        if text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+            buffer.append(' ')
+            continue
+        if char in '\'"`':
+            quote = char
+        buffer.append(char)
+        started = started or not char.isspace()
+        i += 1
+    if started:
+        yield ''.join(buffer).strip()
+
+
+def read_script(path):
+    with open(path) as f:
+        return list(split_script(f.read()))
+
+
+def run_script(script):
+    """
+    Runs the statements of a script one after another on one admin
+    connection, and commits.
+    """
+    with db_pool.connection(db_pool.ADMIN) as conn:
+        cursor = conn.cursor()
+        try:
+            for sql in script:
+                cursor.execute(sql)
+                if cursor.with_rows:
+                    cursor.fetchall()
+        finally:
+            cursor.close()
+        conn.commit()
+
+
+def run_statement(sql, session=(), restore=()):
+    """
+    Runs one statement on an admin connection, after the session
+    statements (and restoring with the restore statements afterward), and
+    commits. Returns the number of rows it changed.
+    """
+    with db_pool.connection(db_pool.ADMIN) as conn:
+        cursor = conn.cursor()
+        try:
+            for setting in session:
+                cursor.execute(setting)
+            try:
+                cursor.execute(sql)
+                rows = cursor.fetchall() if cursor.with_rows else None
+                count = cursor.rowcount
+            finally:
+                for setting in restore:
+                    cursor.execute(setting)
+        finally:
+            cursor.close()
+        conn.commit()
+    return rows[0][0] if rows else count
+
+
+# ----------------------------------------------------------------------
+# Planning
+# ----------------------------------------------------------------------
+def foreign_keys(schema):
+    """
+    Returns the (table, column, parent table, parent column) of every
+    foreign key created by the schema statements.
+    """
+    found = []
+    for sql in schema:
+        table = _CREATE_TABLE.match(sql)
+        if table:
+            found.extend((table[1], *key)
+                         for key in _FOREIGN_KEY.findall(sql))
+    return found
+
+
+def split_indexes(schema):
+    """
+    Returns the schema statements without their CREATE INDEX statements,
+    and the held back indexes as {table: [(index, columns), ...]}.
+    """
+    kept, indexes = [], {}
+    for sql in schema:
+        index = _CREATE_INDEX.match(sql)
+        if index:
+            indexes.setdefault(index[2], []).append((index[1], index[3]))
+        else:
+            kept.append(sql)
+    return kept, indexes
+
+
+def load_statements(data_dir, path=LOAD_FILE):
+    """
+    Returns {table: LOAD DATA statement} for load-data.sql, reading the
+    CSVs from data_dir.
+    """
+    loads = {}
+    for sql in read_script(path):
+        found = _LOAD_DATA.match(sql)
+        if found:
+            csv_path = os.path.abspath(os.path.join(data_dir, found[1]))
+            quoted = csv_path.replace('\\', '\\\\').replace("'", "\\'")
+            loads[found[2]] = sql.replace(f"'{found[1]}'", f"'{quoted}'", 1)
+    return loads
+
+
+def load_levels(tables, keys):
+    """
+    Groups tables into levels whose foreign keys only refer to tables in
+    earlier levels (or not loaded at all).
+    """
+    parents = {table: {parent for child, _, parent, _ in keys
+                       if child == table and parent in tables
+                       and parent != table}
+               for table in tables}
+    levels, done = [], set()
+    while len(done) < len(tables):
+        level = [table for table in tables
+                 if table not in done and parents[table] <= done]
+        if not level:
+            raise ValueError('Foreign keys between the loaded tables form '
+                             'a cycle.')
+        levels.append(level)
+        done.update(level)
+    return levels
+
+
+# ----------------------------------------------------------------------
+# Phases
+# ----------------------------------------------------------------------
+def _timed(function, *args):
+    """
+    Returns the seconds function(*args) took, and its result.
+    """
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def parallel(jobs, tasks):
+    """
+    Runs (name, function) tasks on up to jobs threads and returns the
+    (name, seconds, result) of each, in order. Raises the first error.
+    """
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [(name, executor.submit(_timed, function))
+                   for name, function in tasks]
+        return [(name, *future.result()) for name, future in futures]
+
+
+def check_foreign_keys(keys, tables, jobs):
+    """
+    Counts the rows of the loaded tables whose foreign keys refer to no
+    row. Returns the steps, with the number of orphans as their result.
+    """
+    tasks = []
+    for table, column, parent, parent_column in keys:
+        if table not in tables:
+            continue
+        sql = f"""
+            SELECT COUNT(*)
+            FROM {table} AS C
+            WHERE C.{column} IS NOT NULL
+                AND NOT EXISTS (
+                    SELECT 1
+                    FROM {parent} AS P
+                    WHERE P.{parent_column} = C.{column}
+                )"""
+        tasks.append((f'{table}.{column} -> {parent}',
+                      lambda sql=sql: run_statement(sql)))
+    return parallel(jobs, tasks)
+
+
+def add_indexes(indexes, jobs):
+    tasks = []
+    for table, table_indexes in indexes.items():
+        sql = f'ALTER TABLE {table} ' + ', '.join(
+            f'ADD INDEX {name} {columns}' for name, columns in table_indexes)
+        tasks.append((table, lambda sql=sql: run_statement(sql)))
+    return parallel(jobs, tasks)
+
+
+def _derived(function):
+    with storage.connection(db_pool.ADMIN) as conn:
+        return function(conn)
+
+
+def rebuild_derived(jobs):
+    return parallel(jobs, [
+        ('player_surface_stats',
+         lambda: run_statement('CALL rebuild_player_surface_stats()')),
+        ('head_to_head', lambda: run_statement('CALL rebuild_head_to_head()')),
+        ('match_score', lambda: _derived(score_parser.backfill)),
+        ('player_rating', lambda: _derived(elo.rebuild)),
+    ])
+
+
+def create_database(config):
+    """
+    Creates the configured database if it doesn't exist.
+    """
+    conn = mysql.connector.connect(
+        host=config['host'], port=int(config['port']),
+        user=config['admin_user'], password=config['admin_password'],
+        connection_timeout=int(config['connect_timeout']))
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'CREATE DATABASE IF NOT EXISTS `{config["database"]}`')
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def bootstrap(data_dir, jobs, grants=False, report=print):
+    """
+    Builds the database and returns the (phase, seconds, steps) of each
+    phase, steps being (name, seconds, result) tuples. report is called
+    with a line as each phase ends.
+    """
+    schema, indexes = split_indexes(read_script(SCHEMA_FILE))
+    keys = foreign_keys(schema)
+    loads = load_statements(data_dir)
+    phases = []
+
+    def phase(name, run):
+        start = time.perf_counter()
+        steps = run() or []
+        phases.append((name, time.perf_counter() - start, steps))
+        report(f'{name:<24} {phases[-1][1]:>9.2f}')
+        for step, seconds, result in steps:
+            report(f'  {step:<22} {seconds:>9.2f}'
+                   + ('' if result is None else f'  {result}'))
+        return steps
+
+    phase('schema', lambda: run_script(schema))
+
+    def load():
+        steps = []
+        for level in load_levels(list(loads), keys):
+            steps += parallel(jobs, [
+                (table, lambda table=table: run_statement(
+                    loads[table], LOAD_SESSION, RESTORE_SESSION))
+                for table in level])
+        return steps
+    phase('load', load)
+
+    steps = phase('foreign keys', lambda: check_foreign_keys(keys, loads,
+                                                              jobs))
+    orphaned = [(step, orphans) for step, _, orphans in steps if orphans]
+    if orphaned:
+        raise ValueError('Rows with missing parents: ' + ', '.join(
+            f'{step} ({orphans})' for step, orphans in orphaned))
+    phase('indexes', lambda: add_indexes(indexes, jobs))
+    phase('routines', lambda: [
+        (os.path.basename(path), *_timed(run_script, [
+            sql for sql in read_script(path)
+            if not _REBUILD_CALL.match(sql)]))
+        for path in ROUTINE_FILES])
+    if grants:
+        phase('grants', lambda: run_script(read_script(GRANTS_FILE)))
+    phase('derived', lambda: rebuild_derived(jobs))
+    return phases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Build the MySQL database from the CSVs.')
+    parser.add_argument('--data-dir', default=HERE,
+                        help='directory holding the CSVs')
+    parser.add_argument('--database', help='database to build (default: '
+                                           'the configured database)')
+    parser.add_argument('--user', help='MySQL user (default: the admin '
+                                       'user of wtadb.ini)')
+    parser.add_argument('--password', help="the user's password")
+    parser.add_argument('--jobs', type=int, default=DEFAULT_JOBS,
+                        help='tables loaded and indexed at once')
+    parser.add_argument('--create', action='store_true',
+                        help='create the database if it does not exist')
+    parser.add_argument('--grants', action='store_true',
+                        help='also run grant-permissions.sql')
+    parser.add_argument('--json', help='also write the timings here')
+    args = parser.parse_args(argv)
+
+    config = dict(db_pool.load_config())
+    if args.database:
+        config['database'] = args.database
+    if args.user:
+        config['admin_user'] = args.user
+    if args.password is not None:
+        config['admin_password'] = args.password
+    config['pool_size'] = str(args.jobs + 1)
+    config['local_infile'] = '1'
+    config['replicas'] = ''
+    db_pool.configure(config)
+    storage.configure(storage.MYSQL)
+
+    start = time.perf_counter()
+    print(f'{"Phase":<24} {"Seconds":>9}')
+    try:
+        if args.create:
+            create_database(config)
+        phases = bootstrap(args.data_dir, args.jobs, args.grants)
+    except (mysql.connector.Error, OSError, ValueError) as err:
+        print(f'Bootstrap failed: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    total = time.perf_counter() - start
+    print(f'{"total":<24} {total:>9.2f}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'total_seconds': round(total, 3), 'phases': [
+                {'phase': name, 'seconds': round(seconds, 3),
+                 'steps': [{'step': step, 'seconds': round(step_seconds, 3),
+                            'result': result}
+                           for step, step_seconds, result in steps]}
+                for name, seconds, steps in phases]}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
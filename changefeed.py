@@ -0,0 +1,416 @@
+"""
+Consumers of the change log: the keys of the player, ranking, match_result
+and tournament_history rows that were inserted, updated or deleted, in the
+order of their change_log seq.
+
+Triggers (trg_change_log_*, see setup-routines.sql) append a change_log row
+in the same transaction as every change, so a consumer that keeps a
+derived structure (a cache, a search index, an export) can read the
+changes since its checkpoint and update only the rows they name, instead
+of re-reading whole tables:
+
+    consumer = changefeed.Consumer('search_index')
+    consumer.run(handle, follow=True)
+
+run() passes each batch of Changes to handle() and then saves the seq of
+the last one as the consumer's checkpoint in change_checkpoint, so a
+consumer that stops resumes after the last batch it finished (a batch may
+be handled again if handle() succeeded but the checkpoint wasn't saved).
+A consumer without a checkpoint starts from the oldest change in the log;
+one that has just read its tables in full should seek_head() first.
+
+Seqs are assigned when a change is written but become visible when its
+transaction commits, so a later seq can show up before an earlier one.
+A consumer therefore stops at a gap in the seqs and only skips it once it
+has been there for gap_timeout seconds (the seq of a rolled back
+transaction is never filled in). The skipped seqs are looked up again
+every gap_timeout seconds for late_window seconds, and changes that turn
+up late are handed out then, out of seq order. A change committed more
+than late_window seconds after its seq was skipped is lost to the
+consumer, as are the skipped seqs beyond the newest MAX_LATE_CHANGES and
+those of a consumer that restarts before they turn up, so late_window
+should be longer than the longest write transaction (e.g. an ingest.py
+batch or a rankings.py week).
+
+Changes are read on admin connections, from the primary. Rows changed by
+a foreign key cascade are not logged on MySQL (see setup-routines.sql).
+The log can be pruned of the changes every consumer has processed:
+
+    $ python changefeed.py status
+    $ python changefeed.py tail --consumer export --follow
+    $ python changefeed.py prune
+
+"""
+import argparse
+import collections
+import json
+import sys
+import time
+
+import mysql.connector
+
+import db_pool
+import statements
+import storage
+
+# Changes read per batch
+DEFAULT_BATCH_SIZE = 1000
+# Seconds to wait for a gap in the seqs to be filled before skipping it
+DEFAULT_GAP_TIMEOUT = 10
+# Seconds for which skipped seqs are looked up again
+DEFAULT_LATE_WINDOW = 3600
+# Skipped seqs looked up at most, and per statement
+MAX_LATE_CHANGES = 1024
+LATE_CHANGES = 64
+# Seconds between polls of a consumer that follows the log
+DEFAULT_INTERVAL = 1.0
+
+INSERT = 'I'
+UPDATE = 'U'
+DELETE = 'D'
+
+statements.register('changes_after', """
+    SELECT seq, table_name, row_key, operation, changed_at
+    FROM change_log
+    WHERE seq > %s
+    ORDER BY seq
+    LIMIT %s""",
+                    reads=('change_log', ))
+
+# Skipped seqs, padded with NULLs (which match nothing) up to LATE_CHANGES
+statements.register('changes_in', f"""
+    SELECT seq, table_name, row_key, operation, changed_at
+    FROM change_log
+    WHERE seq IN ({', '.join(['%s'] * LATE_CHANGES)})
+    ORDER BY seq""",
+                    reads=('change_log', ))
+
+statements.register('change_log_bounds', """
+    SELECT MIN(seq), MAX(seq)
+    FROM change_log""",
+                    reads=('change_log', ))
+
+statements.register('change_checkpoint', """
+    SELECT seq
+    FROM change_checkpoint
+    WHERE consumer = %s""",
+                    reads=('change_checkpoint', ))
+
+statements.register('change_checkpoints', """
+    SELECT consumer, seq, updated_at
+    FROM change_checkpoint
+    ORDER BY consumer""",
+                    reads=('change_checkpoint', ))
+
+statements.register('save_change_checkpoint', """
+    REPLACE INTO change_checkpoint (consumer, seq)
+    VALUES (%s, %s)""",
+                    writes=('change_checkpoint', ))
+
+statements.register('oldest_change_checkpoint', """
+    SELECT MIN(seq)
+    FROM change_checkpoint""",
+                    reads=('change_checkpoint', ))
+
+statements.register('prune_change_log', """
+    DELETE FROM change_log
+    WHERE seq < %s""",
+                    writes=('change_log', ))
+
+
+class Change(collections.namedtuple(
+        'Change', 'seq table key operation changed_at')):
+    """
+    One logged change: the table, the changed row's primary key as a tuple
+    of its columns (e.g. (player_id, rank) for ranking), and the operation
+    (INSERT, UPDATE or DELETE).
+    """
+
+
+class Consumer:
+    """
+    Reads the change log in batches from a checkpoint. A named consumer
+    keeps its checkpoint in change_checkpoint; one named None keeps it in
+    memory only. Given after, the consumer starts after that seq instead
+    of its saved checkpoint.
+    """
+
+    def __init__(self, name, batch_size=DEFAULT_BATCH_SIZE,
+                 gap_timeout=DEFAULT_GAP_TIMEOUT, after=None,
+                 late_window=DEFAULT_LATE_WINDOW):
+        self.name = name
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.late_window = late_window
+        # The seq of the last change processed
+        self.position = after
+        # The seq missing at the end of the changes read so far, and when
+        # it was first seen missing
+        self._gap = None
+        # Skipped seq -> when it was skipped, oldest first
+        self._late = collections.OrderedDict()
+        self._late_checked = time.monotonic()
+        # Skipped seqs given up on without turning up
+        self.lost = 0
+
+    def _load(self, conn):
+        """
+        Returns the consumer's saved checkpoint or, if it has none, the seq
+        before the oldest change in the log.
+        """
+        row = None
+        if self.name is not None:
+            row = storage.fetchone(conn, 'change_checkpoint', (self.name, ))
+        if row is not None:
+            return row[0]
+        oldest, _ = storage.fetchone(conn, 'change_log_bounds')
+        return 0 if oldest is None else oldest - 1
+
+    def _skip_gap(self, seq):
+        """
+        Returns whether the missing seq has been missing for gap_timeout
+        seconds.
+        """
+        now = time.monotonic()
+        if self._gap is None or self._gap[0] != seq:
+            self._gap = (seq, now)
+        return now - self._gap[1] >= self.gap_timeout
+
+    def _skip(self, first, last):
+        """
+        Remembers the skipped seqs first to last, to be looked up again.
+        """
+        now = time.monotonic()
+        for seq in range(max(first, last - MAX_LATE_CHANGES + 1), last + 1):
+            self._late[seq] = now
+        self.lost += max(last - first + 1 - MAX_LATE_CHANGES, 0)
+        while len(self._late) > MAX_LATE_CHANGES:
+            self._late.popitem(last=False)
+            self.lost += 1
+
+    def _late_rows(self, conn):
+        """
+        Returns the rows of the skipped seqs that have turned up since they
+        were last looked up (every gap_timeout seconds), and gives up on
+        those skipped more than late_window seconds ago.
+        """
+        now = time.monotonic()
+        if not self._late or now - self._late_checked < self.gap_timeout:
+            return []
+        self._late_checked = now
+        for seq, skipped_at in list(self._late.items()):
+            if now - skipped_at < self.late_window:
+                break
+            del self._late[seq]
+            self.lost += 1
+        rows = []
+        seqs = list(self._late)
+        for start in range(0, len(seqs), LATE_CHANGES):
+            chunk = seqs[start:start + LATE_CHANGES]
+            chunk += [None] * (LATE_CHANGES - len(chunk))
+            rows.extend(storage.fetchall(conn, 'changes_in', chunk))
+        for row in rows:
+            del self._late[row[0]]
+        return rows
+
+    def poll(self):
+        """
+        Returns the next batch of changes (possibly none), without
+        advancing the checkpoint; see commit(). Skipped changes that have
+        turned up late come first.
+        """
+        with storage.connection(db_pool.ADMIN) as conn:
+            if self.position is None:
+                self.position = self._load(conn)
+            late = self._late_rows(conn)
+            rows = storage.fetchall(conn, 'changes_after',
+                                    (self.position, self.batch_size))
+        changes = [_change(row) for row in late]
+        expected = self.position + 1
+        for row in rows:
+            seq = row[0]
+            if seq != expected:
+                if not self._skip_gap(expected):
+                    break
+                self._skip(expected, seq - 1)
+            changes.append(_change(row))
+            expected = seq + 1
+        return changes
+
+    def _save(self, seq):
+        """
+        Sets the checkpoint to seq and, for a named consumer, saves it.
+        """
+        if self.name is not None:
+            with storage.connection(db_pool.ADMIN) as conn:
+                try:
+                    storage.execute(conn, 'save_change_checkpoint',
+                                    (self.name, seq))
+                    conn.commit()
+                except mysql.connector.Error:
+                    conn.rollback()
+                    raise
+        self.position = seq
+
+    def commit(self, changes):
+        """
+        Moves the checkpoint past the given changes (from poll()).
+        """
+        if changes and changes[-1].seq > self.position:
+            self._save(changes[-1].seq)
+
+    def seek(self, seq):
+        """
+        Sets the checkpoint to seq, so that the next change read is the
+        first one after it, e.g. 0 to replay everything still in the log.
+        """
+        with storage.connection(db_pool.ADMIN) as conn:
+            oldest, _ = storage.fetchone(conn, 'change_log_bounds')
+        # Pruned changes are gone, not late
+        if oldest is not None:
+            seq = max(seq, oldest - 1)
+        self._gap = None
+        self._late.clear()
+        self._save(seq)
+
+    def seek_head(self):
+        """
+        Sets the checkpoint to the latest change, so that only later
+        changes are read. Returns its seq.
+        """
+        seq = head()
+        self.seek(seq)
+        return seq
+
+    def run(self, handle, follow=False, interval=DEFAULT_INTERVAL):
+        """
+        Passes every batch of changes to handle(changes), committing after
+        each, until the log is read to the end or, with follow, forever
+        (polling every interval seconds). Returns the number of changes
+        handled.
+        """
+        handled = 0
+        while True:
+            changes = self.poll()
+            if changes:
+                handle(changes)
+                self.commit(changes)
+                handled += len(changes)
+            elif follow:
+                time.sleep(interval)
+            else:
+                return handled
+
+
+def _change(row):
+    seq, table, key, operation, changed_at = row
+    return Change(seq, table, tuple(json.loads(key)), operation, changed_at)
+
+
+def head():
+    """
+    Returns the seq of the latest change in the log (0 if it is empty).
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        _, latest = storage.fetchone(conn, 'change_log_bounds')
+    return latest or 0
+
+
+def status():
+    """
+    Returns the oldest and latest seqs in the log and each consumer's
+    checkpoint, as (consumer, seq, changes behind, updated at) rows.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        oldest, latest = storage.fetchone(conn, 'change_log_bounds')
+        consumers = storage.fetchall(conn, 'change_checkpoints')
+    return oldest, latest, [(name, seq, max((latest or 0) - seq, 0),
+                             updated_at)
+                            for name, seq, updated_at in consumers]
+
+
+def prune():
+    """
+    Deletes the changes that every consumer has processed (none if there
+    are no consumers) and returns how many were deleted. The latest change
+    is always kept, so that consumers without a checkpoint know where the
+    log has got to.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        (processed, ) = storage.fetchone(conn, 'oldest_change_checkpoint')
+        _, latest = storage.fetchone(conn, 'change_log_bounds')
+        if processed is None or latest is None:
+            return 0
+        try:
+            deleted = storage.execute(conn, 'prune_change_log',
+                                      (min(processed + 1, latest), )).rowcount
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+    return max(deleted or 0, 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Read and manage the change log.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('tail', help='print changes as JSON lines')
+    p.add_argument('--consumer',
+                   help='resume from and save this checkpoint')
+    p.add_argument('--after', type=int,
+                   help='start after this seq (default: the checkpoint, '
+                        'or the oldest change)')
+    p.add_argument('--follow', action='store_true',
+                   help='keep waiting for new changes')
+    p.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    p.add_argument('--gap-timeout', type=float, default=DEFAULT_GAP_TIMEOUT,
+                   help='seconds to wait at a gap in the seqs before '
+                        'skipping it')
+    p.add_argument('--late-window', type=float,
+                   default=DEFAULT_LATE_WINDOW,
+                   help='seconds to keep looking up skipped seqs')
+    p.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                   help='seconds between polls with --follow')
+    subparsers.add_parser('status',
+                          help="the log's seqs and each consumer's "
+                               'checkpoint')
+    subparsers.add_parser('prune',
+                          help='delete the changes every consumer has '
+                               'processed')
+    args = parser.parse_args(argv)
+
+    def write(changes):
+        for change in changes:
+            print(json.dumps(change._asdict(), default=str), flush=True)
+
+    try:
+        if args.command == 'tail':
+            consumer = Consumer(args.consumer, args.batch_size,
+                                args.gap_timeout,
+                                late_window=args.late_window)
+            if args.after is not None:
+                consumer.seek(args.after)
+            consumer.run(write, args.follow, args.interval)
+        elif args.command == 'status':
+            oldest, latest, consumers = status()
+            print(f'Oldest change: {oldest}, latest change: {latest}')
+            print(f'{"Consumer":<24} {"Seq":>10} {"Behind":>10} '
+                  f'{"Updated":>20}')
+            for name, seq, behind, updated_at in consumers:
+                print(f'{name:<24} {seq:>10} {behind:>10} '
+                      f'{str(updated_at):>20}')
+        else:
+            print(f'Deleted {prune()} changes')
+    except KeyboardInterrupt:
+        pass
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
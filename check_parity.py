@@ -0,0 +1,415 @@
+"""
+Checks that the MySQL and SQLite storage backends return identical results
+for every read operation in operations.py, and make the same changes for
+the writes that SQLite reimplements.
+
+The cases are generated from the data: the winners of every tournament,
+the surface counts of every player, the players of every country (and the
+highest ranked of each), every final's matchup, the head-to-head records
+of every pair of players, name searches, the rankings in ranking_history,
+serve statistics and their leaders (from analytics.py), Elo ratings and
+previews, the statistics of the parsed scores, the profiles of every
+player (in batches, as for a draw), both top 20 listings (in small pages,
+to exercise the continuation tokens), and logins for the application
+users. Each case is run against both backends, with the result cache and
+the indexes cleared between backends, and every difference is reported.
+Dates are compared in their ISO form, since SQLite stores them as text.
+
+The write cases enter matches (final and not, at a tournament the players
+have already played and at new ones) through input_match_results, in one
+transaction that is rolled back at the end, so both databases are left
+as they were. After each match, the summaries kept by the procedure and
+the triggers are compared: the players' ranking.tournaments_played, the
+tournament's history, the players' surface stats and head-to-head record,
+the changes appended to change_log, and how the match changed each
+player's score_stats. As both backends run the same Python to total the
+score statistics, the final is also checked against the totals its known
+score must add (a player who loses 6-7(2) 6-2 6-0 has won a tiebreak).
+
+Both backends must hold the same data, e.g. a freshly loaded wtadb and a
+SQLite copy built from the same CSVs:
+
+    $ python storage.py build
+    $ python score_parser.py backfill
+    $ python elo.py rebuild
+    $ WTADB_BACKEND=sqlite python elo.py rebuild
+    $ python check_parity.py
+
+"""
+import argparse
+import datetime
+import json
+import sys
+
+import mysql.connector
+
+import analytics
+import db_pool
+import elo
+import key_index
+import name_search
+import operations
+import result_cache
+import score_parser
+import statements
+import storage
+
+PAGE_SIZE = 7
+
+statements.register('parity_players', """
+    SELECT first_name, last_name, country, player_id FROM player
+    ORDER BY player_id""")
+statements.register('parity_tournaments', """
+    SELECT DISTINCT tournament_name FROM tournament
+    ORDER BY tournament_name""")
+statements.register('parity_finals', """
+    SELECT W.first_name, W.last_name, F.first_name, F.last_name
+    FROM tournament_history AS H
+        JOIN player AS W ON H.winner_id = W.player_id
+        JOIN player AS F ON H.finalist_id = F.player_id
+    ORDER BY H.tournament_id, H.tournament_year""")
+
+# For the write cases
+statements.register('parity_ranked_players', """
+    SELECT DISTINCT player_id FROM ranking
+    ORDER BY player_id
+    LIMIT 2""")
+statements.register('parity_last_match', """
+    SELECT tournament_id, tournament_date FROM match_result
+    WHERE winner_id = %s OR loser_id = %s
+    ORDER BY tournament_date DESC, match_id DESC
+    LIMIT 1""")
+statements.register('parity_last_final', """
+    SELECT MAX(tournament_year) FROM tournament_history
+    WHERE tournament_id = %s""")
+statements.register('parity_last_change', """
+    SELECT MAX(seq) FROM change_log""")
+statements.register('parity_tournaments_played', """
+    SELECT player_id, `rank`, tournaments_played FROM ranking
+    WHERE player_id IN (%s, %s)
+    ORDER BY player_id, `rank`""")
+statements.register('parity_history', """
+    SELECT tournament_year, winner_id, finalist_id FROM tournament_history
+    WHERE tournament_id = %s
+    ORDER BY tournament_year""")
+statements.register('parity_surface_stats', """
+    SELECT player_id, surface, matches, wins, losses
+    FROM player_surface_stats
+    WHERE player_id IN (%s, %s)
+    ORDER BY player_id, surface""")
+statements.register('parity_head_to_head', """
+    SELECT player_a, player_b, a_wins, b_wins, hard_a_wins, hard_b_wins,
+        clay_a_wins, clay_b_wins, grass_a_wins, grass_b_wins,
+        last_match_date, last_winner_id, last_score
+    FROM head_to_head
+    WHERE player_a = %s AND player_b = %s""")
+statements.register('parity_changes', """
+    SELECT table_name, row_key, operation FROM change_log
+    WHERE seq > %s
+    ORDER BY seq""")
+
+# The summaries compared after each write, by the statement reading them
+SUMMARIES = ('parity_tournaments_played', 'parity_history',
+             'parity_surface_stats', 'parity_head_to_head', 'parity_changes')
+
+
+def cases(backend_name, path=None):
+    """
+    Returns the (description, function, args) cases to compare, built from
+    the data in the given backend.
+    """
+    storage.configure(backend_name, path)
+    backend = storage.get_backend()
+    with backend.connection(db_pool.CLIENT) as conn:
+        players = backend.execute(conn, 'parity_players').fetchall()
+        tournaments = backend.execute(conn, 'parity_tournaments').fetchall()
+        finals = backend.execute(conn, 'parity_finals').fetchall()
+    countries = sorted({country for _, _, country, _ in players})
+    today = datetime.date.today().isoformat()
+    player_ids = [player_id for _, _, _, player_id in players]
+
+    found = [('players_inside_top_20', operations.players_inside_top_20, ()),
+             ('players_outside_top_20', operations.players_outside_top_20,
+              (PAGE_SIZE, ))]
+    for (name, ) in tournaments:
+        found.append((f'tournament_winners {name!r}',
+                      operations.tournament_winners, (name, )))
+        found.append((f'tournament_winners {name.upper()!r}',
+                      operations.tournament_winners, (name.upper(), )))
+    for first_name, last_name, _, _ in players:
+        found.append((f'surface_count {first_name} {last_name}',
+                      operations.surface_count,
+                      (f'{first_name} {last_name}', )))
+    for country in countries + ['ZZZ']:
+        found.append((f'players_by_country {country}',
+                      operations.players_by_country, (country, PAGE_SIZE)))
+        found.append((f'highest_ranked_player {country}',
+                      operations.highest_ranked_player, (country, )))
+    for first_name, last_name, _, _ in players[:20]:
+        found.append((f'score_stats {first_name} {last_name}',
+                      operations.score_stats,
+                      (f'{first_name} {last_name}', )))
+    found.append(('set_scores', operations.set_scores, ()))
+    for first_name1, last_name1, first_name2, last_name2 in finals:
+        names = (f'{first_name1} {last_name1}', f'{first_name2} {last_name2}')
+        found.append((f'matchup_history {" / ".join(names)}',
+                      operations.matchup_history, names))
+    for first_name, last_name, _, _ in players[:20]:
+        found.append((f'find_players {last_name[:3]!r}',
+                      operations.find_players, (last_name[:3], )))
+        found.append((f'player_rank_on {first_name} {last_name}',
+                      operations.player_rank_on,
+                      (f'{first_name} {last_name}', today)))
+    found.append(('top_ranked_on', operations.top_ranked_on, (today, 100)))
+    for first_name, last_name, _, _ in players[:20]:
+        for by in analytics.GROUPINGS:
+            found.append((f'serve_stats {first_name} {last_name} by {by}',
+                          operations.serve_stats,
+                          (f'{first_name} {last_name}', by)))
+    for first_name, last_name, _, _ in players[:20]:
+        found.append((f'player_rating {first_name} {last_name}',
+                      operations.player_rating,
+                      (f'{first_name} {last_name}', )))
+    for first_name1, last_name1, first_name2, last_name2 in finals:
+        names = (f'{first_name1} {last_name1}', f'{first_name2} {last_name2}')
+        for surface in (None, 'Clay'):
+            found.append((f'match_preview {" / ".join(names)} on {surface}',
+                          operations.match_preview, (*names, surface)))
+    for surface in (None, *elo.SURFACES):
+        found.append((f'top_rated on {surface}', operations.top_rated,
+                      (surface, 50, 1)))
+    for metric in analytics.RANKED_METRICS:
+        found.append((f'stat_leaders {metric}', operations.stat_leaders,
+                      (metric, None, None, 1, 20)))
+        found.append((f'stat_leaders {metric} on clay',
+                      operations.stat_leaders, (metric, None, 'Clay', 1, 20)))
+    for i in range(0, len(player_ids), statements.HEAD_TO_HEAD_PLAYERS):
+        draw = player_ids[i:i + statements.HEAD_TO_HEAD_PLAYERS]
+        found.append((f'draw_head_to_head of {len(draw)} players',
+                      operations.draw_head_to_head, (draw, )))
+    for i in range(0, len(player_ids), statements.PROFILE_PLAYERS):
+        draw = player_ids[i:i + statements.PROFILE_PLAYERS]
+        found.append((f'player_profiles of {len(draw)} players',
+                      operations.player_profiles, (draw, 10)))
+    found.append(('head_to_head of every pair',
+                  operations.head_to_head,
+                  ([(p1, p2) for p1 in player_ids[:20]
+                    for p2 in player_ids[:20] if p1 != p2], )))
+    for username, password in storage.USERS:
+        found.append((f'authenticate {username}', operations.authenticate,
+                      (username, password)))
+        found.append((f'authenticate {username} (wrong password)',
+                      operations.authenticate, (username, password + 'x')))
+    return found
+
+
+def write_cases(backend_name, path=None):
+    """
+    Returns the (description, input_match_results parameters, expected
+    change in the winner's and the loser's score_stats or None) of the
+    matches to enter, between two ranked players, built from the data in
+    the given backend.
+    """
+    storage.configure(backend_name, path)
+    backend = storage.get_backend()
+    with backend.connection(db_pool.CLIENT) as conn:
+        players = [player_id for (player_id, ) in backend.execute(
+            conn, 'parity_ranked_players').fetchall()]
+        if len(players) < 2:
+            return []
+        a, b = players
+        last = backend.execute(conn, 'parity_last_match',
+                               (a, a)).fetchone()
+        if last is None:
+            return []
+        tournament_id, date = last
+        (year, ) = backend.execute(conn, 'parity_last_final',
+                                   (tournament_id, )).fetchone()
+    date = datetime.date.fromisoformat(str(date))
+    later = date + datetime.timedelta(days=7)
+    final = datetime.date(max(int(year or 0), date.year) + 1, 6, 1)
+
+    def match(is_final, on, winner_id, loser_id, score):
+        return (is_final, tournament_id, on.isoformat(), score, 90,
+                winner_id, 3, 2, 1, loser_id, 1, 4, 2)
+    return [
+        (f'{a} beats {b} at {tournament_id} {date}',
+         match(0, date, a, b, '6-4 6-4'), None),
+        (f'{b} beats {a} at {tournament_id} {later}',
+         match(0, later, b, a, '7-6(3) 6-7(5) 6-2'), None),
+        # Matches, deciding sets won and lost, tiebreaks won and lost, 6-0
+        # sets won and lost, and retirements and walkovers won and lost
+        (f'{a} beats {b} in the {tournament_id} {final.year} final',
+         match(1, final, a, b, '6-7(2) 6-2 6-0'),
+         [(a, 1, 1, 0, 0, 1, 1, 0, 0, 0, 0, 0),
+          (b, 1, 0, 1, 1, 0, 0, 1, 0, 0, 0, 0)]),
+    ]
+
+
+def run_writes(backend_name, path, writes):
+    """
+    Enters the matches in one transaction against a backend, returning the
+    summaries (see SUMMARIES) and the change in the winner's and the
+    loser's score_stats after each (or the error it raised), and rolls
+    them back. The new matches' IDs are given as their position
+    among the matches entered, since MySQL doesn't reuse the IDs of
+    rolled back inserts.
+    """
+    storage.configure(backend_name, path)
+    results = []
+    with storage.connection(db_pool.ADMIN) as conn:
+        try:
+            (after, ) = storage.fetchone(conn, 'parity_last_change')
+            match_ids = []
+            for _, params, _ in writes:
+                tournament_id, score, winner_id, loser_id = (
+                    params[1], params[3], params[5], params[9])
+                before = _score_totals(conn, (winner_id, loser_id))
+                try:
+                    storage.execute(conn, 'input_match_results', params)
+                    match_ids.append(
+                        storage.fetchone(conn, 'new_match_id')[0])
+                    score_parser.write(conn, [(match_ids[-1], score)])
+                except mysql.connector.Error as err:
+                    results.append(f'error: {err}')
+                    continue
+                pair = tuple(sorted((winner_id, loser_id)))
+                args = {'parity_tournaments_played': pair,
+                        'parity_history': (tournament_id, ),
+                        'parity_surface_stats': pair,
+                        'parity_head_to_head': pair,
+                        'parity_changes': (after or 0, )}
+                found = {}
+                for name in SUMMARIES:
+                    rows = storage.fetchall(conn, name, args[name])
+                    if name == 'parity_changes':
+                        rows = [(table, _new_match(json.loads(key), table,
+                                                   match_ids), operation)
+                                for table, key, operation in rows]
+                    found[name] = [tuple(_comparable(value) for value in row)
+                                   for row in rows]
+                found['score_stats'] = [
+                    (player_id, *(a - b for a, b in zip(totals, old)))
+                    for (player_id, totals), old in zip(
+                        _score_totals(conn, (winner_id, loser_id)).items(),
+                        before.values())]
+                results.append(found)
+        finally:
+            conn.rollback()
+    return results
+
+
+def _score_totals(conn, player_ids):
+    """
+    Returns each player's score_stats totals (see operations.score_totals)
+    as read on the connection, by player ID.
+    """
+    return {player_id: operations.score_totals(storage.fetchall(
+                conn, 'player_score_stats', (player_id, player_id)))
+            for player_id in player_ids}
+
+
+def _new_match(key, table, match_ids):
+    """
+    Returns a change_log key with the ID of a match entered by run_writes
+    replaced by its position among them.
+    """
+    if table == 'match_result' and key[0] in match_ids:
+        return ['new match', match_ids.index(key[0]) + 1]
+    return key
+
+
+def _comparable(value):
+    """
+    Returns a value with its dates, including those nested in lists and
+    dictionaries (e.g. of player profiles), in their ISO form.
+    """
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return type(value)(_comparable(item) for item in value)
+    if isinstance(value, dict):
+        return {key: _comparable(item) for key, item in value.items()}
+    return value
+
+
+def run(backend_name, path, found):
+    """
+    Runs every case against a backend and returns their results (or the
+    error each raised).
+    """
+    storage.configure(backend_name, path)
+    # Fail fast if the backend can't be reached at all
+    with storage.connection(db_pool.CLIENT):
+        pass
+    result_cache.cache.clear()
+    key_index.index.invalidate()
+    name_search.index.invalidate()
+    analytics.engine.invalidate()
+    results = []
+    for _, function, args in found:
+        try:
+            result = function(*args)
+            if not isinstance(result, bool):
+                result = [tuple(_comparable(value) for value in row)
+                          for row in result]
+            results.append(result)
+        except (operations.InvalidInput, mysql.connector.Error) as err:
+            results.append(f'error: {err}')
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare the results of the MySQL and SQLite backends.')
+    parser.add_argument('--sqlite-path',
+                        help='SQLite database (default: sqlite_path)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='list every case, not only the differences')
+    args = parser.parse_args(argv)
+
+    try:
+        found = cases(storage.SQLITE, args.sqlite_path)
+        writes = write_cases(storage.SQLITE, args.sqlite_path)
+        expected = run(storage.MYSQL, None, found)
+        expected += run_writes(storage.MYSQL, None, writes)
+        actual = run(storage.SQLITE, args.sqlite_path, found)
+        actual += run_writes(storage.SQLITE, args.sqlite_path, writes)
+        found += [(f'input_match_results: {description}', None, None)
+                  for description, _, _ in writes]
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+
+    differences = 0
+    for (description, _, _), mysql_rows, sqlite_rows in zip(found, expected,
+                                                            actual):
+        if mysql_rows != sqlite_rows:
+            differences += 1
+            print(f'DIFFERENT  {description}')
+            print(f'  mysql:  {mysql_rows}')
+            print(f'  sqlite: {sqlite_rows}')
+        elif args.verbose:
+            print(f'same       {description}')
+    wrong = 0
+    for (description, _, score_stats), *results in zip(
+            writes, expected[-len(writes):] if writes else (),
+            actual[-len(writes):] if writes else ()):
+        for backend_name, result in zip((storage.MYSQL, storage.SQLITE),
+                                        results):
+            if score_stats is None or isinstance(result, str):
+                continue
+            if result['score_stats'] != score_stats:
+                wrong += 1
+                print(f'WRONG      score_stats after {description} '
+                      f'({backend_name})')
+                print(f'  expected: {score_stats}')
+                print(f'  got:      {result["score_stats"]}')
+    print(f'{len(found)} cases, {differences} different, {wrong} wrong')
+    return 1 if differences or wrong else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,453 @@
+"""
+Non-interactive command mode for the WTA database, for scripts and batch
+jobs that would otherwise have to drive app.py's prompts.
+
+Each of app.py's menu options is a subcommand that takes its input as
+arguments and writes its rows as JSON lines (one object per row) or CSV.
+The application login is checked once per process, and all commands share
+the pooled database connections, so many commands can be run in one
+process with --batch (one command per line of a file, or '-' for stdin) or
+the repl subcommand:
+
+    $ python cli.py --user elzhang --password emily123 winners 'Wimbledon'
+    $ python cli.py --user admin --password adminpw --format csv \\
+        update-ranking 1 200033 9000 17
+    $ python cli.py --batch lookups.txt
+    $ python cli.py repl
+
+The login can also come from the WTADB_APP_USER and WTADB_APP_PASSWORD
+environment variables.
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import shlex
+import sys
+
+import mysql.connector
+
+import analytics
+import metrics
+import operations
+import storage
+
+FORMATS = ('json', 'csv')
+PROMPT = 'wtadb> '
+
+
+class Output:
+    """
+    Writes the rows of each command to a stream as JSON lines or CSV. In
+    CSV, a header row is written whenever the columns change from those of
+    the previous command.
+    """
+
+    def __init__(self, format='json', stream=sys.stdout):
+        self.format = format
+        self.stream = stream
+        self._writer = csv.writer(stream)
+        self._columns = None
+
+    def write(self, columns, rows):
+        for row in rows:
+            if self.format == 'csv':
+                if columns != self._columns:
+                    self._writer.writerow(columns)
+                    self._columns = columns
+                self._writer.writerow(row)
+            else:
+                self.stream.write(json.dumps(dict(zip(columns, row)),
+                                             default=str) + '\n')
+        # Let a consumer at the other end of a pipe see each result as soon
+        # as its command finishes
+        self.stream.flush()
+
+
+# ----------------------------------------------------------------------
+# Commands
+# ----------------------------------------------------------------------
+# Each returns (columns, rows) for the Output.
+def winners(args):
+    return (operations.COLUMNS['tournament_winners'],
+            operations.tournament_winners(args.tournament))
+
+
+def top20(args):
+    if args.outside:
+        return (operations.COLUMNS['players_outside_top_20'],
+                operations.players_outside_top_20())
+    return (operations.COLUMNS['players_inside_top_20'],
+            operations.players_inside_top_20())
+
+
+def surface(args):
+    return (operations.COLUMNS['surface_count'],
+            operations.surface_count(' '.join(args.name)))
+
+
+def find_player(args):
+    return (operations.COLUMNS['find_players'],
+            operations.find_players(' '.join(args.query), args.limit))
+
+
+def country(args):
+    return (operations.COLUMNS['players_by_country'],
+            operations.players_by_country(args.country))
+
+
+def head_to_head(args):
+    if args.pairs:
+        if len(args.player_ids) % 2:
+            raise operations.InvalidInput('--pairs needs an even number of '
+                                          'player IDs.')
+        pairs = zip(args.player_ids[::2], args.player_ids[1::2])
+        return operations.COLUMNS['head_to_head'], operations.head_to_head(
+            pairs)
+    return (operations.COLUMNS['head_to_head'],
+            operations.draw_head_to_head(args.player_ids))
+
+
+def rank(args):
+    return (operations.COLUMNS['player_rank_on'],
+            operations.player_rank_on(' '.join(args.name), args.date))
+
+
+def rankings(args):
+    return (operations.COLUMNS['top_ranked_on'],
+            operations.top_ranked_on(args.date, args.limit))
+
+
+def serve_stats(args):
+    return (operations.COLUMNS['serve_stats'],
+            operations.serve_stats(' '.join(args.name), args.by))
+
+
+def leaders(args):
+    return (operations.COLUMNS['stat_leaders'],
+            operations.stat_leaders(args.metric, args.season, args.surface,
+                                    args.min_matches, args.limit))
+
+
+def rating(args):
+    return (operations.COLUMNS['player_rating'],
+            operations.player_rating(' '.join(args.name)))
+
+
+def top_rated(args):
+    return (operations.COLUMNS['top_rated'],
+            operations.top_rated(args.surface, args.limit, args.min_matches))
+
+
+def preview(args):
+    return (operations.COLUMNS['match_preview'],
+            operations.match_preview(args.player1, args.player2,
+                                     args.surface))
+
+
+def score_stats(args):
+    return (operations.COLUMNS['score_stats'],
+            operations.score_stats(' '.join(args.name)))
+
+
+def set_scores(args):
+    return operations.COLUMNS['set_scores'], operations.set_scores()
+
+
+def profiles(args):
+    return (operations.COLUMNS['player_profiles'],
+            operations.player_profiles(args.player_ids, args.recent))
+
+
+def update_player(args):
+    operations.update_player(args.player_id, args.attribute, args.value)
+    return (('player_id', 'attribute', 'value'),
+            [(args.player_id, args.attribute, args.value)])
+
+
+def input_match(args):
+    stats = args.stats or (None, ) * 6
+    match_id = operations.input_match_result(
+        args.final, args.tournament_id, args.date, args.score, args.minutes,
+        args.winner_id, args.loser_id, *stats)
+    return operations.COLUMNS['input_match_results'], [(match_id, )]
+
+
+def update_ranking(args):
+    operations.update_ranking(args.rank, args.player_id, args.points,
+                              args.tournaments_played)
+    return (('rank', 'player_id', 'points', 'tournaments_played'),
+            [(args.rank, args.player_id, args.points,
+              args.tournaments_played)])
+
+
+def add_commands(subparsers):
+    """
+    Adds a subparser for each command to the given subparsers.
+    """
+    p = subparsers.add_parser('winners', help='winners of a tournament')
+    p.add_argument('tournament', help='tournament name, e.g. Wimbledon')
+    p.set_defaults(func=winners)
+
+    p = subparsers.add_parser('top20',
+                              help='players inside (or outside) the top 20')
+    p.add_argument('--outside', action='store_true',
+                   help='list the players outside the top 20 instead')
+    p.set_defaults(func=top20)
+
+    p = subparsers.add_parser('surface',
+                              help="a player's matches on each surface")
+    p.add_argument('name', nargs='+',
+                   help="the player's full name, e.g. Su Wei Hsieh")
+    p.set_defaults(func=surface)
+
+    p = subparsers.add_parser('find-player',
+                              help='players with names like a partial or '
+                                   'misspelled name')
+    p.add_argument('query', nargs='+')
+    p.add_argument('--limit', type=int, default=10,
+                   help='most players to list (default: 10)')
+    p.set_defaults(func=find_player)
+
+    p = subparsers.add_parser('country', help='players from a country')
+    p.add_argument('country', help='3 letter country code, e.g. USA')
+    p.set_defaults(func=country)
+
+    p = subparsers.add_parser('head-to-head',
+                              help='head-to-head records of every pair of '
+                                   'the players (e.g. a draw)')
+    p.add_argument('player_ids', nargs='+', metavar='player_id')
+    p.add_argument('--pairs', action='store_true',
+                   help='only the pairs of consecutive IDs (1st vs 2nd, '
+                        '3rd vs 4th, ...)')
+    p.set_defaults(func=head_to_head)
+
+    today = datetime.date.today().isoformat()
+    p = subparsers.add_parser('rank',
+                              help="a player's rank in the rankings of a "
+                                   'past date')
+    p.add_argument('name', nargs='+')
+    p.add_argument('--date', default=today,
+                   help='YYYY-MM-DD (default: today)')
+    p.set_defaults(func=rank)
+
+    p = subparsers.add_parser('rankings',
+                              help='the top ranked players on a past date')
+    p.add_argument('--date', default=today,
+                   help='YYYY-MM-DD (default: today)')
+    p.add_argument('--limit', type=int, default=20,
+                   help='number of ranks (default: 20)')
+    p.set_defaults(func=rankings)
+
+    p = subparsers.add_parser('serve-stats',
+                              help="a player's match and serve statistics")
+    p.add_argument('name', nargs='+')
+    p.add_argument('--by', choices=analytics.GROUPINGS,
+                   default='career',
+                   help='career totals, or per season or surface')
+    p.set_defaults(func=serve_stats)
+
+    p = subparsers.add_parser('leaders',
+                              help='the players with the best value of a '
+                                   'statistic')
+    p.add_argument('metric', choices=analytics.RANKED_METRICS)
+    p.add_argument('--season', help='only this season, e.g. 2020')
+    p.add_argument('--surface', help='only this surface, e.g. Clay')
+    p.add_argument('--min-matches', type=int, default=10,
+                   help='fewest matches to be listed (default: 10)')
+    p.add_argument('--limit', type=int, default=10,
+                   help='most players to list (default: 10)')
+    p.set_defaults(func=leaders)
+
+    p = subparsers.add_parser('rating',
+                              help="a player's Elo ratings, overall and on "
+                                   'each surface')
+    p.add_argument('name', nargs='+')
+    p.set_defaults(func=rating)
+
+    p = subparsers.add_parser('top-rated',
+                              help='the players with the highest Elo rating')
+    p.add_argument('--surface', help='rating on this surface, e.g. Clay')
+    p.add_argument('--limit', type=int, default=20,
+                   help='most players to list (default: 20)')
+    p.add_argument('--min-matches', type=int, default=10,
+                   help='fewest rated matches to be listed (default: 10)')
+    p.set_defaults(func=top_rated)
+
+    p = subparsers.add_parser('preview',
+                              help='the chances of each player in a match '
+                                   'between two players')
+    p.add_argument('player1', help="the first player's full name")
+    p.add_argument('player2', help="the second player's full name")
+    p.add_argument('--surface', help='the surface of the match, e.g. Grass')
+    p.set_defaults(func=preview)
+
+    p = subparsers.add_parser('score-stats',
+                              help="a player's deciding sets, tiebreaks, "
+                                   'bagels, retirements and walkovers')
+    p.add_argument('name', nargs='+')
+    p.set_defaults(func=score_stats)
+
+    p = subparsers.add_parser('set-scores',
+                              help='how many sets ended with each score')
+    p.set_defaults(func=set_scores)
+
+    p = subparsers.add_parser('profiles',
+                              help="the players' bios, rankings, surfaces, "
+                                   'titles and recent matches')
+    p.add_argument('player_ids', nargs='+', metavar='player_id')
+    p.add_argument('--recent', type=int, default=operations.RECENT_MATCHES,
+                   help='recent matches per player (default: '
+                        f'{operations.RECENT_MATCHES})')
+    p.set_defaults(func=profiles)
+
+    p = subparsers.add_parser('update-player',
+                              help='change one attribute of a player')
+    p.add_argument('player_id')
+    p.add_argument('attribute', choices=operations.PLAYER_ATTRIBUTES)
+    p.add_argument('value')
+    p.set_defaults(func=update_player)
+
+    p = subparsers.add_parser('input-match', help='record a match result')
+    p.add_argument('tournament_id')
+    p.add_argument('date', help='tournament start date (YYYY-MM-DD)')
+    p.add_argument('score', help='e.g. "6-4 7-6(3)" or WALKOVER')
+    p.add_argument('minutes')
+    p.add_argument('winner_id')
+    p.add_argument('loser_id')
+    p.add_argument('--final', action='store_true',
+                   help='the match was the final of the tournament')
+    p.add_argument('--stats', nargs=6,
+                   metavar=('W_ACES', 'W_BP_SAVED', 'W_DFS',
+                            'L_ACES', 'L_BP_SAVED', 'L_DFS'),
+                   help='statistics of a played match')
+    p.set_defaults(func=input_match)
+
+    p = subparsers.add_parser('update-ranking',
+                              help='put a player at a rank in the top 20')
+    p.add_argument('rank', help='rank to change (1-20)')
+    p.add_argument('player_id')
+    p.add_argument('points')
+    p.add_argument('tournaments_played',
+                   help='tournaments played in the calendar year')
+    p.set_defaults(func=update_ranking)
+
+
+def command_parser():
+    """
+    Returns the parser for a single command line in batch or REPL mode.
+    """
+    parser = argparse.ArgumentParser(prog='', add_help=False)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    add_commands(subparsers)
+    return parser
+
+
+def run(args, output):
+    """
+    Runs one parsed command, writing its rows to output. Returns True if it
+    succeeded, otherwise reports the error on stderr and returns False.
+    """
+    try:
+        columns, rows = args.func(args)
+        output.write(columns, rows)
+        return True
+    except (operations.InvalidInput, mysql.connector.Error) as err:
+        print(f'{args.command}: {err}', file=sys.stderr)
+        return False
+
+
+def run_lines(lines, output, stop_on_error=False, interactive=False):
+    """
+    Runs one command per line (blank lines and lines starting with # are
+    skipped), over the same connections. Returns the number of commands
+    that failed.
+    """
+    parser = command_parser()
+    failures = 0
+    while True:
+        if interactive:
+            print(PROMPT, end='', file=sys.stderr, flush=True)
+        line = next(lines, None)
+        if line is None:
+            break
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if interactive and line in ('q', 'quit', 'exit'):
+            break
+        try:
+            args = parser.parse_args(shlex.split(line))
+        except (SystemExit, ValueError):
+            # argparse has already printed the usage error
+            ok = False
+        else:
+            ok = run(args, output)
+        if not ok:
+            failures += 1
+            if stop_on_error:
+                break
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run WTA database queries and updates without prompts.')
+    parser.add_argument('--format', choices=FORMATS, default='json',
+                        help='output format (default: json lines)')
+    parser.add_argument('--user', default=os.environ.get('WTADB_APP_USER'),
+                        help='application username')
+    parser.add_argument('--password',
+                        default=os.environ.get('WTADB_APP_PASSWORD'),
+                        help='application password')
+    parser.add_argument('--batch', metavar='FILE',
+                        help="run the commands in FILE ('-' for stdin), "
+                             'one per line')
+    parser.add_argument('--stop-on-error', action='store_true',
+                        help='stop a batch at the first failed command')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='write the statement metrics to FILE on exit '
+                             '(JSON if it ends in .json, otherwise the '
+                             'Prometheus text format)')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('repl', help='read commands interactively')
+    add_commands(subparsers)
+    args = parser.parse_args(argv)
+    if args.command is None and args.batch is None:
+        parser.error('a command, repl or --batch is required')
+    if not args.user or args.password is None:
+        parser.error('--user and --password (or WTADB_APP_USER and '
+                     'WTADB_APP_PASSWORD) are required')
+
+    try:
+        if not operations.authenticate(args.user, args.password):
+            print('Invalid login.', file=sys.stderr)
+            return 1
+    except mysql.connector.Error as err:
+        print(f'Could not connect to the database: {err}', file=sys.stderr)
+        return 1
+
+    output = Output(args.format)
+    try:
+        if args.batch is not None:
+            if args.batch == '-':
+                failures = run_lines(iter(sys.stdin), output,
+                                     args.stop_on_error)
+            else:
+                with open(args.batch) as f:
+                    failures = run_lines(iter(f), output, args.stop_on_error)
+        elif args.command == 'repl':
+            failures = run_lines(iter(sys.stdin), output,
+                                 interactive=sys.stdin.isatty())
+        else:
+            failures = 0 if run(args, output) else 1
+    finally:
+        storage.close_all()
+        if args.metrics:
+            metrics.write(args.metrics)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+Deterministic generator of larger WTA datasets, for seeing how the queries
+behave at production size (the bundled CSVs have 52 players and 70
+matches).
+
+The bundled rows are copied unchanged and synthetic rows are added after
+them until the requested sizes are reached:
+
+  player:              synthetic players with IDs from 300000 up, countries
+                       drawn from the bundled players', heights and dates of
+                       birth in realistic ranges.
+  tournament:          synthetic tournaments with IDs Z000, Z001, ... (none
+                       of the bundled IDs start with a letter); more than
+                       --tournaments if that many can't hold --matches in
+                       the years from FIRST_YEAR to --last-year.
+  match_result:        one edition of each synthetic tournament per year
+                       with draw_size - 1 matches, the last of which is the
+                       final, until --matches is reached. The editions
+                       start as many years before --last-year (by default
+                       last year) as the matches need, so the data ends
+                       recently and no match is dated in the future.
+  tournament_history:  the final of every complete synthetic edition.
+  ranking:             the bundled top 20, unchanged (the app treats ranking
+                       as the current top 20).
+
+Every row satisfies the CHECK and foreign key constraints of setup.sql, and
+the same arguments (including --seed and --last-year) always produce
+identical files. The
+output directory gets the five CSVs in the bundled format, so it can be
+loaded with load-data.sql (run from that directory) or into SQLite with
+`python storage.py build --data-dir DIR`:
+
+    $ python datagen.py --players 10000 --matches 5000000 --out data/large
+    $ cd data/large && mysql --local-infile=1 wtadb < ../../load-data.sql
+
+Matches are written as they are generated, so memory use does not grow
+with --matches.
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+import sys
+
+import storage
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRST_PLAYER_ID = 300000
+MAX_PLAYER_ID = 999999
+FIRST_YEAR = 2000
+ID_CHARS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+SURFACES = (('Hard', 6), ('Clay', 3), ('Grass', 1))
+# (draw size, level, weight)
+LEVELS = ((32, 'I', 6), (64, 'P', 3), (128, 'G', 1))
+SYLLABLES = ('ka', 'ro', 'li', 'na', 'sa', 'mi', 'ta', 've', 'lo', 'ra',
+             'ni', 'ko', 'da', 'el', 'an', 'bri', 'zo', 'ma', 'te', 'su',
+             'vi', 'ha', 'le', 'no', 'pe', 'cho', 'ri', 'ya', 'go', 'stra')
+CITY_SUFFIXES = ('Open', 'Classic', 'Cup', 'Masters', 'Championships')
+
+
+def read_csv(data_dir, table):
+    """
+    Returns the header and rows of one of the bundled CSVs.
+    """
+    with open(os.path.join(data_dir, f'{table}.csv'), newline='') as f:
+        reader = csv.reader(f)
+        return next(reader), list(reader)
+
+
+def make_name(rng, syllables):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(syllables)).title()
+
+
+def weighted(rng, choices):
+    """
+    Returns a random choice from (value..., weight) tuples, without the
+    weight.
+    """
+    choice = rng.choices(choices, weights=[c[-1] for c in choices])[0]
+    return choice[:-1] if len(choice) > 2 else choice[0]
+
+
+def make_score(rng):
+    """
+    Returns a plausible score for a best of three sets match.
+    """
+    def loser_set():
+        games = rng.choice((6, 6, 6, 6, 7))
+        if games == 7:
+            return f'7-{rng.choice((5, 6))}' + (
+                f'({rng.randint(0, 9)})' if rng.random() < 0.5 else '')
+        return f'6-{rng.randint(0, 4)}'
+    sets = [loser_set(), loser_set()]
+    if rng.random() < 0.35:
+        lost = sets[1].split('-')
+        sets[1] = f'{lost[1].split("(")[0]}-{lost[0]}'
+        sets.append(loser_set())
+    return ' '.join(sets)
+
+
+def generate_players(rng, seed_rows, count):
+    """
+    Returns the player rows: the bundled ones, then synthetic ones up to
+    count in total.
+    """
+    countries = [row[5] for row in seed_rows]
+    first_names = sorted({row[1] for row in seed_rows})
+    rows = list(seed_rows)
+    if FIRST_PLAYER_ID + count > MAX_PLAYER_ID:
+        raise ValueError(f'At most {MAX_PLAYER_ID - FIRST_PLAYER_ID} '
+                         f'players can be generated')
+    for i in range(count - len(seed_rows)):
+        dob = (datetime.date(1980, 1, 1)
+               + datetime.timedelta(days=rng.randrange(27 * 365)))
+        rows.append([str(FIRST_PLAYER_ID + i),
+                     rng.choice(first_names),
+                     make_name(rng, rng.randint(2, 4)),
+                     'L' if rng.random() < 0.12 else 'R',
+                     dob.isoformat(),
+                     rng.choice(countries),
+                     str(rng.randint(155, 192))])
+    return rows
+
+
+def tournament_id(i):
+    """
+    Returns the ID of the i-th synthetic tournament (Z000, Z001, ...).
+    """
+    if i >= len(ID_CHARS) ** 3:
+        raise ValueError(f'At most {len(ID_CHARS) ** 3} tournaments can be '
+                         f'generated')
+    return 'Z' + ''.join(ID_CHARS[i // len(ID_CHARS) ** n % len(ID_CHARS)]
+                         for n in (2, 1, 0))
+
+
+def edition_matches(row, players):
+    """
+    Returns the number of matches in one edition of a tournament, given the
+    number of players to draw from.
+    """
+    return min(int(row[3]), players) - 1
+
+
+def generate_tournaments(rng, count, matches=0, years=1, players=0):
+    """
+    Returns the synthetic tournament rows: count of them, or more if need
+    be for matches to fit in the given number of years (of one edition of
+    each tournament).
+    """
+    rows = []
+    names = set()
+    per_year = 0
+    i = 0
+    while i < count or (players > 1 and per_year * years < matches):
+        while True:
+            name = f'{make_name(rng, 3)} {rng.choice(CITY_SUFFIXES)}'[:25]
+            if name not in names:
+                names.add(name)
+                break
+        draw_size, level = weighted(rng, LEVELS)
+        rows.append([tournament_id(i), name, weighted(rng, SURFACES),
+                     str(draw_size), level])
+        per_year += edition_matches(rows[-1], players)
+        i += 1
+    return rows
+
+
+def generate_matches(rng, tournaments, player_ids, count, first_match_id,
+                     last_year):
+    """
+    Yields (match row, history row or None) for count synthetic matches,
+    one edition of every tournament per year, starting as many years before
+    last_year as they take. The history row comes with the final of each
+    edition.
+    """
+    per_year = sum(edition_matches(row, len(player_ids))
+                   for row in tournaments)
+    match_id = first_match_id
+    year = max(FIRST_YEAR, last_year - -(-count // max(per_year, 1)) + 1)
+    generated = 0
+    while generated < count:
+        for week, (t_id, _, _, draw_size, _) in enumerate(tournaments):
+            date = (datetime.date(year, 1, 1)
+                    + datetime.timedelta(weeks=week % 50))
+            # The players entered in this edition
+            entrants = rng.sample(player_ids, min(int(draw_size),
+                                                  len(player_ids)))
+            matches = len(entrants) - 1
+            for n in range(matches):
+                if generated == count:
+                    return
+                winner_id, loser_id = rng.sample(entrants, 2)
+                row = [str(match_id), t_id, date.isoformat(),
+                       make_score(rng), str(rng.randint(55, 200)), winner_id,
+                       str(rng.randint(0, 15)), str(rng.randint(0, 12)),
+                       str(rng.randint(0, 10)), loser_id,
+                       str(rng.randint(0, 15)), str(rng.randint(0, 12)),
+                       str(rng.randint(0, 10))]
+                history = None
+                if n == matches - 1:
+                    history = [t_id, str(year), winner_id, loser_id,
+                               str(match_id)]
+                yield row, history
+                match_id += 1
+                generated += 1
+        year += 1
+
+
+def generate(out_dir, players=10000, tournaments=200, matches=1000000,
+             seed=0, data_dir=HERE, last_year=None):
+    """
+    Writes the five CSVs for a dataset of the given size to out_dir, and
+    returns the number of rows written to each. The synthetic matches end
+    in last_year (by default, last year).
+    """
+    if last_year is None:
+        last_year = datetime.date.today().year - 1
+    if last_year < FIRST_YEAR:
+        raise ValueError(f'The last year must be {FIRST_YEAR} or later')
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    headers = {}
+    seed_rows = {}
+    for table in storage.TABLES:
+        headers[table], seed_rows[table] = read_csv(data_dir, table)
+
+    def open_table(table):
+        f = open(os.path.join(out_dir, f'{table}.csv'), 'w', newline='')
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(headers[table])
+        return f, writer
+
+    counts = {}
+    player_rows = generate_players(rng, seed_rows['player'],
+                                   max(players, len(seed_rows['player'])))
+    synthetic_matches = max(0, matches - len(seed_rows['match_result']))
+    tournament_rows = generate_tournaments(
+        rng, tournaments, synthetic_matches, last_year - FIRST_YEAR + 1,
+        len(player_rows))
+    for table, rows in (('player', player_rows),
+                        ('ranking', seed_rows['ranking']),
+                        ('tournament',
+                         seed_rows['tournament'] + tournament_rows)):
+        f, writer = open_table(table)
+        with f:
+            writer.writerows(rows)
+        counts[table] = len(rows)
+
+    player_ids = [row[0] for row in player_rows]
+    first_match_id = max(int(row[0]) for row in seed_rows['match_result']) + 1
+    match_file, match_writer = open_table('match_result')
+    history_file, history_writer = open_table('tournament_history')
+    with match_file, history_file:
+        match_writer.writerows(seed_rows['match_result'])
+        history_writer.writerows(seed_rows['tournament_history'])
+        counts['match_result'] = len(seed_rows['match_result'])
+        counts['tournament_history'] = len(seed_rows['tournament_history'])
+        if tournament_rows:
+            for row, history in generate_matches(
+                    rng, tournament_rows, player_ids, synthetic_matches,
+                    first_match_id, last_year):
+                match_writer.writerow(row)
+                counts['match_result'] += 1
+                if history is not None:
+                    history_writer.writerow(history)
+                    counts['tournament_history'] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate a larger WTA dataset in the bundled CSV '
+                    'format.')
+    parser.add_argument('--players', type=int, default=10000,
+                        help='total players, including the bundled ones')
+    parser.add_argument('--tournaments', type=int, default=200,
+                        help='synthetic tournaments to add (at least; more '
+                             'are added if the matches need them)')
+    parser.add_argument('--matches', type=int, default=1000000,
+                        help='total matches, including the bundled ones')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed; the same seed gives the same data')
+    parser.add_argument('--last-year', type=int,
+                        help='year of the latest synthetic matches '
+                             '(default: last year)')
+    parser.add_argument('--out', required=True, help='output directory')
+    args = parser.parse_args(argv)
+
+    counts = generate(args.out, args.players, args.tournaments, args.matches,
+                      args.seed, last_year=args.last_year)
+    for table, count in counts.items():
+        print(f'{table:<20} {count:>10} rows')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,618 @@
+"""
+Connection pooling for the WTA database application.
+
+Keeps a small pool of already-authenticated connections for each database
+role (appadmin and appclient, see grant-permissions.sql) so that a query
+borrows an open connection instead of paying for a new TCP and auth
+handshake every time. Connection settings come from a config file and/or
+environment variables rather than being hard-coded in app.py.
+
+Admin connections (and so every write) go to the primary server (host and
+port). When replicas are configured, client (fan) connections are routed
+to them instead by a Router: each read goes to the replica with the fewest
+connections in use, skipping replicas that are further behind the primary
+than max_replica_lag or that could not be reached, and falling back to the
+primary when none is usable. For read_your_writes seconds after an admin
+session (a thread) commits a write, that session's client reads go to the
+primary as well, so an admin sees the match they just entered.
+
+Typical use:
+
+    with db_pool.connection(db_pool.CLIENT) as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+
+"""
+import configparser
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+import mysql.connector
+import mysql.connector.errorcode as errorcode
+
+# Database roles. Admins get full privileges on wtadb, clients (fans) are
+# read-only.
+ADMIN = 'admin'
+CLIENT = 'client'
+ROLES = (ADMIN, CLIENT)
+
+# Settings used when neither the config file nor the environment says
+# otherwise. These match the users created in grant-permissions.sql.
+DEFAULT_CONFIG = {
+    'host': 'localhost',
+    # Find port in MAMP or MySQL Workbench GUI or with
+    # SHOW VARIABLES WHERE variable_name LIKE 'port';
+    'port': '3306',
+    'database': 'wtadb',
+    'admin_user': 'appadmin',
+    'admin_password': 'adminpw',
+    'client_user': 'appclient',
+    'client_password': 'clientpw',
+    # Maximum number of open connections per role
+    'pool_size': '5',
+    # Seconds to wait for a free connection before giving up
+    'pool_timeout': '30',
+    # Idle connections older than this (in seconds) are pinged before
+    # being handed out again
+    'health_check_interval': '60',
+    # Number of times to retry a dropped connection before failing
+    'reconnect_attempts': '3',
+    'reconnect_delay': '1',
+    'connect_timeout': '10',
+    # Allow LOAD DATA LOCAL INFILE on the connections (bootstrap.py turns
+    # this on; the server's local_infile must be ON too)
+    'local_infile': '0',
+    # Storage backend (see storage.py): 'mysql', or 'sqlite' to read from
+    # an embedded copy of the database built with `python storage.py build`
+    'backend': 'mysql',
+    'sqlite_path': 'wtadb.sqlite3',
+    # Statements taking at least this many seconds are logged, with their
+    # plan, to the slow query log (see metrics.py), and appended to
+    # slow_query_log as JSON lines if it is set
+    'slow_query_time': '0.1',
+    'slow_query_log': '',
+    # Read replicas of the primary (host, port) for the client role, as a
+    # comma-separated list of host:port; empty sends every read to the
+    # primary
+    'replicas': '',
+    # Replicas further behind the primary than this many seconds, or not
+    # replicating at all, are skipped until they catch up
+    'max_replica_lag': '5',
+    # Seconds between checks of each replica's lag
+    'replica_check_interval': '5',
+    # Seconds to skip a replica that could not be reached
+    'replica_retry_interval': '30',
+    # Seconds after a thread commits a write during which its client reads
+    # go to the primary, so they see the write (0 to turn off)
+    'read_your_writes': '5',
+}
+
+# Client-side errors meaning the server could not be reached (as opposed to
+# bad credentials or a missing database, which retrying won't fix).
+RETRYABLE_ERRORS = (
+    errorcode.CR_CONNECTION_ERROR,
+    errorcode.CR_CONN_HOST_ERROR,
+    errorcode.CR_SERVER_GONE_ERROR,
+    errorcode.CR_SERVER_LOST,
+)
+
+# Config file read when WTADB_CONFIG is not set; see wtadb.example.ini.
+DEFAULT_CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   'wtadb.ini')
+CONFIG_SECTION = 'wtadb'
+ENV_PREFIX = 'WTADB_'
+
+
+class PoolError(mysql.connector.Error):
+    """
+    Raised when no connection could be handed out, e.g. when every
+    connection in the pool stays busy for longer than the pool timeout.
+    """
+
+
+def load_config(path=None):
+    """
+    Returns the connection settings as a dictionary. The defaults above are
+    overridden by the [wtadb] section of the config file (the given path,
+    $WTADB_CONFIG, or wtadb.ini next to this file), which in turn is
+    overridden by WTADB_<SETTING> environment variables
+    (e.g. WTADB_HOST, WTADB_PORT, WTADB_POOL_SIZE).
+    """
+    config = dict(DEFAULT_CONFIG)
+    path = path or os.environ.get(ENV_PREFIX + 'CONFIG') or DEFAULT_CONFIG_FILE
+    parser = configparser.ConfigParser()
+    if parser.read(path) and parser.has_section(CONFIG_SECTION):
+        config.update(parser.items(CONFIG_SECTION))
+    for key in list(config):
+        value = os.environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            config[key] = value
+    return config
+
+
+class PooledConnection:
+    """
+    A connection borrowed from a ConnectionPool. Attribute access falls
+    through to the underlying mysql.connector connection, so it can be
+    used exactly like one (conn.cursor(), conn.commit(), ...).
+    """
+
+    def __init__(self, pool, raw):
+        self.pool = pool
+        self.raw = raw
+        self.last_used = time.monotonic()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def commit(self):
+        self.raw.commit()
+        if self.pool.role == ADMIN:
+            note_write()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of connections for one database role. Connections are
+    opened lazily up to the pool size, checked for health when they have
+    been idle for a while, and transparently replaced when the server has
+    dropped them.
+    """
+
+    def __init__(self, role, config, host=None, port=None):
+        self.role = role
+        self.size = int(config['pool_size'])
+        self.timeout = float(config['pool_timeout'])
+        self.health_check_interval = float(config['health_check_interval'])
+        self.reconnect_attempts = int(config['reconnect_attempts'])
+        self.reconnect_delay = float(config['reconnect_delay'])
+        self.connect_args = {
+            'host': host or config['host'],
+            'port': int(port or config['port']),
+            'user': config[role + '_user'],
+            'password': config[role + '_password'],
+            'database': config['database'],
+            'connection_timeout': int(config['connect_timeout']),
+            'allow_local_infile': config['local_infile'] == '1',
+        }
+        # LIFO so that the most recently used (and most likely still
+        # healthy) connection is handed out first.
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._closed = False
+
+    def _connect(self):
+        """
+        Opens a new connection, retrying a few times if the server is
+        temporarily unreachable.
+        """
+        for attempt in range(self.reconnect_attempts + 1):
+            try:
+                return PooledConnection(
+                    self, mysql.connector.connect(**self.connect_args))
+            except mysql.connector.Error as err:
+                if (err.errno not in RETRYABLE_ERRORS
+                        or attempt == self.reconnect_attempts):
+                    raise
+                time.sleep(self.reconnect_delay)
+
+    def _discard(self, conn):
+        """
+        Closes a connection that will not be returned to the pool.
+        """
+        with self._lock:
+            self._open -= 1
+        try:
+            conn.raw.close()
+        except mysql.connector.Error:
+            pass
+
+    def _is_healthy(self, conn):
+        """
+        Returns True if the connection is usable, reconnecting it in place
+        if the server dropped it. Connections used recently are trusted
+        without a round trip.
+        """
+        if time.monotonic() - conn.last_used < self.health_check_interval:
+            return True
+        try:
+            conn.raw.ping(reconnect=True, attempts=self.reconnect_attempts,
+                          delay=self.reconnect_delay)
+            return True
+        except mysql.connector.Error:
+            return False
+
+    def acquire(self):
+        """
+        Returns a healthy connection from the pool, opening a new one if the
+        pool is not yet full. Blocks for up to the pool timeout when every
+        connection is in use.
+        """
+        if self._closed:
+            raise PoolError(msg=f'The {self.role} connection pool is closed.')
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    can_open = self._open < self.size
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        return self._connect()
+                    except mysql.connector.Error:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolError(
+                        msg=f'Timed out waiting for a {self.role} connection.')
+                try:
+                    conn = self._idle.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+            if self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn):
+        """
+        Returns a connection to the pool. Any uncommitted work is rolled
+        back so the next borrower starts with a clean session; connections
+        that fail that are closed instead.
+        """
+        if self._closed:
+            self._discard(conn)
+            return
+        try:
+            if conn.raw.in_transaction:
+                conn.raw.rollback()
+        except mysql.connector.Error:
+            self._discard(conn)
+            return
+        conn.last_used = time.monotonic()
+        self._idle.put(conn)
+
+    def in_use(self):
+        """
+        Returns the number of connections currently checked out.
+        """
+        with self._lock:
+            return self._open - self._idle.qsize()
+
+    def close(self):
+        """
+        Closes every idle connection. Connections that are still checked
+        out are closed when they are released.
+        """
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+
+# ----------------------------------------------------------------------
+# Read Replicas
+# ----------------------------------------------------------------------
+def parse_servers(value):
+    """
+    Returns the (host, port) of each server in a comma-separated list of
+    host[:port]; the port defaults to 3306.
+    """
+    servers = []
+    for server in value.split(','):
+        server = server.strip()
+        if server:
+            host, _, port = server.partition(':')
+            servers.append((host, int(port or 3306)))
+    return servers
+
+
+# Replication status statements, newest first; SHOW SLAVE STATUS is for
+# servers older than MySQL 8.0.22
+REPLICA_STATUS = (('SHOW REPLICA STATUS', 'Seconds_Behind_Source'),
+                  ('SHOW SLAVE STATUS', 'Seconds_Behind_Master'))
+
+
+class Replica:
+    """
+    A read replica: a client role pool on the replica's server, with its
+    last measured replication lag. The lag is measured on a connection of
+    its own, so that a check never waits for (or is refused by) a busy
+    pool.
+    """
+
+    def __init__(self, host, port, config):
+        self.host = host
+        self.port = port
+        self.pool = ConnectionPool(CLIENT, config, host, port)
+        # Seconds behind the primary, None when not replicating
+        self.lag = None
+        self.checked_at = None
+        self.down_until = 0
+        self.error = None
+        self._checking = threading.Lock()
+        # Connection used by check_lag (only while holding _checking)
+        self._probe = None
+
+    @property
+    def name(self):
+        return f'{self.host}:{self.port}'
+
+    def check_lag(self):
+        """
+        Measures how far the replica is behind the primary. A server that
+        isn't replicating from anywhere (e.g. a standalone copy used as a
+        stand-in) counts as up to date; one whose replication has stopped
+        has no lag (None). Raises mysql.connector.Error if the replica
+        can't be queried.
+        """
+        if self._probe is None:
+            self._probe = self.pool._connect()
+        conn = self._probe
+        try:
+            for sql, column in REPLICA_STATUS:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(sql)
+                    row = cursor.fetchone()
+                    names = [d[0] for d in cursor.description or ()]
+                    cursor.fetchall()
+                except mysql.connector.Error as err:
+                    if err.errno == errorcode.ER_PARSE_ERROR:
+                        continue
+                    raise
+                finally:
+                    cursor.close()
+                if row is None:
+                    lag = 0
+                else:
+                    lag = dict(zip(names, row)).get(column)
+                self.lag = None if lag is None else float(lag)
+                break
+        except mysql.connector.Error:
+            self._close_probe()
+            raise
+        self.checked_at = time.monotonic()
+        self.error = None
+
+    def _close_probe(self):
+        conn, self._probe = self._probe, None
+        if conn is not None:
+            try:
+                conn.raw.close()
+            except mysql.connector.Error:
+                pass
+
+    def close(self):
+        self.pool.close()
+        with self._checking:
+            self._close_probe()
+
+    def mark_down(self, err, retry_interval):
+        self.down_until = time.monotonic() + retry_interval
+        self.error = str(err)
+
+    def is_usable(self, now, check_interval, max_lag, retry_interval):
+        """
+        Returns True if the replica can take reads, first checking its lag
+        if that is due (unless another thread is already checking it).
+        """
+        if self.down_until > now:
+            return False
+        due = (self.checked_at is None
+               or now - self.checked_at >= check_interval)
+        if due and self._checking.acquire(blocking=False):
+            try:
+                self.check_lag()
+            except mysql.connector.Error as err:
+                self.mark_down(err, retry_interval)
+                return False
+            finally:
+                self._checking.release()
+        return self.lag is not None and self.lag <= max_lag
+
+    def status(self):
+        now = time.monotonic()
+        return {'replica': self.name, 'lag': self.lag,
+                'down': self.down_until > now, 'in_use': self.pool.in_use(),
+                'error': self.error}
+
+
+class Router:
+    """
+    Routes client reads across the configured replicas, checking each
+    replica's lag at most every replica_check_interval seconds.
+    """
+
+    def __init__(self, config):
+        self.replicas = [Replica(host, port, config)
+                         for host, port in parse_servers(config['replicas'])]
+        self.max_lag = float(config['max_replica_lag'])
+        self.check_interval = float(config['replica_check_interval'])
+        self.retry_interval = float(config['replica_retry_interval'])
+        self.read_your_writes = float(config['read_your_writes'])
+        self._next = 0
+        self.primary_reads = 0
+
+    def _reading_own_writes(self, now):
+        """
+        Returns True if the calling thread committed a write within the
+        last read_your_writes seconds.
+        """
+        last_write = getattr(_writes, 'last', None)
+        return (last_write is not None
+                and now - last_write < self.read_your_writes)
+
+    def candidates(self):
+        """
+        Returns the usable replicas, least busy first (ties in round robin
+        order), or an empty list when reads should go to the primary.
+        """
+        now = time.monotonic()
+        if not self.replicas or self._reading_own_writes(now):
+            return []
+        start = self._next
+        self._next = (start + 1) % len(self.replicas)
+        ordered = self.replicas[start:] + self.replicas[:start]
+        usable = [replica for replica in ordered
+                  if replica.is_usable(now, self.check_interval, self.max_lag,
+                                       self.retry_interval)]
+        return sorted(usable, key=lambda replica: replica.pool.in_use())
+
+    def acquire(self):
+        """
+        Returns a client connection from the best usable replica, failing
+        over to the next one (and finally to the primary) when a replica
+        can't be reached.
+        """
+        candidates = self.candidates()
+        for replica in candidates:
+            if (replica.pool.in_use() >= replica.pool.size
+                    and replica is not candidates[-1]):
+                # Every connection is busy; only wait on the last one
+                continue
+            try:
+                return replica.pool.acquire()
+            except PoolError:
+                continue
+            except mysql.connector.Error as err:
+                replica.mark_down(err, self.retry_interval)
+        self.primary_reads += 1
+        return get_pool(CLIENT).acquire()
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+
+    def status(self):
+        return {'replicas': [replica.status() for replica in self.replicas],
+                'primary_reads': self.primary_reads,
+                'reading_own_writes': self._reading_own_writes(
+                    time.monotonic())}
+
+
+_pools = {}
+_router = None
+_pools_lock = threading.Lock()
+_config = None
+# When each thread (an admin session) last committed a write, as
+# _writes.last (see PooledConnection.commit)
+_writes = threading.local()
+
+
+def note_write():
+    """
+    Records that the calling thread just committed a write on the primary,
+    so its client reads go there for the next read_your_writes seconds.
+    """
+    _writes.last = time.monotonic()
+
+
+def _close_pools():
+    global _router
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+    if _router is not None:
+        _router.close()
+        _router = None
+
+
+def configure(config=None, path=None):
+    """
+    Sets the connection settings used by the pools, closing any pools that
+    were already opened with the previous settings.
+    """
+    global _config
+    with _pools_lock:
+        _close_pools()
+        _config = config if config is not None else load_config(path)
+
+
+def get_config():
+    """
+    Returns the settings in use, loading them on first use.
+    """
+    global _config
+    with _pools_lock:
+        if _config is None:
+            _config = load_config()
+        return _config
+
+
+def get_pool(role):
+    """
+    Returns the pool for the given role (ADMIN or CLIENT) on the primary,
+    creating it on first use.
+    """
+    if role not in ROLES:
+        raise ValueError(f'Unknown database role: {role}')
+    config = get_config()
+    with _pools_lock:
+        if role not in _pools:
+            _pools[role] = ConnectionPool(role, config)
+        return _pools[role]
+
+
+def get_router():
+    """
+    Returns the router of client reads, or None if no replicas are
+    configured.
+    """
+    global _router
+    config = get_config()
+    if not config['replicas'].strip():
+        return None
+    with _pools_lock:
+        if _router is None:
+            _router = Router(config)
+        return _router
+
+
+@contextmanager
+def connection(role):
+    """
+    Checks out a connection for the given role for the duration of a
+    with-block and returns it to its pool afterward. Client connections
+    come from a replica when replicas are configured.
+    """
+    router = get_router() if role == CLIENT else None
+    if router is None:
+        conn = get_pool(role).acquire()
+    else:
+        conn = router.acquire()
+    try:
+        yield conn
+    finally:
+        conn.pool.release(conn)
+
+
+def replica_status():
+    """
+    Returns the state of each replica (lag, whether it is down, connections
+    in use) and the number of reads sent to the primary, or None if no
+    replicas are configured.
+    """
+    router = get_router()
+    return None if router is None else router.status()
+
+
+def close_all():
+    """
+    Closes every pool. Called when the application exits.
+    """
+    with _pools_lock:
+        _close_pools()
@@ -0,0 +1,498 @@
+"""
+Elo ratings of every player, overall and on each surface, for seeding and
+match previews. The ratings are kept in the player_rating table, along
+with the number of matches behind each, and rating_state records the last
+match rated.
+
+Ratings start at INITIAL_RATING and move after every match by K times the
+difference between the result and the expected result, with K shrinking as
+a player plays more matches (k_factor), as in FiveThirtyEight's tennis
+Elo. The surface ratings only count the matches on their surface.
+
+A full replay (rebuild) reads every match in chronological order (by
+tournament_date, then match_id) into compact arrays of player and surface
+codes and runs through them once, in a single loop over plain Python lists
+of ratings, and then replaces player_rating in one transaction. After that,
+update() rates only the matches added since the last match rated: it reads
+the ratings of just the players in them, applies the matches in order and
+writes those players back. input_match_result and ingest.py call it after
+committing new matches. A new match dated before the last match rated
+can't be applied in order, so it makes update() replay everything instead,
+as does a missing rating_state (e.g. on a freshly loaded database).
+input_match_result can't wait for that, so it calls update() with
+replay=False, which leaves the new matches unrated, and has
+update_in_background() do the replay on a thread of its own; until it is
+done the ratings don't count the new matches. Unrated matches are picked
+up by the next update() even if the process exits first. Run a rebuild
+after matches are changed or deleted.
+
+Match IDs are assigned when a match is inserted but become visible when
+its transaction commits, so an update can rate match 102 while 101 is
+still uncommitted. The IDs missing below the last match rated are kept in
+rating_skipped, and each update rates those that have turned up since (in
+order, or by replaying, like any other new match). They are forgotten
+once last_match_id is SKIP_WINDOW IDs past them, as by then they are
+taken to be rolled back.
+
+    $ python elo.py rebuild
+    $ python elo.py update
+
+"""
+import argparse
+import collections
+import sys
+import threading
+import time
+from array import array
+
+import mysql.connector
+
+import db_pool
+import result_cache
+import statements
+import storage
+
+INITIAL_RATING = 1500.0
+# Overall rating, then one per surface, in player_rating's column order
+SURFACES = ('Hard', 'Clay', 'Grass')
+KINDS = (None, *SURFACES)
+# Ratings of players looked up per query by update(), padded with NULLs so
+# that every lookup reuses one prepared statement
+RATING_LOOKUP = 64
+# Rows per multi-row INSERT when writing ratings
+WRITE_BATCH_SIZE = 1000
+# Match IDs after which a skipped ID is given up on
+SKIP_WINDOW = 100000
+
+RATING_COLUMNS = ('player_id', 'elo', 'matches', 'hard_elo', 'hard_matches',
+                  'clay_elo', 'clay_matches', 'grass_elo', 'grass_matches',
+                  'last_match_date')
+
+statements.register('rating_matches', """
+    SELECT M.match_id, M.tournament_date, M.winner_id, M.loser_id, T.surface
+    FROM match_result AS M
+        JOIN tournament AS T ON T.tournament_id = M.tournament_id
+    WHERE M.match_id > %s
+    ORDER BY M.tournament_date, M.match_id""",
+                    reads=('match_result', 'tournament'))
+
+statements.register('rating_skipped_matches', """
+    SELECT M.match_id, M.tournament_date, M.winner_id, M.loser_id, T.surface
+    FROM rating_skipped AS K
+        JOIN match_result AS M ON M.match_id = K.match_id
+        JOIN tournament AS T ON T.tournament_id = M.tournament_id
+    ORDER BY M.tournament_date, M.match_id""",
+                    reads=('rating_skipped', 'match_result', 'tournament'))
+
+statements.register('rating_skipped', """
+    SELECT match_id FROM rating_skipped""",
+                    reads=('rating_skipped', ))
+
+statements.register('add_rating_skipped', """
+    INSERT INTO rating_skipped (match_id) VALUES (%s)""",
+                    writes=('rating_skipped', ))
+
+statements.register('remove_rating_skipped', """
+    DELETE FROM rating_skipped WHERE match_id = %s""",
+                    writes=('rating_skipped', ))
+
+statements.register('expire_rating_skipped', """
+    DELETE FROM rating_skipped WHERE match_id < %s""",
+                    writes=('rating_skipped', ))
+
+# Taken first by update(), so that two updates never rate the same matches.
+# Without a rating_state row there is nothing to lock, so update() creates
+# it, which makes a concurrent update wait (and then fail on the duplicate
+# key) instead of replaying everything too.
+statements.register('lock_rating_state', """
+    UPDATE rating_state SET last_match_id = last_match_id
+    WHERE state_id = 1""")
+
+statements.register('create_rating_state', """
+    INSERT INTO rating_state (state_id, last_match_id, last_match_date)
+    VALUES (1, 0, NULL)""",
+                    writes=('rating_state', ))
+
+statements.register('rating_state', """
+    SELECT last_match_id, last_match_date
+    FROM rating_state
+    WHERE state_id = 1""",
+                    reads=('rating_state', ))
+
+statements.register('save_rating_state', """
+    REPLACE INTO rating_state (state_id, last_match_id, last_match_date)
+    VALUES (1, %s, %s)""",
+                    writes=('rating_state', ))
+
+statements.register('clear_player_ratings', 'DELETE FROM player_rating',
+                    writes=('player_rating', ))
+
+statements.register('save_player_rating', f"""
+    REPLACE INTO player_rating ({', '.join(RATING_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(RATING_COLUMNS))})""",
+                    writes=('player_rating', ))
+
+statements.register('player_ratings_of', f"""
+    SELECT {', '.join(RATING_COLUMNS)}
+    FROM player_rating
+    WHERE player_id IN ({', '.join(['%s'] * RATING_LOOKUP)})""",
+                    reads=('player_rating', ))
+
+statements.register('player_rating', f"""
+    SELECT {', '.join(RATING_COLUMNS)}
+    FROM player_rating
+    WHERE player_id = %s""",
+                    reads=('player_rating', ))
+
+# Column names can't be statement parameters, so there is one listing per
+# rating, keyed by surface (None for the overall rating).
+TOP_RATED_STATEMENTS = {
+    kind: statements.register(
+        f'top_rated_{kind.lower()}' if kind else 'top_rated', f"""
+    SELECT R.player_id, P.first_name, P.last_name, R.{prefix}elo,
+        R.{prefix}matches
+    FROM player_rating AS R
+        JOIN player AS P ON P.player_id = R.player_id
+    WHERE R.{prefix}matches >= %s
+    ORDER BY R.{prefix}elo DESC, R.player_id
+    LIMIT %s""",
+        reads=('player_rating', 'player'))
+    for kind, prefix in ((kind, f'{kind.lower()}_' if kind else '')
+                         for kind in KINDS)
+}
+
+
+def k_factor(matches):
+    """
+    Returns how far a rating moves after a match, given the number of
+    matches it is already based on.
+    """
+    return 250 / (matches + 5) ** 0.4
+
+
+def expected(rating, opponent_rating):
+    """
+    Returns the probability of beating an opponent, given both ratings.
+    """
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+
+class Ratings:
+    """
+    The overall and surface ratings of a set of players in memory, with
+    player IDs encoded as list indexes.
+    """
+
+    def __init__(self):
+        self.codes = {}
+        self.player_ids = []
+        # Per kind (see KINDS), the rating and number of matches of each
+        # player code
+        self.elo = [[] for _ in KINDS]
+        self.matches = [[] for _ in KINDS]
+        self.last_dates = []
+        self.changed = set()
+
+    def __len__(self):
+        return len(self.player_ids)
+
+    def code(self, player_id):
+        """
+        Returns the code of a player, adding them with initial ratings if
+        they are new.
+        """
+        code = self.codes.get(player_id)
+        if code is None:
+            code = self.codes[player_id] = len(self.player_ids)
+            self.player_ids.append(player_id)
+            for elo, matches in zip(self.elo, self.matches):
+                elo.append(INITIAL_RATING)
+                matches.append(0)
+            self.last_dates.append(None)
+        return code
+
+    def add_rows(self, rows):
+        """
+        Adds players from player_rating rows (RATING_COLUMNS).
+        """
+        for player_id, *values, last_match_date in rows:
+            code = self.code(str(player_id))
+            for i in range(len(KINDS)):
+                self.elo[i][code] = float(values[2 * i])
+                self.matches[i][code] = values[2 * i + 1]
+            self.last_dates[code] = last_match_date
+
+    def encode(self, matches):
+        """
+        Encodes rating_matches rows (match_id, tournament_date, winner_id,
+        loser_id, surface) as compact arrays: winner and loser codes,
+        surface indexes into KINDS, and the distinct dates with the index
+        of each match's.
+        """
+        surfaces = {kind: i for i, kind in enumerate(KINDS) if kind}
+        winners, losers, kinds = array('i'), array('i'), array('b')
+        dates, date_indexes = [], array('i')
+        for _, date, winner_id, loser_id, surface in matches:
+            winners.append(self.code(str(winner_id)))
+            losers.append(self.code(str(loser_id)))
+            kinds.append(surfaces[surface])
+            if not dates or dates[-1] != date:
+                dates.append(date)
+            date_indexes.append(len(dates) - 1)
+        return winners, losers, kinds, dates, date_indexes
+
+    def replay(self, winners, losers, kinds, dates=None, date_indexes=None):
+        """
+        Applies encoded matches in order. The loop is written out in full,
+        since a function call per rating update would double its cost, and
+        K is looked up in a table by match count rather than computed.
+        """
+        elo, played = self.elo[0], self.matches[0]
+        by_surface = list(zip(self.elo, self.matches))
+        # No count can grow past its largest value so far plus the most
+        # matches any one player has here
+        appearances = collections.Counter(winners)
+        appearances.update(losers)
+        most = (max((max(matches, default=0) for matches in self.matches),
+                    default=0)
+                + max(appearances.values(), default=0) + 1)
+        k = [k_factor(n) for n in range(most)]
+        for w, l, s in zip(winners, losers, kinds):
+            rw, rl = elo[w], elo[l]
+            nw, nl = played[w], played[l]
+            change = 1 - 1 / (1 + 10 ** ((rl - rw) / 400))
+            elo[w] = rw + k[nw] * change
+            elo[l] = rl - k[nl] * change
+            played[w], played[l] = nw + 1, nl + 1
+            surface_elo, surface_played = by_surface[s]
+            rw, rl = surface_elo[w], surface_elo[l]
+            nw, nl = surface_played[w], surface_played[l]
+            change = 1 - 1 / (1 + 10 ** ((rl - rw) / 400))
+            surface_elo[w] = rw + k[nw] * change
+            surface_elo[l] = rl - k[nl] * change
+            surface_played[w], surface_played[l] = nw + 1, nl + 1
+        if dates is not None:
+            last_dates = self.last_dates
+            for w, l, d in zip(winners, losers, date_indexes):
+                last_dates[w] = last_dates[l] = dates[d]
+        self.changed.update(winners)
+        self.changed.update(losers)
+
+    def rows(self, codes=None):
+        """
+        Returns player_rating rows (RATING_COLUMNS) for the given player
+        codes, by default every player.
+        """
+        if codes is None:
+            codes = range(len(self.player_ids))
+        return [(self.player_ids[code],
+                 *(value for i in range(len(KINDS))
+                   for value in (self.elo[i][code], self.matches[i][code])),
+                 self.last_dates[code])
+                for code in codes]
+
+
+# ----------------------------------------------------------------------
+# Rating the Database's Matches
+# ----------------------------------------------------------------------
+def _write(conn, rows):
+    for i in range(0, len(rows), WRITE_BATCH_SIZE):
+        storage.executemany(conn, 'save_player_rating',
+                            rows[i:i + WRITE_BATCH_SIZE])
+
+
+def _track_skipped(conn, matches, last_match_id):
+    """
+    Updates rating_skipped after rating the given matches, where
+    last_match_id was the last match rated before them (None if nothing
+    was): drops the skipped IDs that were rated, adds the IDs missing
+    between last_match_id and the last match rated now, and forgets those
+    too far behind it. Returns the last match ID rated now.
+    """
+    rated = {match[0] for match in matches}
+    latest = max(rated, default=0)
+    if last_match_id is None:
+        last_match_id = latest
+    skipped = {match_id for (match_id, ) in
+               storage.fetchall(conn, 'rating_skipped')}
+    found = sorted(skipped & rated)
+    if found:
+        storage.executemany(conn, 'remove_rating_skipped',
+                            [(match_id, ) for match_id in found])
+    missing = [(match_id, )
+               for match_id in range(last_match_id + 1, latest)
+               if match_id not in rated and match_id not in skipped]
+    for i in range(0, len(missing), WRITE_BATCH_SIZE):
+        storage.executemany(conn, 'add_rating_skipped',
+                            missing[i:i + WRITE_BATCH_SIZE])
+    latest = max(latest, last_match_id)
+    storage.execute(conn, 'expire_rating_skipped', (latest - SKIP_WINDOW, ))
+    return latest
+
+
+def _replay_all(conn, last_match_id=None):
+    """
+    Rates every match and replaces player_rating, without committing.
+    Returns the number of matches rated.
+    """
+    matches = storage.fetchall(conn, 'rating_matches', (0, ))
+    ratings = Ratings()
+    ratings.replay(*ratings.encode(matches))
+    storage.execute(conn, 'clear_player_ratings')
+    _write(conn, ratings.rows())
+    # The last match ID rated, and the latest date (which new matches must
+    # not be older than)
+    storage.execute(conn, 'save_rating_state',
+                    (_track_skipped(conn, matches, last_match_id),
+                     matches[-1][1] if matches else None))
+    return len(matches)
+
+
+def _finish(conn):
+    conn.commit()
+    result_cache.invalidate_for('save_player_rating')
+    result_cache.invalidate_for('save_rating_state')
+
+
+def rebuild(conn):
+    """
+    Replays every match in the database and replaces the ratings, in one
+    transaction on an admin connection. Returns the number of matches
+    rated.
+    """
+    try:
+        state = storage.fetchone(conn, 'rating_state')
+        rated = _replay_all(conn, state and state[0])
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    _finish(conn)
+    return rated
+
+
+def update(conn, replay=True):
+    """
+    Rates the matches added since the last update or rebuild, replaying
+    every match instead if one of them is older than the last match rated
+    or nothing was rated yet. Runs in one transaction on an admin
+    connection and returns the number of matches rated. With replay False,
+    a replay is left undone and None is returned instead.
+    """
+    try:
+        storage.execute(conn, 'lock_rating_state')
+        state = storage.fetchone(conn, 'rating_state')
+        if state is None:
+            storage.execute(conn, 'create_rating_state')
+            last_match_id, matches = None, None
+        else:
+            last_match_id, last_date = state
+            matches = storage.fetchall(conn, 'rating_matches',
+                                       (last_match_id, ))
+            # Skipped matches that have turned up since
+            late = storage.fetchall(conn, 'rating_skipped_matches')
+            if late:
+                matches = sorted([*late, *matches],
+                                 key=lambda match: (str(match[1]), match[0]))
+            # Dates come back as text from SQLite
+            if last_date is not None and any(
+                    str(match[1]) < str(last_date) for match in matches):
+                matches = None
+        if matches is None and not replay:
+            conn.rollback()
+            return None
+        if matches is None:
+            rated = _replay_all(conn, last_match_id)
+        elif matches:
+            rated = _apply(conn, matches, last_match_id)
+        else:
+            rated = 0
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    _finish(conn)
+    return rated
+
+
+# The thread running update_in_background(), and whether it should update
+# again when done
+_background = None
+_background_again = False
+_background_lock = threading.Lock()
+
+
+def update_in_background():
+    """
+    Runs update() (replaying if need be) on a background thread with its
+    own admin connection. If one is already running, it updates once more
+    when done, to rate matches added in the meantime.
+    """
+    global _background, _background_again
+    with _background_lock:
+        if _background is not None:
+            _background_again = True
+            return
+        _background = threading.Thread(target=_update_until_done,
+                                       name='elo-update', daemon=True)
+        _background.start()
+
+
+def _update_until_done():
+    global _background, _background_again
+    while True:
+        try:
+            with storage.connection(db_pool.ADMIN) as conn:
+                update(conn)
+        except mysql.connector.Error:
+            # Left for the next update
+            pass
+        with _background_lock:
+            if not _background_again:
+                _background = None
+                return
+            _background_again = False
+
+
+def _apply(conn, matches, last_match_id):
+    """
+    Rates new matches, all dated on or after the last match rated, reading
+    and writing the ratings of only the players in them.
+    """
+    player_ids = sorted({str(player_id) for match in matches
+                         for player_id in match[2:4]})
+    ratings = Ratings()
+    for i in range(0, len(player_ids), RATING_LOOKUP):
+        params = player_ids[i:i + RATING_LOOKUP]
+        params += [None] * (RATING_LOOKUP - len(params))
+        ratings.add_rows(storage.fetchall(conn, 'player_ratings_of',
+                                          tuple(params)))
+    ratings.replay(*ratings.encode(matches))
+    _write(conn, ratings.rows(sorted(ratings.changed)))
+    storage.execute(conn, 'save_rating_state',
+                    (_track_skipped(conn, matches, last_match_id),
+                     matches[-1][1]))
+    return len(matches)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Maintain the Elo ratings in player_rating.')
+    parser.add_argument('command', choices=('rebuild', 'update'),
+                        help='replay every match, or rate only new ones')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            run = rebuild if args.command == 'rebuild' else update
+            rated = run(conn)
+    except mysql.connector.Error as err:
+        print(f'Rating failed: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    print(f'Rated {rated} matches in {time.perf_counter() - start:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
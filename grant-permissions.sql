@@ -5,4 +5,14 @@ CREATE USER 'appclient'@'localhost' IDENTIFIED BY 'clientpw';
 -- Can add more users or refine permissions
 GRANT ALL PRIVILEGES ON wtadb.* TO 'appadmin'@'localhost';
 GRANT SELECT ON wtadb.* TO 'appclient'@'localhost';
+-- Lets db_pool.py check how far a read replica is behind the primary
+GRANT REPLICATION CLIENT ON *.* TO 'appclient'@'localhost';
+-- Lets operations.player_profiles load a batch of profiles in one call
+GRANT EXECUTE ON PROCEDURE wtadb.player_profiles TO 'appclient'@'localhost';
+-- Lets operations.highest_ranked_player and bench_queries.py call the
+-- lookup functions
+GRANT EXECUTE ON FUNCTION wtadb.find_highest_ranked_player
+    TO 'appclient'@'localhost';
+GRANT EXECUTE ON FUNCTION wtadb.find_matchup_history
+    TO 'appclient'@'localhost';
 FLUSH PRIVILEGES;
@@ -0,0 +1,521 @@
+"""
+Asynchronous HTTP read API over the WTA database, for dashboards and other
+programs that need the fan queries without going through app.py.
+
+The server runs on asyncio and answers each request with JSON. Queries are
+blocking (mysql.connector), so they run on a thread pool no larger than
+the client connection pool, which keeps the number of concurrent queries
+bounded. Backpressure comes from a limit on the number of queries waiting
+to run (--max-pending): past it, new requests are turned away with
+503 Service Unavailable and a Retry-After header instead of queueing
+without bound. Concurrent identical requests are collapsed into one query
+whose result is shared by all of them, and results also go through the
+result cache, so a burst of dashboards asking for the same page costs one
+trip to MySQL.
+
+    $ python http_api.py --port 8080
+    $ curl 'http://localhost:8080/winners?tournament=Wimbledon'
+
+Endpoints (all GET):
+
+    /winners?tournament=NAME
+    /top20                        /top20?outside=1[&token=T][&page_size=N]
+    /surface?name=NAME
+    /country?country=USA[&token=T][&page_size=N]
+    /matchup?player1=NAME&player2=NAME
+    /highest-ranked?country=USA
+    /players?q=PARTIAL_NAME[&limit=N]
+    /rank?name=NAME[&date=YYYY-MM-DD]
+    /rankings[?date=YYYY-MM-DD][&limit=N]
+    /head-to-head?players=ID,ID,...     /head-to-head?pair=ID,ID[&pair=...]
+    /serve-stats?name=NAME[&by=career|season|surface]
+    /leaders?metric=M[&season=YYYY|&surface=S][&min_matches=N][&limit=N]
+    /rating?name=NAME
+    /top-rated[?surface=S][&limit=N][&min_matches=N]
+    /preview?player1=NAME&player2=NAME[&surface=S]
+    /score-stats?name=NAME
+    /set-scores
+    /profiles?players=ID,ID,...[&recent=N]
+    /health
+    /metrics                      /metrics?format=json
+
+Each answers {"columns": [...], "rows": [{column: value, ...}, ...],
+"next_token": T}. The listings of players outside the top 20 and by country
+are paged: pass next_token back as token= to get the next page. It is null
+on the last page, and for the other endpoints. Player names are resolved
+through name_search (/surface and /matchup also take the first_name= and
+last_name= parameters of earlier versions), and /players lists the closest
+names for autocompletion. /rank and /rankings read the rankings in effect
+on a date (by default today) from ranking_history. /serve-stats and
+/leaders are computed in process by analytics.py. /rating, /top-rated and
+/preview read the Elo ratings maintained by elo.py, and /score-stats and
+/set-scores the scores parsed by score_parser.py. /profiles returns the
+bio, rankings, surface counts, titles and recent matches of a batch of
+players (e.g. a draw) from a single procedure call. /metrics answers with the
+statement metrics of metrics.py in the Prometheus text format (or as JSON),
+and /health with the server's counters and, when reading from replicas
+(see db_pool.py), the lag and state of each replica.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import sys
+import traceback
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+import mysql.connector
+
+import db_pool
+import metrics
+import operations
+import paging
+import storage
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+# Queries allowed to wait for a worker thread before requests are refused
+DEFAULT_MAX_PENDING = 256
+MAX_PAGE_SIZE = 1000
+# Seconds an idle keep-alive connection may take to send its next request
+READ_TIMEOUT = 30
+MAX_HEADERS = 100
+
+
+class HTTPError(Exception):
+    """
+    Raised to answer a request with an error status.
+    """
+
+    def __init__(self, status, message=None):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+# ----------------------------------------------------------------------
+# Endpoints
+# ----------------------------------------------------------------------
+# Each takes the parsed query string and returns (columns, rows,
+# next_token); next_token is None for endpoints that aren't paged. They run
+# on the worker threads.
+def _param(query, name):
+    values = query.get(name)
+    if not values or not values[0]:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f'Missing parameter: {name}')
+    return values[0]
+
+
+def _flag(query, name):
+    return query.get(name, ['0'])[0].lower() not in ('0', 'false', 'no', '')
+
+
+def _page(role, name, params, query):
+    """
+    Returns one page of a paged query for the token and page_size in the
+    query string.
+    """
+    page_size = int(query.get('page_size', [paging.DEFAULT_PAGE_SIZE])[0])
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise HTTPError(HTTPStatus.BAD_REQUEST,
+                        f'page_size must be between 1 and {MAX_PAGE_SIZE}')
+    token = query.get('token', [None])[0]
+    return paging.fetch_page(role, name, params, token, page_size)
+
+
+def winners(query):
+    return (operations.COLUMNS['tournament_winners'],
+            operations.tournament_winners(_param(query, 'tournament')), None)
+
+
+def top20(query):
+    if _flag(query, 'outside'):
+        rows, token = _page(db_pool.CLIENT, 'players_outside_top_20_page',
+                            (), query)
+        return operations.COLUMNS['players_outside_top_20'], rows, token
+    return (operations.COLUMNS['players_inside_top_20'],
+            operations.players_inside_top_20(), None)
+
+
+def _name(query, name='name', suffix=''):
+    """
+    Returns a player name given as name=, or as first_name= and last_name=.
+    """
+    if name not in query and f'first_name{suffix}' in query:
+        return (f"{_param(query, f'first_name{suffix}')} "
+                f"{_param(query, f'last_name{suffix}')}")
+    return _param(query, name)
+
+
+def surface(query):
+    return (operations.COLUMNS['surface_count'],
+            operations.surface_count(_name(query)), None)
+
+
+def country(query):
+    rows, token = _page(db_pool.CLIENT, 'players_by_country_page',
+                        (_param(query, 'country'), ), query)
+    return operations.COLUMNS['players_by_country'], rows, token
+
+
+def matchup(query):
+    return (operations.COLUMNS['matchup_history'],
+            operations.matchup_history(_name(query, 'player1', '1'),
+                                       _name(query, 'player2', '2')), None)
+
+
+def _date(query):
+    return query.get('date', [datetime.date.today().isoformat()])[0]
+
+
+def rank(query):
+    return (operations.COLUMNS['player_rank_on'],
+            operations.player_rank_on(_name(query), _date(query)), None)
+
+
+def rankings(query):
+    return (operations.COLUMNS['top_ranked_on'],
+            operations.top_ranked_on(_date(query),
+                                     query.get('limit', ['20'])[0]), None)
+
+
+def players(query):
+    return (operations.COLUMNS['find_players'],
+            operations.find_players(_param(query, 'q'),
+                                    query.get('limit', ['10'])[0]), None)
+
+
+def highest_ranked(query):
+    return (operations.COLUMNS['highest_ranked_player'],
+            operations.highest_ranked_player(_param(query, 'country')), None)
+
+
+def head_to_head(query):
+    if 'pair' in query:
+        pairs = []
+        for value in query['pair']:
+            pair = value.split(',')
+            if len(pair) != 2:
+                raise HTTPError(HTTPStatus.BAD_REQUEST,
+                                'pair must be two player IDs, e.g. '
+                                'pair=200033,201458')
+            pairs.append(pair)
+        return (operations.COLUMNS['head_to_head'],
+                operations.head_to_head(pairs), None)
+    return (operations.COLUMNS['head_to_head'],
+            operations.draw_head_to_head(_param(query, 'players').split(',')),
+            None)
+
+
+def serve_stats(query):
+    return (operations.COLUMNS['serve_stats'],
+            operations.serve_stats(_name(query),
+                                   query.get('by', ['career'])[0]), None)
+
+
+def leaders(query):
+    return (operations.COLUMNS['stat_leaders'],
+            operations.stat_leaders(_param(query, 'metric'),
+                                    query.get('season', [None])[0],
+                                    query.get('surface', [None])[0],
+                                    query.get('min_matches', ['10'])[0],
+                                    query.get('limit', ['10'])[0]), None)
+
+
+def rating(query):
+    return (operations.COLUMNS['player_rating'],
+            operations.player_rating(_name(query)), None)
+
+
+def top_rated(query):
+    return (operations.COLUMNS['top_rated'],
+            operations.top_rated(query.get('surface', [None])[0],
+                                 query.get('limit', ['20'])[0],
+                                 query.get('min_matches', ['10'])[0]), None)
+
+
+def preview(query):
+    return (operations.COLUMNS['match_preview'],
+            operations.match_preview(_name(query, 'player1', '1'),
+                                     _name(query, 'player2', '2'),
+                                     query.get('surface', [None])[0]), None)
+
+
+def score_stats(query):
+    return (operations.COLUMNS['score_stats'],
+            operations.score_stats(_name(query)), None)
+
+
+def set_scores(query):
+    return operations.COLUMNS['set_scores'], operations.set_scores(), None
+
+
+def profiles(query):
+    return (operations.COLUMNS['player_profiles'],
+            operations.player_profiles(
+                _param(query, 'players').split(','),
+                query.get('recent', [operations.RECENT_MATCHES])[0]), None)
+
+
+ENDPOINTS = {
+    '/winners': winners,
+    '/top20': top20,
+    '/surface': surface,
+    '/country': country,
+    '/matchup': matchup,
+    '/highest-ranked': highest_ranked,
+    '/players': players,
+    '/rank': rank,
+    '/rankings': rankings,
+    '/head-to-head': head_to_head,
+    '/serve-stats': serve_stats,
+    '/leaders': leaders,
+    '/rating': rating,
+    '/top-rated': top_rated,
+    '/preview': preview,
+    '/score-stats': score_stats,
+    '/set-scores': set_scores,
+    '/profiles': profiles,
+}
+
+
+# ----------------------------------------------------------------------
+# Server
+# ----------------------------------------------------------------------
+def _response(status, body, keep_alive):
+    """
+    Returns the bytes of an HTTP response with a JSON body, or a plain text
+    one if the body is a string.
+    """
+    if isinstance(body, str):
+        data = body.encode()
+        content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    else:
+        data = json.dumps(body, default=str).encode()
+        content_type = 'application/json'
+    head = (f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(data)}\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n')
+    if status == HTTPStatus.SERVICE_UNAVAILABLE:
+        head += 'Retry-After: 1\r\n'
+    return (head + '\r\n').encode() + data
+
+
+class ReadAPI:
+    """
+    Serves the endpoints above over HTTP/1.1 (with keep-alive), running
+    their queries on a bounded thread pool.
+    """
+
+    def __init__(self, workers=None, max_pending=DEFAULT_MAX_PENDING):
+        # More threads than pooled connections would only wait on the pool
+        self.workers = workers or int(db_pool.get_config()['pool_size'])
+        self.max_pending = max_pending
+        self.executor = ThreadPoolExecutor(self.workers,
+                                           thread_name_prefix='http_api')
+        # (path, query) -> future of the query being run for it
+        self._in_flight = {}
+        self._pending = 0
+        self.requests = 0
+        self.queries = 0
+        self.collapsed = 0
+        self.rejected = 0
+
+    def stats(self):
+        return {'requests': self.requests, 'queries': self.queries,
+                'collapsed': self.collapsed, 'rejected': self.rejected,
+                'pending': self._pending, 'workers': self.workers}
+
+    async def query(self, path, query):
+        """
+        Runs the endpoint for the path on a worker thread, or waits for the
+        identical request already running.
+        """
+        key = (path, tuple(sorted((name, tuple(values))
+                                  for name, values in query.items())))
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.collapsed += 1
+            return await asyncio.shield(future)
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPError(HTTPStatus.SERVICE_UNAVAILABLE,
+                            'Too many requests in progress, try again later')
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._in_flight[key] = future
+        self._pending += 1
+        self.queries += 1
+        try:
+            result = await loop.run_in_executor(self.executor,
+                                                ENDPOINTS[path], query)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as err:
+            future.set_exception(err)
+            # The error is reported by the caller; don't warn that nobody
+            # else retrieved it
+            future.exception()
+            raise
+        finally:
+            self._pending -= 1
+            del self._in_flight[key]
+
+    async def respond(self, method, target):
+        """
+        Returns the status and JSON body (or text, for /metrics) answering a
+        request. Unexpected errors are logged and answered with 500, so
+        that no request is left without a response.
+        """
+        try:
+            return await self._respond(method, target)
+        except Exception:
+            print(f'{target}: unexpected error', file=sys.stderr)
+            traceback.print_exc()
+            return (HTTPStatus.INTERNAL_SERVER_ERROR,
+                    {'error': 'Internal server error'})
+
+    async def _respond(self, method, target):
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/health':
+            replicas = db_pool.replica_status()
+            if replicas is None:
+                return HTTPStatus.OK, {'status': 'ok', **self.stats()}
+            return HTTPStatus.OK, {'status': 'ok', **self.stats(), **replicas}
+        if url.path == '/metrics':
+            if urllib.parse.parse_qs(url.query).get('format') == ['json']:
+                return HTTPStatus.OK, metrics.metrics.snapshot()
+            return HTTPStatus.OK, metrics.metrics.prometheus()
+        if url.path not in ENDPOINTS:
+            return HTTPStatus.NOT_FOUND, {'error': 'Not found'}
+        if method != 'GET':
+            return (HTTPStatus.METHOD_NOT_ALLOWED,
+                    {'error': 'Only GET is supported'})
+        query = urllib.parse.parse_qs(url.query)
+        try:
+            columns, rows, token = await self.query(url.path, query)
+        except HTTPError as err:
+            return err.status, {'error': str(err)}
+        except ValueError as err:
+            # Includes operations.InvalidInput, bad page sizes and tokens
+            return HTTPStatus.BAD_REQUEST, {'error': str(err)}
+        except db_pool.PoolError:
+            return (HTTPStatus.SERVICE_UNAVAILABLE,
+                    {'error': 'No database connection available'})
+        except mysql.connector.Error as err:
+            print(f'{target}: {err}', file=sys.stderr)
+            return (HTTPStatus.INTERNAL_SERVER_ERROR,
+                    {'error': 'Database error'})
+        return HTTPStatus.OK, {
+            'columns': columns,
+            'rows': [dict(zip(columns, row)) for row in rows],
+            'next_token': token}
+
+    async def _read_request(self, reader):
+        """
+        Reads one request from a connection and returns its method, target,
+        version and headers, or None if the client closed the connection.
+        """
+        line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+        if not line:
+            return None
+        parts = line.decode('latin-1').split()
+        if len(parts) != 3:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, 'Malformed request line')
+        method, target, version = parts
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            if len(headers) >= MAX_HEADERS:
+                raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        # Requests are all GETs, but skip any body so the next request on
+        # the connection is read from the right place
+        length = int(headers.get('content-length', 0) or 0)
+        if length:
+            await reader.readexactly(length)
+        return method, target, version, headers
+
+    async def handle(self, reader, writer):
+        """
+        Serves the requests on one client connection.
+        """
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HTTPError as err:
+                    writer.write(_response(err.status, {'error': str(err)},
+                                           False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+                method, target, version, headers = request
+                self.requests += 1
+                connection = headers.get('connection', '').lower()
+                keep_alive = (connection == 'keep-alive'
+                              or version == 'HTTP/1.1' and connection != 'close')
+                status, body = await self.respond(method, target)
+                writer.write(_response(status, body, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError, ValueError):
+            # Disconnects, idle timeouts, and lines longer than the stream
+            # limit; nothing more can be sent
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+
+async def serve(api, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await asyncio.start_server(api.handle, host, port)
+    async with server:
+        print(f'Serving on http://{host}:{port} with {api.workers} workers')
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve the WTA database fan queries over HTTP.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int,
+                        help='query threads (default: the client pool size)')
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING,
+                        help='queries that may wait for a thread before '
+                             'requests get 503 responses')
+    args = parser.parse_args(argv)
+
+    try:
+        with storage.connection(db_pool.CLIENT):
+            pass
+    except mysql.connector.Error as err:
+        print(f'Could not connect to the database: {err}', file=sys.stderr)
+        return 1
+    api = ReadAPI(args.workers, args.max_pending)
+    try:
+        asyncio.run(serve(api, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        api.close()
+        storage.close_all()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
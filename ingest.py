@@ -0,0 +1,415 @@
+"""
+Non-interactive bulk ingest of match results in Jeff Sackmann's tennis_wta
+format (https://github.com/JeffSackmann/tennis_wta), e.g. a season's
+wta_matches_2023.csv, or the same records as JSON lines.
+
+Rather than calling the input_match_results procedure (and committing) once
+per match like the admin prompt does, the file is streamed in batches: each
+batch is validated against the local key index (no validation queries),
+written with one multi-row INSERT, and committed every --commit-size rows.
+Finals (round F) are routed into tournament_history. Progress and overall
+rows per second are reported as the file is read.
+
+With --set-based, ranking.tournaments_played is maintained once per commit
+(apply_tournaments_played) instead of by the insert trigger for every row.
+Each batch's scores are parsed into match_score and match_set (see
+score_parser.py) in the same transaction. The Elo ratings are brought up
+to date with the new matches at the end of each file.
+
+Usage:
+
+    $ python ingest.py wta_matches_2023.csv [more files ...]
+        [--batch-size 1000] [--commit-size 10000] [--add-tournaments]
+        [--set-based] [--rejects rejects.csv] [--dry-run]
+
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import sys
+import time
+
+import mysql.connector
+
+import db_pool
+import elo
+import key_index
+import result_cache
+import score_parser
+import statements
+
+# Columns of match_result filled from a Sackmann match record, in INSERT
+# order. match_id is left to AUTO_INCREMENT.
+MATCH_COLUMNS = (
+    'tournament_id', 'tournament_date', 'score', 'minutes',
+    'winner_id', 'winner_aces', 'winner_bp_saved', 'winner_dfs',
+    'loser_id', 'loser_aces', 'loser_bp_saved', 'loser_dfs',
+)
+
+# Sackmann column for each match_result statistic column.
+STAT_COLUMNS = {
+    'winner_aces': 'w_ace',
+    'winner_bp_saved': 'w_bpSaved',
+    'winner_dfs': 'w_df',
+    'loser_aces': 'l_ace',
+    'loser_bp_saved': 'l_bpSaved',
+    'loser_dfs': 'l_df',
+}
+
+# Limits from setup.sql that a record must fit in.
+MAX_TOURNAMENT_ID = 4
+MAX_TOURNAMENT_NAME = 25
+MAX_SCORE = 20
+SURFACES = ('Clay', 'Hard', 'Grass')
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_COMMIT_SIZE = 10000
+
+statements.register('ingest_match', f"""
+    INSERT INTO match_result ({', '.join(MATCH_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(MATCH_COLUMNS))})""",
+                    writes=('match_result', 'ranking',
+                            'player_surface_stats', 'head_to_head'))
+
+# A final is linked to the newest match with its natural key, which is the
+# one just inserted by this ingest (match_id >= the batch's first ID).
+statements.register('ingest_final', """
+    INSERT INTO tournament_history
+    SELECT tournament_id, YEAR(tournament_date), winner_id, loser_id,
+        match_id
+    FROM match_result
+    WHERE tournament_id = %s
+        AND tournament_date = %s
+        AND winner_id = %s
+        AND loser_id = %s
+        AND match_id >= %s
+    ORDER BY match_id DESC
+    LIMIT 1
+    ON DUPLICATE KEY UPDATE winner_id = VALUES(winner_id),
+                            finalist_id = VALUES(finalist_id),
+                            match_id = VALUES(match_id)""",
+                    writes=('tournament_history', ))
+
+statements.register('ingest_tournament', """
+    INSERT IGNORE INTO tournament
+    VALUES (%s, %s, %s, %s, %s)""",
+                    writes=('tournament', ))
+
+
+class RejectedRecord(ValueError):
+    """
+    Raised when a match record can't be mapped onto the match_result schema.
+    """
+
+
+# ----------------------------------------------------------------------
+# Reading and Mapping Records
+# ----------------------------------------------------------------------
+def read_records(path):
+    """
+    Yields each match record in a Sackmann CSV file, or a JSON lines file
+    (one object with the same keys per line) if the name ends in .jsonl.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(f)
+
+
+def _int_or_none(value):
+    """
+    Converts a Sackmann numeric field (which may be blank or written as a
+    float, e.g. 7.0) to an int, or None if it is blank.
+    """
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        raise RejectedRecord(f'not a number: {value!r}')
+
+
+def map_tournament_id(record):
+    """
+    Returns the match_result tournament_id for a Sackmann tourney_id, which
+    is prefixed with the year (e.g. 2023-580 -> 580).
+    """
+    tourney_id = str(record.get('tourney_id') or '').split('-', 1)[-1]
+    if tourney_id.isdecimal():
+        tourney_id = str(int(tourney_id))
+    if not tourney_id or len(tourney_id) > MAX_TOURNAMENT_ID:
+        raise RejectedRecord(f'unsupported tourney_id: {tourney_id!r}')
+    return tourney_id
+
+
+def map_date(record):
+    """
+    Returns the tourney_date (YYYYMMDD) as a date.
+    """
+    try:
+        return datetime.datetime.strptime(
+            str(record.get('tourney_date')), '%Y%m%d').date()
+    except ValueError:
+        raise RejectedRecord(
+            f'bad tourney_date: {record.get("tourney_date")!r}')
+
+
+def map_match(record):
+    """
+    Maps a Sackmann match record to a tuple of MATCH_COLUMNS values.
+    """
+    score = str(record.get('score') or '').strip()
+    if not score or len(score) > MAX_SCORE:
+        raise RejectedRecord(f'unsupported score: {score!r}')
+    values = {
+        'tournament_id': map_tournament_id(record),
+        'tournament_date': map_date(record),
+        'score': score,
+        # minutes is NOT NULL in match_result but often blank in the
+        # source data, so unknown durations are stored as 0
+        'minutes': _int_or_none(record.get('minutes')) or 0,
+        'winner_id': str(record.get('winner_id') or '').strip(),
+        'loser_id': str(record.get('loser_id') or '').strip(),
+    }
+    for column, source in STAT_COLUMNS.items():
+        values[column] = _int_or_none(record.get(source))
+    return tuple(values[column] for column in MATCH_COLUMNS)
+
+
+def map_tournament(record):
+    """
+    Maps a Sackmann match record to a row for the tournament table, for
+    tournaments that are not in the database yet.
+    """
+    surface = record.get('surface')
+    if surface not in SURFACES:
+        raise RejectedRecord(f'unsupported surface: {surface!r}')
+    return (map_tournament_id(record),
+            str(record.get('tourney_name'))[:MAX_TOURNAMENT_NAME],
+            surface,
+            _int_or_none(record.get('draw_size')) or 0,
+            str(record.get('tourney_level') or '')[:1])
+
+
+# ----------------------------------------------------------------------
+# Ingest
+# ----------------------------------------------------------------------
+class IngestStats:
+    """
+    Running totals for an ingest, used for progress reports.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.inserted = 0
+        self.finals = 0
+        self.tournaments = 0
+        self.rejected = {}
+
+    def reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.inserted / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f'{self.read} read, {self.inserted} inserted '
+                f'({self.finals} finals, {self.tournaments} new tournaments), '
+                f'{sum(self.rejected.values())} rejected; '
+                f'{self.rows_per_second():.0f} rows/s')
+
+
+class Ingest:
+    """
+    Streams match records into the database in batches. Set dry_run to
+    validate and map records without writing anything.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE,
+                 commit_size=DEFAULT_COMMIT_SIZE, add_tournaments=False,
+                 rejects=None, dry_run=False, set_based=False):
+        self.batch_size = batch_size
+        self.commit_size = max(commit_size, batch_size)
+        self.add_tournaments = add_tournaments
+        self.set_based = set_based
+        self.rejects = rejects
+        self.dry_run = dry_run
+        self.stats = IngestStats()
+        self._new_tournaments = set()
+        # Range of match IDs inserted since the last commit
+        self._first_id = None
+        self._last_id = None
+
+    def _known(self, table, attribute, value):
+        """
+        Checks a key against the local index only; a bulk ingest makes no
+        validation queries.
+        """
+        return key_index.index.contains(table, attribute, value,
+                                        verify=False)
+
+    def _validate(self, record, row, conn):
+        """
+        Raises RejectedRecord if the mapped row references a player or
+        tournament that is not in the database. Unknown tournaments are
+        created first when add_tournaments is set.
+        """
+        tournament_id = row[0]
+        if (tournament_id not in self._new_tournaments
+                and not self._known('tournament', 'tournament_id',
+                                    tournament_id)):
+            if not self.add_tournaments:
+                raise RejectedRecord('unknown tournament')
+            tournament = map_tournament(record)
+            if not self.dry_run:
+                statements.execute(conn, 'ingest_tournament', tournament)
+            self._new_tournaments.add(tournament_id)
+            self.stats.tournaments += 1
+        for player_id in (row[4], row[8]):
+            if not self._known('player', 'player_id', player_id):
+                raise RejectedRecord('unknown player')
+
+    def _write_batch(self, conn, rows, finals):
+        """
+        Inserts one batch of matches, with their parsed scores, and links
+        its finals into tournament_history.
+        """
+        if self.dry_run:
+            return
+        cursor = statements.executemany(conn, 'ingest_match', rows)
+        # lastrowid is the first AUTO_INCREMENT ID of a multi-row INSERT,
+        # whose rows get consecutive IDs
+        first_id = cursor.lastrowid
+        if self._first_id is None:
+            self._first_id = first_id
+        self._last_id = first_id + len(rows) - 1
+        score_rows, set_rows = score_parser.rows(
+            (first_id + i, row[2]) for i, row in enumerate(rows))
+        statements.executemany(conn, 'insert_match_score', score_rows)
+        if set_rows:
+            statements.executemany(conn, 'insert_match_set', set_rows)
+        if finals:
+            statements.executemany(
+                conn, 'ingest_final',
+                [(row[0], row[1], row[4], row[8], first_id)
+                 for row in finals])
+
+    def _commit(self, conn):
+        """
+        Commits the matches inserted so far, first bringing
+        tournaments_played up to date for them in set-based mode.
+        """
+        if self.set_based and self._first_id is not None:
+            statements.execute(conn, 'apply_tournaments_played',
+                               (self._first_id, self._last_id))
+        conn.commit()
+        self._first_id = self._last_id = None
+        for name in ('ingest_tournament', 'ingest_match', 'ingest_final',
+                     'insert_match_score', 'insert_match_set'):
+            result_cache.invalidate_for(name)
+
+    def run(self, records, conn):
+        """
+        Ingests an iterable of Sackmann match records over the given
+        connection, committing every commit_size rows.
+        """
+        if self.set_based and not self.dry_run:
+            statements.execute(conn, 'defer_tournaments_played', (1, ))
+        try:
+            self._run(iter(records), conn)
+        finally:
+            if self.set_based and not self.dry_run:
+                # The connection goes back to the pool, so don't leave the
+                # trigger switched off for its next user
+                statements.execute(conn, 'defer_tournaments_played', (0, ))
+        if self._new_tournaments:
+            key_index.index.invalidate('tournament')
+        if not self.dry_run:
+            # Rate the new matches (see elo.update)
+            elo.update(conn)
+        return self.stats
+
+    def _run(self, records, conn):
+        uncommitted = 0
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                break
+            rows, finals = [], []
+            for record in batch:
+                self.stats.read += 1
+                try:
+                    row = map_match(record)
+                    self._validate(record, row, conn)
+                except RejectedRecord as err:
+                    self.stats.reject(str(err))
+                    if self.rejects:
+                        self.rejects.write(
+                            json.dumps({'reason': str(err), **record}) + '\n')
+                    continue
+                rows.append(row)
+                if record.get('round') == 'F':
+                    finals.append(row)
+            if rows:
+                self._write_batch(conn, rows, finals)
+                self.stats.inserted += len(rows)
+                self.stats.finals += len(finals)
+                uncommitted += len(rows)
+            if uncommitted >= self.commit_size:
+                self._commit(conn)
+                uncommitted = 0
+                print(f'  {self.stats.summary()}', file=sys.stderr)
+        self._commit(conn)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Bulk-load Sackmann tennis_wta match files into wtadb.')
+    parser.add_argument('files', nargs='+',
+                        help='match files (.csv, or .jsonl for JSON lines)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per multi-row INSERT')
+    parser.add_argument('--commit-size', type=int,
+                        default=DEFAULT_COMMIT_SIZE,
+                        help='rows per transaction')
+    parser.add_argument('--add-tournaments', action='store_true',
+                        help='create tournaments missing from the database')
+    parser.add_argument('--set-based', action='store_true',
+                        help='update tournaments_played once per commit '
+                             'instead of once per row')
+    parser.add_argument('--rejects',
+                        help='write rejected records (JSON lines) here')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='validate and map records without writing')
+    args = parser.parse_args(argv)
+
+    rejects = open(args.rejects, 'w') if args.rejects else None
+    ingest = Ingest(args.batch_size, args.commit_size, args.add_tournaments,
+                    rejects, args.dry_run, args.set_based)
+    try:
+        with db_pool.connection(db_pool.ADMIN) as conn:
+            for path in args.files:
+                print(f'Ingesting {path}...', file=sys.stderr)
+                ingest.run(read_records(path), conn)
+    except mysql.connector.Error as err:
+        print(f'Ingest failed: {err}', file=sys.stderr)
+        return 1
+    finally:
+        if rejects:
+            rejects.close()
+        db_pool.close_all()
+    print(ingest.stats.summary())
+    for reason, count in sorted(ingest.stats.rejected.items()):
+        print(f'  rejected ({reason}): {count}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
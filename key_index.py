@@ -0,0 +1,186 @@
+"""
+In-memory index of the keys that admin input is validated against:
+player.player_id, tournament.tournament_id and the distinct player.country
+values.
+
+The index is loaded once (three small queries) and then answers membership
+checks locally, so validating a prompt or a whole bulk ingest doesn't cost
+a database round trip per value. Numeric IDs are kept as a sorted array of
+unsigned ints and searched with bisect, which is far smaller than a set of
+strings for the full WTA player file.
+
+Values missing from the index are double-checked against the database
+(unless verify=False) before being rejected, since another session may have
+added them since the index was loaded. Admin writes that change one of the
+indexed columns should call invalidate(), and the whole index is reloaded
+after max_age seconds regardless.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import db_pool
+import statements
+import storage
+
+# Indexed (table, attribute) pairs, mapped to the statement that loads them.
+INDEXED = {
+    ('player', 'player_id'): 'index_player_ids',
+    ('tournament', 'tournament_id'): 'index_tournament_ids',
+    ('player', 'country'): 'index_countries',
+}
+
+# Columns MySQL compares case-insensitively (the default collation), so that
+# e.g. 'usa' is accepted as a country just like it was by a WHERE clause.
+CASE_INSENSITIVE = {('player', 'country')}
+
+statements.register('index_player_ids',
+                    'SELECT player_id FROM player ORDER BY player_id')
+statements.register('index_tournament_ids',
+                    'SELECT tournament_id FROM tournament')
+statements.register('index_countries',
+                    'SELECT DISTINCT country FROM player')
+
+
+def _is_canonical_int(value):
+    """
+    Returns True if the string is a non-negative integer without leading
+    zeros, so it survives a round trip through int().
+    """
+    return value.isdecimal() and str(int(value)) == value
+
+
+def _normalize(key, value):
+    """
+    Returns the form of a value that is stored in and looked up from the
+    key set for the given column.
+    """
+    value = str(value)
+    if key in CASE_INSENSITIVE:
+        return value.upper()
+    return value
+
+
+class KeySet:
+    """
+    A read-only set of key values. Keys that are all plain integers (such
+    as player IDs) are stored as a sorted array of unsigned ints; anything
+    else falls back to a frozenset of strings.
+    """
+
+    def __init__(self, values):
+        values = [str(value) for value in values]
+        if values and all(_is_canonical_int(value) for value in values):
+            self._ints = array('Q', sorted(int(value) for value in values))
+            self._strs = None
+        else:
+            self._ints = None
+            self._strs = frozenset(values)
+
+    def __contains__(self, value):
+        value = str(value)
+        if self._strs is not None:
+            return value in self._strs
+        if not _is_canonical_int(value):
+            return False
+        key = int(value)
+        i = bisect_left(self._ints, key)
+        return i < len(self._ints) and self._ints[i] == key
+
+    def __len__(self):
+        if self._strs is not None:
+            return len(self._strs)
+        return len(self._ints)
+
+    def with_value(self, value):
+        """
+        Returns a copy of this set that also contains the given value.
+        """
+        if self._strs is not None:
+            return KeySet(self._strs | {str(value)})
+        return KeySet([*self._ints, value])
+
+
+class KeyIndex:
+    """
+    The loaded key sets for every (table, attribute) pair in INDEXED.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._sets = {}
+        self._loaded_at = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db_checks = 0
+
+    def covers(self, table, attribute):
+        """
+        Returns True if the given column is kept in the index.
+        """
+        return (table, attribute) in INDEXED
+
+    def _load(self, key, role):
+        """
+        Loads one key set from the database.
+        """
+        with storage.connection(role) as conn:
+            rows = storage.fetchall(conn, INDEXED[key])
+        keys = KeySet(_normalize(key, row[0]) for row in rows)
+        self._sets[key] = keys
+        self._loaded_at[key] = time.monotonic()
+        return keys
+
+    def _get(self, key, role):
+        """
+        Returns the key set for a column, (re)loading it if it has been
+        invalidated or is older than max_age.
+        """
+        with self._lock:
+            keys = self._sets.get(key)
+            if (keys is None or time.monotonic() - self._loaded_at[key]
+                    > self.max_age):
+                keys = self._load(key, role)
+            return keys
+
+    def contains(self, table, attribute, value, role=db_pool.ADMIN,
+                 verify=True):
+        """
+        Returns True if the value exists in the given indexed column. Values
+        not in the index are looked up in the database when verify is True,
+        and added to the index if they turn out to exist.
+        """
+        key = (table, attribute)
+        value = _normalize(key, value)
+        if value in self._get(key, role):
+            self.hits += 1
+            return True
+        self.misses += 1
+        if not verify:
+            return False
+        self.db_checks += 1
+        name = statements.EXISTS_STATEMENTS[key].name
+        with storage.connection(role) as conn:
+            found = bool(storage.fetchall(conn, name, (value, )))
+        if found:
+            with self._lock:
+                if key in self._sets:
+                    self._sets[key] = self._sets[key].with_value(value)
+        return found
+
+    def invalidate(self, table=None, attribute=None):
+        """
+        Drops the given column's key set (or every key set, if no column is
+        given) so that it is reloaded on next use.
+        """
+        with self._lock:
+            for key in list(self._sets):
+                if table in (None, key[0]) and attribute in (None, key[1]):
+                    del self._sets[key]
+                    del self._loaded_at[key]
+
+
+# The index shared by the whole application.
+index = KeyIndex()
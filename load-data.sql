@@ -15,4 +15,8 @@ LOAD DATA LOCAL INFILE 'match_result.csv' INTO TABLE match_result
 FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n' IGNORE 1 ROWS;
 
 LOAD DATA LOCAL INFILE 'tournament_history.csv' INTO TABLE tournament_history
-FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n' IGNORE 1 ROWS;
\ No newline at end of file
+FIELDS TERMINATED BY ',' ENCLOSED BY '"' LINES TERMINATED BY '\n' IGNORE 1 ROWS;
+
+-- LOAD DATA doesn't parse the scores: afterwards, fill match_score and
+-- match_set with
+--     $ python score_parser.py backfill
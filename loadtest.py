@@ -0,0 +1,470 @@
+"""
+Load test of the application's operations (operations.py) under
+contention, with simulated fans and admins.
+
+Each worker is a thread with its own pooled connections that repeatedly
+picks an operation from the --mix (weights per operation), runs it with
+parameters drawn from the data, and then waits a think time (exponentially
+distributed around --think seconds) before the next one. Workers are
+started evenly over --ramp-up seconds and stop after --duration seconds;
+with --processes, the workers are split over that many processes, e.g. to
+take the client side's GIL out of the measurement. The result cache is
+disabled unless --cache is given, so every read reaches the database.
+
+Only operations started after the ramp-up are counted. For each operation
+the run reports its throughput, its p50/p95/p99 latency, and its errors,
+with deadlocks (ER_LOCK_DEADLOCK) and lock wait timeouts
+(ER_LOCK_WAIT_TIMEOUT) counted separately. On MySQL, the server's InnoDB
+row lock waits and the time spent in them over the run are reported too.
+
+Admin operations write: update_ranking and update_player write back the
+values a row already holds (still taking its locks), and input_match_result
+inserts new matches, so run it against a scratch copy of wtadb. --cleanup
+deletes the inserted matches afterward (rebuild the Elo ratings with
+`python elo.py rebuild` after that):
+
+    $ WTADB_DATABASE=wtadb_load python loadtest.py --workers 32 \\
+        --duration 60 --ramp-up 10 --think 0.1 --json before.json
+    $ WTADB_DATABASE=wtadb_load python loadtest.py --workers 32 \\
+        --mix players_inside_top_20=50,update_ranking=50
+
+"""
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import random
+import statistics
+import sys
+import threading
+import time
+
+import mysql.connector
+import mysql.connector.errorcode as errorcode
+
+import db_pool
+import operations
+import result_cache
+import statements
+import storage
+
+DEFAULT_MIX = {
+    'players_inside_top_20': 20,
+    'surface_count': 15,
+    'tournament_winners': 10,
+    'players_by_country': 10,
+    'highest_ranked_player': 5,
+    'matchup_history': 10,
+    'draw_head_to_head': 5,
+    'player_profiles': 5,
+    'update_ranking': 8,
+    'input_match_result': 7,
+    'update_player': 5,
+}
+DEFAULT_WORKERS = 16
+DEFAULT_DURATION = 30
+DEFAULT_THINK = 0.05
+# Players in the draws of draw_head_to_head and player_profiles
+DRAW_SIZE = 32
+
+# How each run of an operation ended
+OK = 'ok'
+ERROR = 'error'
+DEADLOCK = 'deadlock'
+LOCK_WAIT_TIMEOUT = 'lock_wait_timeout'
+INVALID = 'invalid'
+
+statements.register('loadtest_players', """
+    SELECT player_id, first_name, last_name, country, height
+    FROM player""",
+                    reads=('player', ))
+
+statements.register('loadtest_tournaments', """
+    SELECT tournament_id, tournament_name
+    FROM tournament""",
+                    reads=('tournament', ))
+
+statements.register('loadtest_top_20', """
+    SELECT `rank`, player_id, player_points, tournaments_played
+    FROM ranking
+    WHERE `rank` BETWEEN %s AND %s""",
+                    reads=('ranking', ))
+
+statements.register('loadtest_lock_status', """
+    SELECT VARIABLE_NAME, VARIABLE_VALUE
+    FROM performance_schema.global_status
+    WHERE VARIABLE_NAME IN ('Innodb_row_lock_waits',
+                            'Innodb_row_lock_time')""")
+
+statements.register('loadtest_delete_match',
+                    'DELETE FROM match_result WHERE match_id = %s',
+                    writes=('match_result', 'tournament_history', 'ranking',
+                            'player_surface_stats', 'head_to_head',
+                            'match_score', 'match_set'))
+
+
+# ----------------------------------------------------------------------
+# Operations
+# ----------------------------------------------------------------------
+def load_sample():
+    """
+    Returns the players, tournaments and top 20 rankings that operations
+    draw their parameters from.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        return {
+            'players': [tuple(row) for row in
+                        storage.fetchall(conn, 'loadtest_players')],
+            'tournaments': [tuple(row) for row in
+                            storage.fetchall(conn, 'loadtest_tournaments')],
+            'top_20': [tuple(row) for row in storage.fetchall(
+                conn, 'loadtest_top_20',
+                (operations.MIN_RANK, operations.MAX_RANK))],
+        }
+
+
+def _name(player):
+    return f'{player[1]} {player[2]}'
+
+
+def _draw(rng, sample):
+    return [player[0] for player in rng.sample(
+        sample['players'], min(DRAW_SIZE, len(sample['players'])))]
+
+
+def _update_ranking(rng, sample):
+    if not sample['top_20']:
+        raise operations.InvalidInput('No ranks to update.')
+    operations.update_ranking(*rng.choice(sample['top_20']))
+
+
+def _input_match_result(rng, sample):
+    winner, loser = rng.sample(sample['players'], 2)
+    return operations.input_match_result(
+        False, rng.choice(sample['tournaments'])[0], '2023-01-16', '6-4 6-4',
+        rng.randint(50, 200), winner[0], loser[0])
+
+
+def _update_player(rng, sample):
+    player = rng.choice(sample['players'])
+    operations.update_player(player[0], 'height', player[4])
+
+
+# Operation name -> (fan or admin, function of (rng, sample)). Only
+# input_match_result returns anything: the ID of the match it inserted.
+OPERATIONS = {
+    'players_inside_top_20': (
+        'fan', lambda rng, s: operations.players_inside_top_20()),
+    'surface_count': (
+        'fan', lambda rng, s: operations.surface_count(
+            _name(rng.choice(s['players'])))),
+    'tournament_winners': (
+        'fan', lambda rng, s: operations.tournament_winners(
+            rng.choice(s['tournaments'])[1])),
+    'players_by_country': (
+        'fan', lambda rng, s: list(operations.players_by_country(
+            rng.choice(s['players'])[3]))),
+    'highest_ranked_player': (
+        'fan', lambda rng, s: operations.highest_ranked_player(
+            rng.choice(s['players'])[3])),
+    'matchup_history': (
+        'fan', lambda rng, s: operations.matchup_history(
+            *(_name(player) for player in rng.sample(s['players'], 2)))),
+    'draw_head_to_head': (
+        'fan', lambda rng, s: operations.draw_head_to_head(_draw(rng, s))),
+    'player_profiles': (
+        'fan', lambda rng, s: operations.player_profiles(_draw(rng, s))),
+    'update_ranking': ('admin', _update_ranking),
+    'input_match_result': ('admin', _input_match_result),
+    'update_player': ('admin', _update_player),
+}
+
+
+def parse_mix(value):
+    """
+    Parses a mix given as name=weight pairs separated by commas, e.g.
+    'players_inside_top_20=50,update_ranking=50'.
+    """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(
+                f'unknown operation {name!r}; choose from '
+                f'{", ".join(OPERATIONS)}')
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f'invalid weight for {name}: {weight!r}') from None
+        if mix[name] < 0:
+            raise argparse.ArgumentTypeError(
+                f'invalid weight for {name}: {weight!r}')
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError('the mix has no operations')
+    return mix
+
+
+def outcome(err):
+    """
+    Returns how a run of an operation that raised err ended.
+    """
+    if isinstance(err, operations.InvalidInput):
+        return INVALID
+    if err.errno == errorcode.ER_LOCK_DEADLOCK:
+        return DEADLOCK
+    if err.errno == errorcode.ER_LOCK_WAIT_TIMEOUT:
+        return LOCK_WAIT_TIMEOUT
+    return ERROR
+
+
+# ----------------------------------------------------------------------
+# Workers
+# ----------------------------------------------------------------------
+def worker(seed, mix, sample, start_at, end_at, think, runs, match_ids):
+    """
+    Runs operations from the mix from start_at until end_at (time.time()
+    values), appending (operation, started, seconds, outcome) to runs.
+    """
+    rng = random.Random(seed)
+    names, weights = list(mix), list(mix.values())
+    time.sleep(max(0, start_at - time.time()))
+    while True:
+        started = time.time()
+        if started >= end_at:
+            break
+        name = rng.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            result = OPERATIONS[name][1](rng, sample)
+            ended = OK
+        except (operations.InvalidInput, mysql.connector.Error) as err:
+            result = None
+            ended = outcome(err)
+        runs.append((name, started, time.perf_counter() - start, ended))
+        if name == 'input_match_result' and ended == OK:
+            match_ids.append(result)
+        if think:
+            time.sleep(min(rng.expovariate(1 / think),
+                           max(0, end_at - time.time())))
+
+
+def run_workers(first, count, total, settings, sample):
+    """
+    Runs workers first to first + count - 1 of total in this process and
+    returns their runs and the IDs of the matches they inserted. Worker i
+    starts ramp_up * i / total seconds after the run's start.
+    """
+    config = dict(db_pool.get_config())
+    config['pool_size'] = str(max(count, int(config['pool_size'])))
+    db_pool.configure(config)
+    if not settings['cache']:
+        result_cache.cache = result_cache.ResultCache(max_entries=0)
+    runs, match_ids = [], []
+    threads = [
+        threading.Thread(target=worker, args=(
+            settings['seed'] + i, settings['mix'], sample,
+            settings['start_at'] + settings['ramp_up'] * i / total,
+            settings['end_at'], settings['think'], runs, match_ids))
+        for i in range(first, first + count)
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        storage.close_all()
+    return runs, match_ids
+
+
+def run(workers, processes, settings, sample):
+    """
+    Runs the workers, split over the given number of processes, and
+    returns all their runs and inserted match IDs.
+    """
+    if processes <= 1:
+        return run_workers(0, workers, workers, settings, sample)
+    # Each process opens its own connections; none are inherited
+    storage.close_all()
+    shares = [workers // processes + (i < workers % processes)
+              for i in range(processes)]
+    runs, match_ids = [], []
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=context) as executor:
+        futures = [executor.submit(run_workers, sum(shares[:i]), share,
+                                   workers, settings, sample)
+                   for i, share in enumerate(shares) if share]
+        for future in futures:
+            found, ids = future.result()
+            runs.extend(found)
+            match_ids.extend(ids)
+    return runs, match_ids
+
+
+# ----------------------------------------------------------------------
+# Reporting
+# ----------------------------------------------------------------------
+def lock_status():
+    """
+    Returns the server's InnoDB row lock counters, or None on backends
+    without them or if they can't be read.
+    """
+    if storage.get_backend().name != storage.MYSQL:
+        return None
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            return {name.lower(): int(value) for name, value in
+                    storage.fetchall(conn, 'loadtest_lock_status')}
+    except mysql.connector.Error:
+        return None
+
+
+def percentile(times, fraction):
+    """
+    Returns the value below which the given fraction of the sorted times
+    fall.
+    """
+    return times[min(len(times) - 1, int(fraction * len(times)))]
+
+
+def summarize(name, runs, seconds):
+    """
+    Returns the statistics of the runs of one operation (or of all of
+    them) over a measured window of the given length.
+    """
+    times = sorted(run[2] * 1000 for run in runs)
+    ended = [run[3] for run in runs]
+    result = {'operation': name, 'runs': len(runs),
+              'per_second': round(len(runs) / seconds, 1)}
+    if times:
+        result.update({
+            'p50_ms': round(statistics.median(times), 3),
+            'p95_ms': round(percentile(times, 0.95), 3),
+            'p99_ms': round(percentile(times, 0.99), 3),
+            'max_ms': round(times[-1], 3),
+        })
+    result.update({
+        'errors': len(runs) - ended.count(OK),
+        'deadlocks': ended.count(DEADLOCK),
+        'lock_wait_timeouts': ended.count(LOCK_WAIT_TIMEOUT),
+        'invalid': ended.count(INVALID),
+    })
+    return result
+
+
+def report(runs, mix, measured_from, seconds):
+    """
+    Returns the statistics of every operation in the mix and of all of
+    them together, counting only the runs started at or after
+    measured_from.
+    """
+    runs = [run for run in runs if run[1] >= measured_from]
+    results = []
+    for name in mix:
+        if mix[name]:
+            result = summarize(name, [run for run in runs if run[0] == name],
+                               seconds)
+            results.append({'kind': OPERATIONS[name][0], **result})
+    results.append({'kind': 'all', **summarize('all', runs, seconds)})
+    return results
+
+
+def cleanup(match_ids):
+    """
+    Deletes the matches inserted by the run.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        try:
+            storage.executemany(conn, 'loadtest_delete_match',
+                                [(match_id, ) for match_id in match_ids])
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+    result_cache.invalidate_for('loadtest_delete_match')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load test the operations with simulated fans and '
+                    'admins.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='concurrent simulated users')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='processes to split the workers over')
+    parser.add_argument('--duration', type=float, default=DEFAULT_DURATION,
+                        help='seconds to run, including the ramp-up')
+    parser.add_argument('--ramp-up', type=float, default=0,
+                        help='seconds over which the workers are started')
+    parser.add_argument('--think', type=float, default=DEFAULT_THINK,
+                        help='mean seconds between operations of a worker '
+                             '(0 for none)')
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='operation weights as name=weight,... '
+                             '(default: a mix of every operation)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--cache', action='store_true',
+                        help='keep the result cache on')
+    parser.add_argument('--cleanup', action='store_true',
+                        help='delete the inserted matches afterward')
+    parser.add_argument('--json', help='also write the results here')
+    args = parser.parse_args(argv)
+    if args.workers < 1 or args.processes < 1:
+        parser.error('--workers and --processes must be at least 1')
+    if args.ramp_up >= args.duration:
+        parser.error('--ramp-up must be shorter than --duration')
+
+    try:
+        sample = load_sample()
+        before = lock_status()
+        start_at = time.time() + 1
+        settings = {'mix': args.mix, 'seed': args.seed, 'think': args.think,
+                    'ramp_up': args.ramp_up, 'cache': args.cache,
+                    'start_at': start_at,
+                    'end_at': start_at + args.duration}
+        runs, match_ids = run(args.workers, args.processes, settings, sample)
+        after = lock_status()
+        if args.cleanup and match_ids:
+            cleanup(match_ids)
+    except mysql.connector.Error as err:
+        print(f'Database error: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+
+    results = report(runs, args.mix, start_at + args.ramp_up,
+                     args.duration - args.ramp_up)
+    print(f'{"Operation":<24} {"Runs":>7} {"Ops/s":>8} {"p50 ms":>9} '
+          f'{"p95 ms":>9} {"p99 ms":>9} {"Errors":>7} {"Deadlocks":>10} '
+          f'{"Lock waits":>11}')
+    for result in results:
+        print(f'{result["operation"]:<24} {result["runs"]:>7} '
+              f'{result["per_second"]:>8} {result.get("p50_ms", "-"):>9} '
+              f'{result.get("p95_ms", "-"):>9} '
+              f'{result.get("p99_ms", "-"):>9} {result["errors"]:>7} '
+              f'{result["deadlocks"]:>10} '
+              f'{result["lock_wait_timeouts"]:>11}')
+    server = None
+    if before is not None and after is not None:
+        server = {name: after[name] - before.get(name, 0) for name in after}
+        print(f'InnoDB row lock waits: '
+              f'{server.get("innodb_row_lock_waits", 0)}, '
+              f'time waiting: {server.get("innodb_row_lock_time", 0)} ms')
+    if args.cleanup:
+        print(f'Deleted {len(match_ids)} inserted matches')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'workers': args.workers,
+                       'processes': args.processes,
+                       'duration': args.duration, 'ramp_up': args.ramp_up,
+                       'think': args.think, 'mix': args.mix,
+                       'cache': args.cache, 'results': results,
+                       'server': server}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+Per-statement metrics and the slow query log.
+
+storage.py records every named statement it runs here: how long it took
+(as a latency histogram), how many rows and roughly how many bytes it
+returned, and whether it failed, labeled by the database role (admin or
+client) that ran it. Statements slower than the slow query threshold are
+also written to the slow query log along with their query plan.
+
+The metrics can be exported in the Prometheus text format (prometheus())
+or as a JSON-serializable dictionary (snapshot()); http_api.py serves them
+at /metrics, cli.py can write them on exit with --metrics, and app.py
+prints report() on quit when DEBUG is on.
+"""
+import collections
+import datetime
+import json
+import threading
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+DEFAULT_SLOW_QUERY_TIME = 0.1
+# Slow queries kept in memory for snapshot()
+SLOW_QUERIES_KEPT = 100
+# Statements whose parameters are never logged
+SENSITIVE = frozenset(('authenticate', 'add_user'))
+
+
+def row_bytes(row):
+    """
+    Returns the approximate size of a row as sent by the server: the
+    length of each value in its text form.
+    """
+    size = 0
+    for value in row:
+        if value is None:
+            continue
+        if isinstance(value, (bytes, bytearray)):
+            size += len(value)
+        elif isinstance(value, str):
+            size += len(value.encode())
+        else:
+            size += len(str(value))
+    return size
+
+
+class Histogram:
+    """
+    A cumulative histogram of latencies over BUCKETS, with their sum.
+    """
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        """
+        Returns the upper bound of the bucket holding the q-th quantile
+        (None if nothing was observed, inf if it is past the last bucket).
+        """
+        if not self.count:
+            return None
+        for bound, count in zip(BUCKETS, self.counts):
+            if count >= q * self.count:
+                return bound
+        return float('inf')
+
+
+class StatementMetrics:
+    """
+    The metrics of one statement run by one role.
+    """
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+        self.slow = 0
+
+
+class Metrics:
+    """
+    Metrics of every statement run, keyed by (statement name, role), and
+    the slow query log.
+    """
+
+    def __init__(self, slow_query_time=DEFAULT_SLOW_QUERY_TIME,
+                 slow_query_log=None):
+        self.slow_query_time = slow_query_time
+        # Path of a file the slow queries are appended to as JSON lines
+        self.slow_query_log = slow_query_log
+        self._statements = collections.defaultdict(StatementMetrics)
+        self._slow_queries = collections.deque(maxlen=SLOW_QUERIES_KEPT)
+        self._lock = threading.Lock()
+
+    def is_slow(self, seconds):
+        return (self.slow_query_time is not None
+                and seconds >= self.slow_query_time)
+
+    def observe(self, name, role, seconds, rows=0, nbytes=0, error=False):
+        """
+        Records one run of a statement.
+        """
+        with self._lock:
+            metrics = self._statements[(name, role)]
+            metrics.latency.observe(seconds)
+            metrics.rows += rows
+            metrics.bytes += nbytes
+            if error:
+                metrics.errors += 1
+
+    def log_slow_query(self, name, role, seconds, rows, params, plan):
+        """
+        Adds a slow query to the log, with its parameters unless the
+        statement is SENSITIVE.
+        """
+        entry = {'time': datetime.datetime.now().isoformat(),
+                 'statement': name, 'role': role,
+                 'seconds': round(seconds, 6), 'rows': rows,
+                 'params': None if name in SENSITIVE else list(params),
+                 'plan': plan}
+        with self._lock:
+            self._statements[(name, role)].slow += 1
+            self._slow_queries.append(entry)
+            if self.slow_query_log:
+                with open(self.slow_query_log, 'a') as f:
+                    f.write(json.dumps(entry, default=str) + '\n')
+
+    def reset(self):
+        with self._lock:
+            self._statements.clear()
+            self._slow_queries.clear()
+
+    def snapshot(self):
+        """
+        Returns every statement's metrics and the recent slow queries as a
+        JSON-serializable dictionary.
+        """
+        with self._lock:
+            statements = []
+            for (name, role), m in sorted(self._statements.items(),
+                                          key=lambda item: str(item[0])):
+                statements.append({
+                    'statement': name, 'role': role,
+                    'count': m.latency.count, 'errors': m.errors,
+                    'slow': m.slow, 'rows': m.rows, 'bytes': m.bytes,
+                    'seconds': round(m.latency.sum, 6),
+                    'p50_seconds': m.latency.quantile(0.5),
+                    'p99_seconds': m.latency.quantile(0.99),
+                    'buckets': dict(zip(map(str, BUCKETS),
+                                        m.latency.counts)),
+                })
+            return {'slow_query_time': self.slow_query_time,
+                    'statements': statements,
+                    'slow_queries': list(self._slow_queries)}
+
+    def prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            '# HELP wtadb_statement_duration_seconds Time to run a statement '
+            'and fetch its rows.',
+            '# TYPE wtadb_statement_duration_seconds histogram']
+        with self._lock:
+            items = sorted(self._statements.items(),
+                           key=lambda item: str(item[0]))
+            for (name, role), m in items:
+                labels = f'statement="{name}",role="{role}"'
+                for bound, count in zip(BUCKETS, m.latency.counts):
+                    lines.append(f'wtadb_statement_duration_seconds_bucket'
+                                 f'{{{labels},le="{bound}"}} {count}')
+                lines.append(f'wtadb_statement_duration_seconds_bucket'
+                             f'{{{labels},le="+Inf"}} {m.latency.count}')
+                lines.append(f'wtadb_statement_duration_seconds_sum'
+                             f'{{{labels}}} {m.latency.sum}')
+                lines.append(f'wtadb_statement_duration_seconds_count'
+                             f'{{{labels}}} {m.latency.count}')
+            for metric, attribute, text in (
+                    ('rows', 'rows', 'Rows returned by a statement.'),
+                    ('bytes', 'bytes', 'Approximate bytes returned by a '
+                                       'statement.'),
+                    ('errors', 'errors', 'Statement runs that failed.'),
+                    ('slow_queries', 'slow', 'Statement runs slower than '
+                                             'the slow query threshold.')):
+                lines.append(f'# HELP wtadb_statement_{metric}_total {text}')
+                lines.append(f'# TYPE wtadb_statement_{metric}_total counter')
+                for (name, role), m in items:
+                    lines.append(f'wtadb_statement_{metric}_total'
+                                 f'{{statement="{name}",role="{role}"}} '
+                                 f'{getattr(m, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+    def report(self):
+        """
+        Returns a printable table of the statements by total time spent.
+        """
+        rows = sorted(self.snapshot()['statements'],
+                      key=lambda s: s['seconds'], reverse=True)
+        lines = [f'{"Statement":<36} {"Role":<7} {"Count":>7} '
+                 f'{"Seconds":>9} {"p99 <=":>7} {"Rows":>8} {"Slow":>5}']
+        for s in rows:
+            lines.append(f'{s["statement"]:<36} {str(s["role"]):<7} '
+                         f'{s["count"]:>7} {s["seconds"]:>9.4f} '
+                         f'{s["p99_seconds"]:>7} {s["rows"]:>8} '
+                         f'{s["slow"]:>5}')
+        return '\n'.join(lines)
+
+
+# The metrics shared by the whole application.
+metrics = Metrics()
+
+
+def configure(config):
+    """
+    Applies the slow_query_time and slow_query_log settings.
+    """
+    metrics.slow_query_time = float(config['slow_query_time'])
+    metrics.slow_query_log = config['slow_query_log'] or None
+
+
+def write(path):
+    """
+    Writes the metrics to a file: JSON if the path ends in .json,
+    otherwise the Prometheus text format.
+    """
+    with open(path, 'w') as f:
+        if path.endswith('.json'):
+            json.dump(metrics.snapshot(), f, indent=2, default=str)
+        else:
+            f.write(metrics.prometheus())
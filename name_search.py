@@ -0,0 +1,390 @@
+"""
+In-memory index of player names, for resolving the names people type to
+player IDs.
+
+Names are folded before they are indexed or looked up: accents and other
+marks are stripped, case is folded and punctuation becomes a space, so
+'Garbiñe Muguruza', 'garbine  MUGURUZA' and 'Garbine-Muguruza' are the same
+name. Each name is then split into words, and a player is found when every
+word of the query matches a word of their name, in any order, so
+'Su Wei Hsieh', 'Hsieh Su-Wei' and 'hsieh' all find the same player. A word
+of the query matches a word of a name:
+
+  exactly                   distance 0
+  as a prefix               distance 0.5 (when autocompleting, so 'se wil'
+                            finds Serena Williams)
+  within a few typos        distance 1 per insertion, deletion, substitution
+                            or swap of adjacent letters (1 for words of 4 to 7
+                            letters, 2 for longer ones)
+
+Matches are ranked by their total distance, then shortest name first. The
+distinct words are kept in a sorted array, so the words with a prefix are a
+bisect range. Typos are only looked for in query words that aren't known
+words: the words one typo away are found by looking up every variant of
+the query word, and only when there are none are words two typos away
+looked for, among those sharing enough letter trigrams with it. A query of
+several words starts from the one matching the fewest players. With 60,000
+players, full names resolve in tens of microseconds, prefixes and single
+typos well under a millisecond, and words two typos away from any name in
+a few milliseconds.
+
+The index is loaded with one query and reloaded after max_age seconds, or
+on the next lookup after invalidate(), which admin writes that change a
+player's name call.
+"""
+import collections
+import heapq
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+import db_pool
+import statements
+import storage
+
+DEFAULT_LIMIT = 10
+# Distance of a word that the query word is a prefix of
+PREFIX_DISTANCE = 0.5
+# Letters that don't decompose into a base letter and a mark
+_FOLD = str.maketrans({'ł': 'l', 'ø': 'o', 'đ': 'd', 'ð': 'd', 'þ': 'th',
+                       'æ': 'ae', 'œ': 'oe', 'ı': 'i'})
+
+statements.register('name_index_players', """
+    SELECT player_id, first_name, last_name, country
+    FROM player""",
+                    reads=('player', ))
+
+
+def fold(text):
+    """
+    Returns the folded form of a name: lower case, without accents, with
+    each run of spaces and punctuation replaced by a single space.
+    """
+    text = unicodedata.normalize('NFKD', str(text).casefold()).translate(_FOLD)
+    text = ''.join(c if c.isalnum() else ' ' for c in text
+                   if not unicodedata.combining(c))
+    return ' '.join(text.split())
+
+
+def max_edits(word):
+    """
+    Returns the number of typos tolerated in a query word.
+    """
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+def trigrams(word):
+    """
+    Returns the set of letter trigrams of a word, padded at both ends.
+    """
+    padded = f'^{word}$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def variants(word, alphabet):
+    """
+    Returns the strings one insertion, deletion, substitution or swap of
+    adjacent letters (from alphabet) away from a word.
+    """
+    splits = [(word[:i], word[i:]) for i in range(len(word) + 1)]
+    found = {a + b[1:] for a, b in splits if b}
+    found.update(a + b[1] + b[0] + b[2:] for a, b in splits if len(b) > 1)
+    found.update(a + c + b[1:] for a, b in splits if b for c in alphabet)
+    found.update(a + c + b for a, b in splits for c in alphabet)
+    found.discard(word)
+    return found
+
+
+def edit_distance(a, b, limit):
+    """
+    Returns the optimal string alignment distance between two words (edits
+    being insertions, deletions, substitutions and swaps of adjacent
+    letters), or limit + 1 if it is more than limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = None
+    row = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(row[j] + 1, current[j - 1] + 1, row[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2]
+                    and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous, row = row, current
+    return row[-1] if row[-1] <= limit else limit + 1
+
+
+class NameMatch(collections.namedtuple(
+        'NameMatch', 'player_id first_name last_name country distance')):
+    """
+    A player found by a search, and how far their name is from the query
+    (0 for an exact match).
+    """
+
+
+class NameIndex:
+    """
+    The folded names of every player, indexed by word, word prefix and
+    word trigram.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._loaded_at = None
+        # Held while loading and while searching, so that a search never
+        # sees a half-loaded index
+        self._lock = threading.RLock()
+        # Per player, in load order
+        self._players = []
+        # Player ID -> player number
+        self._by_id = {}
+        # Folded full name ('first last' and 'last first') -> player numbers
+        self._full_names = {}
+        # Sorted distinct words, and the player numbers of each word (in
+        # _order)
+        self._words = []
+        self._postings = []
+        # Per player, the numbers of the words of their name, and their
+        # place in the order ties are broken in
+        self._player_words = []
+        self._order = []
+        # Per word, the place of its first player
+        self._first_orders = []
+        # Word -> word number, and every letter used in a word
+        self._word_numbers = {}
+        self._alphabet = ''
+        # Trigram -> numbers of the words (in _words) that contain it
+        self._trigrams = {}
+
+    def load(self, rows):
+        """
+        Builds the index from (player_id, first_name, last_name, country)
+        rows.
+        """
+        players = []
+        full_names = collections.defaultdict(list)
+        word_players = collections.defaultdict(set)
+        name_words = []
+        for n, (player_id, first_name, last_name, country) in enumerate(rows):
+            first_name, last_name = first_name or '', last_name or ''
+            players.append((str(player_id), first_name, last_name, country))
+            first, last = fold(first_name), fold(last_name)
+            full_names[f'{first} {last}'.strip()].append(n)
+            full_names[f'{last} {first}'.strip()].append(n)
+            name_words.append(f'{first} {last}'.split())
+            for word in name_words[-1]:
+                word_players[word].add(n)
+        words = sorted(word_players)
+        word_numbers = {word: w for w, word in enumerate(words)}
+        # Among equally close names, shorter ones (with fewer words the
+        # query didn't mention) come first
+        ranked = sorted(range(len(players)), key=lambda n: (
+            len(players[n][1]) + len(players[n][2]), players[n][2],
+            players[n][1], players[n][0]))
+        order = [0] * len(players)
+        for place, n in enumerate(ranked):
+            order[n] = place
+        word_trigrams = collections.defaultdict(list)
+        for w, word in enumerate(words):
+            for gram in trigrams(word):
+                word_trigrams[gram].append(w)
+        postings = [tuple(sorted(word_players[word], key=order.__getitem__))
+                    for word in words]
+        with self._lock:
+            self._players = players
+            self._by_id = {player[0]: n for n, player in enumerate(players)}
+            self._full_names = {name: sorted(set(numbers))
+                                for name, numbers in full_names.items()}
+            self._words = words
+            self._postings = postings
+            self._player_words = [tuple(word_numbers[word] for word in name)
+                                  for name in name_words]
+            self._order = order
+            self._first_orders = [order[p[0]] for p in postings]
+            self._word_numbers = word_numbers
+            self._alphabet = ''.join(sorted(set(''.join(words))))
+            self._trigrams = dict(word_trigrams)
+            self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self, role):
+        with self._lock:
+            if (self._loaded_at is None
+                    or time.monotonic() - self._loaded_at > self.max_age):
+                with storage.connection(role) as conn:
+                    self.load(storage.fetchall(conn, 'name_index_players'))
+
+    def invalidate(self):
+        """
+        Drops the index so that it is reloaded on next use.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def __len__(self):
+        return len(self._players)
+
+    def _word_matches(self, query_word, prefix, fuzzy):
+        """
+        Returns {word number: distance} for the indexed words matching one
+        word of a query.
+        """
+        found = {}
+        i = bisect_left(self._words, query_word)
+        exact = i < len(self._words) and self._words[i] == query_word
+        if exact:
+            found[i] = 0
+        if prefix:
+            # Every word starting with the query word sorts before the
+            # query word followed by the last code point
+            end = bisect_left(self._words, query_word + '\U0010ffff', i)
+            for j in range(i + 1 if exact else i, end):
+                found[j] = PREFIX_DISTANCE
+        # Typos are only looked for when the word isn't a known one
+        limit = max_edits(query_word) if fuzzy and not exact else 0
+        typos = 0
+        if limit:
+            # The words one typo away are among the query word's variants
+            for variant in variants(query_word, self._alphabet):
+                w = self._word_numbers.get(variant)
+                if w is not None and w not in found:
+                    found[w] = 1
+                    typos += 1
+        if limit > 1 and not typos:
+            # Words two typos away are only looked for if none is one typo
+            # away. They share at least a few of the query word's trigrams
+            # (each edit changes at most 3 of them), so only those are
+            # compared letter by letter
+            grams = trigrams(query_word)
+            shared = collections.Counter()
+            for gram in grams:
+                shared.update(self._trigrams.get(gram, ()))
+            needed = max(1, len(grams) - 3 * limit)
+            for w, count in shared.items():
+                if count >= needed and w not in found:
+                    distance = edit_distance(query_word, self._words[w],
+                                             limit)
+                    if distance <= limit:
+                        found[w] = distance
+        return found
+
+    def search(self, query, limit=DEFAULT_LIMIT, prefix=True, fuzzy=True,
+               role=db_pool.CLIENT):
+        """
+        Returns up to limit NameMatches for a (partial, misspelled) name,
+        closest first. With prefix=True the words of the query may be the
+        start of a word, for autocompletion; with fuzzy=True they may have
+        typos.
+        """
+        query_words = fold(query).split()
+        if not query_words or limit < 1:
+            return []
+        with self._lock:
+            self._ensure_loaded(role)
+            return self._search(query_words, limit, prefix, fuzzy)
+
+    def _search(self, query_words, limit, prefix, fuzzy):
+        matches = [self._word_matches(query_word, prefix, fuzzy)
+                   for query_word in query_words]
+        if not all(matches):
+            return []
+        order = self._order
+        if len(matches) == 1:
+            return self._first_players(matches[0], limit)
+        # Start from the query word matching the fewest players, and narrow
+        # those down by checking the words of their names against the
+        # matches of the other query words, rather than collecting the
+        # players of every match
+        matches.sort(key=lambda found: sum(len(self._postings[w])
+                                           for w in found))
+        distances = {}
+        for w, distance in matches[0].items():
+            for n in self._postings[w]:
+                if distance < distances.get(n, distance + 1):
+                    distances[n] = distance
+        for found in matches[1:]:
+            narrowed = {}
+            for n, total in distances.items():
+                best = min((found[w] for w in self._player_words[n]
+                            if w in found), default=None)
+                if best is not None:
+                    narrowed[n] = total + best
+            distances = narrowed
+            if not distances:
+                return []
+        ranked = heapq.nsmallest(limit, distances.items(),
+                                 key=lambda item: (item[1], order[item[0]]))
+        return [NameMatch(*self._players[n], distance)
+                for n, distance in ranked]
+
+    def _first_players(self, found, limit):
+        """
+        Returns the closest limit NameMatches of the players with one of
+        the found words, merging the postings (which are already in order)
+        of the words at each distance instead of ranking every player.
+        """
+        results = []
+        seen = set()
+        for distance in sorted(set(found.values())):
+            words = sorted((w for w, d in found.items() if d == distance),
+                           key=self._first_orders.__getitem__)
+            # The words whose first players come after those of enough
+            # other words to fill the results can't have any of them
+            firsts = set()
+            for cut, w in enumerate(words, 1):
+                n = self._postings[w][0]
+                if n not in seen:
+                    firsts.add(n)
+                    if len(firsts) >= limit - len(results):
+                        break
+            postings = [self._postings[w] for w in words[:cut]]
+            for n in heapq.merge(*postings, key=self._order.__getitem__):
+                if n not in seen:
+                    seen.add(n)
+                    results.append(NameMatch(*self._players[n], distance))
+                    if len(results) == limit:
+                        return results
+        return results
+
+    def complete(self, prefix, limit=DEFAULT_LIMIT, role=db_pool.CLIENT):
+        """
+        Returns up to limit NameMatches whose names start with the given
+        words, for autocompletion.
+        """
+        return self.search(prefix, limit, prefix=True, fuzzy=False,
+                           role=role)
+
+    def resolve(self, name, role=db_pool.CLIENT):
+        """
+        Returns the IDs of the players with exactly this name (after
+        folding), given as 'First Last' or 'Last First'. More than one
+        player may share a name.
+        """
+        with self._lock:
+            self._ensure_loaded(role)
+            return [self._players[n][0]
+                    for n in self._full_names.get(fold(name), ())]
+
+    def name(self, player_id, role=db_pool.CLIENT):
+        """
+        Returns the (first_name, last_name) of a player ID, or None.
+        """
+        with self._lock:
+            self._ensure_loaded(role)
+            n = self._by_id.get(str(player_id))
+            if n is None:
+                return None
+            return self._players[n][1:3]
+
+
+# The index shared by the whole application.
+index = NameIndex()
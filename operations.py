@@ -0,0 +1,670 @@
+"""
+The operations behind app.py's user and admin menus, without any prompts or
+printing, so that they can also be driven from the command line (cli.py) or
+other programs.
+
+Read operations return rows (lists of tuples, or generators for the
+streamed listings) whose columns are named in COLUMNS. Write operations
+validate their arguments, raising InvalidInput for anything the
+interactive prompts would have rejected, commit, and invalidate the
+caches that depend on what they changed. Database failures are raised as
+mysql.connector.Error.
+"""
+import datetime
+import json
+
+import mysql.connector
+
+import analytics
+import db_pool
+import elo
+import key_index
+import name_search
+import paging
+import result_cache
+import score_parser
+import statements
+import storage
+
+# Column names of the rows returned by each read operation.
+COLUMNS = {
+    'tournament_winners': ('tournament_year', 'first_name', 'last_name'),
+    'players_inside_top_20': ('rank', 'first_name', 'last_name', 'age'),
+    'players_outside_top_20': ('first_name', 'last_name', 'age'),
+    'surface_count': ('surface', 'matches', 'wins', 'losses'),
+    'players_by_country': ('first_name', 'last_name', 'hand', 'height'),
+    'find_players': ('player_id', 'first_name', 'last_name', 'country',
+                     'distance'),
+    'matchup_history': ('result', ),
+    'highest_ranked_player': ('player', ),
+    'head_to_head': ('player1_id', 'player2_id', 'player1_wins',
+                     'player2_wins', 'hard_player1_wins', 'hard_player2_wins',
+                     'clay_player1_wins', 'clay_player2_wins',
+                     'grass_player1_wins', 'grass_player2_wins',
+                     'last_match_date', 'last_winner_id', 'last_score'),
+    'player_rank_on': ('player_id', 'first_name', 'last_name',
+                       'ranking_date', 'rank', 'player_points'),
+    'top_ranked_on': ('ranking_date', 'rank', 'player_id', 'first_name',
+                      'last_name', 'player_points'),
+    'serve_stats': ('player_id', 'first_name', 'last_name', 'group',
+                    *analytics.METRICS),
+    'stat_leaders': ('player_id', 'first_name', 'last_name', 'group',
+                     *analytics.METRICS),
+    'player_rating': ('player_id', 'first_name', 'last_name', 'elo',
+                      'matches', 'hard_elo', 'hard_matches', 'clay_elo',
+                      'clay_matches', 'grass_elo', 'grass_matches',
+                      'last_match_date'),
+    'top_rated': ('player_id', 'first_name', 'last_name', 'elo', 'matches'),
+    'match_preview': ('player1_id', 'player1', 'player2_id', 'player2',
+                      'surface', 'player1_elo', 'player2_elo',
+                      'player1_win_probability'),
+    'score_stats': ('player_id', 'first_name', 'last_name', 'matches',
+                    'deciding_sets_won', 'deciding_sets_lost',
+                    'tiebreaks_won', 'tiebreaks_lost', 'bagels_won',
+                    'bagels_lost', 'won_by_retirement', 'lost_by_retirement',
+                    'won_by_walkover', 'lost_by_walkover'),
+    'set_scores': ('winner_games', 'loser_games', 'sets'),
+    'player_profiles': ('player_id', 'first_name', 'last_name', 'hand',
+                        'dob', 'country', 'height', 'rankings', 'surfaces',
+                        'titles', 'recent_matches'),
+    'input_match_results': ('match_id', ),
+}
+
+# Suggestions offered when a name matches no player.
+SUGGESTIONS = 3
+
+# Player attributes that can be changed with update_player.
+PLAYER_ATTRIBUTES = tuple(statements.UPDATE_PLAYER_STATEMENTS)
+
+# Recent matches in a player profile, by default and at most.
+RECENT_MATCHES = 5
+MAX_RECENT_MATCHES = 50
+
+# Columns of the sections nested in a player profile.
+PROFILE_SECTIONS = {
+    'rankings': ('rank', 'player_points', 'tournaments_played'),
+    'surfaces': ('surface', 'matches', 'wins', 'losses'),
+    'titles': ('tournament_year', 'tournament_id', 'tournament_name'),
+    'recent_matches': ('match_id', 'tournament_date', 'tournament_name',
+                       'result', 'opponent_id', 'opponent_first_name',
+                       'opponent_last_name', 'score'),
+}
+
+# Ranks that update_ranking can change.
+MIN_RANK = 1
+MAX_RANK = 20
+
+
+class InvalidInput(ValueError):
+    """
+    Raised when an argument to an operation is not valid, with a message
+    suitable for showing to the user.
+    """
+
+
+# ----------------------------------------------------------------------
+# Validation
+# ----------------------------------------------------------------------
+def exists(table, attribute, value, role=db_pool.ADMIN):
+    """
+    Checks to see if a specific value exists in a given table with a given
+    attribute, using a connection from the given role's pool. Player IDs,
+    tournament IDs and countries are answered from the local key index.
+    """
+    if key_index.index.covers(table, attribute):
+        return key_index.index.contains(table, attribute, value, role)
+    name = statements.EXISTS_STATEMENTS[(table, attribute)].name
+    with storage.connection(role) as conn:
+        return bool(storage.fetchall(conn, name, (value, )))
+
+
+def valid_date(date):
+    """
+    Checks to see if an input is in a valid date format.
+    """
+    try:
+        datetime.datetime.strptime(date, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+
+def _is_count(value):
+    """
+    Checks that a value is a non-negative whole number (as an int or a
+    string of digits).
+    """
+    return isinstance(value, int) and value >= 0 or str(value).isdecimal()
+
+
+def _require(condition, message):
+    if not condition:
+        raise InvalidInput(message)
+
+
+# ----------------------------------------------------------------------
+# Logins
+# ----------------------------------------------------------------------
+def authenticate(username, password):
+    """
+    Returns True if the username and password match an application user.
+    Checked with the admin role, since the read-only client role cannot
+    call authenticate().
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        (valid, ) = storage.fetchone(conn, 'authenticate',
+                                     (username, password, ))
+    return bool(valid)
+
+
+def add_user(username, password):
+    """
+    Registers a new application user.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        storage.execute(conn, 'add_user', (username, password, ))
+        conn.commit()
+
+
+# ----------------------------------------------------------------------
+# User (Fan) Operations
+# ----------------------------------------------------------------------
+def tournament_winners(tournament):
+    """
+    Returns the winners of the named tournament in the database, oldest
+    first.
+    """
+    return result_cache.fetchall(db_pool.CLIENT, 'tournament_winners',
+                                 (tournament, ))
+
+
+def players_inside_top_20():
+    """
+    Returns the players in the current top 20, ordered by rank.
+    """
+    return result_cache.fetchall(db_pool.CLIENT, 'players_inside_top_20')
+
+
+def players_outside_top_20(page_size=paging.DEFAULT_PAGE_SIZE):
+    """
+    Yields every player outside the current top 20, youngest first, one
+    page at a time. The pages are streamed rather than cached, so a full
+    listing doesn't push the hot results out of the result cache.
+    """
+    return paging.iter_rows(db_pool.CLIENT, 'players_outside_top_20_page',
+                            page_size=page_size, cached=False)
+
+
+def find_players(query, limit=name_search.DEFAULT_LIMIT):
+    """
+    Returns up to limit players whose names are closest to a partial or
+    misspelled name (see name_search), closest first.
+    """
+    _require(_is_count(limit) and int(limit) > 0, 'Invalid limit.')
+    return [tuple(match) for match in name_search.index.search(
+        query, int(limit))]
+
+
+def player_ids(name):
+    """
+    Returns the IDs of the players with the given full name ('First Last'
+    or 'Last First', ignoring case, accents and punctuation); more than one
+    player may share a name. Raises InvalidInput, with the closest names as
+    suggestions, if no player has it.
+    """
+    ids = name_search.index.resolve(name)
+    if not ids:
+        suggestions = [f'{match.first_name} {match.last_name}'
+                       for match in name_search.index.search(
+                           name, SUGGESTIONS)]
+        message = f'No player named {name}.'
+        if suggestions:
+            message += f' Did you mean {" or ".join(suggestions)}?'
+        raise InvalidInput(message)
+    return ids
+
+
+def surface_count(name):
+    """
+    Returns the number of matches, wins and losses of the named player on
+    each surface.
+    """
+    totals = {}
+    for player_id in player_ids(name):
+        for surface, matches, wins, losses in result_cache.fetchall(
+                db_pool.CLIENT, 'player_surface_count', (player_id, )):
+            total = totals.setdefault(surface, [0, 0, 0])
+            total[0] += matches
+            total[1] += wins
+            total[2] += losses
+    return [(surface, *totals[surface]) for surface in sorted(totals)]
+
+
+def players_by_country(country, page_size=paging.DEFAULT_PAGE_SIZE):
+    """
+    Yields the players from the given 3 letter country code, ordered by
+    name, one page at a time (streamed, as for players_outside_top_20).
+    """
+    return paging.iter_rows(db_pool.CLIENT, 'players_by_country_page',
+                            (country, ), page_size=page_size, cached=False)
+
+
+def matchup_history(name1, name2):
+    """
+    Returns the winner and score of the most recent match between the two
+    named players, as a single row, or no rows if they have not played each
+    other.
+    """
+    ids1, ids2 = player_ids(name1), player_ids(name2)
+    pairs = [(player1_id, player2_id)
+             for player1_id in ids1 for player2_id in ids2
+             if player1_id != player2_id]
+    rows = head_to_head(pairs)
+    if not rows:
+        return []
+    # The latest meeting, should either name be shared by several players
+    *_, last_winner_id, last_score = max(rows,
+                                         key=lambda row: str(row[-3] or ''))
+    if last_score is None:
+        return []
+    first_name, last_name = name_search.index.name(last_winner_id)
+    return [(f'{first_name} {last_name} {last_score}', )]
+
+
+def highest_ranked_player(country):
+    """
+    Returns the name and rank of the highest ranked player from the given
+    3 letter country code (see find_highest_ranked_player), as a single
+    row, or no rows if no player from the country is ranked.
+    """
+    rows = result_cache.fetchall(db_pool.CLIENT, 'highest_ranked_player',
+                                 (country, ))
+    return [row for row in rows if row[0] is not None]
+
+
+def _orient(row, player1_id):
+    """
+    Returns a head_to_head row (stored with the smaller player ID first) as
+    seen from player1_id's side.
+    """
+    if row[0] == player1_id:
+        return tuple(row)
+    (a, b, a_wins, b_wins, hard_a, hard_b, clay_a, clay_b, grass_a, grass_b,
+     *last) = row
+    return (b, a, b_wins, a_wins, hard_b, hard_a, clay_b, clay_a, grass_b,
+            grass_a, *last)
+
+
+def head_to_head(pairs):
+    """
+    Returns the head-to-head records of the given (player1_id, player2_id)
+    pairs, each seen from player1's side, in the order given. Pairs that
+    have never played each other are left out. Up to HEAD_TO_HEAD_PAIRS
+    pairs are looked up per query.
+    """
+    wanted = []
+    for player1_id, player2_id in pairs:
+        _require(str(player1_id) != str(player2_id),
+                 'A head-to-head needs two different players.')
+        wanted.append((str(player1_id), str(player2_id)))
+    keys = sorted({tuple(sorted(pair)) for pair in wanted})
+    size = statements.HEAD_TO_HEAD_PAIRS
+    found = {}
+    for i in range(0, len(keys), size):
+        params = [player_id for key in keys[i:i + size] for player_id in key]
+        params += [None] * (2 * size - len(params))
+        for row in result_cache.fetchall(db_pool.CLIENT, 'head_to_head_pairs',
+                                         tuple(params)):
+            found[(row[0], row[1])] = row
+    rows = []
+    for player1_id, player2_id in wanted:
+        row = found.get(tuple(sorted((player1_id, player2_id))))
+        if row is not None:
+            rows.append(_orient(row, player1_id))
+    return rows
+
+
+def draw_head_to_head(player_ids):
+    """
+    Returns the head-to-head records of every pair of the given players
+    (e.g. the entrants of a draw) that have played each other, in a single
+    query. Each pair is returned once, with the smaller player ID as
+    player1.
+    """
+    player_ids = sorted({str(player_id) for player_id in player_ids})
+    _require(len(player_ids) <= statements.HEAD_TO_HEAD_PLAYERS,
+             f'At most {statements.HEAD_TO_HEAD_PLAYERS} players.')
+    if len(player_ids) < 2:
+        return []
+    params = player_ids + [None] * (statements.HEAD_TO_HEAD_PLAYERS
+                                    - len(player_ids))
+    return [tuple(row) for row in result_cache.fetchall(
+        db_pool.CLIENT, 'head_to_head_draw', tuple(params * 2))]
+
+
+def player_rank_on(name, date):
+    """
+    Returns the rank and points of the named player in the rankings in
+    effect on the given date (the latest week published on or before it),
+    one row per player with the name that was ranked that week.
+    """
+    _require(valid_date(str(date)), 'Invalid date format.')
+    rows = []
+    for player_id in player_ids(name):
+        first_name, last_name = name_search.index.name(player_id)
+        for ranking_date, rank, points in result_cache.fetchall(
+                db_pool.CLIENT, 'player_rank_on', (date, player_id)):
+            rows.append((player_id, first_name, last_name, ranking_date,
+                         rank, points))
+    return rows
+
+
+def top_ranked_on(date, limit=MAX_RANK):
+    """
+    Returns the top limit players of the rankings in effect on the given
+    date (the latest week published on or before it), by rank. Players
+    missing from the player table have no name.
+    """
+    _require(valid_date(str(date)), 'Invalid date format.')
+    _require(_is_count(limit) and int(limit) > 0, 'Invalid limit.')
+    return result_cache.fetchall(db_pool.CLIENT, 'top_ranked_on',
+                                 (date, int(limit)))
+
+
+def _with_names(rows):
+    """
+    Adds the first and last names after the player IDs of analytics rows.
+    """
+    named = []
+    for player_id, *values in rows:
+        first_name, last_name = name_search.index.name(player_id) or (None,
+                                                                      None)
+        named.append((player_id, first_name, last_name, *values))
+    return named
+
+
+def serve_stats(name, by='career'):
+    """
+    Returns the named player's match and serve statistics (see analytics)
+    over their career, or per season or surface (by), one row per player
+    with the name and group.
+    """
+    _require(by in analytics.GROUPINGS, 'Invalid grouping.')
+    return _with_names(analytics.engine.player_stats(player_ids(name), by))
+
+
+def stat_leaders(metric, season=None, surface=None, min_matches=1,
+                 limit=10):
+    """
+    Returns the limit players with the highest value of a metric (see
+    analytics.RANKED_METRICS) over their careers, or in one season or on
+    one surface, among those with at least min_matches matches.
+    """
+    _require(metric in analytics.RANKED_METRICS, 'Invalid statistic.')
+    _require(season is None or surface is None,
+             'Give a season or a surface, not both.')
+    _require(season is None or str(season).isdecimal(), 'Invalid season.')
+    _require(surface is None or str(surface).capitalize()
+             in analytics.SURFACES, 'Invalid surface.')
+    _require(_is_count(min_matches), 'Invalid number of matches.')
+    _require(_is_count(limit) and int(limit) > 0, 'Invalid limit.')
+    if season is not None:
+        by, label = 'season', int(season)
+    elif surface is not None:
+        by, label = 'surface', str(surface).capitalize()
+    else:
+        by, label = 'career', None
+    return _with_names(analytics.engine.leaders(metric, by, label,
+                                                int(min_matches), int(limit)))
+
+
+def _surface(surface):
+    """
+    Returns a surface name in the case elo.SURFACES uses, or None.
+    """
+    if surface is None:
+        return None
+    _require(str(surface).capitalize() in elo.SURFACES, 'Invalid surface.')
+    return str(surface).capitalize()
+
+
+def player_rating(name):
+    """
+    Returns the named player's Elo ratings, overall and on each surface,
+    with the number of matches behind each, one row per player with the
+    name. Ratings are rounded to 1 decimal.
+    """
+    rows = []
+    for player_id in player_ids(name):
+        first_name, last_name = name_search.index.name(player_id)
+        for (_, overall, matches, hard, hard_matches, clay, clay_matches,
+             grass, grass_matches, last_match_date) in result_cache.fetchall(
+                db_pool.CLIENT, 'player_rating', (player_id, )):
+            rows.append((player_id, first_name, last_name,
+                         round(overall, 1), matches, round(hard, 1),
+                         hard_matches, round(clay, 1), clay_matches,
+                         round(grass, 1), grass_matches, last_match_date))
+    return rows
+
+
+def top_rated(surface=None, limit=MAX_RANK, min_matches=1):
+    """
+    Returns the limit players with the highest Elo rating, overall or on
+    one surface, among those rated on at least min_matches matches.
+    """
+    surface = _surface(surface)
+    _require(_is_count(limit) and int(limit) > 0, 'Invalid limit.')
+    _require(_is_count(min_matches), 'Invalid number of matches.')
+    return [(player_id, first_name, last_name, round(rating, 1), matches)
+            for player_id, first_name, last_name, rating, matches
+            in result_cache.fetchall(
+                db_pool.CLIENT, elo.TOP_RATED_STATEMENTS[surface].name,
+                (int(min_matches), int(limit)))]
+
+
+def match_preview(name1, name2, surface=None):
+    """
+    Returns each named player's rating and the first one's chance of
+    winning a match between them, from their overall Elo ratings or, on a
+    surface, the average of their overall and surface ratings. There is a
+    row for each pair of players with the names; unrated players are left
+    out.
+    """
+    surface = _surface(surface)
+    # Overall rating, then the rating on each surface (see elo.KINDS)
+    kind = elo.KINDS.index(surface)
+    ratings = {}
+    for player_id in {*player_ids(name1), *player_ids(name2)}:
+        for row in result_cache.fetchall(db_pool.CLIENT, 'player_rating',
+                                         (player_id, )):
+            overall = row[1]
+            ratings[player_id] = (overall if surface is None
+                                  else (overall + row[1 + 2 * kind]) / 2)
+    rows = []
+    for player1_id in player_ids(name1):
+        for player2_id in player_ids(name2):
+            if (player1_id == player2_id or player1_id not in ratings
+                    or player2_id not in ratings):
+                continue
+            rating1, rating2 = ratings[player1_id], ratings[player2_id]
+            rows.append((player1_id,
+                         ' '.join(name_search.index.name(player1_id)),
+                         player2_id,
+                         ' '.join(name_search.index.name(player2_id)),
+                         surface, round(rating1, 1), round(rating2, 1),
+                         round(elo.expected(rating1, rating2), 3)))
+    return rows
+
+
+def score_stats(name):
+    """
+    Returns the named player's deciding (third) sets, tiebreaks and 6-0
+    sets won and lost, and the matches won and lost by retirement or
+    walkover, from the parsed scores (see score_parser.py); one row per
+    player with the name.
+    """
+    return [(player_id, *name_search.index.name(player_id),
+             *score_totals(result_cache.fetchall(
+                 db_pool.CLIENT, 'player_score_stats',
+                 (player_id, player_id))))
+            for player_id in player_ids(name)]
+
+
+def score_totals(sides):
+    """
+    Returns the score_stats columns after the name (matches, deciding sets
+    won and lost, ...) from the player_score_stats rows of a player's wins
+    and losses. Both rows count the tiebreaks and 6-0 sets from the
+    player's own side, so they add up column by column.
+    """
+    won, lost = (tuple(value or 0 for value in side) for side in sides)
+    return (won[0] + lost[0], won[1], lost[1], won[2] + lost[2],
+            won[3] + lost[3], won[4] + lost[4], won[5] + lost[5],
+            won[6], lost[6], won[7], lost[7])
+
+
+def set_scores():
+    """
+    Returns how many sets ended with each score (from the set winner's
+    side, e.g. 6-4), most common first.
+    """
+    counts = {}
+    for winner_games, loser_games, sets in result_cache.fetchall(
+            db_pool.CLIENT, 'set_score_counts'):
+        key = (max(winner_games, loser_games), min(winner_games, loser_games))
+        counts[key] = counts.get(key, 0) + sets
+    return sorted(((*key, sets) for key, sets in counts.items()),
+                  key=lambda row: (-row[2], -row[0], row[1]))
+
+
+def player_profiles(player_ids, recent=RECENT_MATCHES):
+    """
+    Returns the profiles of the given players (e.g. a draw's entrants) in
+    the order given: bio, current rankings, matches by surface, titles and
+    last recent matches, all from one call of the player_profiles
+    procedure. The sections are lists of dictionaries (PROFILE_SECTIONS).
+    Unknown player IDs are left out.
+    """
+    wanted = list(dict.fromkeys(str(player_id) for player_id in player_ids))
+    _require(len(wanted) <= statements.PROFILE_PLAYERS,
+             f'At most {statements.PROFILE_PLAYERS} players.')
+    _require(_is_count(recent) and int(recent) <= MAX_RECENT_MATCHES,
+             f'Recent matches must be 0 to {MAX_RECENT_MATCHES}.')
+    if not wanted:
+        return []
+    return profile_rows(wanted, result_cache.fetchsets(
+        db_pool.CLIENT, 'player_profiles',
+        (json.dumps(sorted(wanted)), int(recent))))
+
+
+def profile_rows(player_ids, sets):
+    """
+    Returns the player_profiles rows of the given players, in that order,
+    from the procedure's five result sets (each led by the player ID).
+    """
+    bios, *sections = sets
+    profiles = {row[0]: (tuple(row), {name: [] for name in PROFILE_SECTIONS})
+                for row in bios}
+    for name, rows in zip(PROFILE_SECTIONS, sections):
+        for player_id, *values in rows:
+            profiles[player_id][1][name].append(
+                dict(zip(PROFILE_SECTIONS[name], values)))
+    return [(*profiles[player_id][0], *profiles[player_id][1].values())
+            for player_id in player_ids if player_id in profiles]
+
+
+# ----------------------------------------------------------------------
+# Admin Operations
+# ----------------------------------------------------------------------
+def _write(name, params):
+    """
+    Runs a write statement on an admin connection, commits, and drops the
+    cached results it made stale.
+    """
+    with storage.connection(db_pool.ADMIN) as conn:
+        storage.execute(conn, name, params)
+        conn.commit()
+    result_cache.invalidate_for(name)
+
+
+def input_match_result(is_final, tournament_id, date, score, minutes,
+                       winner_id, loser_id, winner_aces=None,
+                       winner_bp_saved=None, winner_dfs=None,
+                       loser_aces=None, loser_bp_saved=None, loser_dfs=None):
+    """
+    Records a match result (and, for a final, the tournament history entry)
+    and returns the new match ID. The statistics are left as None for
+    matches that were not played.
+    """
+    _require(exists('tournament', 'tournament_id', tournament_id),
+             'Invalid tournament ID.')
+    _require(valid_date(str(date)), 'Invalid date format.')
+    _require(score and not str(score).isdecimal(), 'Invalid match score.')
+    _require(_is_count(minutes), 'Invalid duration.')
+    _require(exists('player', 'player_id', winner_id), 'Invalid winner ID.')
+    _require(exists('player', 'player_id', loser_id), 'Invalid loser ID.')
+    stats = (winner_aces, winner_bp_saved, winner_dfs,
+             loser_aces, loser_bp_saved, loser_dfs)
+    _require(all(stat is None or _is_count(stat) for stat in stats),
+             'Invalid match statistics.')
+    params = (1 if is_final else 0, tournament_id, date, score, minutes,
+              winner_id, winner_aces, winner_bp_saved, winner_dfs, loser_id,
+              loser_aces, loser_bp_saved, loser_dfs, )
+    # The procedure leaves the commit to us, so the match and its parsed
+    # score go in together (or, on an error, not at all)
+    with storage.connection(db_pool.ADMIN) as conn:
+        storage.execute(conn, 'input_match_results', params)
+        (match_id, ) = storage.fetchone(conn, 'new_match_id')
+        score_parser.write(conn, [(match_id, score)])
+        conn.commit()
+    result_cache.invalidate_for('input_match_results')
+    score_parser.invalidate()
+    analytics.engine.expire()
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            if elo.update(conn, replay=False) is None:
+                # Dated before the last match rated: the ratings have to be
+                # replayed, which is too slow to wait for here
+                elo.update_in_background()
+    except mysql.connector.Error:
+        # The match is in; the next update rates it along with later ones
+        pass
+    return match_id
+
+
+def update_player(player_id, attribute, value):
+    """
+    Changes one attribute (see PLAYER_ATTRIBUTES) of a player.
+    """
+    _require(exists('player', 'player_id', player_id), 'Invalid player ID.')
+    _require(attribute in PLAYER_ATTRIBUTES, 'Unknown option.')
+    if attribute == 'hand':
+        _require(str(value).upper() in ('R', 'L'), 'Invalid hand.')
+        value = str(value).upper()
+    elif attribute == 'dob':
+        _require(valid_date(str(value)), 'Invalid date of birth.')
+    elif attribute == 'country':
+        _require(len(value) == 3 and not value.isdecimal(),
+                 'Invalid country.')
+        value = value.upper()
+    elif attribute == 'height':
+        _require(_is_count(value), 'Invalid height.')
+    _write(statements.UPDATE_PLAYER_STATEMENTS[attribute].name,
+           (value, player_id, ))
+    # e.g. a new country code must be accepted by later validation
+    key_index.index.invalidate('player', attribute)
+    if attribute in ('first_name', 'last_name'):
+        name_search.index.invalidate()
+
+
+def update_ranking(rank, player_id, points, tournaments_played):
+    """
+    Puts a player at the given rank (1-20) in the current rankings.
+    """
+    _require(_is_count(rank) and MIN_RANK <= int(rank) <= MAX_RANK,
+             'Invalid rank.')
+    _require(exists('player', 'player_id', player_id), 'Invalid ID.')
+    _require(_is_count(points), 'Invalid number of points.')
+    _require(_is_count(tournaments_played),
+             'Invalid number of tournaments.')
+    _write('update_ranking', (player_id, points, tournaments_played, rank, ))
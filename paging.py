@@ -0,0 +1,223 @@
+"""
+Streaming and keyset pagination for queries that can return large result
+sets (e.g. every player outside the top 20, or every player from USA).
+
+stream() runs a statement on a server-side prepared cursor, which reads rows
+off the connection as they are fetched rather than buffering the whole
+result, and yields them in fetchmany() batches.
+
+Paged queries are registered with the columns they are ordered by. Each page
+is fetched with a WHERE clause that continues strictly after the last row
+of the previous page (keyset pagination), so every page costs the same
+index range scan no matter how deep into the result it is, unlike OFFSET.
+The position is handed back to the caller as an opaque continuation token.
+iter_rows() chains the pages into one generator, so callers can print the
+first row right away while memory stays bounded by the page size.
+
+Typical use:
+
+    for row in paging.iter_rows(db_pool.CLIENT, 'players_by_country_page',
+                                (country, )):
+        print(row)
+
+    rows, token = paging.fetch_page(db_pool.CLIENT,
+                                    'players_by_country_page', (country, ),
+                                    token=token)
+
+"""
+import base64
+import datetime
+import json
+
+import result_cache
+import statements
+import storage
+
+DEFAULT_PAGE_SIZE = 100
+DEFAULT_BATCH_SIZE = 50
+
+
+class PagedQuery:
+    """
+    A query paged on the given key columns, each a (column, descending)
+    pair. The statement's rows end with the key columns, in order, after the
+    columns meant for display.
+    """
+
+    def __init__(self, name, key_columns):
+        self.name = name
+        self.key_columns = key_columns
+        # Statement for the first page, and for the pages after a key
+        self.first = name + '_first'
+        self.after = name + '_after'
+
+    def display(self, row):
+        """
+        Returns the row without its trailing key columns.
+        """
+        return row[:-len(self.key_columns)]
+
+    def key(self, row):
+        """
+        Returns the key columns of a row.
+        """
+        return row[-len(self.key_columns):]
+
+
+PAGED_QUERIES = {}
+
+
+def keyset_predicate(key_columns):
+    """
+    Returns a WHERE condition matching the rows strictly after a key in
+    the given order, e.g. for (a ASC, b DESC):
+    (a > %s) OR (a = %s AND b < %s).
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(key_columns):
+        parts = [f'{earlier} = %s' for earlier, _ in key_columns[:i]]
+        parts.append(f'{column} {"<" if descending else ">"} %s')
+        clauses.append('(' + ' AND '.join(parts) + ')')
+    return '(' + ' OR '.join(clauses) + ')'
+
+
+def keyset_params(key):
+    """
+    Returns the parameters for keyset_predicate() after the given key.
+    """
+    params = []
+    for i in range(len(key)):
+        params.extend(key[:i])
+        params.append(key[i])
+    return params
+
+
+def register_paged(name, sql, key_columns, reads=()):
+    """
+    Registers a paged query. The SQL must contain {keyset} where the keyset
+    condition goes (after any other parameters) and {order_by} for the
+    ORDER BY list, and end with LIMIT %s.
+    """
+    order_by = ', '.join(f'{column} DESC' if descending else column
+                         for column, descending in key_columns)
+    query = PagedQuery(name, key_columns)
+    statements.register(query.first,
+                        sql.format(keyset='TRUE', order_by=order_by),
+                        reads=reads)
+    statements.register(query.after,
+                        sql.format(keyset=keyset_predicate(key_columns),
+                                   order_by=order_by),
+                        reads=reads)
+    PAGED_QUERIES[name] = query
+    return query
+
+
+def encode_token(key):
+    """
+    Returns the continuation token for the position after the given key.
+    """
+    data = json.dumps([value.isoformat()
+                       if isinstance(value, datetime.date) else value
+                       for value in key])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_token(token, key_columns):
+    """
+    Returns the key a continuation token points after, which must have a
+    value for each of the key columns. Dates come back as ISO strings,
+    which MySQL compares to DATE columns correctly.
+    """
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        key = None
+    if (not isinstance(key, list) or len(key) != len(key_columns)
+            or not all(isinstance(value, (str, int, float))
+                       or value is None for value in key)):
+        raise ValueError(f'Invalid continuation token: {token!r}')
+    return key
+
+
+# ----------------------------------------------------------------------
+# Paged Query Definitions
+# ----------------------------------------------------------------------
+# Youngest first (latest date of birth); player_id breaks ties.
+register_paged('players_outside_top_20_page', """
+    SELECT first_name,
+        last_name,
+        TIMESTAMPDIFF(YEAR, dob, current_date()) AS age,
+        dob,
+        player_id
+    FROM player
+    WHERE player_id NOT IN (
+            SELECT player_id
+            FROM ranking
+            WHERE `rank` <= 20
+        )
+        AND {keyset}
+    ORDER BY {order_by}
+    LIMIT %s""", (('dob', True), ('player_id', False)),
+               reads=('player', 'ranking'))
+
+register_paged('players_by_country_page', """
+    SELECT first_name, last_name, hand, height,
+        last_name, first_name, player_id
+    FROM player
+    WHERE country = %s
+        AND {keyset}
+    ORDER BY {order_by}
+    LIMIT %s""", (('last_name', False), ('first_name', False),
+                  ('player_id', False)),
+               reads=('player', ))
+
+
+# ----------------------------------------------------------------------
+# Fetching
+# ----------------------------------------------------------------------
+def stream(role, name, params=(), batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields the rows of the named statement as they arrive from the server,
+    fetching batch_size rows at a time. The connection stays checked out
+    until the generator is exhausted or closed.
+    """
+    with storage.connection(role) as conn:
+        yield from storage.iterate(conn, name, params, batch_size)
+
+
+def fetch_page(role, name, params=(), token=None,
+               page_size=DEFAULT_PAGE_SIZE, cached=True):
+    """
+    Returns one page of a paged query as (rows, next_token), where the rows
+    hold only the display columns and next_token is None on the last page.
+    Pages go through the result cache unless cached is False.
+    """
+    query = PAGED_QUERIES[name]
+    if token is None:
+        statement = query.first
+        params = (*params, page_size)
+    else:
+        statement = query.after
+        key = decode_token(token, query.key_columns)
+        params = (*params, *keyset_params(key), page_size)
+    if cached:
+        rows = result_cache.fetchall(role, statement, params)
+    else:
+        rows = list(stream(role, statement, params))
+    next_token = None
+    if len(rows) == page_size:
+        next_token = encode_token(query.key(rows[-1]))
+    return [query.display(row) for row in rows], next_token
+
+
+def iter_rows(role, name, params=(), page_size=DEFAULT_PAGE_SIZE,
+              cached=True):
+    """
+    Yields every row of a paged query, fetching one page at a time.
+    """
+    token = None
+    while True:
+        rows, token = fetch_page(role, name, params, token, page_size, cached)
+        yield from rows
+        if token is None:
+            break
@@ -24,6 +24,7 @@ FROM player
 WHERE player_id NOT IN (
         SELECT player_id
         FROM ranking
+        WHERE `rank` <= 20
     )
 ORDER BY age;
 
@@ -0,0 +1,281 @@
+"""
+Loads weekly WTA rankings in Jeff Sackmann's tennis_wta format (the
+wta_rankings_*.csv files: ranking_date, rank, player, points and, in most
+files, tours) into ranking_history, and publishes the latest week as the
+current ranking.
+
+Rather than changing the current ranking one rank at a time like the admin
+prompt does, each week is loaded in a single transaction: its rows replace
+any earlier load of the same week in ranking_history (in multi-row INSERTs
+of --batch-size rows), and if it is the newest week loaded so far, the
+ranking table is emptied and refilled from it before the commit. Readers
+see either the previous week or the new one in full, never a mix of the
+two, and a load that fails leaves both tables as they were. Every ranked
+player is kept in ranking_history; ranking, whose foreign key needs them,
+only gets the players that are in the player table.
+
+Usage:
+
+    $ python rankings.py wta_rankings_current.csv [more files ...]
+        [--batch-size 1000] [--history-only] [--dry-run]
+
+"""
+import argparse
+import csv
+import datetime
+import itertools
+import sys
+import time
+
+import mysql.connector
+
+import db_pool
+import result_cache
+import statements
+import storage
+
+# Columns of ranking_history filled from a Sackmann ranking record, in
+# INSERT order.
+RANKING_COLUMNS = ('ranking_date', '`rank`', 'player_id', 'player_points',
+                   'tournaments')
+
+# Limits from setup.sql that a record must fit in.
+MAX_PLAYER_ID = 6
+
+DEFAULT_BATCH_SIZE = 1000
+
+statements.register('ranking_history_clear_week', """
+    DELETE FROM ranking_history
+    WHERE ranking_date = %s""",
+                    writes=('ranking_history', ))
+
+statements.register('ranking_history_insert', f"""
+    INSERT INTO ranking_history ({', '.join(RANKING_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(RANKING_COLUMNS))})""",
+                    writes=('ranking_history', ))
+
+statements.register('latest_ranking_date', """
+    SELECT MAX(ranking_date)
+    FROM ranking_history""",
+                    reads=('ranking_history', ))
+
+statements.register('clear_ranking', 'DELETE FROM ranking',
+                    writes=('ranking', ))
+
+statements.register('publish_ranking', """
+    INSERT INTO ranking (player_id, `rank`, player_points, tournaments_played)
+    SELECT H.player_id,
+        H.`rank`,
+        COALESCE(H.player_points, 0),
+        COALESCE(H.tournaments, 0)
+    FROM ranking_history AS H
+        JOIN player AS P ON P.player_id = H.player_id
+    WHERE H.ranking_date = %s""",
+                    writes=('ranking', ))
+
+
+class RejectedRecord(ValueError):
+    """
+    Raised when a ranking record can't be mapped onto the ranking_history
+    schema.
+    """
+
+
+# ----------------------------------------------------------------------
+# Reading and Mapping Records
+# ----------------------------------------------------------------------
+def read_records(path):
+    """
+    Yields each ranking record in a Sackmann rankings file as a list of
+    fields. The header row, which some of the files don't have, is
+    skipped.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.reader(f):
+            if row and row[0] != 'ranking_date':
+                yield row
+
+
+def _int_or_none(value):
+    """
+    Converts a numeric field (which may be blank or written as a float,
+    e.g. 4.0) to an int, or None if it is blank.
+    """
+    if value is None or str(value).strip() == '':
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        raise RejectedRecord(f'not a number: {value!r}')
+
+
+def map_ranking(record):
+    """
+    Maps a Sackmann ranking record to a tuple of RANKING_COLUMNS values.
+    """
+    if len(record) < 4:
+        raise RejectedRecord('too few fields')
+    try:
+        date = datetime.datetime.strptime(record[0].strip(), '%Y%m%d').date()
+    except ValueError:
+        raise RejectedRecord(f'bad ranking_date: {record[0]!r}')
+    rank = _int_or_none(record[1])
+    if rank is None or rank < 1:
+        raise RejectedRecord(f'bad rank: {record[1]!r}')
+    player_id = record[2].strip()
+    if not player_id or len(player_id) > MAX_PLAYER_ID:
+        raise RejectedRecord(f'unsupported player: {player_id!r}')
+    tournaments = _int_or_none(record[4]) if len(record) > 4 else None
+    return (date, rank, player_id, _int_or_none(record[3]), tournaments)
+
+
+# ----------------------------------------------------------------------
+# Loading
+# ----------------------------------------------------------------------
+class LoadStats:
+    """
+    Running totals for a load, used for progress reports.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.loaded = 0
+        self.weeks = 0
+        self.published = None
+        self.rejected = {}
+
+    def reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        rate = self.loaded / elapsed if elapsed > 0 else 0.0
+        published = (f'published {self.published}' if self.published
+                     else 'current ranking unchanged')
+        return (f'{self.read} read, {self.loaded} loaded in {self.weeks} '
+                f'weeks, {sum(self.rejected.values())} rejected; '
+                f'{published}; {rate:.0f} rows/s')
+
+
+class RankingLoader:
+    """
+    Loads weeks of ranking records, one transaction per week. Set
+    history_only to leave the current ranking alone, and dry_run to
+    validate and map records without writing anything.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, history_only=False,
+                 dry_run=False):
+        self.batch_size = batch_size
+        self.history_only = history_only
+        self.dry_run = dry_run
+        self.stats = LoadStats()
+        self._weeks_seen = set()
+
+    def _mapped(self, records):
+        for record in records:
+            self.stats.read += 1
+            try:
+                yield map_ranking(record)
+            except RejectedRecord as err:
+                self.stats.reject(str(err))
+
+    def weeks(self, records):
+        """
+        Groups mapped records into (ranking_date, rows) weeks. The files are
+        sorted by date, so a week is a run of consecutive records; one that
+        shows up again later in the input is an error, since loading it
+        twice would replace its first part.
+        """
+        for date, week in itertools.groupby(self._mapped(records),
+                                            key=lambda row: row[0]):
+            if date in self._weeks_seen:
+                raise RejectedRecord(f'the records of {date} are not '
+                                     f'together; sort the file by '
+                                     f'ranking_date')
+            self._weeks_seen.add(date)
+            # A player listed twice in a week keeps their first entry
+            found = {}
+            for row in week:
+                if row[2] in found:
+                    self.stats.reject('duplicate player in week')
+                else:
+                    found[row[2]] = row
+            yield date, list(found.values())
+
+    def load_week(self, conn, date, rows):
+        """
+        Replaces one week in ranking_history and, if it is the newest week,
+        publishes it as the current ranking, all in one transaction.
+        Returns True if the week was published.
+        """
+        if self.dry_run:
+            return False
+        try:
+            latest = storage.fetchone(conn, 'latest_ranking_date')[0]
+            storage.execute(conn, 'ranking_history_clear_week', (date, ))
+            for i in range(0, len(rows), self.batch_size):
+                storage.executemany(conn, 'ranking_history_insert',
+                                    rows[i:i + self.batch_size])
+            # Dates come back as text from SQLite
+            publish = (not self.history_only
+                       and (latest is None
+                            or date.isoformat() >= str(latest)))
+            if publish:
+                storage.execute(conn, 'clear_ranking')
+                storage.execute(conn, 'publish_ranking', (date, ))
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+        result_cache.invalidate_for('ranking_history_insert')
+        if publish:
+            result_cache.invalidate_for('publish_ranking')
+        return publish
+
+    def run(self, records, conn):
+        """
+        Loads an iterable of Sackmann ranking records over the given admin
+        connection.
+        """
+        for date, rows in self.weeks(records):
+            if self.load_week(conn, date, rows):
+                self.stats.published = date
+            self.stats.weeks += 1
+            self.stats.loaded += len(rows)
+        return self.stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Load Sackmann tennis_wta ranking files into wtadb.')
+    parser.add_argument('files', nargs='+', help='ranking files (.csv)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='rows per multi-row INSERT')
+    parser.add_argument('--history-only', action='store_true',
+                        help='only add the weeks to ranking_history, '
+                             'leaving the current ranking alone')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='validate and map records without writing')
+    args = parser.parse_args(argv)
+
+    loader = RankingLoader(args.batch_size, args.history_only, args.dry_run)
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            for path in args.files:
+                print(f'Loading {path}...', file=sys.stderr)
+                loader.run(read_records(path), conn)
+    except (RejectedRecord, mysql.connector.Error) as err:
+        print(f'Load failed: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    print(loader.stats.summary())
+    for reason, count in sorted(loader.stats.rejected.items()):
+        print(f'  rejected ({reason}): {count}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
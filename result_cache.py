@@ -0,0 +1,232 @@
+"""
+Read-through cache of query results for the fan-facing queries.
+
+Results are cached under the statement name and its (normalized)
+parameters, so e.g. repeated lookups of the Australian Open winners or the
+top 20 are answered without going to MySQL. The cache holds at most
+max_entries results, evicting the least recently used one when full, and
+each entry expires after ttl seconds.
+
+Every statement in the registry lists the tables it reads and writes, so
+when an admin write commits, invalidate_for() drops exactly the cached
+results that read one of the tables it wrote. A result loaded while one
+of its tables was being invalidated is returned but not cached, since the
+load may have read the rows from before the write; with read replicas, the
+same goes for results loaded up to max_replica_lag seconds after the
+invalidation (see db_pool.py). Writes made by other processes are not
+seen; the TTL bounds how stale a result can get.
+
+Typical use:
+
+    rows = result_cache.fetchall(db_pool.CLIENT, 'tournament_winners',
+                                 (tournament, ))
+
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import db_pool
+import statements
+import storage
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL = 300
+
+
+def normalize(params):
+    """
+    Returns the cache key form of a statement's parameters. Strings are
+    case-folded, since the columns the fan queries filter on use MySQL's
+    case-insensitive default collation ('australian open' finds the same
+    rows as 'Australian Open').
+    """
+    return tuple(param.casefold() if isinstance(param, str) else param
+                 for param in params)
+
+
+class ResultCache:
+    """
+    A size-bounded LRU cache of query results with a TTL and per-table
+    invalidation.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expiry time, rows), least recently used first
+        self._entries = OrderedDict()
+        # table -> keys of the cached results that read it
+        self._by_table = {}
+        self._lock = threading.Lock()
+        # Bumped by every invalidation; table -> (generation, time) of the
+        # table's last invalidation
+        self._generation = 0
+        self._invalidated = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_loads = 0
+
+    def _remove(self, key):
+        """
+        Drops one entry. Must be called with the lock held.
+        """
+        del self._entries[key]
+        for table in statements.STATEMENTS[key[0]].reads:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+
+    def get(self, name, params):
+        """
+        Returns the cached rows for the statement and parameters, or None
+        if they are not cached (or have expired).
+        """
+        key = (name, normalize(params))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def _stale(self, name, generation, since):
+        """
+        Returns True if a table the statement reads was invalidated after
+        the given generation or time. Must be called with the lock held.
+        """
+        for table in statements.STATEMENTS[name].reads:
+            invalidated = self._invalidated.get(table)
+            if invalidated is not None and (invalidated[0] > generation
+                                            or invalidated[1] > since):
+                return True
+        return False
+
+    def put(self, name, params, rows, generation=None, since=None):
+        """
+        Caches the rows returned by the statement for the parameters. Given
+        the generation and time at which the rows started loading, they are
+        not cached if a table they were read from has been invalidated
+        since.
+        """
+        key = (name, normalize(params))
+        with self._lock:
+            if generation is not None and self._stale(name, generation,
+                                                      since):
+                self.stale_loads += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, rows)
+            for table in statements.STATEMENTS[name].reads:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def get_or_load(self, name, params, load, settle=0):
+        """
+        Returns the cached rows for the statement and parameters, calling
+        load() to fetch (and cache) them on a miss. The rows are not cached
+        if a table they read was invalidated during the load, or less than
+        settle seconds before it (e.g. while replicas catch up).
+        """
+        rows = self.get(name, params)
+        if rows is None:
+            with self._lock:
+                generation = self._generation
+            started = time.monotonic()
+            rows = load()
+            self.put(name, params, rows, generation, started - settle)
+        return rows
+
+    def invalidate(self, tables):
+        """
+        Drops every cached result that reads one of the given tables.
+        """
+        with self._lock:
+            self._generation += 1
+            now = time.monotonic()
+            for table in tables:
+                self._invalidated[table] = (self._generation, now)
+                for key in list(self._by_table.get(table, ())):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def invalidate_for(self, name):
+        """
+        Drops every cached result made stale by running the named write
+        statement.
+        """
+        self.invalidate(statements.STATEMENTS[name].writes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+    def stats(self):
+        """
+        Returns the cache's hit, miss, eviction and invalidation counters.
+        """
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'invalidations': self.invalidations,
+                    'stale_loads': self.stale_loads}
+
+
+# The cache shared by the whole application.
+cache = ResultCache()
+
+
+def _settle(role):
+    """
+    Returns how many seconds after an invalidation a read by the role may
+    still return the rows from before it: up to max_replica_lag when
+    client reads go to replicas, otherwise 0.
+    """
+    if role != db_pool.CLIENT:
+        return 0
+    config = db_pool.get_config()
+    if not config['replicas'].strip():
+        return 0
+    return float(config['max_replica_lag'])
+
+
+def fetchall(role, name, params=()):
+    """
+    Returns all rows of the named statement, from the cache if possible,
+    otherwise by running it on a connection from the given role's pool.
+    """
+    def load():
+        with storage.connection(role) as conn:
+            return storage.fetchall(conn, name, params)
+    return cache.get_or_load(name, params, load, _settle(role))
+
+
+def fetchsets(role, name, params=()):
+    """
+    Returns the result sets of the named multi-result statement (see
+    storage.fetchsets()), from the cache if possible.
+    """
+    def load():
+        with storage.connection(role) as conn:
+            return storage.fetchsets(conn, name, params)
+    return cache.get_or_load(name, params, load, _settle(role))
+
+
+def invalidate_for(name):
+    """
+    Drops the cached results made stale by the named write statement.
+    Called after the write commits.
+    """
+    cache.invalidate_for(name)
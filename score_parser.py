@@ -0,0 +1,274 @@
+"""
+Parses match_result.score (e.g. '7-6(6) 6-2', '6-3 2-1 RET', 'W/O') into
+the match_score and match_set tables, so that questions about sets
+(tiebreaks won, three setters, bagels, retirements) are indexed column
+queries instead of LIKE scans over every score.
+
+Each match gets one match_score row: how it ended (STATUS), the sets
+played and won by each side, and the tiebreaks and 6-0 sets each side
+won. Each set gets a match_set row with the games of the match winner and
+loser and, for a tiebreak, the points of its loser as written in
+parentheses. A match tiebreak written as [10-8] is stored as a 1-0 set
+with 8 tiebreak points. Scores that can't be read get status 'U' and no
+sets.
+
+The parser is a couple of regular expressions over the whitespace
+separated parts of a score, and results are cached by score string, since
+the same few thousand scores make up almost every match. Rows are written
+on every insert path: operations.input_match_result and ingest.py parse
+the scores of the matches they add, and
+
+    $ python score_parser.py backfill
+
+parses every match without a match_score row, e.g. after load-data.sql or
+after a failed write (--rebuild reparses every match).
+"""
+import argparse
+import collections
+import functools
+import re
+import sys
+import time
+
+import mysql.connector
+
+import db_pool
+import result_cache
+import statements
+import storage
+
+# How a match ended
+PLAYED = 'P'
+RETIRED = 'R'
+WALKOVER = 'W'
+DEFAULTED = 'D'
+UNPARSED = 'U'
+STATUS = {PLAYED: 'played', RETIRED: 'retired', WALKOVER: 'walkover',
+          DEFAULTED: 'defaulted', UNPARSED: 'unparsed'}
+
+_SET = re.compile(r'(\d{1,2})-(\d{1,2})(?:\((\d{1,2})(?:-(\d{1,2}))?\))?$')
+_MATCH_TIEBREAK = re.compile(r'\[(\d{1,2})-(\d{1,2})\]$')
+_ENDINGS = {
+    'RET': RETIRED, 'RET.': RETIRED, 'RETIRED': RETIRED, 'ABD': RETIRED,
+    'ABN': RETIRED, 'ABANDONED': RETIRED,
+    'DEF': DEFAULTED, 'DEF.': DEFAULTED, 'DEFAULT': DEFAULTED,
+}
+_WALKOVERS = {'W/O', 'WO', 'W/O.', 'WALKOVER'}
+# Rows per batch of the backfill
+DEFAULT_BATCH_SIZE = 5000
+
+SCORE_COLUMNS = ('match_id', 'status', 'sets', 'winner_sets', 'loser_sets',
+                 'winner_tiebreaks', 'loser_tiebreaks', 'winner_bagels',
+                 'loser_bagels')
+SET_COLUMNS = ('match_id', 'set_number', 'winner_games', 'loser_games',
+               'tiebreak_points')
+
+statements.register('insert_match_score', f"""
+    REPLACE INTO match_score ({', '.join(SCORE_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(SCORE_COLUMNS))})""",
+                    writes=('match_score', ))
+
+statements.register('insert_match_set', f"""
+    REPLACE INTO match_set ({', '.join(SET_COLUMNS)})
+    VALUES ({', '.join(['%s'] * len(SET_COLUMNS))})""",
+                    writes=('match_set', ))
+
+statements.register('unparsed_scores', """
+    SELECT M.match_id, M.score
+    FROM match_result AS M
+        LEFT JOIN match_score AS S ON S.match_id = M.match_id
+    WHERE M.match_id > %s
+        AND S.match_id IS NULL
+    ORDER BY M.match_id
+    LIMIT %s""",
+                    reads=('match_result', 'match_score'))
+
+# A player's matches, from the side of the winner and then the loser
+_SIDE_STATS = """
+    SELECT COUNT(*), SUM(S.sets = 3 AND S.status = 'P'),
+        SUM(S.{won}_tiebreaks), SUM(S.{lost}_tiebreaks),
+        SUM(S.{won}_bagels), SUM(S.{lost}_bagels),
+        SUM(S.status = 'R'), SUM(S.status = 'W')
+    FROM match_result AS M
+        JOIN match_score AS S ON S.match_id = M.match_id
+    WHERE M.{won}_id = %s"""
+
+statements.register('player_score_stats', (
+    _SIDE_STATS.format(won='winner', lost='loser') + '\n    UNION ALL'
+    + _SIDE_STATS.format(won='loser', lost='winner')),
+                    reads=('match_result', 'match_score'))
+
+statements.register('set_score_counts', """
+    SELECT winner_games, loser_games, COUNT(*)
+    FROM match_set
+    GROUP BY winner_games, loser_games""",
+                    reads=('match_set', ))
+
+statements.register('clear_match_scores', 'DELETE FROM match_score',
+                    writes=('match_score', 'match_set'))
+
+statements.register('clear_match_sets', 'DELETE FROM match_set',
+                    writes=('match_set', ))
+
+
+class ParsedScore(collections.namedtuple(
+        'ParsedScore', 'status sets winner_sets loser_sets winner_tiebreaks '
+                       'loser_tiebreaks winner_bagels loser_bagels')):
+    """
+    A parsed score. sets holds a (winner_games, loser_games,
+    tiebreak_points) tuple per set, from the match winner's side;
+    tiebreak_points is None for sets without a tiebreak.
+    """
+
+
+def _set_winner(winner_games, loser_games, tiebreak):
+    """
+    Returns 1 if the match winner won a set, -1 if the loser did, or 0 if
+    it wasn't finished (e.g. the set a player retired in).
+    """
+    high, low = max(winner_games, loser_games), min(winner_games,
+                                                    loser_games)
+    finished = (tiebreak or (high >= 6 and high - low >= 2)
+                or (high == 7 and low == 6))
+    if not finished:
+        return 0
+    return 1 if winner_games > loser_games else -1
+
+
+@functools.lru_cache(maxsize=65536)
+def parse(score):
+    """
+    Parses a score string into a ParsedScore.
+    """
+    parts = str(score or '').upper().split()
+    if not parts or ' '.join(parts) in _WALKOVERS:
+        status = WALKOVER if parts else UNPARSED
+        return ParsedScore(status, (), 0, 0, 0, 0, 0, 0)
+    status = PLAYED
+    if parts[-1] in _ENDINGS:
+        status = _ENDINGS[parts.pop()]
+    sets = []
+    won = [0, 0]
+    tiebreaks = [0, 0]
+    bagels = [0, 0]
+    for part in parts:
+        found = _SET.match(part)
+        if found:
+            winner_games, loser_games = int(found[1]), int(found[2])
+            points = found[3]
+            if points is not None and found[4] is not None:
+                # Written as both players' points, e.g. 7-6(7-5)
+                points = min(int(found[3]), int(found[4]))
+            points = None if points is None else int(points)
+            tiebreak = points is not None or {winner_games,
+                                              loser_games} == {6, 7}
+        else:
+            found = _MATCH_TIEBREAK.match(part)
+            if not found:
+                return ParsedScore(UNPARSED, (), 0, 0, 0, 0, 0, 0)
+            first, second = int(found[1]), int(found[2])
+            winner_games, loser_games = (1, 0) if first > second else (0, 1)
+            points, tiebreak = min(first, second), True
+        sets.append((winner_games, loser_games, points))
+        side = _set_winner(winner_games, loser_games, tiebreak)
+        if side:
+            index = 0 if side > 0 else 1
+            won[index] += 1
+            if tiebreak:
+                tiebreaks[index] += 1
+            if min(winner_games, loser_games) == 0 and max(
+                    winner_games, loser_games) == 6:
+                bagels[index] += 1
+    return ParsedScore(status, tuple(sets), won[0], won[1], tiebreaks[0],
+                       tiebreaks[1], bagels[0], bagels[1])
+
+
+def rows(matches):
+    """
+    Returns the match_score and match_set rows (SCORE_COLUMNS and
+    SET_COLUMNS) of (match_id, score) pairs.
+    """
+    score_rows, set_rows = [], []
+    for match_id, score in matches:
+        parsed = parse(score)
+        score_rows.append((match_id, parsed.status, len(parsed.sets),
+                           *parsed[2:]))
+        set_rows.extend((match_id, number, *games)
+                        for number, games in enumerate(parsed.sets, 1))
+    return score_rows, set_rows
+
+
+def write(conn, matches):
+    """
+    Parses the scores of (match_id, score) pairs and writes their rows,
+    without committing.
+    """
+    score_rows, set_rows = rows(matches)
+    if score_rows:
+        storage.executemany(conn, 'insert_match_score', score_rows)
+    if set_rows:
+        storage.executemany(conn, 'insert_match_set', set_rows)
+
+
+def invalidate():
+    """
+    Drops the cached results that read the parsed scores.
+    """
+    result_cache.invalidate_for('insert_match_score')
+    result_cache.invalidate_for('insert_match_set')
+
+
+def backfill(conn, batch_size=DEFAULT_BATCH_SIZE, rebuild=False):
+    """
+    Parses the scores of every match without a match_score row (with
+    rebuild, of every match), committing each batch. Returns the number of
+    matches parsed.
+    """
+    parsed = 0
+    after = 0
+    try:
+        if rebuild:
+            storage.execute(conn, 'clear_match_sets')
+            storage.execute(conn, 'clear_match_scores')
+        while True:
+            matches = storage.fetchall(conn, 'unparsed_scores',
+                                       (after, batch_size))
+            if not matches:
+                break
+            write(conn, matches)
+            conn.commit()
+            parsed += len(matches)
+            after = matches[-1][0]
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    conn.commit()
+    invalidate()
+    return parsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Parse match scores into match_score and match_set.')
+    parser.add_argument('command', choices=('backfill', ))
+    parser.add_argument('--rebuild', action='store_true',
+                        help='reparse every match, not just new ones')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='matches per transaction')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    try:
+        with storage.connection(db_pool.ADMIN) as conn:
+            parsed = backfill(conn, args.batch_size, args.rebuild)
+    except mysql.connector.Error as err:
+        print(f'Backfill failed: {err}', file=sys.stderr)
+        return 1
+    finally:
+        storage.close_all()
+    print(f'Parsed {parsed} scores in {time.perf_counter() - start:.2f}s')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
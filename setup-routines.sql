@@ -3,10 +3,36 @@ DROP FUNCTION IF EXISTS find_matchup_history;
 DROP FUNCTION IF EXISTS find_highest_ranked_player;
 DROP PROCEDURE IF EXISTS input_match_results;
 DROP PROCEDURE IF EXISTS update_tournaments_played;
+DROP PROCEDURE IF EXISTS apply_tournaments_played;
 DROP TRIGGER IF EXISTS trg_match_result_insert;
+DROP PROCEDURE IF EXISTS add_surface_result;
+DROP PROCEDURE IF EXISTS rebuild_player_surface_stats;
+DROP TRIGGER IF EXISTS trg_surface_stats_insert;
+DROP TRIGGER IF EXISTS trg_surface_stats_update;
+DROP TRIGGER IF EXISTS trg_surface_stats_delete;
+DROP PROCEDURE IF EXISTS reset_last_meeting;
+DROP PROCEDURE IF EXISTS add_head_to_head_result;
+DROP PROCEDURE IF EXISTS rebuild_head_to_head;
+DROP TRIGGER IF EXISTS trg_head_to_head_insert;
+DROP TRIGGER IF EXISTS trg_head_to_head_update;
+DROP TRIGGER IF EXISTS trg_head_to_head_delete;
+DROP PROCEDURE IF EXISTS player_profiles;
+DROP TRIGGER IF EXISTS trg_change_log_player_insert;
+DROP TRIGGER IF EXISTS trg_change_log_player_update;
+DROP TRIGGER IF EXISTS trg_change_log_player_delete;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_insert;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_update;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_delete;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_insert;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_update;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_delete;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_insert;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_update;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_delete;
 
 -- A function that executes given two player names. Reports their
--- most recent score results with the winner name.
+-- most recent score results with the winner name, from the pair's
+-- head_to_head row.
 -- Returns NULL if no matches were played between them or player
 -- is not in the database.
 DELIMITER !
@@ -42,20 +68,12 @@ CREATE FUNCTION find_matchup_history(
         THEN RETURN NULL;
     END IF;
 
-    SELECT score,
-        winner_id INTO match_score,
+    SELECT last_score,
+        last_winner_id INTO match_score,
         w_id
-    FROM match_result
-    WHERE (
-            winner_id = player1_id
-            AND loser_id = player2_id
-        )
-        OR (
-            winner_id = player2_id
-            AND loser_id = player1_id
-        )
-    ORDER BY tournament_date DESC
-    LIMIT 1;
+    FROM head_to_head
+    WHERE player_a = LEAST(player1_id, player2_id)
+        AND player_b = GREATEST(player1_id, player2_id);
 
     -- No match was played between the two specified players
     IF match_score IS NULL
@@ -75,7 +93,13 @@ DELIMITER ;
 
 -- A procedure to execute when given a match result data. If the match is
 -- a final, update the tournament history table accordingly. Update
--- the match result table as well.
+-- the match result table as well. The new match ID is assigned by
+-- AUTO_INCREMENT (so concurrent admins never race for the same ID) and
+-- returned through new_match_id. Both inserts happen in one transaction:
+-- called with autocommit off (as from Python), the procedure runs in the
+-- caller's transaction and leaves the commit to the caller, so that e.g.
+-- the parsed score can be written in the same transaction; called with
+-- autocommit on (as from the mysql client), it commits by itself.
 DELIMITER !
 CREATE PROCEDURE input_match_results(
     is_final TINYINT,
@@ -90,18 +114,46 @@ CREATE PROCEDURE input_match_results(
     loser_id CHAR(6),
     loser_aces INT,
     loser_bp_saved INT,
-    loser_dfs INT
+    loser_dfs INT,
+    OUT new_match_id INT
 ) BEGIN
 
-    DECLARE new_match_id INT DEFAULT NULL;
     DECLARE match_year CHAR(4) DEFAULT NULL;
+    DECLARE own_transaction TINYINT DEFAULT @@autocommit;
+
+    -- Never leave a match without its tournament history entry (or the
+    -- other way around) if either insert fails. In the caller's
+    -- transaction, the caller rolls back.
+    DECLARE EXIT HANDLER FOR SQLEXCEPTION
+    BEGIN
+        IF own_transaction = 1 THEN
+            ROLLBACK;
+            SET autocommit = 1;
+        END IF;
+        RESIGNAL;
+    END;
 
-    SET new_match_id = ((SELECT MAX(match_id) FROM match_result) + 1);
     SET match_year = (SELECT YEAR(match_date));
 
-    INSERT INTO match_result
+    IF own_transaction = 1 THEN
+        SET autocommit = 0;
+    END IF;
+
+    INSERT INTO match_result (
+            tournament_id,
+            tournament_date,
+            score,
+            minutes,
+            winner_id,
+            winner_aces,
+            winner_bp_saved,
+            winner_dfs,
+            loser_id,
+            loser_aces,
+            loser_bp_saved,
+            loser_dfs
+        )
     VALUES (
-            new_match_id,
             tournament_id,
             match_date,
             score,
@@ -116,6 +168,10 @@ CREATE PROCEDURE input_match_results(
             loser_dfs
         );
 
+    -- LAST_INSERT_ID() is kept per connection, so this is the ID of the
+    -- row inserted above even when other sessions insert concurrently
+    SET new_match_id = LAST_INSERT_ID();
+
     IF is_final = 1
         THEN INSERT INTO tournament_history
         VALUES (
@@ -127,12 +183,18 @@ CREATE PROCEDURE input_match_results(
             );
     END IF;
 
+    IF own_transaction = 1 THEN
+        COMMIT;
+        SET autocommit = 1;
+    END IF;
+
 END !
 DELIMITER ;
 
 -- A procedure that is called after inserting data into match results
 -- to update the number of tournaments played (if necessary) in the
--- rankings table.
+-- rankings table. Each count is answered from the covering index for its
+-- side of the match.
 DELIMITER !
 CREATE PROCEDURE update_tournaments_played(
     p_id CHAR(6),
@@ -141,64 +203,483 @@ CREATE PROCEDURE update_tournaments_played(
 ) BEGIN
 
     DECLARE num_matches INT DEFAULT NULL;
-    DECLARE ranked_id CHAR(6) DEFAULT NULL;
-    DECLARE curr_played INT DEFAULT NULL;
 
     SET num_matches = (
             SELECT COUNT(*)
             FROM match_result
-            WHERE tournament_id = t_id
+            WHERE winner_id = p_id
+                AND tournament_id = t_id
+                AND tournament_date = m_date
+        ) + (
+            SELECT COUNT(*)
+            FROM match_result
+            WHERE loser_id = p_id
+                AND tournament_id = t_id
                 AND tournament_date = m_date
-                AND (
-                    winner_id = p_id
-                    OR loser_id = p_id
-                )
         );
 
-    SET ranked_id = (SELECT player_id FROM ranking WHERE player_id = p_id);
-
-    IF ranked_id IS NOT NULL
-        THEN SET curr_played = (
-                SELECT tournaments_played
-                FROM ranking
-                WHERE player_id = p_id
-            );
-        END IF;
-
-    IF num_matches = 1 AND ranked_id IS NOT NULL
+    -- Only a player's first match of a tournament counts as a new
+    -- tournament played; unranked players have no row to update
+    IF num_matches = 1
         THEN
         UPDATE ranking
-        SET tournaments_played = curr_played + 1
+        SET tournaments_played = tournaments_played + 1
         WHERE player_id = p_id;
     END IF;
 
 END !
 DELIMITER ;
 
+-- Set-based equivalent of update_tournaments_played for a batch of matches
+-- with IDs first_id to last_id. Adds one tournament played for every ranked
+-- player and tournament in the batch that the player had no match in
+-- outside of the batch, so each player is updated once per batch instead
+-- of once per row. Used together with @defer_tournaments_played (see the
+-- trigger below) by bulk loads, which must be the only writer of match IDs
+-- in that range.
+DELIMITER !
+CREATE PROCEDURE apply_tournaments_played(
+    first_id INT,
+    last_id INT
+) BEGIN
+
+    UPDATE ranking
+        JOIN (
+            SELECT player_id,
+                COUNT(*) AS new_tournaments
+            FROM (
+                    SELECT DISTINCT B.player_id,
+                        B.tournament_id,
+                        B.tournament_date
+                    FROM (
+                            SELECT winner_id AS player_id,
+                                tournament_id,
+                                tournament_date
+                            FROM match_result
+                            WHERE match_id BETWEEN first_id AND last_id
+                            UNION ALL
+                            SELECT loser_id AS player_id,
+                                tournament_id,
+                                tournament_date
+                            FROM match_result
+                            WHERE match_id BETWEEN first_id AND last_id
+                        ) AS B
+                    WHERE B.player_id IN (
+                            SELECT player_id
+                            FROM ranking
+                        )
+                        AND NOT EXISTS (
+                            SELECT 1
+                            FROM match_result AS M
+                            WHERE M.winner_id = B.player_id
+                                AND M.tournament_id = B.tournament_id
+                                AND M.tournament_date = B.tournament_date
+                                AND M.match_id NOT BETWEEN first_id AND last_id
+                        )
+                        AND NOT EXISTS (
+                            SELECT 1
+                            FROM match_result AS M
+                            WHERE M.loser_id = B.player_id
+                                AND M.tournament_id = B.tournament_id
+                                AND M.tournament_date = B.tournament_date
+                                AND M.match_id NOT BETWEEN first_id AND last_id
+                        )
+                ) AS T
+            GROUP BY player_id
+        ) AS N ON ranking.player_id = N.player_id
+    SET ranking.tournaments_played =
+        ranking.tournaments_played + N.new_tournaments;
+
+END !
+DELIMITER ;
+
 -- A trigger to handle inserts to the match results table. If the inserted
 -- match is from a new tournament, update the number of tournaments played for
--- the specified player if they are in the rankings table.
+-- the specified player if they are in the rankings table. Sessions that set
+-- @defer_tournaments_played = 1 skip this and call apply_tournaments_played
+-- once for the whole batch instead.
 DELIMITER !
 CREATE TRIGGER trg_match_result_insert AFTER INSERT
     ON match_result FOR EACH ROW
 BEGIN
 
-    CALL update_tournaments_played(
-        NEW.winner_id,
-        NEW.tournament_id,
-        NEW.tournament_date
-    );
-    CALL update_tournaments_played(
-        NEW.loser_id,
-        NEW.tournament_id,
-        NEW.tournament_date
-    );
+    IF COALESCE(@defer_tournaments_played, 0) = 0
+        THEN
+        CALL update_tournaments_played(
+            NEW.winner_id,
+            NEW.tournament_id,
+            NEW.tournament_date
+        );
+        CALL update_tournaments_played(
+            NEW.loser_id,
+            NEW.tournament_id,
+            NEW.tournament_date
+        );
+    END IF;
+END !
+DELIMITER ;
+
+-- A procedure that adds a match (delta = 1) to, or removes it (delta = -1)
+-- from, the player_surface_stats rows of its winner and loser on the
+-- tournament's surface.
+DELIMITER !
+CREATE PROCEDURE add_surface_result(
+    w_id CHAR(6),
+    l_id CHAR(6),
+    t_id VARCHAR(4),
+    delta INT
+) BEGIN
+
+    DECLARE t_surface VARCHAR(10) DEFAULT NULL;
+
+    SET t_surface = (
+            SELECT surface
+            FROM tournament
+            WHERE tournament_id = t_id
+        );
+
+    INSERT INTO player_surface_stats
+    VALUES (w_id, t_surface, delta, delta, 0)
+    ON DUPLICATE KEY UPDATE matches = matches + delta,
+                            wins = wins + delta;
+
+    INSERT INTO player_surface_stats
+    VALUES (l_id, t_surface, delta, 0, delta)
+    ON DUPLICATE KEY UPDATE matches = matches + delta,
+                            losses = losses + delta;
+
+END !
+DELIMITER ;
+
+-- A procedure that recomputes player_surface_stats from match_result, e.g.
+-- after a bulk load, or after changes the triggers below can't see
+-- (MySQL doesn't fire triggers for rows deleted by a foreign key cascade,
+-- and a tournament's surface may be changed).
+DELIMITER !
+CREATE PROCEDURE rebuild_player_surface_stats() BEGIN
+
+    DELETE FROM player_surface_stats;
+
+    INSERT INTO player_surface_stats
+    SELECT player_id,
+        surface,
+        COUNT(*) AS matches,
+        SUM(won) AS wins,
+        COUNT(*) - SUM(won) AS losses
+    FROM (
+            SELECT winner_id AS player_id,
+                tournament_id,
+                1 AS won
+            FROM match_result
+            UNION ALL
+            SELECT loser_id AS player_id,
+                tournament_id,
+                0 AS won
+            FROM match_result
+        ) AS M
+        NATURAL JOIN tournament
+    GROUP BY player_id, surface;
+
+END !
+DELIMITER ;
+
+-- Triggers that keep player_surface_stats current as matches are inserted,
+-- updated and deleted.
+DELIMITER !
+CREATE TRIGGER trg_surface_stats_insert AFTER INSERT
+    ON match_result FOR EACH ROW
+BEGIN
+    CALL add_surface_result(NEW.winner_id, NEW.loser_id,
+                            NEW.tournament_id, 1);
+END !
+
+CREATE TRIGGER trg_surface_stats_update AFTER UPDATE
+    ON match_result FOR EACH ROW
+BEGIN
+    IF NEW.winner_id <> OLD.winner_id
+        OR NEW.loser_id <> OLD.loser_id
+        OR NEW.tournament_id <> OLD.tournament_id
+        THEN
+        CALL add_surface_result(OLD.winner_id, OLD.loser_id,
+                                OLD.tournament_id, -1);
+        CALL add_surface_result(NEW.winner_id, NEW.loser_id,
+                                NEW.tournament_id, 1);
+    END IF;
+END !
+
+CREATE TRIGGER trg_surface_stats_delete AFTER DELETE
+    ON match_result FOR EACH ROW
+BEGIN
+    CALL add_surface_result(OLD.winner_id, OLD.loser_id,
+                            OLD.tournament_id, -1);
+END !
+DELIMITER ;
+
+-- A procedure that sets the last meeting of a head_to_head row from
+-- match_result, e.g. after the match it pointed to was deleted. Each side
+-- of the pair is a short range of idx_winner_loser.
+DELIMITER !
+CREATE PROCEDURE reset_last_meeting(
+    a_id CHAR(6),
+    b_id CHAR(6)
+) BEGIN
+
+    DECLARE m_id INT DEFAULT NULL;
+    DECLARE m_date DATE DEFAULT NULL;
+    DECLARE w_id CHAR(6) DEFAULT NULL;
+    DECLARE m_score VARCHAR(20) DEFAULT NULL;
+
+    SELECT match_id,
+        tournament_date,
+        winner_id,
+        score INTO m_id,
+        m_date,
+        w_id,
+        m_score
+    FROM (
+            (
+                SELECT match_id, tournament_date, winner_id, score
+                FROM match_result
+                WHERE winner_id = a_id
+                    AND loser_id = b_id
+                ORDER BY tournament_date DESC, match_id DESC
+                LIMIT 1
+            )
+            UNION ALL
+            (
+                SELECT match_id, tournament_date, winner_id, score
+                FROM match_result
+                WHERE winner_id = b_id
+                    AND loser_id = a_id
+                ORDER BY tournament_date DESC, match_id DESC
+                LIMIT 1
+            )
+        ) AS M
+    ORDER BY tournament_date DESC, match_id DESC
+    LIMIT 1;
+
+    UPDATE head_to_head
+    SET last_match_id = m_id,
+        last_match_date = m_date,
+        last_winner_id = w_id,
+        last_score = m_score
+    WHERE player_a = a_id
+        AND player_b = b_id;
+
+END !
+DELIMITER ;
+
+-- A procedure that adds a match (delta = 1) to, or removes it (delta = -1)
+-- from, the head_to_head row of its two players: their wins overall and on
+-- the tournament's surface, and the last meeting. Rows whose matches have
+-- all been removed are deleted.
+DELIMITER !
+CREATE PROCEDURE add_head_to_head_result(
+    m_id INT,
+    m_date DATE,
+    w_id CHAR(6),
+    l_id CHAR(6),
+    t_id VARCHAR(4),
+    m_score VARCHAR(20),
+    delta INT
+) BEGIN
+
+    DECLARE a_id CHAR(6) DEFAULT NULL;
+    DECLARE b_id CHAR(6) DEFAULT NULL;
+    DECLARE a_won INT DEFAULT 0;
+    DECLARE b_won INT DEFAULT 0;
+    DECLARE t_surface VARCHAR(10) DEFAULT NULL;
+
+    -- Each pair is stored once, in player ID order
+    SET a_id = LEAST(w_id, l_id);
+    SET b_id = GREATEST(w_id, l_id);
+    SET a_won = IF(w_id = a_id, delta, 0);
+    SET b_won = IF(w_id = b_id, delta, 0);
+    SET t_surface = (
+            SELECT surface
+            FROM tournament
+            WHERE tournament_id = t_id
+        );
+
+    INSERT INTO head_to_head (
+            player_a,
+            player_b,
+            a_wins,
+            b_wins,
+            hard_a_wins,
+            hard_b_wins,
+            clay_a_wins,
+            clay_b_wins,
+            grass_a_wins,
+            grass_b_wins
+        )
+    VALUES (
+            a_id,
+            b_id,
+            a_won,
+            b_won,
+            IF(t_surface = 'Hard', a_won, 0),
+            IF(t_surface = 'Hard', b_won, 0),
+            IF(t_surface = 'Clay', a_won, 0),
+            IF(t_surface = 'Clay', b_won, 0),
+            IF(t_surface = 'Grass', a_won, 0),
+            IF(t_surface = 'Grass', b_won, 0)
+        )
+    ON DUPLICATE KEY UPDATE a_wins = a_wins + a_won,
+                            b_wins = b_wins + b_won,
+                            hard_a_wins = hard_a_wins
+                                + IF(t_surface = 'Hard', a_won, 0),
+                            hard_b_wins = hard_b_wins
+                                + IF(t_surface = 'Hard', b_won, 0),
+                            clay_a_wins = clay_a_wins
+                                + IF(t_surface = 'Clay', a_won, 0),
+                            clay_b_wins = clay_b_wins
+                                + IF(t_surface = 'Clay', b_won, 0),
+                            grass_a_wins = grass_a_wins
+                                + IF(t_surface = 'Grass', a_won, 0),
+                            grass_b_wins = grass_b_wins
+                                + IF(t_surface = 'Grass', b_won, 0);
+
+    IF delta > 0
+        THEN
+        -- The match is the last meeting unless a later one is recorded
+        UPDATE head_to_head
+        SET last_match_id = m_id,
+            last_match_date = m_date,
+            last_winner_id = w_id,
+            last_score = m_score
+        WHERE player_a = a_id
+            AND player_b = b_id
+            AND (
+                last_match_id IS NULL
+                OR last_match_date < m_date
+                OR (last_match_date = m_date AND last_match_id < m_id)
+            );
+    ELSE
+        DELETE FROM head_to_head
+        WHERE player_a = a_id
+            AND player_b = b_id
+            AND a_wins + b_wins <= 0;
+
+        IF m_id = (
+                SELECT last_match_id
+                FROM head_to_head
+                WHERE player_a = a_id
+                    AND player_b = b_id
+            )
+            THEN CALL reset_last_meeting(a_id, b_id);
+        END IF;
+    END IF;
+
+END !
+DELIMITER ;
+
+-- A procedure that recomputes head_to_head from match_result, e.g. after a
+-- bulk load or a change the triggers below can't see (as for
+-- rebuild_player_surface_stats).
+DELIMITER !
+CREATE PROCEDURE rebuild_head_to_head() BEGIN
+
+    DELETE FROM head_to_head;
+
+    INSERT INTO head_to_head (
+            player_a,
+            player_b,
+            a_wins,
+            b_wins,
+            hard_a_wins,
+            hard_b_wins,
+            clay_a_wins,
+            clay_b_wins,
+            grass_a_wins,
+            grass_b_wins
+        )
+    SELECT player_a,
+        player_b,
+        SUM(a_won),
+        SUM(1 - a_won),
+        SUM(IF(surface = 'Hard', a_won, 0)),
+        SUM(IF(surface = 'Hard', 1 - a_won, 0)),
+        SUM(IF(surface = 'Clay', a_won, 0)),
+        SUM(IF(surface = 'Clay', 1 - a_won, 0)),
+        SUM(IF(surface = 'Grass', a_won, 0)),
+        SUM(IF(surface = 'Grass', 1 - a_won, 0))
+    FROM (
+            SELECT LEAST(winner_id, loser_id) AS player_a,
+                GREATEST(winner_id, loser_id) AS player_b,
+                IF(winner_id < loser_id, 1, 0) AS a_won,
+                tournament_id
+            FROM match_result
+        ) AS M
+        NATURAL JOIN tournament
+    GROUP BY player_a, player_b;
+
+    UPDATE head_to_head AS H
+        JOIN (
+            SELECT LEAST(winner_id, loser_id) AS player_a,
+                GREATEST(winner_id, loser_id) AS player_b,
+                match_id,
+                tournament_date,
+                winner_id,
+                score,
+                ROW_NUMBER() OVER (
+                    PARTITION BY LEAST(winner_id, loser_id),
+                        GREATEST(winner_id, loser_id)
+                    ORDER BY tournament_date DESC, match_id DESC
+                ) AS n
+            FROM match_result
+        ) AS L ON L.player_a = H.player_a
+            AND L.player_b = H.player_b
+            AND L.n = 1
+    SET H.last_match_id = L.match_id,
+        H.last_match_date = L.tournament_date,
+        H.last_winner_id = L.winner_id,
+        H.last_score = L.score;
+
+END !
+DELIMITER ;
+
+-- Triggers that keep head_to_head current as matches are inserted, updated
+-- and deleted.
+DELIMITER !
+CREATE TRIGGER trg_head_to_head_insert AFTER INSERT
+    ON match_result FOR EACH ROW
+BEGIN
+    CALL add_head_to_head_result(NEW.match_id, NEW.tournament_date,
+                                 NEW.winner_id, NEW.loser_id,
+                                 NEW.tournament_id, NEW.score, 1);
+END !
+
+CREATE TRIGGER trg_head_to_head_update AFTER UPDATE
+    ON match_result FOR EACH ROW
+BEGIN
+    IF NEW.winner_id <> OLD.winner_id
+        OR NEW.loser_id <> OLD.loser_id
+        OR NEW.tournament_id <> OLD.tournament_id
+        OR NEW.tournament_date <> OLD.tournament_date
+        OR NEW.score <> OLD.score
+        THEN
+        CALL add_head_to_head_result(OLD.match_id, OLD.tournament_date,
+                                     OLD.winner_id, OLD.loser_id,
+                                     OLD.tournament_id, OLD.score, -1);
+        CALL add_head_to_head_result(NEW.match_id, NEW.tournament_date,
+                                     NEW.winner_id, NEW.loser_id,
+                                     NEW.tournament_id, NEW.score, 1);
+    END IF;
+END !
+
+CREATE TRIGGER trg_head_to_head_delete AFTER DELETE
+    ON match_result FOR EACH ROW
+BEGIN
+    CALL add_head_to_head_result(OLD.match_id, OLD.tournament_date,
+                                 OLD.winner_id, OLD.loser_id,
+                                 OLD.tournament_id, OLD.score, -1);
 END !
 DELIMITER ;
 
 -- A function that returns the highest ranked player given a specific
--- country. Returns null if no player from that country exists in the
--- top 20. Country is given in the 3 digit character code.
+-- country. Returns null if no player from that country is in the current
+-- rankings. Country is given in the 3 digit character code.
 DELIMITER !
 
 CREATE FUNCTION find_highest_ranked_player(
@@ -221,9 +702,256 @@ CREATE FUNCTION find_highest_ranked_player(
         player_last_name
     FROM ranking
         NATURAL JOIN player
-    WHERE `rank` = player_rank;
+    WHERE `rank` = player_rank
+        AND country = player_country
+    LIMIT 1;
 
     RETURN CONCAT(player_first_name, ' ', player_last_name, ' ', player_rank);
 
 END !
 DELIMITER ;
+
+-- A procedure that returns the profiles of a batch of players (e.g. a
+-- draw's entrants) in one call, as five result sets ordered by player ID:
+-- bio, current rankings, matches by surface, titles, and the most recent
+-- recent_matches matches. player_ids is a JSON array of player IDs; IDs
+-- not in the database are skipped. The IDs are copied into a temporary
+-- table so that every result set joins on player_id with the table's own
+-- collation.
+DELIMITER !
+CREATE PROCEDURE player_profiles(
+    player_ids JSON,
+    recent_matches INT
+) BEGIN
+
+    DROP TEMPORARY TABLE IF EXISTS profile_players;
+    DROP TEMPORARY TABLE IF EXISTS profile_matches;
+    CREATE TEMPORARY TABLE profile_players (
+        player_id       CHAR(6),
+        PRIMARY KEY (player_id)
+    );
+    CREATE TEMPORARY TABLE profile_matches (
+        player_id       CHAR(6) NOT NULL,
+        match_id        INT NOT NULL,
+        tournament_date DATE NOT NULL,
+        result          CHAR(1) NOT NULL,
+        opponent_id     CHAR(6) NOT NULL
+    );
+
+    INSERT IGNORE INTO profile_players
+    SELECT I.player_id
+    FROM JSON_TABLE(player_ids, '$[*]'
+            COLUMNS (player_id VARCHAR(6) PATH '$')) AS I
+    WHERE I.player_id IS NOT NULL;
+
+    SELECT P.player_id, P.first_name, P.last_name, P.hand, P.dob,
+        P.country, P.height
+    FROM profile_players AS I
+        JOIN player AS P ON P.player_id = I.player_id
+    ORDER BY P.player_id;
+
+    SELECT R.player_id, R.`rank`, R.player_points, R.tournaments_played
+    FROM profile_players AS I
+        JOIN ranking AS R ON R.player_id = I.player_id
+    ORDER BY R.player_id, R.`rank`;
+
+    SELECT S.player_id, S.surface, S.matches, S.wins, S.losses
+    FROM profile_players AS I
+        JOIN player_surface_stats AS S ON S.player_id = I.player_id
+    WHERE S.matches > 0
+    ORDER BY S.player_id, S.surface;
+
+    SELECT H.winner_id, H.tournament_year, H.tournament_id,
+        T.tournament_name
+    FROM profile_players AS I
+        JOIN tournament_history AS H ON H.winner_id = I.player_id
+        JOIN tournament AS T ON T.tournament_id = H.tournament_id
+    ORDER BY H.winner_id, H.tournament_year DESC, H.tournament_id;
+
+    -- A temporary table can only be opened once per query, so the matches
+    -- won and lost are collected separately, keeping at most
+    -- recent_matches of each per player.
+    INSERT INTO profile_matches
+    SELECT player_id, match_id, tournament_date, 'W', opponent_id
+    FROM (
+            SELECT I.player_id, M.match_id, M.tournament_date,
+                M.loser_id AS opponent_id,
+                ROW_NUMBER() OVER (
+                    PARTITION BY I.player_id
+                    ORDER BY M.tournament_date DESC, M.match_id DESC
+                ) AS n
+            FROM profile_players AS I
+                JOIN match_result AS M ON M.winner_id = I.player_id
+        ) AS W
+    WHERE n <= recent_matches;
+
+    INSERT INTO profile_matches
+    SELECT player_id, match_id, tournament_date, 'L', opponent_id
+    FROM (
+            SELECT I.player_id, M.match_id, M.tournament_date,
+                M.winner_id AS opponent_id,
+                ROW_NUMBER() OVER (
+                    PARTITION BY I.player_id
+                    ORDER BY M.tournament_date DESC, M.match_id DESC
+                ) AS n
+            FROM profile_players AS I
+                JOIN match_result AS M ON M.loser_id = I.player_id
+        ) AS L
+    WHERE n <= recent_matches;
+
+    SELECT R.player_id, R.match_id, R.tournament_date, T.tournament_name,
+        R.result, R.opponent_id, O.first_name, O.last_name, M.score
+    FROM (
+            SELECT player_id, match_id, tournament_date, result,
+                opponent_id,
+                ROW_NUMBER() OVER (
+                    PARTITION BY player_id
+                    ORDER BY tournament_date DESC, match_id DESC
+                ) AS n
+            FROM profile_matches
+        ) AS R
+        JOIN match_result AS M ON M.match_id = R.match_id
+        JOIN tournament AS T ON T.tournament_id = M.tournament_id
+        JOIN player AS O ON O.player_id = R.opponent_id
+    WHERE R.n <= recent_matches
+    ORDER BY R.player_id, R.n;
+
+    DROP TEMPORARY TABLE profile_matches;
+    DROP TEMPORARY TABLE profile_players;
+
+END !
+DELIMITER ;
+
+-- Triggers that append every insert, update and delete on player, ranking,
+-- match_result and tournament_history to change_log (see changefeed.py),
+-- in the same transaction as the change, with the row's key as a JSON
+-- array. An update that changes the key is logged as a delete of the old
+-- key and an insert of the new one. MySQL fires no triggers for rows
+-- changed by a foreign key cascade (e.g. the tournament_history row
+-- deleted with its final), so those are not logged.
+DELIMITER !
+
+CREATE TRIGGER trg_change_log_player_insert AFTER INSERT
+    ON player FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('player', JSON_ARRAY(NEW.player_id), 'I');
+END !
+
+CREATE TRIGGER trg_change_log_player_update AFTER UPDATE
+    ON player FOR EACH ROW
+BEGIN
+    IF NEW.player_id <=> OLD.player_id
+        THEN
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('player', JSON_ARRAY(NEW.player_id), 'U');
+    ELSE
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('player', JSON_ARRAY(OLD.player_id), 'D'),
+            ('player', JSON_ARRAY(NEW.player_id), 'I');
+    END IF;
+END !
+
+CREATE TRIGGER trg_change_log_player_delete AFTER DELETE
+    ON player FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('player', JSON_ARRAY(OLD.player_id), 'D');
+END !
+
+CREATE TRIGGER trg_change_log_ranking_insert AFTER INSERT
+    ON ranking FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('ranking', JSON_ARRAY(NEW.player_id, NEW.`rank`), 'I');
+END !
+
+CREATE TRIGGER trg_change_log_ranking_update AFTER UPDATE
+    ON ranking FOR EACH ROW
+BEGIN
+    IF NEW.player_id <=> OLD.player_id
+        AND NEW.`rank` <=> OLD.`rank`
+        THEN
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('ranking', JSON_ARRAY(NEW.player_id, NEW.`rank`), 'U');
+    ELSE
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('ranking', JSON_ARRAY(OLD.player_id, OLD.`rank`), 'D'),
+            ('ranking', JSON_ARRAY(NEW.player_id, NEW.`rank`), 'I');
+    END IF;
+END !
+
+CREATE TRIGGER trg_change_log_ranking_delete AFTER DELETE
+    ON ranking FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('ranking', JSON_ARRAY(OLD.player_id, OLD.`rank`), 'D');
+END !
+
+CREATE TRIGGER trg_change_log_match_result_insert AFTER INSERT
+    ON match_result FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('match_result', JSON_ARRAY(NEW.match_id), 'I');
+END !
+
+CREATE TRIGGER trg_change_log_match_result_update AFTER UPDATE
+    ON match_result FOR EACH ROW
+BEGIN
+    IF NEW.match_id <=> OLD.match_id
+        THEN
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('match_result', JSON_ARRAY(NEW.match_id), 'U');
+    ELSE
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('match_result', JSON_ARRAY(OLD.match_id), 'D'),
+            ('match_result', JSON_ARRAY(NEW.match_id), 'I');
+    END IF;
+END !
+
+CREATE TRIGGER trg_change_log_match_result_delete AFTER DELETE
+    ON match_result FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('match_result', JSON_ARRAY(OLD.match_id), 'D');
+END !
+
+CREATE TRIGGER trg_change_log_tournament_history_insert AFTER INSERT
+    ON tournament_history FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('tournament_history',
+            JSON_ARRAY(NEW.tournament_id, NEW.tournament_year), 'I');
+END !
+
+CREATE TRIGGER trg_change_log_tournament_history_update AFTER UPDATE
+    ON tournament_history FOR EACH ROW
+BEGIN
+    IF NEW.tournament_id <=> OLD.tournament_id
+        AND NEW.tournament_year <=> OLD.tournament_year
+        THEN
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('tournament_history',
+            JSON_ARRAY(NEW.tournament_id, NEW.tournament_year), 'U');
+    ELSE
+        INSERT INTO change_log (table_name, row_key, operation)
+        VALUES ('tournament_history',
+            JSON_ARRAY(OLD.tournament_id, OLD.tournament_year), 'D'),
+            ('tournament_history',
+                JSON_ARRAY(NEW.tournament_id, NEW.tournament_year), 'I');
+    END IF;
+END !
+
+CREATE TRIGGER trg_change_log_tournament_history_delete AFTER DELETE
+    ON tournament_history FOR EACH ROW
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('tournament_history',
+            JSON_ARRAY(OLD.tournament_id, OLD.tournament_year), 'D');
+END !
+DELIMITER ;
+
+-- Fills player_surface_stats and head_to_head for the matches loaded by
+-- load-data.sql, which were inserted before the triggers above existed.
+CALL rebuild_player_surface_stats();
+CALL rebuild_head_to_head();
@@ -0,0 +1,410 @@
+-- Triggers for the embedded SQLite copy of the WTA database, equivalent to
+-- those in setup-routines.sql. SQLite has no stored procedures or
+-- functions; input_match_results, find_matchup_history,
+-- find_highest_ranked_player and authenticate are implemented in storage.py.
+-- Created after the data is loaded, as setup-routines.sql is.
+DROP TRIGGER IF EXISTS trg_match_result_insert;
+DROP TRIGGER IF EXISTS trg_surface_stats_insert;
+DROP TRIGGER IF EXISTS trg_surface_stats_update;
+DROP TRIGGER IF EXISTS trg_surface_stats_delete;
+DROP TRIGGER IF EXISTS trg_head_to_head_insert;
+DROP TRIGGER IF EXISTS trg_head_to_head_update;
+DROP TRIGGER IF EXISTS trg_head_to_head_delete;
+DROP TRIGGER IF EXISTS trg_change_log_player_insert;
+DROP TRIGGER IF EXISTS trg_change_log_player_update;
+DROP TRIGGER IF EXISTS trg_change_log_player_delete;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_insert;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_update;
+DROP TRIGGER IF EXISTS trg_change_log_ranking_delete;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_insert;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_update;
+DROP TRIGGER IF EXISTS trg_change_log_match_result_delete;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_insert;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_update;
+DROP TRIGGER IF EXISTS trg_change_log_tournament_history_delete;
+
+-- update_tournaments_played for the winner and the loser: a player's first
+-- match of a tournament counts as a new tournament played.
+CREATE TRIGGER trg_match_result_insert AFTER INSERT ON match_result
+BEGIN
+    UPDATE ranking
+    SET tournaments_played = tournaments_played + 1
+    WHERE player_id = NEW.winner_id
+        AND (
+            SELECT COUNT(*)
+            FROM match_result
+            WHERE winner_id = NEW.winner_id
+                AND tournament_id = NEW.tournament_id
+                AND tournament_date = NEW.tournament_date
+        ) + (
+            SELECT COUNT(*)
+            FROM match_result
+            WHERE loser_id = NEW.winner_id
+                AND tournament_id = NEW.tournament_id
+                AND tournament_date = NEW.tournament_date
+        ) = 1;
+
+    UPDATE ranking
+    SET tournaments_played = tournaments_played + 1
+    WHERE player_id = NEW.loser_id
+        AND (
+            SELECT COUNT(*)
+            FROM match_result
+            WHERE winner_id = NEW.loser_id
+                AND tournament_id = NEW.tournament_id
+                AND tournament_date = NEW.tournament_date
+        ) + (
+            SELECT COUNT(*)
+            FROM match_result
+            WHERE loser_id = NEW.loser_id
+                AND tournament_id = NEW.tournament_id
+                AND tournament_date = NEW.tournament_date
+        ) = 1;
+END;
+
+-- add_surface_result with delta = 1 and -1: each statement adds its
+-- counts to the player's row for the tournament's surface.
+CREATE TRIGGER trg_surface_stats_insert AFTER INSERT ON match_result
+BEGIN
+    INSERT INTO player_surface_stats
+    VALUES (NEW.winner_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = NEW.tournament_id), 1, 1, 0)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches, wins = wins + excluded.wins;
+
+    INSERT INTO player_surface_stats
+    VALUES (NEW.loser_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = NEW.tournament_id), 1, 0, 1)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches,
+        losses = losses + excluded.losses;
+END;
+
+CREATE TRIGGER trg_surface_stats_update AFTER UPDATE ON match_result
+WHEN NEW.winner_id <> OLD.winner_id
+    OR NEW.loser_id <> OLD.loser_id
+    OR NEW.tournament_id <> OLD.tournament_id
+BEGIN
+    INSERT INTO player_surface_stats
+    VALUES (OLD.winner_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = OLD.tournament_id), -1, -1, 0)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches, wins = wins + excluded.wins;
+
+    INSERT INTO player_surface_stats
+    VALUES (OLD.loser_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = OLD.tournament_id), -1, 0, -1)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches,
+        losses = losses + excluded.losses;
+
+    INSERT INTO player_surface_stats
+    VALUES (NEW.winner_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = NEW.tournament_id), 1, 1, 0)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches, wins = wins + excluded.wins;
+
+    INSERT INTO player_surface_stats
+    VALUES (NEW.loser_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = NEW.tournament_id), 1, 0, 1)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches,
+        losses = losses + excluded.losses;
+END;
+
+CREATE TRIGGER trg_surface_stats_delete AFTER DELETE ON match_result
+BEGIN
+    INSERT INTO player_surface_stats
+    VALUES (OLD.winner_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = OLD.tournament_id), -1, -1, 0)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches, wins = wins + excluded.wins;
+
+    INSERT INTO player_surface_stats
+    VALUES (OLD.loser_id,
+            (SELECT surface FROM tournament
+             WHERE tournament_id = OLD.tournament_id), -1, 0, -1)
+    ON CONFLICT (player_id, surface) DO UPDATE
+    SET matches = matches + excluded.matches,
+        losses = losses + excluded.losses;
+END;
+
+-- add_head_to_head_result with delta = 1: adds the match to its pair's
+-- wins and makes it the last meeting unless a later one is recorded.
+CREATE TRIGGER trg_head_to_head_insert AFTER INSERT ON match_result
+BEGIN
+    INSERT INTO head_to_head
+    SELECT min(NEW.winner_id, NEW.loser_id),
+        max(NEW.winner_id, NEW.loser_id),
+        NEW.winner_id < NEW.loser_id,
+        NEW.winner_id > NEW.loser_id,
+        surface = 'Hard' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Hard' AND NEW.winner_id > NEW.loser_id,
+        surface = 'Clay' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Clay' AND NEW.winner_id > NEW.loser_id,
+        surface = 'Grass' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Grass' AND NEW.winner_id > NEW.loser_id,
+        NEW.match_id,
+        NEW.tournament_date,
+        NEW.winner_id,
+        NEW.score
+    FROM tournament
+    WHERE tournament_id = NEW.tournament_id
+    ON CONFLICT (player_a, player_b) DO UPDATE
+    SET a_wins = a_wins + excluded.a_wins,
+        b_wins = b_wins + excluded.b_wins,
+        hard_a_wins = hard_a_wins + excluded.hard_a_wins,
+        hard_b_wins = hard_b_wins + excluded.hard_b_wins,
+        clay_a_wins = clay_a_wins + excluded.clay_a_wins,
+        clay_b_wins = clay_b_wins + excluded.clay_b_wins,
+        grass_a_wins = grass_a_wins + excluded.grass_a_wins,
+        grass_b_wins = grass_b_wins + excluded.grass_b_wins;
+
+    UPDATE head_to_head
+    SET last_match_id = NEW.match_id,
+        last_match_date = NEW.tournament_date,
+        last_winner_id = NEW.winner_id,
+        last_score = NEW.score
+    WHERE player_a = min(NEW.winner_id, NEW.loser_id)
+        AND player_b = max(NEW.winner_id, NEW.loser_id)
+        AND (last_match_date, last_match_id)
+            < (NEW.tournament_date, NEW.match_id);
+END;
+
+-- add_head_to_head_result with delta = -1: removes the match from its
+-- pair's wins, deletes the pair once it has no matches left and otherwise
+-- looks up the last meeting again if it was this match (reset_last_meeting).
+-- The update trigger does the same for the old row and then what the
+-- insert trigger does for the new one.
+CREATE TRIGGER trg_head_to_head_delete AFTER DELETE ON match_result
+BEGIN
+    UPDATE head_to_head
+    SET a_wins = a_wins - (OLD.winner_id < OLD.loser_id),
+        b_wins = b_wins - (OLD.winner_id > OLD.loser_id),
+        hard_a_wins = hard_a_wins - (surface = 'Hard'
+                                     AND OLD.winner_id < OLD.loser_id),
+        hard_b_wins = hard_b_wins - (surface = 'Hard'
+                                     AND OLD.winner_id > OLD.loser_id),
+        clay_a_wins = clay_a_wins - (surface = 'Clay'
+                                     AND OLD.winner_id < OLD.loser_id),
+        clay_b_wins = clay_b_wins - (surface = 'Clay'
+                                     AND OLD.winner_id > OLD.loser_id),
+        grass_a_wins = grass_a_wins - (surface = 'Grass'
+                                       AND OLD.winner_id < OLD.loser_id),
+        grass_b_wins = grass_b_wins - (surface = 'Grass'
+                                       AND OLD.winner_id > OLD.loser_id)
+    FROM (SELECT surface FROM tournament
+          WHERE tournament_id = OLD.tournament_id)
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id);
+
+    DELETE FROM head_to_head
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id)
+        AND a_wins + b_wins <= 0;
+
+    UPDATE head_to_head
+    SET (last_match_id, last_match_date, last_winner_id, last_score) = (
+            SELECT match_id, tournament_date, winner_id, score
+            FROM match_result
+            WHERE (winner_id = player_a AND loser_id = player_b)
+                OR (winner_id = player_b AND loser_id = player_a)
+            ORDER BY tournament_date DESC, match_id DESC
+            LIMIT 1
+        )
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id)
+        AND last_match_id = OLD.match_id;
+END;
+
+CREATE TRIGGER trg_head_to_head_update AFTER UPDATE ON match_result
+WHEN NEW.winner_id <> OLD.winner_id
+    OR NEW.loser_id <> OLD.loser_id
+    OR NEW.tournament_id <> OLD.tournament_id
+    OR NEW.tournament_date <> OLD.tournament_date
+    OR NEW.score <> OLD.score
+BEGIN
+    UPDATE head_to_head
+    SET a_wins = a_wins - (OLD.winner_id < OLD.loser_id),
+        b_wins = b_wins - (OLD.winner_id > OLD.loser_id),
+        hard_a_wins = hard_a_wins - (surface = 'Hard'
+                                     AND OLD.winner_id < OLD.loser_id),
+        hard_b_wins = hard_b_wins - (surface = 'Hard'
+                                     AND OLD.winner_id > OLD.loser_id),
+        clay_a_wins = clay_a_wins - (surface = 'Clay'
+                                     AND OLD.winner_id < OLD.loser_id),
+        clay_b_wins = clay_b_wins - (surface = 'Clay'
+                                     AND OLD.winner_id > OLD.loser_id),
+        grass_a_wins = grass_a_wins - (surface = 'Grass'
+                                       AND OLD.winner_id < OLD.loser_id),
+        grass_b_wins = grass_b_wins - (surface = 'Grass'
+                                       AND OLD.winner_id > OLD.loser_id)
+    FROM (SELECT surface FROM tournament
+          WHERE tournament_id = OLD.tournament_id)
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id);
+
+    DELETE FROM head_to_head
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id)
+        AND a_wins + b_wins <= 0;
+
+    UPDATE head_to_head
+    SET (last_match_id, last_match_date, last_winner_id, last_score) = (
+            SELECT match_id, tournament_date, winner_id, score
+            FROM match_result
+            WHERE (winner_id = player_a AND loser_id = player_b)
+                OR (winner_id = player_b AND loser_id = player_a)
+            ORDER BY tournament_date DESC, match_id DESC
+            LIMIT 1
+        )
+    WHERE player_a = min(OLD.winner_id, OLD.loser_id)
+        AND player_b = max(OLD.winner_id, OLD.loser_id)
+        AND last_match_id = OLD.match_id;
+
+    INSERT INTO head_to_head
+    SELECT min(NEW.winner_id, NEW.loser_id),
+        max(NEW.winner_id, NEW.loser_id),
+        NEW.winner_id < NEW.loser_id,
+        NEW.winner_id > NEW.loser_id,
+        surface = 'Hard' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Hard' AND NEW.winner_id > NEW.loser_id,
+        surface = 'Clay' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Clay' AND NEW.winner_id > NEW.loser_id,
+        surface = 'Grass' AND NEW.winner_id < NEW.loser_id,
+        surface = 'Grass' AND NEW.winner_id > NEW.loser_id,
+        NEW.match_id,
+        NEW.tournament_date,
+        NEW.winner_id,
+        NEW.score
+    FROM tournament
+    WHERE tournament_id = NEW.tournament_id
+    ON CONFLICT (player_a, player_b) DO UPDATE
+    SET a_wins = a_wins + excluded.a_wins,
+        b_wins = b_wins + excluded.b_wins,
+        hard_a_wins = hard_a_wins + excluded.hard_a_wins,
+        hard_b_wins = hard_b_wins + excluded.hard_b_wins,
+        clay_a_wins = clay_a_wins + excluded.clay_a_wins,
+        clay_b_wins = clay_b_wins + excluded.clay_b_wins,
+        grass_a_wins = grass_a_wins + excluded.grass_a_wins,
+        grass_b_wins = grass_b_wins + excluded.grass_b_wins;
+
+    UPDATE head_to_head
+    SET last_match_id = NEW.match_id,
+        last_match_date = NEW.tournament_date,
+        last_winner_id = NEW.winner_id,
+        last_score = NEW.score
+    WHERE player_a = min(NEW.winner_id, NEW.loser_id)
+        AND player_b = max(NEW.winner_id, NEW.loser_id)
+        AND (last_match_date, last_match_id)
+            < (NEW.tournament_date, NEW.match_id);
+END;
+
+-- The change_log triggers. Unlike MySQL, SQLite also fires them for rows
+-- changed by a foreign key cascade.
+
+CREATE TRIGGER trg_change_log_player_insert AFTER INSERT ON player
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('player', json_array(NEW.player_id), 'I');
+END;
+
+CREATE TRIGGER trg_change_log_player_update AFTER UPDATE ON player
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'player', json_array(OLD.player_id), 'D'
+    WHERE NOT (OLD.player_id IS NEW.player_id);
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'player', json_array(NEW.player_id),
+        CASE WHEN OLD.player_id IS NEW.player_id THEN 'U' ELSE 'I' END;
+END;
+
+CREATE TRIGGER trg_change_log_player_delete AFTER DELETE ON player
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('player', json_array(OLD.player_id), 'D');
+END;
+
+CREATE TRIGGER trg_change_log_ranking_insert AFTER INSERT ON ranking
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('ranking', json_array(NEW.player_id, NEW.`rank`), 'I');
+END;
+
+CREATE TRIGGER trg_change_log_ranking_update AFTER UPDATE ON ranking
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'ranking', json_array(OLD.player_id, OLD.`rank`), 'D'
+    WHERE NOT (OLD.player_id IS NEW.player_id AND OLD.`rank` IS NEW.`rank`);
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'ranking', json_array(NEW.player_id, NEW.`rank`),
+        CASE WHEN OLD.player_id IS NEW.player_id AND OLD.`rank` IS NEW.`rank`
+            THEN 'U' ELSE 'I' END;
+END;
+
+CREATE TRIGGER trg_change_log_ranking_delete AFTER DELETE ON ranking
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('ranking', json_array(OLD.player_id, OLD.`rank`), 'D');
+END;
+
+CREATE TRIGGER trg_change_log_match_result_insert AFTER INSERT ON match_result
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('match_result', json_array(NEW.match_id), 'I');
+END;
+
+CREATE TRIGGER trg_change_log_match_result_update AFTER UPDATE ON match_result
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'match_result', json_array(OLD.match_id), 'D'
+    WHERE NOT (OLD.match_id IS NEW.match_id);
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'match_result', json_array(NEW.match_id),
+        CASE WHEN OLD.match_id IS NEW.match_id THEN 'U' ELSE 'I' END;
+END;
+
+CREATE TRIGGER trg_change_log_match_result_delete AFTER DELETE ON match_result
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('match_result', json_array(OLD.match_id), 'D');
+END;
+
+CREATE TRIGGER trg_change_log_tournament_history_insert
+    AFTER INSERT ON tournament_history
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('tournament_history',
+            json_array(NEW.tournament_id, NEW.tournament_year), 'I');
+END;
+
+CREATE TRIGGER trg_change_log_tournament_history_update
+    AFTER UPDATE ON tournament_history
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'tournament_history',
+        json_array(OLD.tournament_id, OLD.tournament_year), 'D'
+    WHERE NOT (OLD.tournament_id IS NEW.tournament_id
+               AND OLD.tournament_year IS NEW.tournament_year);
+    INSERT INTO change_log (table_name, row_key, operation)
+    SELECT 'tournament_history',
+        json_array(NEW.tournament_id, NEW.tournament_year),
+        CASE WHEN OLD.tournament_id IS NEW.tournament_id
+                AND OLD.tournament_year IS NEW.tournament_year
+            THEN 'U' ELSE 'I' END;
+END;
+
+CREATE TRIGGER trg_change_log_tournament_history_delete
+    AFTER DELETE ON tournament_history
+BEGIN
+    INSERT INTO change_log (table_name, row_key, operation)
+    VALUES ('tournament_history',
+            json_array(OLD.tournament_id, OLD.tournament_year), 'D');
+END;
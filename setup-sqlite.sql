@@ -0,0 +1,234 @@
+-- Table definitions for the embedded SQLite copy of the WTA database (see
+-- storage.py). These mirror setup.sql; text columns use NOCASE so that
+-- lookups by name or country match the same rows as MySQL's
+-- case-insensitive default collation.
+DROP TABLE IF EXISTS user_info;
+DROP TABLE IF EXISTS change_checkpoint;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS match_set;
+DROP TABLE IF EXISTS match_score;
+DROP TABLE IF EXISTS rating_skipped;
+DROP TABLE IF EXISTS rating_state;
+DROP TABLE IF EXISTS player_rating;
+DROP TABLE IF EXISTS ranking_history;
+DROP TABLE IF EXISTS head_to_head;
+DROP TABLE IF EXISTS player_surface_stats;
+DROP TABLE IF EXISTS tournament_history;
+DROP TABLE IF EXISTS match_result;
+DROP TABLE IF EXISTS tournament;
+DROP TABLE IF EXISTS ranking;
+DROP TABLE IF EXISTS player;
+
+CREATE TABLE player (
+    player_id       CHAR(6) COLLATE NOCASE,
+    first_name      VARCHAR(20) COLLATE NOCASE NOT NULL,
+    last_name       VARCHAR(20) COLLATE NOCASE NOT NULL,
+    hand            CHAR(1) COLLATE NOCASE NOT NULL,
+    dob             DATE NOT NULL,
+    country         CHAR(3) COLLATE NOCASE NOT NULL,
+    height          INT NOT NULL,
+    CHECK (hand IN ('R', 'L')),
+    PRIMARY KEY (player_id)
+);
+
+CREATE TABLE ranking (
+    player_id               CHAR(6) COLLATE NOCASE,
+    `rank`                  INT,
+    player_points           INT NOT NULL,
+    tournaments_played      INT NOT NULL,
+    PRIMARY KEY (player_id, `rank`),
+    FOREIGN KEY (player_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE tournament (
+    tournament_id           VARCHAR(4) COLLATE NOCASE,
+    tournament_name         VARCHAR(25) COLLATE NOCASE NOT NULL,
+    surface                 VARCHAR(10) COLLATE NOCASE NOT NULL,
+    draw_size               INT NOT NULL,
+    tournament_level        CHAR(1) COLLATE NOCASE NOT NULL,
+    CHECK (surface IN ('Clay', 'Hard', 'Grass')),
+    PRIMARY KEY (tournament_id)
+);
+
+-- INTEGER PRIMARY KEY AUTOINCREMENT, like AUTO_INCREMENT, never reuses the
+-- ID of a deleted match.
+CREATE TABLE match_result (
+    match_id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    tournament_id       VARCHAR(4) COLLATE NOCASE NOT NULL,
+    tournament_date     DATE NOT NULL,
+    score               VARCHAR(20) COLLATE NOCASE NOT NULL,
+    minutes             INT NOT NULL,
+    winner_id           CHAR(6) COLLATE NOCASE NOT NULL,
+    winner_aces         INT,
+    winner_bp_saved     INT,
+    winner_dfs          INT,
+    loser_id            CHAR(6) COLLATE NOCASE NOT NULL,
+    loser_aces          INT,
+    loser_bp_saved      INT,
+    loser_dfs           INT,
+    FOREIGN KEY (winner_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (loser_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (tournament_id) REFERENCES tournament(tournament_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE tournament_history (
+    tournament_id       VARCHAR(25) COLLATE NOCASE NOT NULL,
+    tournament_year     CHAR(4) NOT NULL,
+    winner_id           CHAR(6) COLLATE NOCASE,
+    finalist_id         CHAR(6) COLLATE NOCASE NOT NULL,
+    match_id            INT NOT NULL,
+    PRIMARY KEY (tournament_id, tournament_year),
+    FOREIGN KEY (winner_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (finalist_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (match_id) REFERENCES match_result(match_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (tournament_id) REFERENCES tournament(tournament_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE player_surface_stats (
+    player_id           CHAR(6) COLLATE NOCASE,
+    surface             VARCHAR(10) COLLATE NOCASE,
+    matches             INT NOT NULL DEFAULT 0,
+    wins                INT NOT NULL DEFAULT 0,
+    losses              INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, surface),
+    FOREIGN KEY (player_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE head_to_head (
+    player_a            CHAR(6) COLLATE NOCASE,
+    player_b            CHAR(6) COLLATE NOCASE,
+    a_wins              INT NOT NULL DEFAULT 0,
+    b_wins              INT NOT NULL DEFAULT 0,
+    hard_a_wins         INT NOT NULL DEFAULT 0,
+    hard_b_wins         INT NOT NULL DEFAULT 0,
+    clay_a_wins         INT NOT NULL DEFAULT 0,
+    clay_b_wins         INT NOT NULL DEFAULT 0,
+    grass_a_wins        INT NOT NULL DEFAULT 0,
+    grass_b_wins        INT NOT NULL DEFAULT 0,
+    last_match_id       INT,
+    last_match_date     DATE,
+    last_winner_id      CHAR(6) COLLATE NOCASE,
+    last_score          VARCHAR(20) COLLATE NOCASE,
+    CHECK (player_a < player_b),
+    PRIMARY KEY (player_a, player_b),
+    FOREIGN KEY (player_a) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (player_b) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- SQLite has no partitioning; the primary key and indexes are the same.
+CREATE TABLE ranking_history (
+    ranking_date            DATE NOT NULL,
+    `rank`                  INT NOT NULL,
+    player_id               CHAR(6) COLLATE NOCASE NOT NULL,
+    player_points           INT,
+    tournaments             INT,
+    PRIMARY KEY (ranking_date, player_id)
+);
+
+CREATE TABLE player_rating (
+    player_id           CHAR(6) COLLATE NOCASE,
+    elo                 DOUBLE NOT NULL,
+    matches             INT NOT NULL,
+    hard_elo            DOUBLE NOT NULL,
+    hard_matches        INT NOT NULL,
+    clay_elo            DOUBLE NOT NULL,
+    clay_matches        INT NOT NULL,
+    grass_elo           DOUBLE NOT NULL,
+    grass_matches       INT NOT NULL,
+    last_match_date     DATE,
+    PRIMARY KEY (player_id),
+    FOREIGN KEY (player_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+CREATE TABLE rating_state (
+    state_id            TINYINT,
+    last_match_id       INT NOT NULL,
+    last_match_date     DATE,
+    CHECK (state_id = 1),
+    PRIMARY KEY (state_id)
+);
+
+CREATE TABLE rating_skipped (
+    match_id            INT,
+    PRIMARY KEY (match_id)
+);
+
+CREATE TABLE match_score (
+    match_id            INT,
+    status              CHAR(1) NOT NULL,
+    sets                TINYINT NOT NULL,
+    winner_sets         TINYINT NOT NULL,
+    loser_sets          TINYINT NOT NULL,
+    winner_tiebreaks    TINYINT NOT NULL,
+    loser_tiebreaks     TINYINT NOT NULL,
+    winner_bagels       TINYINT NOT NULL,
+    loser_bagels        TINYINT NOT NULL,
+    CHECK (status IN ('P', 'R', 'W', 'D', 'U')),
+    PRIMARY KEY (match_id),
+    FOREIGN KEY (match_id) REFERENCES match_result(match_id)
+    ON DELETE CASCADE
+);
+
+CREATE TABLE match_set (
+    match_id            INT,
+    set_number          TINYINT,
+    winner_games        TINYINT NOT NULL,
+    loser_games         TINYINT NOT NULL,
+    tiebreak_points     TINYINT,
+    PRIMARY KEY (match_id, set_number),
+    FOREIGN KEY (match_id) REFERENCES match_result(match_id)
+    ON DELETE CASCADE
+);
+
+-- AUTOINCREMENT, so that seqs are never reused once the log is pruned.
+CREATE TABLE change_log (
+    seq                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name          VARCHAR(20) NOT NULL,
+    row_key             VARCHAR(64) NOT NULL,
+    operation           CHAR(1) NOT NULL,
+    changed_at          TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CHECK (operation IN ('I', 'U', 'D'))
+);
+
+CREATE TABLE change_checkpoint (
+    consumer            VARCHAR(40),
+    seq                 BIGINT NOT NULL,
+    updated_at          TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (consumer)
+);
+
+-- As in setup-passwords.sql; the salt and hash are made by storage.py.
+CREATE TABLE user_info (
+    username VARCHAR(20) COLLATE NOCASE PRIMARY KEY,
+    salt CHAR(8) NOT NULL,
+    password_hash BINARY(64) NOT NULL
+);
+
+CREATE INDEX idx_min ON match_result (minutes);
+CREATE INDEX idx_winner_tournament
+    ON match_result (winner_id, tournament_id, tournament_date);
+CREATE INDEX idx_loser_tournament
+    ON match_result (loser_id, tournament_id, tournament_date);
+CREATE INDEX idx_player_name ON player (last_name, first_name);
+CREATE INDEX idx_player_dob ON player (dob DESC, player_id);
+CREATE INDEX idx_player_country_name
+    ON player (country, last_name, first_name);
+CREATE INDEX idx_winner_loser
+    ON match_result (winner_id, loser_id, tournament_date, match_id);
+CREATE INDEX idx_ranking_history_rank ON ranking_history (ranking_date, `rank`);
+CREATE INDEX idx_ranking_history_player
+    ON ranking_history (player_id, ranking_date);
+CREATE INDEX idx_match_score_status ON match_score (status, sets);
+CREATE INDEX idx_match_set_games ON match_set (winner_games, loser_games);
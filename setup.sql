@@ -1,4 +1,14 @@
 -- Table definitions for WTA database.
+DROP TABLE IF EXISTS change_checkpoint;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS match_set;
+DROP TABLE IF EXISTS match_score;
+DROP TABLE IF EXISTS rating_skipped;
+DROP TABLE IF EXISTS rating_state;
+DROP TABLE IF EXISTS player_rating;
+DROP TABLE IF EXISTS ranking_history;
+DROP TABLE IF EXISTS head_to_head;
+DROP TABLE IF EXISTS player_surface_stats;
 DROP TABLE IF EXISTS tournament_history;
 DROP TABLE IF EXISTS match_result;
 DROP TABLE IF EXISTS tournament;
@@ -26,7 +36,8 @@ CREATE TABLE player (
 );
 
 -- Defines the current WTA rankings table including associated player
--- and number of player points.
+-- and number of player points. Holds the top 20 as loaded from ranking.csv,
+-- or every ranked player of the latest week loaded by rankings.py.
 CREATE TABLE ranking (
     player_id               CHAR(6),
     `rank`                  INT,
@@ -41,6 +52,37 @@ CREATE TABLE ranking (
     ON UPDATE CASCADE ON DELETE CASCADE
 );
 
+-- Every published week of the WTA rankings, as loaded from the Sackmann
+-- wta_rankings files by rankings.py, which also copies the latest week into
+-- ranking. Holds every ranked player, not only the top 20, so a player
+-- that is not in the player table is kept too: partitioned tables can't
+-- have foreign keys. Partitioned by decade of the ranking date, so a
+-- lookup on one date reads one partition, and old decades can be dropped
+-- or archived whole.
+CREATE TABLE ranking_history (
+    -- Monday of the week the ranking was published
+    ranking_date            DATE NOT NULL,
+    `rank`                  INT NOT NULL,
+    player_id               CHAR(6) NOT NULL,
+    player_points           INT,
+    -- Number of tournaments counting towards the ranking
+    tournaments             INT,
+    -- The rank of player X on date D is a primary key lookup
+    PRIMARY KEY (ranking_date, player_id),
+    -- The top N on date D is an index range scan
+    INDEX idx_ranking_history_rank (ranking_date, `rank`),
+    -- A player's rankings over time
+    INDEX idx_ranking_history_player (player_id, ranking_date)
+)
+PARTITION BY RANGE COLUMNS (ranking_date) (
+    PARTITION p1980s VALUES LESS THAN ('1990-01-01'),
+    PARTITION p1990s VALUES LESS THAN ('2000-01-01'),
+    PARTITION p2000s VALUES LESS THAN ('2010-01-01'),
+    PARTITION p2010s VALUES LESS THAN ('2020-01-01'),
+    PARTITION p2020s VALUES LESS THAN ('2030-01-01'),
+    PARTITION pfuture VALUES LESS THAN (MAXVALUE)
+);
+
 -- Defines a tournament table including where the tournament is played and
 -- the level.
 CREATE TABLE tournament (
@@ -118,6 +160,189 @@ CREATE TABLE tournament_history (
     ON UPDATE CASCADE ON DELETE CASCADE
 );
 
+-- Summary of match_result: the number of matches, wins and losses of each
+-- player on each surface. Kept current by triggers on match_result and
+-- rebuilt from scratch by rebuild_player_surface_stats (see
+-- setup-routines.sql), so per-player surface counts are a primary key
+-- lookup instead of a scan of every match.
+CREATE TABLE player_surface_stats (
+    player_id           CHAR(6),
+    surface             VARCHAR(10),
+    matches             INT NOT NULL DEFAULT 0,
+    wins                INT NOT NULL DEFAULT 0,
+    losses              INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, surface),
+    -- Automatically update player IDs when changed or deleted
+    FOREIGN KEY (player_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Summary of match_result: the head-to-head record of every pair of players
+-- that have met, one row per pair with player_a the smaller player ID. Holds
+-- each player's wins overall and on each surface, and the most recent
+-- meeting. Kept current by triggers on match_result and rebuilt from
+-- scratch by rebuild_head_to_head (see setup-routines.sql), so the records
+-- of a whole draw are a single range lookup instead of a scan of every
+-- match per pair.
+CREATE TABLE head_to_head (
+    player_a            CHAR(6),
+    player_b            CHAR(6),
+    a_wins              INT NOT NULL DEFAULT 0,
+    b_wins              INT NOT NULL DEFAULT 0,
+    -- Wins by surface
+    hard_a_wins         INT NOT NULL DEFAULT 0,
+    hard_b_wins         INT NOT NULL DEFAULT 0,
+    clay_a_wins         INT NOT NULL DEFAULT 0,
+    clay_b_wins         INT NOT NULL DEFAULT 0,
+    grass_a_wins        INT NOT NULL DEFAULT 0,
+    grass_b_wins        INT NOT NULL DEFAULT 0,
+    -- The most recent meeting (latest tournament date, then match ID)
+    last_match_id       INT,
+    last_match_date     DATE,
+    last_winner_id      CHAR(6),
+    last_score          VARCHAR(20),
+    -- Each pair is stored once, in player ID order
+    CHECK (player_a < player_b),
+    PRIMARY KEY (player_a, player_b),
+    -- Automatically update player IDs when changed or deleted
+    FOREIGN KEY (player_a) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+    FOREIGN KEY (player_b) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- Elo ratings of each player, overall and on each surface, with the number
+-- of matches behind each and the date of their last match. Maintained by
+-- elo.py, which replays match_result into it and then rates new matches as
+-- they are added; one row per player, so the top rated listings just sort
+-- it.
+CREATE TABLE player_rating (
+    player_id           CHAR(6),
+    elo                 DOUBLE NOT NULL,
+    matches             INT NOT NULL,
+    hard_elo            DOUBLE NOT NULL,
+    hard_matches        INT NOT NULL,
+    clay_elo            DOUBLE NOT NULL,
+    clay_matches        INT NOT NULL,
+    grass_elo           DOUBLE NOT NULL,
+    grass_matches       INT NOT NULL,
+    last_match_date     DATE,
+    PRIMARY KEY (player_id),
+    -- Automatically update player IDs when changed or deleted
+    FOREIGN KEY (player_id) REFERENCES player(player_id)
+    ON UPDATE CASCADE ON DELETE CASCADE
+);
+
+-- The last match rated into player_rating (a single row), and the latest
+-- tournament date rated, which new matches are checked against.
+CREATE TABLE rating_state (
+    state_id            TINYINT,
+    last_match_id       INT NOT NULL,
+    last_match_date     DATE,
+    CHECK (state_id = 1),
+    PRIMARY KEY (state_id)
+);
+
+-- Match IDs that update() (see elo.py) found missing below the last match
+-- it rated, e.g. because their insert had not committed yet. They are
+-- rated when they turn up, and forgotten (as rolled back) once
+-- last_match_id is far enough past them.
+CREATE TABLE rating_skipped (
+    match_id            INT,
+    PRIMARY KEY (match_id)
+);
+
+-- The parsed score of each match (see score_parser.py), written with the
+-- match: how it ended, the sets played and won by each side, and the
+-- tiebreaks and 6-0 sets each side won. Scores that can't be parsed have
+-- status 'U' and no sets.
+CREATE TABLE match_score (
+    match_id            INT,
+    -- P(layed), R(etired), W(alkover), D(efaulted) or U(nparsed)
+    status              CHAR(1) NOT NULL,
+    -- Sets started, including one a player retired in
+    sets                TINYINT NOT NULL,
+    -- Sets (and of those, tiebreaks and 6-0 sets) won by each side
+    winner_sets         TINYINT NOT NULL,
+    loser_sets          TINYINT NOT NULL,
+    winner_tiebreaks    TINYINT NOT NULL,
+    loser_tiebreaks     TINYINT NOT NULL,
+    winner_bagels       TINYINT NOT NULL,
+    loser_bagels        TINYINT NOT NULL,
+    CHECK (status IN ('P', 'R', 'W', 'D', 'U')),
+    PRIMARY KEY (match_id),
+    FOREIGN KEY (match_id) REFERENCES match_result(match_id)
+    ON DELETE CASCADE
+);
+
+-- The games of each set of a match, from the match winner's side. A match
+-- tiebreak ([10-8]) is stored as a 1-0 set.
+CREATE TABLE match_set (
+    match_id            INT,
+    set_number          TINYINT,
+    winner_games        TINYINT NOT NULL,
+    loser_games         TINYINT NOT NULL,
+    -- Points of the loser of the set's tiebreak, when written (7-6(5))
+    tiebreak_points     TINYINT,
+    PRIMARY KEY (match_id, set_number),
+    FOREIGN KEY (match_id) REFERENCES match_result(match_id)
+    ON DELETE CASCADE
+);
+
+-- Append-only log of the changes to player, ranking, match_result and
+-- tournament_history, written by the trg_change_log_* triggers in
+-- setup-routines.sql in the same transaction as the change. Consumers
+-- (see changefeed.py) read it in seq order from their checkpoint.
+CREATE TABLE change_log (
+    seq                 BIGINT AUTO_INCREMENT,
+    table_name          VARCHAR(20) NOT NULL,
+    -- The changed row's primary key, as a JSON array of its columns
+    row_key             VARCHAR(64) NOT NULL,
+    -- I(nsert), U(pdate) or D(elete); an update that changes the key is
+    -- logged as a delete of the old key and an insert of the new one
+    operation           CHAR(1) NOT NULL,
+    changed_at          TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    CHECK (operation IN ('I', 'U', 'D')),
+    PRIMARY KEY (seq)
+);
+
+-- The last change_log seq each named consumer has processed.
+CREATE TABLE change_checkpoint (
+    consumer            VARCHAR(40),
+    seq                 BIGINT NOT NULL,
+    updated_at          TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (consumer)
+);
+
 -- Creates index on the match_result table to improve performance time
 -- of related queries.
 CREATE INDEX idx_min ON match_result (minutes);
+
+-- Covering indexes for finding a player's matches in one tournament
+-- (update_tournaments_played and apply_tournaments_played), one per side of
+-- the match so neither lookup needs an OR over winner_id and loser_id.
+CREATE INDEX idx_winner_tournament
+    ON match_result (winner_id, tournament_id, tournament_date);
+CREATE INDEX idx_loser_tournament
+    ON match_result (loser_id, tournament_id, tournament_date);
+
+-- Index for looking players up by name (e.g. show_surface_count).
+CREATE INDEX idx_player_name ON player (last_name, first_name);
+
+-- Indexes matching the order of the paged player listings in paging.py,
+-- so each page is a short index range scan. The listing outside the top 20
+-- is ordered by dob descending but player_id ascending, so the index has
+-- to say so; (dob) alone can only be read in one direction for both.
+CREATE INDEX idx_player_dob ON player (dob DESC, player_id);
+CREATE INDEX idx_player_country_name
+    ON player (country, last_name, first_name);
+
+-- Index for finding the matches between two players (the latest one first)
+-- when a head_to_head row's last meeting is removed.
+CREATE INDEX idx_winner_loser
+    ON match_result (winner_id, loser_id, tournament_date, match_id);
+
+-- Indexes for set-level statistics: matches by how they ended and how many
+-- sets they went, and sets by their score (e.g. every 6-0 or 7-6).
+CREATE INDEX idx_match_score_status ON match_score (status, sets);
+CREATE INDEX idx_match_set_games ON match_set (winner_games, loser_games);
@@ -0,0 +1,364 @@
+"""
+Registry of the named, parameterized SQL statements used by the WTA
+database application.
+
+Every statement is prepared on the server (a prepared cursor) the first time
+it runs on a given connection and reused for every later call on that
+connection, so the server no longer re-parses and re-plans the SQL on each
+request. Values are always sent as statement parameters, never interpolated
+into the SQL text.
+
+Typical use:
+
+    with db_pool.connection(db_pool.CLIENT) as conn:
+        cursor = statements.execute(conn, 'tournament_winners', (name, ))
+        rows = cursor.fetchall()
+
+Per-statement prepare and hit counts are kept so it is easy to confirm that
+re-parsing is gone from the hot path; see stats() and report().
+"""
+import threading
+import weakref
+
+
+class Statement:
+    """
+    A named SQL statement with %s parameter placeholders, along with
+    counters of how often it had to be prepared and how often an already
+    prepared copy was reused. reads and writes name the tables the
+    statement depends on and modifies (including through triggers), which
+    the result cache uses for invalidation.
+    """
+
+    def __init__(self, name, sql, reads=(), writes=()):
+        self.name = name
+        self.sql = sql
+        self.reads = frozenset(reads)
+        self.writes = frozenset(writes)
+        self.prepares = 0
+        self.hits = 0
+
+
+STATEMENTS = {}
+
+
+def register(name, sql, reads=(), writes=()):
+    """
+    Adds a statement to the registry under the given name and returns it.
+    """
+    if name in STATEMENTS:
+        raise ValueError(f'Statement {name} is already registered')
+    STATEMENTS[name] = Statement(name, sql, reads, writes)
+    return STATEMENTS[name]
+
+
+# ----------------------------------------------------------------------
+# Statement Definitions
+# ----------------------------------------------------------------------
+# Lookups used to validate user input, keyed by (table, attribute) so that
+# exists() in app.py can pick the matching statement.
+EXISTS_STATEMENTS = {
+    ('player', 'player_id'): register(
+        'exists_player_id',
+        'SELECT 1 FROM player WHERE player_id = %s LIMIT 1'),
+    ('player', 'country'): register(
+        'exists_country',
+        'SELECT 1 FROM player WHERE country = %s LIMIT 1'),
+    ('tournament', 'tournament_id'): register(
+        'exists_tournament_id',
+        'SELECT 1 FROM tournament WHERE tournament_id = %s LIMIT 1'),
+    ('user_info', 'username'): register(
+        'exists_username',
+        'SELECT 1 FROM user_info WHERE username = %s LIMIT 1'),
+}
+
+register('tournament_winners', """
+    SELECT tournament_year,
+        first_name,
+        last_name
+    FROM (
+            SELECT tournament_name,
+                tournament_year,
+                winner_id
+            FROM tournament
+                NATURAL JOIN tournament_history
+            WHERE tournament_name = %s
+        ) AS T
+        JOIN player ON winner_id = player_id
+    ORDER BY tournament_year""",
+         reads=('tournament', 'tournament_history', 'player'))
+
+register('players_inside_top_20', """
+    SELECT `rank`,
+        first_name,
+        last_name,
+        TIMESTAMPDIFF(YEAR, dob, current_date()) AS age
+    FROM ranking NATURAL JOIN player
+    WHERE `rank` <= 20
+    ORDER BY `rank`""",
+         reads=('ranking', 'player'))
+
+register('players_outside_top_20', """
+    SELECT first_name,
+        last_name,
+        TIMESTAMPDIFF(YEAR, dob, current_date()) AS age
+    FROM player
+    WHERE player_id NOT IN (
+            SELECT player_id
+            FROM ranking
+            WHERE `rank` <= 20
+        )
+    ORDER BY age""",
+         reads=('ranking', 'player'))
+
+# Reads the player_surface_stats summary rather than grouping match_result.
+# Players are found by name through name_search, and the rows of players
+# sharing a name are summed by operations.surface_count.
+register('player_surface_count', """
+    SELECT surface, matches, wins, losses
+    FROM player_surface_stats
+    WHERE player_id = %s
+        AND matches > 0
+    ORDER BY surface""",
+         reads=('player_surface_stats', ))
+
+register('rebuild_player_surface_stats',
+         'CALL rebuild_player_surface_stats()',
+         writes=('player_surface_stats', ))
+
+register('players_by_country', """
+    SELECT first_name, last_name, hand, height
+    FROM player
+    WHERE country = %s""",
+         reads=('player', ))
+
+# Kept for bench_queries.py; operations.matchup_history resolves the names
+# through name_search and reads head_to_head_pairs instead.
+register('matchup_history',
+         'SELECT find_matchup_history(%s, %s, %s, %s)',
+         reads=('player', 'head_to_head'))
+
+register('highest_ranked_player',
+         'SELECT find_highest_ranked_player(%s)',
+         reads=('player', 'ranking'))
+
+# Head-to-head records from the head_to_head summary, many pairs per
+# statement. The lists of players and pairs are padded with NULLs (which
+# match nothing) up to a fixed length, so every call reuses one prepared
+# statement. head_to_head_draw returns every pair among up to
+# HEAD_TO_HEAD_PLAYERS players (a whole draw) in a single index lookup per
+# player; head_to_head_pairs returns up to HEAD_TO_HEAD_PAIRS given pairs,
+# each a primary key lookup.
+HEAD_TO_HEAD_PLAYERS = 128
+HEAD_TO_HEAD_PAIRS = 64
+HEAD_TO_HEAD_COLUMNS = ('player_a, player_b, a_wins, b_wins, '
+                        'hard_a_wins, hard_b_wins, clay_a_wins, clay_b_wins, '
+                        'grass_a_wins, grass_b_wins, last_match_date, '
+                        'last_winner_id, last_score')
+_PLAYER_LIST = ', '.join(['%s'] * HEAD_TO_HEAD_PLAYERS)
+
+register('head_to_head_draw', f"""
+    SELECT {HEAD_TO_HEAD_COLUMNS}
+    FROM head_to_head
+    WHERE player_a IN ({_PLAYER_LIST})
+        AND player_b IN ({_PLAYER_LIST})
+    ORDER BY player_a, player_b""",
+         reads=('head_to_head', ))
+
+register('head_to_head_pairs', f"""
+    SELECT {HEAD_TO_HEAD_COLUMNS}
+    FROM head_to_head
+    WHERE {' OR '.join(['(player_a = %s AND player_b = %s)']
+                       * HEAD_TO_HEAD_PAIRS)}
+    ORDER BY player_a, player_b""",
+         reads=('head_to_head', ))
+
+register('rebuild_head_to_head', 'CALL rebuild_head_to_head()',
+         writes=('head_to_head', ))
+
+# The procedure returns the new match ID through its OUT parameter, which
+# is read back from the session variable with new_match_id.
+register('input_match_results', """
+    CALL input_match_results(%s, %s, %s, %s, %s, %s, %s,
+                             %s, %s, %s, %s, %s, %s, @new_match_id)""",
+         writes=('match_result', 'tournament_history', 'ranking',
+                 'player_surface_stats', 'head_to_head'))
+
+register('new_match_id', 'SELECT @new_match_id')
+
+# Bulk loads switch the session to set-based maintenance of
+# ranking.tournaments_played: the insert trigger skips its per-row update
+# and the loader applies each batch of match IDs in one statement instead.
+register('defer_tournaments_played', 'SET @defer_tournaments_played = %s')
+
+register('apply_tournaments_played',
+         'CALL apply_tournaments_played(%s, %s)',
+         writes=('ranking', ))
+
+# Column names can't be statement parameters, so there is one UPDATE per
+# editable player attribute, keyed by attribute name.
+UPDATE_PLAYER_STATEMENTS = {
+    attribute: register(
+        f'update_player_{attribute}',
+        f'UPDATE player SET {attribute} = %s WHERE player_id = %s',
+        writes=('player', ))
+    for attribute in ('first_name', 'last_name', 'hand', 'dob', 'country',
+                      'height')
+}
+
+register('update_ranking', """
+    UPDATE ranking SET player_id = %s,
+                       player_points = %s,
+                       tournaments_played = %s
+    WHERE `rank` = %s""",
+         writes=('ranking', ))
+
+# Rankings of past weeks, from ranking_history. The ranking in effect on a
+# date is the latest one published on or before it.
+register('player_rank_on', """
+    SELECT ranking_date, `rank`, player_points
+    FROM ranking_history
+    WHERE ranking_date = (
+            SELECT MAX(ranking_date)
+            FROM ranking_history
+            WHERE ranking_date <= %s
+        )
+        AND player_id = %s""",
+         reads=('ranking_history', ))
+
+register('top_ranked_on', """
+    SELECT H.ranking_date, H.`rank`, H.player_id, P.first_name, P.last_name,
+        H.player_points
+    FROM ranking_history AS H
+        LEFT JOIN player AS P ON P.player_id = H.player_id
+    WHERE H.ranking_date = (
+            SELECT MAX(ranking_date)
+            FROM ranking_history
+            WHERE ranking_date <= %s
+        )
+        AND H.`rank` <= %s
+    ORDER BY H.`rank`, H.player_id""",
+         reads=('ranking_history', 'player'))
+
+# Profiles of up to PROFILE_PLAYERS players (a JSON array of IDs) with
+# their most recent matches, as five result sets from one procedure call;
+# read with fetchsets().
+PROFILE_PLAYERS = 128
+register('player_profiles', 'CALL player_profiles(%s, %s)',
+         reads=('player', 'ranking', 'player_surface_stats',
+                'tournament_history', 'tournament', 'match_result'))
+
+register('authenticate', 'SELECT authenticate(%s, %s)')
+
+register('add_user', 'CALL sp_add_user(%s, %s)')
+
+
+# ----------------------------------------------------------------------
+# Execution
+# ----------------------------------------------------------------------
+# Prepared cursors belong to one server session, so they are cached per
+# connection. Each entry remembers the server connection id it was prepared
+# under; if the pool reconnected the connection since, the server has
+# forgotten the statements and they are prepared again.
+_cursors = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def _prepared_cursor(conn, statement):
+    """
+    Returns a prepared cursor for the statement on the given connection,
+    creating (and counting) a new one if this session has not prepared the
+    statement yet.
+    """
+    session = _cursors.get(conn)
+    if session is None or session['connection_id'] != conn.connection_id:
+        session = {'connection_id': conn.connection_id, 'cursors': {}}
+        _cursors[conn] = session
+    cursor = session['cursors'].get(statement.name)
+    with _lock:
+        if cursor is None:
+            statement.prepares += 1
+        else:
+            statement.hits += 1
+    if cursor is None:
+        cursor = conn.cursor(prepared=True)
+        session['cursors'][statement.name] = cursor
+    return cursor
+
+
+def execute(conn, name, params=()):
+    """
+    Runs the named statement with the given parameters on the connection,
+    and returns the cursor so that results can be fetched from it. Results
+    must be fetched before the same statement is run again on the same
+    connection.
+    """
+    statement = STATEMENTS[name]
+    cursor = _prepared_cursor(conn, statement)
+    # The cursor skips the prepare step only when it is handed the exact
+    # string object it prepared last time, so always pass statement.sql.
+    cursor.execute(statement.sql, tuple(params))
+    return cursor
+
+
+def executemany(conn, name, rows):
+    """
+    Runs the named statement once for every parameter tuple in rows and
+    returns the cursor. This uses a plain (text) cursor rather than a
+    prepared one, since the connector rewrites a batch of INSERTs into a
+    single multi-row INSERT, which beats executing a prepared INSERT once
+    per row.
+    """
+    statement = STATEMENTS[name]
+    with _lock:
+        statement.hits += 1
+    cursor = conn.cursor()
+    cursor.executemany(statement.sql, rows)
+    return cursor
+
+
+def fetchsets(conn, name, params=()):
+    """
+    Runs the named statement, a CALL of a procedure returning several
+    result sets, and returns a list of the rows of each. This uses a text
+    cursor, since a prepared statement only returns the first result set.
+    """
+    statement = STATEMENTS[name]
+    with _lock:
+        statement.hits += 1
+    cursor = conn.cursor()
+    try:
+        cursor.execute(statement.sql, tuple(params))
+        sets = []
+        while True:
+            # The CALL's own status comes last and has no rows
+            if cursor.with_rows:
+                sets.append(cursor.fetchall())
+            if not cursor.nextset():
+                break
+    finally:
+        cursor.close()
+    return sets
+
+
+def stats():
+    """
+    Returns a dictionary mapping each statement name to its prepare and
+    hit counts.
+    """
+    with _lock:
+        return {name: {'prepares': s.prepares, 'hits': s.hits}
+                for name, s in STATEMENTS.items()}
+
+
+def report():
+    """
+    Returns a printable table of prepare and hit counts for every statement
+    that has been run.
+    """
+    lines = [f'{"Statement":<32} {"Prepares":>9} {"Hits":>9}']
+    for name, counts in sorted(stats().items()):
+        if counts['prepares'] or counts['hits']:
+            lines.append(f'{name:<32} {counts["prepares"]:>9} '
+                         f'{counts["hits"]:>9}')
+    return '\n'.join(lines)
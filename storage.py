@@ -0,0 +1,815 @@
+"""
+Storage backends for the WTA database application.
+
+The query layers (operations, result_cache, paging and key_index) borrow a
+connection with storage.connection(role) and run named statements from the
+registry with storage.execute(conn, name, params). Where those go depends on
+the configured backend (the 'backend' setting in wtadb.ini, or
+WTADB_BACKEND):
+
+  mysql:   the default; db_pool connections and server-side prepared
+           statements, exactly as before.
+  sqlite:  an embedded SQLite copy of the database at sqlite_path, built
+           from the same five CSVs with `python storage.py build`. It runs
+           in-process with no server or network hop, e.g. as a read-only
+           replica at the edge or in CI. Client connections are opened
+           read-only.
+
+The SQLite backend runs the registry's MySQL statements after translating
+their placeholders and MySQL-only functions. The stored routines are
+reimplemented: find_matchup_history, find_highest_ranked_player,
+authenticate and sp_add_user as SQLite statements (with SHA2 and make_salt
+as Python functions), input_match_results in Python, player_profiles as one
+query per result set, and the triggers in setup-sqlite-routines.sql. Bulk
+load statements (defer/apply_tournaments_played) are MySQL only. SQLite
+errors are raised as BackendError, a mysql.connector.Error, so the
+application's error handling is the same for both backends.
+
+    $ python storage.py build
+    $ WTADB_BACKEND=sqlite python app.py
+
+check_parity.py compares the results of both backends.
+
+Every statement run through execute(), executemany(), fetchall(),
+fetchsets(), fetchone() or iterate() is timed and recorded in metrics.py
+(latency, rows, bytes, errors), and statements slower than slow_query_time
+go to the slow query log with their EXPLAIN plan.
+"""
+import argparse
+import contextlib
+import csv
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+
+import mysql.connector
+
+import db_pool
+import metrics
+import statements
+
+MYSQL = 'mysql'
+SQLITE = 'sqlite'
+BACKENDS = (MYSQL, SQLITE)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SQLITE_SCHEMA_FILE = os.path.join(HERE, 'setup-sqlite.sql')
+SQLITE_ROUTINES_FILE = os.path.join(HERE, 'setup-sqlite-routines.sql')
+
+# The CSVs loaded by load-data.sql, in an order that satisfies every
+# foreign key.
+TABLES = ('player', 'ranking', 'tournament', 'match_result',
+          'tournament_history')
+
+# The application users registered by setup-passwords.sql.
+USERS = (('bavilari', 'bea123'), ('elzhang', 'emily123'),
+         ('admin', 'adminpw'))
+
+
+class BackendError(mysql.connector.Error):
+    """
+    An error from a backend other than MySQL, raised as a
+    mysql.connector.Error so that the same handlers catch it.
+    """
+
+
+class MySQLBackend:
+    """
+    The MySQL server, through the db_pool connection pools and prepared
+    statements.
+    """
+    name = MYSQL
+
+    def connection(self, role):
+        return db_pool.connection(role)
+
+    def execute(self, conn, name, params=()):
+        return statements.execute(conn, name, params)
+
+    def executemany(self, conn, name, rows):
+        return statements.executemany(conn, name, rows)
+
+    def fetchsets(self, conn, name, params=()):
+        return statements.fetchsets(conn, name, params)
+
+    def sql(self, name):
+        return statements.STATEMENTS[name].sql
+
+    def explain(self, conn, sql, params=()):
+        cursor = conn.cursor()
+        try:
+            cursor.execute('EXPLAIN FORMAT=JSON ' + sql, tuple(params))
+            (plan, ) = cursor.fetchone()
+        finally:
+            cursor.close()
+        return json.loads(plan)
+
+    def close(self):
+        db_pool.close_all()
+
+
+# ----------------------------------------------------------------------
+# SQLite Functions and Statements
+# ----------------------------------------------------------------------
+def age_years(dob):
+    """
+    TIMESTAMPDIFF(YEAR, dob, current_date()): whole years since dob.
+    """
+    if dob is None:
+        return None
+    born = datetime.date.fromisoformat(dob)
+    today = datetime.date.today()
+    return (today.year - born.year
+            - ((today.month, today.day) < (born.month, born.day)))
+
+
+def make_salt(num_chars):
+    """
+    make_salt() from setup-passwords.sql: up to 20 random characters from
+    ASCII 32 (space) to 126.
+    """
+    return ''.join(chr(32 + random.randrange(95))
+                   for _ in range(min(20, num_chars)))
+
+
+def sha2(value, bits):
+    """
+    SHA2(value, 256) as MySQL returns it, a hex string.
+    """
+    if value is None or bits != 256:
+        return None
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _create_functions(raw):
+    raw.create_function('age_years', 1, age_years, deterministic=True)
+    raw.create_function('make_salt', 1, make_salt)
+    raw.create_function('sha2', 2, sha2, deterministic=True)
+
+
+_TIMESTAMPDIFF = re.compile(r'TIMESTAMPDIFF\(YEAR, (\w+), current_date\(\)\)',
+                            re.IGNORECASE)
+
+
+def translate(sql):
+    """
+    Returns the SQLite form of a registry statement's MySQL SQL.
+    """
+    return _TIMESTAMPDIFF.sub(r'age_years(\1)', sql).replace('%s', '?')
+
+
+# The stored functions, as statements returning the same single value
+# (NULL when there is no answer).
+SQLITE_STATEMENTS = {
+    'matchup_history': """
+        SELECT (
+            SELECT CASE
+                    WHEN H.last_winner_id = P1.player_id
+                    THEN ?1 || ' ' || ?2
+                    ELSE ?3 || ' ' || ?4
+                END || ' ' || H.last_score
+            FROM player AS P1,
+                player AS P2,
+                head_to_head AS H
+            WHERE P1.first_name = ?1
+                AND P1.last_name = ?2
+                AND P2.first_name = ?3
+                AND P2.last_name = ?4
+                AND H.player_a = min(P1.player_id, P2.player_id)
+                AND H.player_b = max(P1.player_id, P2.player_id)
+        )""",
+    'highest_ranked_player': """
+        SELECT (
+            SELECT first_name || ' ' || last_name || ' ' || `rank`
+            FROM ranking
+                NATURAL JOIN player
+            WHERE country = ?
+            ORDER BY `rank`
+            LIMIT 1
+        )""",
+    'authenticate': """
+        SELECT COUNT(*)
+        FROM user_info
+        WHERE username = ?1
+            AND password_hash = sha2(salt || ?2, 256)""",
+    'add_user': """
+        INSERT INTO user_info
+        SELECT ?1, salt, sha2(salt || ?2, 256)
+        FROM (SELECT make_salt(8) AS salt)""",
+}
+
+REBUILD_SURFACE_STATS = ("""
+    DELETE FROM player_surface_stats""", """
+    INSERT INTO player_surface_stats
+    SELECT player_id,
+        surface,
+        COUNT(*) AS matches,
+        SUM(won) AS wins,
+        COUNT(*) - SUM(won) AS losses
+    FROM (
+            SELECT winner_id AS player_id,
+                tournament_id,
+                1 AS won
+            FROM match_result
+            UNION ALL
+            SELECT loser_id AS player_id,
+                tournament_id,
+                0 AS won
+            FROM match_result
+        ) AS M
+        NATURAL JOIN tournament
+    GROUP BY player_id, surface""")
+
+REBUILD_HEAD_TO_HEAD = ("""
+    DELETE FROM head_to_head""", """
+    INSERT INTO head_to_head (
+            player_a, player_b, a_wins, b_wins, hard_a_wins, hard_b_wins,
+            clay_a_wins, clay_b_wins, grass_a_wins, grass_b_wins)
+    SELECT player_a,
+        player_b,
+        SUM(a_won),
+        SUM(1 - a_won),
+        SUM(a_won * (surface = 'Hard')),
+        SUM((1 - a_won) * (surface = 'Hard')),
+        SUM(a_won * (surface = 'Clay')),
+        SUM((1 - a_won) * (surface = 'Clay')),
+        SUM(a_won * (surface = 'Grass')),
+        SUM((1 - a_won) * (surface = 'Grass'))
+    FROM (
+            SELECT min(winner_id, loser_id) AS player_a,
+                max(winner_id, loser_id) AS player_b,
+                winner_id < loser_id AS a_won,
+                tournament_id
+            FROM match_result
+        ) AS M
+        NATURAL JOIN tournament
+    GROUP BY player_a, player_b""", """
+    UPDATE head_to_head
+    SET (last_match_id, last_match_date, last_winner_id, last_score) = (
+            SELECT match_id, tournament_date, winner_id, score
+            FROM match_result
+            WHERE (winner_id = player_a AND loser_id = player_b)
+                OR (winner_id = player_b AND loser_id = player_a)
+            ORDER BY tournament_date DESC, match_id DESC
+            LIMIT 1
+        )""")
+
+
+# Procedures returning several result sets, as the names of their
+# parameters and one query per result set.
+_PROFILE_IDS = 'SELECT DISTINCT value FROM json_each(:player_ids)'
+_PROFILE_SIDE = """
+            SELECT {player}_id AS player_id, match_id, tournament_date,
+                '{result}' AS result, {opponent}_id AS opponent_id
+            FROM match_result
+            WHERE {player}_id IN ({ids})"""
+
+SQLITE_RESULT_SETS = {
+    'player_profiles': (('player_ids', 'recent_matches'), (f"""
+        SELECT player_id, first_name, last_name, hand, dob, country, height
+        FROM player
+        WHERE player_id IN ({_PROFILE_IDS})
+        ORDER BY player_id""", f"""
+        SELECT player_id, `rank`, player_points, tournaments_played
+        FROM ranking
+        WHERE player_id IN ({_PROFILE_IDS})
+        ORDER BY player_id, `rank`""", f"""
+        SELECT player_id, surface, matches, wins, losses
+        FROM player_surface_stats
+        WHERE player_id IN ({_PROFILE_IDS})
+            AND matches > 0
+        ORDER BY player_id, surface""", f"""
+        SELECT H.winner_id, H.tournament_year, H.tournament_id,
+            T.tournament_name
+        FROM tournament_history AS H
+            JOIN tournament AS T ON T.tournament_id = H.tournament_id
+        WHERE H.winner_id IN ({_PROFILE_IDS})
+        ORDER BY H.winner_id, H.tournament_year DESC, H.tournament_id""", f"""
+        SELECT R.player_id, R.match_id, R.tournament_date,
+            T.tournament_name, R.result, R.opponent_id, O.first_name,
+            O.last_name, M.score
+        FROM (
+                SELECT *,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY player_id
+                        ORDER BY tournament_date DESC, match_id DESC
+                    ) AS n
+                FROM ({_PROFILE_SIDE.format(player='winner', result='W',
+                                            opponent='loser',
+                                            ids=_PROFILE_IDS)}
+                    UNION ALL{_PROFILE_SIDE.format(player='loser',
+                                                   result='L',
+                                                   opponent='winner',
+                                                   ids=_PROFILE_IDS)}
+                )
+            ) AS R
+            JOIN match_result AS M ON M.match_id = R.match_id
+            JOIN tournament AS T ON T.tournament_id = M.tournament_id
+            JOIN player AS O ON O.player_id = R.opponent_id
+        WHERE R.n <= :recent_matches
+        ORDER BY R.player_id, R.n""")),
+}
+
+
+class SQLiteCursor:
+    """
+    A sqlite3 cursor with the with_rows attribute of a mysql.connector
+    cursor.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    @property
+    def with_rows(self):
+        return self.raw.description is not None
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class SQLiteConnection:
+    """
+    A sqlite3 connection, along with the session variables (e.g.
+    @new_match_id) that the MySQL statements set and read back.
+    """
+
+    def __init__(self, raw, role):
+        self.raw = raw
+        self.role = role
+        self.variables = {}
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+def _input_match_results(conn, params):
+    """
+    The input_match_results procedure: inserts the match (and, for a final,
+    its tournament history entry) and sets @new_match_id. Committed by the
+    caller, as the rest of the transaction is.
+    """
+    (is_final, tournament_id, date, score, minutes, winner_id, winner_aces,
+     winner_bp_saved, winner_dfs, loser_id, loser_aces, loser_bp_saved,
+     loser_dfs) = params
+    cursor = conn.raw.execute("""
+        INSERT INTO match_result (
+                tournament_id, tournament_date, score, minutes, winner_id,
+                winner_aces, winner_bp_saved, winner_dfs, loser_id,
+                loser_aces, loser_bp_saved, loser_dfs)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                              (tournament_id, str(date), score, minutes,
+                               winner_id, winner_aces, winner_bp_saved,
+                               winner_dfs, loser_id, loser_aces,
+                               loser_bp_saved, loser_dfs))
+    conn.variables['new_match_id'] = cursor.lastrowid
+    if int(is_final) == 1:
+        conn.raw.execute("""
+            INSERT INTO tournament_history VALUES (?, ?, ?, ?, ?)""",
+                         (tournament_id, str(date)[:4], winner_id, loser_id,
+                          cursor.lastrowid))
+    return cursor
+
+
+def _new_match_id(conn, params):
+    return conn.raw.execute('SELECT ?',
+                            (conn.variables.get('new_match_id'), ))
+
+
+def _rebuild_player_surface_stats(conn, params):
+    for sql in REBUILD_SURFACE_STATS:
+        cursor = conn.raw.execute(sql)
+    return cursor
+
+
+def _rebuild_head_to_head(conn, params):
+    for sql in REBUILD_HEAD_TO_HEAD:
+        cursor = conn.raw.execute(sql)
+    return cursor
+
+
+# Statements that call procedures or use session variables, implemented in
+# Python against the connection.
+SQLITE_ROUTINES = {
+    'input_match_results': _input_match_results,
+    'new_match_id': _new_match_id,
+    'rebuild_player_surface_stats': _rebuild_player_surface_stats,
+    'rebuild_head_to_head': _rebuild_head_to_head,
+}
+
+
+class SQLiteBackend:
+    """
+    An embedded SQLite database file. Each thread gets its own connection
+    per role; client connections are read-only.
+    """
+    name = SQLITE
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        # statement name -> translated SQL
+        self._sql = {}
+
+    def _connect(self, role):
+        if not os.path.exists(self.path):
+            raise BackendError(f'SQLite database {self.path} does not exist; '
+                               f'create it with `python storage.py build`')
+        mode = 'ro' if role == db_pool.CLIENT else 'rw'
+        uri = f'file:{urllib.parse.quote(os.path.abspath(self.path))}' \
+              f'?mode={mode}'
+        try:
+            raw = sqlite3.connect(uri, uri=True, timeout=self.timeout,
+                                  check_same_thread=False)
+            raw.execute('PRAGMA foreign_keys = ON')
+        except sqlite3.Error as err:
+            raise BackendError(str(err)) from err
+        _create_functions(raw)
+        conn = SQLiteConnection(raw, role)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def connection(self, role):
+        """
+        Returns this thread's connection for the role for the duration of a
+        with-block, rolling back whatever it left uncommitted.
+        """
+        if role not in db_pool.ROLES:
+            raise ValueError(f'Unknown database role: {role}')
+        conn = getattr(self._local, role, None)
+        if conn is None:
+            conn = self._connect(role)
+            setattr(self._local, role, conn)
+        try:
+            yield conn
+        finally:
+            if conn.raw.in_transaction:
+                conn.raw.rollback()
+
+    def sql(self, name):
+        """
+        Returns the SQLite SQL for the named statement.
+        """
+        sql = self._sql.get(name)
+        if sql is None:
+            sql = SQLITE_STATEMENTS.get(name)
+            if sql is None:
+                sql = statements.STATEMENTS[name].sql
+                if sql.lstrip().upper().startswith(('CALL', 'SET')):
+                    raise BackendError(f'Statement {name} is not supported '
+                                       f'by the SQLite backend')
+                sql = translate(sql)
+            self._sql[name] = sql
+        return sql
+
+    def execute(self, conn, name, params=()):
+        try:
+            routine = SQLITE_ROUTINES.get(name)
+            if routine is not None:
+                cursor = routine(conn, tuple(params))
+            else:
+                cursor = conn.raw.execute(self.sql(name), tuple(params))
+        except sqlite3.Error as err:
+            raise BackendError(f'{name}: {err}') from err
+        return SQLiteCursor(cursor)
+
+    def fetchsets(self, conn, name, params=()):
+        if name not in SQLITE_RESULT_SETS:
+            raise BackendError(f'Statement {name} is not supported by the '
+                               f'SQLite backend')
+        names, queries = SQLITE_RESULT_SETS[name]
+        values = dict(zip(names, params))
+        try:
+            return [conn.raw.execute(sql, values).fetchall()
+                    for sql in queries]
+        except sqlite3.Error as err:
+            raise BackendError(f'{name}: {err}') from err
+
+    def executemany(self, conn, name, rows):
+        try:
+            cursor = conn.raw.executemany(self.sql(name),
+                                          [tuple(row) for row in rows])
+        except sqlite3.Error as err:
+            raise BackendError(f'{name}: {err}') from err
+        return SQLiteCursor(cursor)
+
+    def explain(self, conn, sql, params=()):
+        try:
+            rows = conn.raw.execute('EXPLAIN QUERY PLAN ' + sql,
+                                    tuple(params)).fetchall()
+        except sqlite3.Error as err:
+            raise BackendError(str(err)) from err
+        return [row[-1] for row in rows]
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.raw.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def build_sqlite(path, data_dir=HERE):
+    """
+    Creates (or recreates) the SQLite database at path from the CSVs in
+    data_dir, as setup.sql, load-data.sql, setup-passwords.sql and
+    setup-routines.sql do for MySQL, and parses the match scores as
+    score_parser.py backfill does.
+    """
+    # Imported here, as score_parser uses this module
+    import score_parser
+    if os.path.exists(path):
+        os.remove(path)
+    raw = sqlite3.connect(path)
+    try:
+        _create_functions(raw)
+        raw.execute('PRAGMA foreign_keys = ON')
+        with open(SQLITE_SCHEMA_FILE) as f:
+            raw.executescript(f.read())
+        for table in TABLES:
+            with open(os.path.join(data_dir, f'{table}.csv'),
+                      newline='') as f:
+                reader = csv.reader(f)
+                header = next(reader)
+                columns = ', '.join(f'`{column}`' for column in header)
+                placeholders = ', '.join('?' * len(header))
+                raw.executemany(
+                    f'INSERT INTO {table} ({columns}) VALUES ({placeholders})',
+                    ([value if value != '' else None for value in row]
+                     for row in reader))
+        with open(SQLITE_ROUTINES_FILE) as f:
+            raw.executescript(f.read())
+        for sql in REBUILD_SURFACE_STATS + REBUILD_HEAD_TO_HEAD:
+            raw.execute(sql)
+        score_rows, set_rows = score_parser.rows(
+            raw.execute('SELECT match_id, score FROM match_result'))
+        for name, rows in (('insert_match_score', score_rows),
+                           ('insert_match_set', set_rows)):
+            raw.executemany(translate(statements.STATEMENTS[name].sql), rows)
+        raw.executemany(SQLITE_STATEMENTS['add_user'], USERS)
+        raw.commit()
+    finally:
+        raw.close()
+
+
+# ----------------------------------------------------------------------
+# The Configured Backend
+# ----------------------------------------------------------------------
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def configure(backend=None, path=None):
+    """
+    Selects the backend ('mysql' or 'sqlite', by default the 'backend'
+    setting) and, for SQLite, the database file, closing the connections
+    of the previous backend.
+    """
+    global _backend
+    config = db_pool.get_config()
+    metrics.configure(config)
+    backend = backend or config['backend']
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown storage backend: {backend}')
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+        if backend == SQLITE:
+            _backend = SQLiteBackend(
+                path or os.path.join(HERE, config['sqlite_path']),
+                float(config['pool_timeout']))
+        else:
+            _backend = MySQLBackend()
+        return _backend
+
+
+def get_backend():
+    """
+    Returns the configured backend, selecting it on first use.
+    """
+    if _backend is None:
+        return configure()
+    return _backend
+
+
+def connection(role):
+    """
+    Checks out a connection for the given role from the configured backend
+    for the duration of a with-block.
+    """
+    return get_backend().connection(role)
+
+
+def _role(conn):
+    """
+    Returns the role (db_pool.ADMIN or db_pool.CLIENT) of a connection from
+    either backend.
+    """
+    role = getattr(conn, 'role', None)
+    if role is None and hasattr(conn, 'pool'):
+        role = conn.pool.role
+    return role
+
+
+def explain(conn, name, params=()):
+    """
+    Returns the configured backend's query plan for the named statement:
+    EXPLAIN FORMAT=JSON on MySQL, EXPLAIN QUERY PLAN on SQLite. Statements
+    other than SELECTs (writes, procedure calls) have no plan and return
+    None.
+    """
+    backend = get_backend()
+    if backend.name == SQLITE and (name in SQLITE_ROUTINES
+                                   or name in SQLITE_RESULT_SETS):
+        return None
+    sql = backend.sql(name)
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    return backend.explain(conn, sql, params)
+
+
+def _record(conn, name, params, start, rows=0, nbytes=0, error=False,
+            can_explain=True):
+    """
+    Records a run of a statement that started at start (a perf_counter()
+    time) in the metrics, and logs it if it was slow, with its plan unless
+    the connection still has unread rows (can_explain=False).
+    """
+    seconds = time.perf_counter() - start
+    role = _role(conn)
+    metrics.metrics.observe(name, role, seconds, rows, nbytes, error)
+    if error or not metrics.metrics.is_slow(seconds):
+        return
+    plan = None
+    try:
+        if can_explain:
+            plan = explain(conn, name, params)
+    except mysql.connector.Error as err:
+        plan = f'EXPLAIN failed: {err}'
+    metrics.metrics.log_slow_query(name, role, seconds, rows, params, plan)
+
+
+def execute(conn, name, params=()):
+    """
+    Runs the named statement on a connection from connection() and returns
+    the cursor to fetch results from. Use this for writes; reads should use
+    fetchall(), fetchone() or iterate(), which also record the rows and
+    bytes they return and the time to fetch them.
+    """
+    start = time.perf_counter()
+    try:
+        cursor = get_backend().execute(conn, name, params)
+    except mysql.connector.Error:
+        _record(conn, name, params, start, error=True)
+        raise
+    if cursor.with_rows:
+        _record(conn, name, params, start, can_explain=False)
+    else:
+        _record(conn, name, params, start, max(cursor.rowcount or 0, 0))
+    return cursor
+
+
+def executemany(conn, name, rows):
+    """
+    Runs the named write statement once for every parameter tuple in rows
+    (as one multi-row INSERT on MySQL) and returns the cursor. Recorded as
+    one run; the slow query log shows the first row's parameters.
+    """
+    rows = list(rows)
+    start = time.perf_counter()
+    first = rows[0] if rows else ()
+    try:
+        cursor = get_backend().executemany(conn, name, rows)
+    except mysql.connector.Error:
+        _record(conn, name, first, start, error=True)
+        raise
+    _record(conn, name, first, start, max(cursor.rowcount or 0, 0),
+            can_explain=False)
+    return cursor
+
+
+def fetchall(conn, name, params=()):
+    """
+    Runs the named statement and returns all of its rows.
+    """
+    start = time.perf_counter()
+    try:
+        rows = get_backend().execute(conn, name, params).fetchall()
+    except mysql.connector.Error:
+        _record(conn, name, params, start, error=True)
+        raise
+    _record(conn, name, params, start, len(rows),
+            sum(metrics.row_bytes(row) for row in rows))
+    return rows
+
+
+def fetchsets(conn, name, params=()):
+    """
+    Runs a statement returning several result sets (a procedure such as
+    player_profiles) and returns a list of the rows of each. Recorded as
+    one run, with the rows and bytes of every set.
+    """
+    start = time.perf_counter()
+    try:
+        sets = get_backend().fetchsets(conn, name, params)
+    except mysql.connector.Error:
+        _record(conn, name, params, start, error=True)
+        raise
+    _record(conn, name, params, start, sum(len(rows) for rows in sets),
+            sum(metrics.row_bytes(row) for rows in sets for row in rows))
+    return sets
+
+
+def fetchone(conn, name, params=()):
+    """
+    Runs a statement returning (at most) one row and returns the row, or
+    None.
+    """
+    start = time.perf_counter()
+    try:
+        cursor = get_backend().execute(conn, name, params)
+        row = cursor.fetchone()
+        # Read past the end so the connection is ready for the next query
+        if row is not None:
+            cursor.fetchall()
+    except mysql.connector.Error:
+        _record(conn, name, params, start, error=True)
+        raise
+    if row is None:
+        _record(conn, name, params, start)
+    else:
+        _record(conn, name, params, start, 1, metrics.row_bytes(row))
+    return row
+
+
+def iterate(conn, name, params=(), batch_size=1000):
+    """
+    Yields the rows of the named statement as they arrive, fetching
+    batch_size rows at a time. The run is recorded when the generator is
+    exhausted or closed; rows the caller didn't read are drained so the
+    connection can be reused.
+    """
+    start = time.perf_counter()
+    count = 0
+    nbytes = 0
+    error = False
+    try:
+        cursor = get_backend().execute(conn, name, params)
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                count += len(rows)
+                nbytes += sum(metrics.row_bytes(row) for row in rows)
+                yield from rows
+        finally:
+            if cursor.with_rows:
+                cursor.fetchall()
+    except mysql.connector.Error:
+        error = True
+        raise
+    finally:
+        _record(conn, name, params, start, count, nbytes, error)
+
+
+def close_all():
+    """
+    Closes the backend's connections. Called when the application exits.
+    """
+    if _backend is not None:
+        _backend.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Manage the embedded SQLite copy of the WTA database.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    p = subparsers.add_parser('build',
+                              help='create the SQLite database from the CSVs')
+    p.add_argument('--path', help='database file (default: sqlite_path)')
+    p.add_argument('--data-dir', default=HERE,
+                   help='directory holding the CSVs')
+    args = parser.parse_args(argv)
+
+    path = args.path or os.path.join(HERE, db_pool.get_config()['sqlite_path'])
+    build_sqlite(path, args.data_dir)
+    print(f'Built {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())